@@ -0,0 +1,111 @@
+"""
+Compression and streaming for API responses.
+
+compress_response() is an after_request hook: JSON, NDJSON and CSV responses
+above a size threshold are brotli- or gzip-encoded according to the client's
+Accept-Encoding (brotli only when the optional ``brotli`` package is
+installed), and streamed responses are compressed chunk by chunk.
+
+stream_ndjson() and stream_json() build streamed listings from iterators, so
+large results are never materialized as one list or one JSON string.
+"""
+
+import gzip
+import json
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv")
+
+# Streamed output is compressed in blocks of at least this many bytes
+STREAM_FLUSH_BYTES = 16 * 1024
+
+
+def negotiate_encoding(accept_encodings):
+    """Pick "br", "gzip" or None from the request's parsed Accept-Encoding."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compressor(encoding, level):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compress_stream(chunks, encoding, level):
+    compress, flush, finish = _compressor(encoding, level)
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        pending += len(chunk)
+        data = compress(chunk)
+        if pending >= STREAM_FLUSH_BYTES:
+            # Emit what we have so the client sees progress
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response, request, min_size=1024, level=5):
+    """Encode a JSON/NDJSON/CSV response for the client if it is worth it."""
+    if (response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "Content-Encoding" in response.headers):
+        return response
+    encoding = negotiate_encoding(request.accept_encodings)
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding, level)
+        response.direct_passthrough = False
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        if encoding == "br":
+            response.set_data(brotli.compress(body, quality=level))
+        else:
+            response.set_data(gzip.compress(body, compresslevel=level))
+
+    response.headers["Content-Encoding"] = encoding
+    # The encoded bytes differ from the identity representation
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def stream_ndjson(items):
+    """One JSON document per line."""
+    for item in items:
+        yield json.dumps(item) + "\n"
+
+
+def stream_json(envelope, key, items):
+    """
+    The usual {..., key: [...], "count": n} document, written item by item.
+    The count is only known at the end, so it follows the list.
+    """
+    head = json.dumps(envelope)
+    yield head[:-1] + (", " if envelope else "") + json.dumps(key) + ": ["
+    count = 0
+    for item in items:
+        yield ("," if count else "") + json.dumps(item)
+        count += 1
+    yield f'], "count": {count}}}'
@@ -0,0 +1,410 @@
+"""
+Inbound auto-response rules.
+
+Each account has a list of rules; every incoming text message is matched
+against the account's compiled rule set and the best matching rule's reply is
+sent back through the normal send path by a background thread, so the webhook
+never waits on the Graph API.
+
+Rule types:
+
+- keyword: any of "keywords" appears as a whole word (case-insensitive)
+- intent: at least "min_matches" different "keywords" of the intent appear
+- regex: "pattern" matches somewhere in the text (case-insensitive)
+
+All keyword and intent terms of an account go into one Aho-Corasick
+automaton, so a message is scanned once however many rules there are.
+Regexes are prefiltered the same way: the longest literal every match of a
+regex must contain is added to the automaton, and a regex only runs when its
+literal was seen (regexes without such a literal of at least three ASCII
+characters run on every message, so keep those few). The matching rule with
+the lowest "priority" wins; ties go to the earlier rule.
+
+Rules are stored in Redis (``auto_rules:{account_id}``, with a version under
+``auto_rules:{account_id}:version``); each worker keeps the compiled set and
+re-checks the version every few seconds, so replacing the rules through the
+API reloads them everywhere without a restart.
+"""
+
+import json
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+from key_schema import account_key
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+RULE_TYPES = ("keyword", "intent", "regex")
+DEFAULT_PRIORITY = 100
+
+# Shorter required literals would match almost every message
+MIN_PREFILTER_LITERAL = 3
+
+
+def rules_key(account_id):
+    return account_key(account_id, "auto_rules")
+
+
+def rules_version_key(account_id):
+    return account_key(account_id, "auto_rules", "version")
+
+
+class RuleError(ValueError):
+    """Rules that failed validation; errors is a list of {"rule", "error"}."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(f"{e['rule']}: {e['error']}" for e in errors))
+        self.errors = errors
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher over a fixed set of terms."""
+
+    def __init__(self, terms):
+        self.terms = list(terms)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, term in enumerate(self.terms):
+            node = 0
+            for char in term:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = child
+            self._output[node].append(index)
+
+        # Breadth-first failure links; outputs are merged along them
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self._goto[node].items():
+                pending.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def iter_matches(self, text):
+        """(start, end, term_index) of every occurrence of every term in text."""
+        goto, fail, output, terms = self._goto, self._fail, self._output, self.terms
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for index in output[node]:
+                yield position + 1 - len(terms[index]), position + 1, index
+
+
+def _is_word_boundary(text, start, end, term):
+    if term[0].isalnum() and start > 0 and text[start - 1].isalnum():
+        return False
+    if term[-1].isalnum() and end < len(text) and text[end].isalnum():
+        return False
+    return True
+
+
+def required_literal(pattern):
+    """
+    The longest run of literal characters every match of pattern must
+    contain, lowercased, or None if there is no ASCII one of at least
+    MIN_PREFILTER_LITERAL characters.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return None
+    best, run = "", []
+
+    def walk(items):
+        nonlocal best, run
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+            if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+                walk(av[-1])  # a plain group is part of the sequence
+                continue
+            if op is not sre_parse.AT:  # anchors and boundaries don't consume text
+                best = max(best, "".join(run), key=len)
+                run = []
+
+    walk(parsed)
+    best = max(best, "".join(run), key=len).lower()
+    if len(best) < MIN_PREFILTER_LITERAL or not best.isascii():
+        return None
+    return best
+
+
+def _rule_terms(rule):
+    keywords = rule.get("keywords")
+    if keywords is None and rule.get("pattern"):
+        keywords = [rule["pattern"]]
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    return [str(k).casefold().strip() for k in keywords or [] if str(k).strip()]
+
+
+def validate_rule(index, rule):
+    """A cleaned-up copy of rule, or raise ValueError."""
+    if not isinstance(rule, dict):
+        raise ValueError("a rule must be an object")
+    rule_type = rule.get("type", "keyword")
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"'type' must be one of {', '.join(RULE_TYPES)}")
+    if not rule.get("response") and not rule.get("template"):
+        raise ValueError("needs a 'response' text or a 'template'")
+    try:
+        priority = int(rule.get("priority", DEFAULT_PRIORITY))
+    except (TypeError, ValueError):
+        raise ValueError("'priority' must be an integer")
+
+    cleaned = dict(rule, id=str(rule.get("id") or f"rule-{index}"), type=rule_type, priority=priority,
+                   enabled=bool(rule.get("enabled", True)))
+    if rule_type == "regex":
+        if not rule.get("pattern"):
+            raise ValueError("regex rules need a 'pattern'")
+        try:
+            re.compile(f"(?P<r0>{rule['pattern']})", re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"invalid pattern: {e}")
+    else:
+        terms = _rule_terms(rule)
+        if not terms:
+            raise ValueError(f"{rule_type} rules need 'keywords'")
+        cleaned["keywords"] = terms
+        if rule_type == "intent":
+            try:
+                cleaned["min_matches"] = max(int(rule.get("min_matches", 1)), 1)
+            except (TypeError, ValueError):
+                raise ValueError("'min_matches' must be an integer")
+    return cleaned
+
+
+class RuleSet:
+    """The compiled rules of one account."""
+
+    def __init__(self, rules, version=0):
+        errors = []
+        cleaned = []
+        for index, rule in enumerate(rules):
+            try:
+                cleaned.append(validate_rule(index, rule))
+            except ValueError as e:
+                errors.append({"rule": (rule.get("id") if isinstance(rule, dict) else None) or f"rule-{index}",
+                               "error": str(e)})
+        if errors:
+            raise RuleError(errors)
+
+        started = time.perf_counter()
+        self.rules = cleaned
+        self.version = version
+        # Rank = position in priority order; lower rank wins
+        ranked = sorted((r for r in cleaned if r["enabled"]), key=lambda r: r["priority"])
+        self._ranked = ranked
+
+        term_ids = {}
+        # term index -> ranks of the keyword / intent / regex rules using it
+        self._keyword_ranks = []
+        self._intent_ranks = []
+        self._regex_ranks = []
+        self._patterns = {}  # rank -> compiled regex
+        self._unfiltered = []  # ranks of regexes without a prefilter literal
+
+        def add_term(term, target, rank):
+            if term not in term_ids:
+                term_ids[term] = len(term_ids)
+                self._keyword_ranks.append([])
+                self._intent_ranks.append([])
+                self._regex_ranks.append([])
+            target[term_ids[term]].append(rank)
+
+        for rank, rule in enumerate(ranked):
+            if rule["type"] == "regex":
+                self._patterns[rank] = re.compile(rule["pattern"], re.IGNORECASE)
+                literal = required_literal(rule["pattern"])
+                if literal:
+                    add_term(literal, self._regex_ranks, rank)
+                else:
+                    self._unfiltered.append(rank)
+                continue
+            target = self._keyword_ranks if rule["type"] == "keyword" else self._intent_ranks
+            for term in rule["keywords"]:
+                add_term(term, target, rank)
+        self._matcher = AhoCorasick(term_ids) if term_ids else None
+        self.compile_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def describe(self):
+        return {
+            "rules": len(self.rules),
+            "version": self.version,
+            "compile_ms": self.compile_ms,
+            "terms": len(self._matcher.terms) if self._matcher else 0,
+            "unfiltered_regexes": len(self._unfiltered),
+        }
+
+    def match(self, text):
+        """The winning rule for a message text, or None."""
+        if not text:
+            return None
+        best = None
+        regex_candidates = set(self._unfiltered)
+        if self._matcher is not None:
+            folded = text.casefold()
+            terms = self._matcher.terms
+            intent_hits = {}
+            for start, end, index in self._matcher.iter_matches(folded):
+                regex_candidates.update(self._regex_ranks[index])
+                if not _is_word_boundary(folded, start, end, terms[index]):
+                    continue
+                ranks = self._keyword_ranks[index]
+                if ranks and (best is None or ranks[0] < best):
+                    best = ranks[0]
+                for rank in self._intent_ranks[index]:
+                    intent_hits.setdefault(rank, set()).add(index)
+            for rank, hits in intent_hits.items():
+                if len(hits) >= self._ranked[rank]["min_matches"] and (best is None or rank < best):
+                    best = rank
+        for rank in sorted(regex_candidates):
+            if best is not None and rank >= best:
+                break
+            if self._patterns[rank].search(text):
+                best = rank
+                break
+        return self._ranked[best] if best is not None else None
+
+
+class AutoResponder:
+    """
+    Per-account rule sets, refreshed from Redis, and a background sender.
+
+    send(account_id, phone_number, rule) sends the rule's reply and returns
+    the send result dict.
+    """
+
+    def __init__(self, redis_manager, send, refresh_interval=5, queue_size=1000):
+        self.redis_manager = redis_manager
+        self.send = send
+        self.refresh_interval = refresh_interval
+        self.evaluated = 0
+        self.matched = 0
+        self.sent = 0
+        self.failed = 0
+        self._rulesets = {}  # account_id -> RuleSet
+        self._checked_at = {}  # account_id -> when the Redis version was last checked
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name="auto-responder", daemon=True)
+            self._thread.start()
+
+    def _load(self, account_id, client):
+        version, raw = client.mget([rules_version_key(account_id), rules_key(account_id)])
+        version = int(version or 0)
+        current = self._rulesets.get(account_id)
+        if current is not None and current.version >= version:
+            return current  # unchanged, or our own replace() hasn't reached Redis yet
+        try:
+            ruleset = RuleSet(json.loads(raw) if raw else [], version)
+        except (RuleError, json.JSONDecodeError) as e:
+            print(f"⚠️ Ignoring invalid auto-response rules for account {account_id}: {e}")
+            return current
+        self._rulesets[account_id] = ruleset
+        print(f"🤖 Loaded {len(ruleset.rules)} auto-response rule(s) for account {account_id} in {ruleset.compile_ms}ms")
+        return ruleset
+
+    def ruleset(self, account_id, force=False):
+        """The account's compiled rules, re-read from Redis when their version may have changed."""
+        now = time.monotonic()
+        if force or now - self._checked_at.get(account_id, float("-inf")) >= self.refresh_interval:
+            self._checked_at[account_id] = now
+            client = self.redis_manager.get_client()
+            if client is not None:
+                try:
+                    return self._load(account_id, client)
+                except Exception as e:
+                    self.redis_manager.record_error(e)
+                    print(f"⚠️ Could not load auto-response rules for account {account_id}: {e}")
+        return self._rulesets.get(account_id)
+
+    def replace(self, account_id, rules):
+        """
+        Validate and compile new rules, use them right away, and return the
+        RuleSet with the Redis commands that publish them to other workers.
+        Raises RuleError.
+        """
+        version = time.time_ns() // 1000
+        ruleset = RuleSet(rules, version)
+        self._rulesets[account_id] = ruleset
+        self._checked_at[account_id] = time.monotonic()
+        return ruleset, [
+            ("set", rules_key(account_id), json.dumps(ruleset.rules)),
+            ("set", rules_version_key(account_id), version),
+        ]
+
+    def handle_incoming(self, account_id, phone_number, text):
+        """Match an incoming message and queue the reply; returns the matched rule or None."""
+        ruleset = self.ruleset(account_id)
+        if ruleset is None:
+            return None
+        self.evaluated += 1
+        rule = ruleset.match(text)
+        if rule is None:
+            return None
+        self.matched += 1
+        if not self._thread:
+            self.start()
+        try:
+            self._queue.put_nowait((account_id, phone_number, rule))
+        except queue.Full:
+            self.failed += 1
+            print(f"⚠️ Auto-response queue full, dropping reply to {phone_number} (Account: {account_id})")
+        return rule
+
+    def stats(self):
+        return {
+            "accounts": {account_id: ruleset.describe() for account_id, ruleset in self._rulesets.items()},
+            "queued": self._queue.qsize(),
+            "evaluated": self.evaluated,
+            "matched": self.matched,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+    def _run(self):
+        while True:
+            account_id, phone_number, rule = self._queue.get()
+            try:
+                result = self.send(account_id, phone_number, rule)
+                if result.get("success"):
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    print(f"⚠️ Auto-response '{rule['id']}' to {phone_number} failed: {result.get('error')}")
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ Auto-response '{rule['id']}' to {phone_number} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued reply has been sent."""
+        if self._thread:
+            self._queue.join()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Auto-response rule matching benchmark.
+
+Compiles a synthetic rule set (keyword, intent and regex rules in the given
+proportions) and matches a stream of synthetic messages against it, reporting
+compile time, messages per second and per-message latency percentiles. Pure
+CPU: no Redis or Graph API involved.
+
+Usage: python benchmarks/bench_auto_responder.py [--rules 10000] [--messages 100000] [--regex-share 0.1]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auto_responder import RuleSet  # noqa: E402
+
+FILLER = ("please", "the", "my", "can", "you", "help", "with", "today", "thanks", "order", "when", "is", "it")
+
+
+def synthetic_rules(count, regex_share, intent_share):
+    rules = []
+    for i in range(count):
+        share = random.random()
+        if share < regex_share:
+            rules.append({"id": f"regex-{i}", "type": "regex", "pattern": f"ref(erence)?[ -]?{i}-\\d{{3,}}",
+                          "response": f"Reply {i}"})
+        elif share < regex_share + intent_share:
+            rules.append({"id": f"intent-{i}", "type": "intent", "keywords": [f"topic{i}", f"detail{i}", f"extra{i}"],
+                          "min_matches": 2, "response": f"Reply {i}"})
+        else:
+            rules.append({"id": f"keyword-{i}", "keywords": [f"product{i}", f"sku {i}"], "response": f"Reply {i}",
+                          "priority": random.randint(1, 200)})
+    return rules
+
+
+def synthetic_messages(count, rules):
+    for _ in range(count):
+        words = [random.choice(FILLER) for _ in range(random.randint(3, 30))]
+        if random.random() < 0.3:
+            i = random.randrange(rules)
+            words.insert(random.randrange(len(words)), random.choice(
+                (f"product{i}", f"topic{i} and detail{i}", f"reference {i}-{random.randint(100, 99999)}")))
+        yield " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--regex-share", type=float, default=0.1)
+    parser.add_argument("--intent-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    started = time.perf_counter()
+    ruleset = RuleSet(synthetic_rules(args.rules, args.regex_share, args.intent_share))
+    print(f"Compiled {args.rules} rules in {(time.perf_counter() - started) * 1000:.0f}ms: {ruleset.describe()}")
+
+    messages = list(synthetic_messages(args.messages, args.rules))
+    latencies = []
+    matched = 0
+    started = time.perf_counter()
+    for text in messages:
+        before = time.perf_counter()
+        if ruleset.match(text):
+            matched += 1
+        latencies.append(time.perf_counter() - before)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Matched {matched}/{len(messages)} messages in {elapsed:.2f}s ({len(messages) / elapsed:,.0f} msg/s)")
+    print(f"Latency p50 {statistics.median(latencies) * 1e6:.1f}µs  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}µs  max {latencies[-1] * 1e6:.1f}µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
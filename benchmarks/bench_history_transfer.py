@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+History import/export throughput benchmark.
+
+Imports synthetic history into a throwaway account through
+/api/accounts/<id>/import, exports it again as NDJSON and CSV through
+/api/accounts/<id>/export, and reports messages per second for each. Needs the
+Redis configured by REDIS_HOST/REDIS_PORT/...; the account's keys are deleted
+afterwards.
+
+Usage: python benchmarks/bench_history_transfer.py [--messages 200000] [--contacts 2000]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SEARCH_ENABLED", "false")  # measure Redis, not the search indexer
+
+import whatsapp_bot  # noqa: E402
+from conversation_versions import versions_key  # noqa: E402
+from storage import history_key  # noqa: E402
+
+
+def synthetic_history(messages, contacts):
+    for i in range(messages):
+        yield (json.dumps({
+            "phone_number": f"23480{i % contacts:08d}",
+            "type": "incoming" if i % 2 else "outgoing",
+            "timestamp": f"2024-01-01T{(i // 3600) % 24:02d}:{(i // 60) % 60:02d}:{i % 60:02d}",
+            "text": f"Benchmark message {i} with a little bit of realistic text in it",
+        }) + "\n").encode("utf-8")
+
+
+class ChunkedUpload(io.RawIOBase):
+    """A request body read from an iterator of chunks, like a chunked upload."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+def streamed_post(path, chunks, content_type):
+    environ = EnvironBuilder(path=path, method="POST", content_type=content_type).get_environ()
+    environ.pop("CONTENT_LENGTH", None)
+    environ["wsgi.input"] = io.BufferedReader(ChunkedUpload(chunks))
+    environ["wsgi.input_terminated"] = True
+    app_iter, status, _ = run_wsgi_app(whatsapp_bot.app, environ)
+    return int(status.split()[0]), json.loads(b"".join(app_iter))
+
+
+def delete_account_keys(client, account_id):
+    for key in client.scan_iter(match=history_key(account_id, "*"), count=1000):
+        client.delete(key)
+    client.delete(versions_key(account_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--contacts", type=int, default=2000)
+    args = parser.parse_args()
+
+    whatsapp_bot.create_app()
+    client = whatsapp_bot.redis_manager.get_client()
+    if client is None:
+        print("❌ Redis is not reachable; set REDIS_HOST/REDIS_PORT/REDIS_PASSWORD")
+        return 1
+
+    account_id = f"bench-{os.getpid()}"
+    whatsapp_bot.WHATSAPP_ACCOUNTS[account_id] = dict(whatsapp_bot.WHATSAPP_ACCOUNTS[whatsapp_bot.DEFAULT_ACCOUNT_ID])
+    http = whatsapp_bot.app.test_client()
+    try:
+        started = time.perf_counter()
+        status, result = streamed_post(
+            f"/api/accounts/{account_id}/import",
+            synthetic_history(args.messages, args.contacts),
+            "application/x-ndjson"
+        )
+        elapsed = time.perf_counter() - started
+        if status != 200:
+            print(f"❌ Import failed: {result}")
+            return 1
+        print(f"Import  {result['imported']:>9} messages in {elapsed:6.2f}s  ({result['imported'] / elapsed:,.0f} msg/s)")
+
+        # History keeps the last 100 messages per contact
+        stored = min(args.messages, args.contacts * 100)
+        for fmt in ("ndjson", "csv"):
+            started = time.perf_counter()
+            response = http.get(f"/api/accounts/{account_id}/export?format={fmt}")
+            size = 0
+            for chunk in response.response:
+                size += len(chunk)
+            elapsed = time.perf_counter() - started
+            print(f"Export  {stored:>9} messages in {elapsed:6.2f}s  ({stored / elapsed:,.0f} msg/s, "
+                  f"{size / elapsed / 1e6:.1f} MB/s) as {fmt}")
+    finally:
+        delete_account_keys(client, account_id)
+        del whatsapp_bot.WHATSAPP_ACCOUNTS[account_id]
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
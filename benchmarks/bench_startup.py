@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Worker cold-start benchmark.
+
+Boots whatsapp_bot in fresh interpreters (the way a gunicorn worker would) and
+reports how long the import and create_app() take, compared to STARTUP_BUDGET_MS.
+
+Usage: python benchmarks/bench_startup.py [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT_SNIPPET = """
+import json, whatsapp_bot
+whatsapp_bot.create_app()
+print("STARTUP_TIMINGS=" + json.dumps(whatsapp_bot.STARTUP_TIMINGS))
+"""
+
+
+def boot_once():
+    output = subprocess.run(
+        [sys.executable, "-c", BOOT_SNIPPET],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    for line in output.splitlines():
+        if line.startswith("STARTUP_TIMINGS="):
+            return json.loads(line.split("=", 1)[1])
+    raise RuntimeError("worker did not report its startup timings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [boot_once() for _ in range(args.runs)]
+    budget = runs[0]["budget_ms"]
+
+    print(f"Cold start over {args.runs} runs (budget {budget:g}ms)")
+    for key in ("import_ms", "create_app_ms", "total_ms"):
+        values = [run[key] for run in runs]
+        print(f"  {key:<14} min {min(values):8.1f}  median {statistics.median(values):8.1f}  max {max(values):8.1f}")
+
+    median_total = statistics.median(run["total_ms"] for run in runs)
+    if median_total > budget:
+        print(f"❌ Median cold start {median_total:.1f}ms is over budget")
+        return 1
+    print(f"✅ Median cold start {median_total:.1f}ms is within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Storage backend benchmark: Redis vs embedded SQLite.
+
+Runs the same workload against each backend under a throwaway account: append
+messages spread over a number of contacts, read full conversation histories
+of random contacts, and list the most recently active contacts. Reports
+append throughput and read latency percentiles. The Redis run needs the Redis
+configured by REDIS_HOST/REDIS_PORT/... and is skipped when it isn't reachable;
+the account's keys are deleted afterwards.
+
+Usage: python benchmarks/bench_storage.py [--messages 20000] [--contacts 500] [--reads 2000] [--backend all|redis|sqlite]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import whatsapp_bot  # noqa: E402
+from storage import HISTORY_LIMIT, RedisStorage, SQLiteStorage, contacts_key, history_key  # noqa: E402
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(int(len(samples) * p), len(samples) - 1)] * 1e6
+    return f"p50 {pick(0.5):8.1f}µs  p99 {pick(0.99):8.1f}µs"
+
+
+def run(name, storage, account_id, args):
+    phones = [f"23480{i:08d}" for i in range(args.contacts)]
+    started = time.perf_counter()
+    for i in range(args.messages):
+        phone = phones[i % args.contacts]
+        storage.append_message(account_id, phone, {
+            "id": f"bench_{i}", "text": f"Benchmark message {i} with a little bit of realistic text in it",
+            "type": "incoming" if i % 2 else "outgoing", "timestamp": f"{i:010d}", "phone_number": phone,
+        })
+    storage.flush()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<7} append   {args.messages:>8} messages in {elapsed:6.2f}s  ({args.messages / elapsed:,.0f} msg/s)")
+
+    samples = []
+    for _ in range(args.reads):
+        phone = random.choice(phones)
+        started = time.perf_counter()
+        storage.history(account_id, phone, 0, HISTORY_LIMIT - 1)
+        samples.append(time.perf_counter() - started)
+    print(f"{name:<7} history  {args.reads:>8} reads              {percentiles(samples)}")
+
+    samples = []
+    for _ in range(max(args.reads // 10, 1)):
+        started = time.perf_counter()
+        storage.contacts(account_id, 0, 49)
+        samples.append(time.perf_counter() - started)
+    print(f"{name:<7} contacts {len(samples):>8} pages of 50         {percentiles(samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--contacts", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--backend", choices=("all", "redis", "sqlite"), default="all")
+    args = parser.parse_args()
+    account_id = f"bench-{os.getpid()}"
+
+    if args.backend in ("all", "sqlite"):
+        with tempfile.TemporaryDirectory() as directory:
+            run("sqlite", SQLiteStorage(os.path.join(directory, "storage.db")), account_id, args)
+
+    if args.backend in ("all", "redis"):
+        manager = whatsapp_bot.redis_manager
+        manager.check_health()
+        client = manager.get_client()
+        if client is None:
+            print("⚠️ Redis is not reachable; skipped (set REDIS_HOST/REDIS_PORT/REDIS_PASSWORD)")
+            return 0 if args.backend == "all" else 1
+        try:
+            run("redis", RedisStorage(manager), account_id, args)
+        finally:
+            for i in range(args.contacts):
+                client.delete(history_key(account_id, f"23480{i:08d}"))
+            client.delete(contacts_key(account_id))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
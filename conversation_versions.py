@@ -0,0 +1,93 @@
+"""
+Change versions for accounts and conversations.
+
+store_message() stamps every message with a version and bumps the version of
+its conversation and account. Versions are microsecond timestamps forced to
+increase within a process, so workers can issue them without coordinating;
+conversation versions are shared through a sorted set per account
+(``{account_id}:versions``, written with ZADD GT so it never moves backwards),
+and an account's version is the highest score in it, so every worker hands out
+the same account ETag.
+The API turns them into ETags (304 when nothing changed) and answers
+``?since=<version>`` with only what changed after it.
+"""
+
+import threading
+import time
+
+from key_schema import account_key
+
+
+def versions_key(account_id):
+    return account_key(account_id, "versions")
+
+
+class ConversationVersions:
+    def __init__(self, redis_manager):
+        self.redis_manager = redis_manager
+        self._last = 0
+        self._accounts = {}  # account_id -> version
+        self._conversations = {}  # account_id -> {phone: version}
+        self._lock = threading.Lock()
+
+    def bump(self, account_id, phone_number):
+        """
+        Issue a new version for a conversation. Returns (version, command),
+        the command being the Redis write that publishes it (see RedisManager.write).
+        """
+        with self._lock:
+            version = max(self._last + 1, time.time_ns() // 1000)
+            self._last = version
+            self._accounts[account_id] = version
+            self._conversations.setdefault(account_id, {})[phone_number] = version
+        return version, ("zadd", versions_key(account_id), {phone_number: version}, False, False, False, False, True)
+
+    def account_version(self, account_id):
+        """
+        Latest version of any conversation of an account across workers (0 if
+        nothing was stored); falls back to this worker's view without Redis.
+        """
+        local = self._accounts.get(account_id, 0)
+        client = self.redis_manager.get_client()
+        if client is None:
+            return local
+        try:
+            newest = client.zrevrange(versions_key(account_id), 0, 0, withscores=True)
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            return local
+        return max(local, int(newest[0][1])) if newest else local
+
+    def local_version(self, account_id, phone_number):
+        return self._conversations.get(account_id, {}).get(phone_number, 0)
+
+    def conversation_version(self, account_id, phone_number):
+        """Latest version of a conversation across workers; falls back to the local one without Redis."""
+        local = self.local_version(account_id, phone_number)
+        client = self.redis_manager.get_client()
+        if client is None:
+            return local
+        try:
+            shared = client.zscore(versions_key(account_id), phone_number)
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            return local
+        return max(local, int(shared or 0))
+
+    def changed_since(self, account_id, since):
+        """
+        Phone numbers whose conversation version is newer than since, across
+        workers; only this worker's conversations without Redis.
+        """
+        changed = {
+            phone for phone, version in self._conversations.get(account_id, {}).items()
+            if version > since
+        }
+        client = self.redis_manager.get_client()
+        if client is None:
+            return changed
+        try:
+            changed.update(client.zrangebyscore(versions_key(account_id), f"({since}", "+inf"))
+        except Exception as e:
+            self.redis_manager.record_error(e)
+        return changed
@@ -0,0 +1,43 @@
+# Loaded by gunicorn from the working directory (see start.sh)
+
+# Time a worker gets to finish after SIGTERM; DRAIN_TIMEOUT_SECONDS should fit inside it
+graceful_timeout = 30
+
+
+def post_worker_init(worker):
+    """
+    Drain on SIGTERM while the worker still serves: new webhooks and writes get
+    503 and /ready fails while running requests and queued sends finish, and
+    only then is gunicorn's own handler told to stop the worker.
+    """
+    import signal
+    import threading
+
+    import whatsapp_bot
+
+    stop = signal.getsignal(signal.SIGTERM)
+
+    def drain_then_stop(signum, frame):
+        def run():
+            whatsapp_bot.drain_worker()
+            stop(signum, None)
+        threading.Thread(target=run, name="worker-drain", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain_then_stop)
+
+
+def worker_int(worker):
+    """Quick shutdown (SIGINT/SIGQUIT): drain in whatever time is left."""
+    import whatsapp_bot
+
+    whatsapp_bot.drain_worker()
+
+
+def worker_exit(server, worker):
+    """
+    Final flush. A no-op after the SIGTERM drain; covers exits that skip it
+    (max_requests restarts), at which point the worker no longer serves.
+    """
+    import whatsapp_bot
+
+    whatsapp_bot.drain_worker()
@@ -0,0 +1,280 @@
+"""
+Bulk export and import of an account's message history.
+
+Export walks the account's history keys with a cursor-based SCAN (of every
+shard, in Redis Cluster) and reads each batch of conversations with one
+pipelined round trip of LRANGEs, so it
+never loads the keyspace (or the whole account) into memory; messages are
+yielded one by one and written out as NDJSON or CSV.
+
+Import reads NDJSON or CSV records from a stream and writes them in large
+pipelined batches, in the same layout store_message() uses. Imported
+history is usually older than what the app has stored since, so each
+conversation is merged by version (MERGE_SCRIPT) rather than pushed on top:
+records older than the conversation's newest message get a version derived
+from their timestamp, land behind the live messages and never trim them
+away, and only records newer than everything stored get fresh versions (and
+so show up for ``?since=`` clients). Every conversation an import writes to
+still gets a new conversation version, so its ETag changes, and each batch
+publishes near cache invalidations for the histories it rewrote.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from storage import contacts_key, history_key
+
+SCAN_COUNT = 500
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+
+# KEYS[1] history list (newest first); ARGV[1] length limit, ARGV[2..] messages
+# as JSON. Merges them in by "version", newest first, keeping the stored copy of
+# a message id that is already there, and trims the oldest beyond the limit.
+MERGE_SCRIPT = """
+local entries, seen = {}, {}
+local function add(raw, order)
+    local ok, message = pcall(cjson.decode, raw)
+    local id = ok and type(message) == 'table' and message.id or nil
+    if id and seen[id] then
+        return
+    end
+    if id then
+        seen[id] = true
+    end
+    local version = ok and type(message) == 'table' and tonumber(message.version) or 0
+    entries[#entries + 1] = {raw = raw, version = version, order = order}
+end
+local stored = redis.call('LRANGE', KEYS[1], 0, -1)
+for i, raw in ipairs(stored) do
+    add(raw, i)
+end
+for i = 2, #ARGV do
+    add(ARGV[i], #stored + i)
+end
+table.sort(entries, function(a, b)
+    if a.version ~= b.version then
+        return a.version > b.version
+    end
+    return a.order < b.order
+end)
+redis.call('DEL', KEYS[1])
+local limit = math.min(#entries, tonumber(ARGV[1]))
+for i = 1, limit do
+    redis.call('RPUSH', KEYS[1], entries[i].raw)
+end
+return limit
+"""
+
+CSV_FIELDS = ("account_id", "phone_number", "id", "type", "timestamp", "text", "version", "media")
+MESSAGE_TYPES = ("incoming", "outgoing")
+
+
+def message_time(timestamp):
+    """Epoch seconds of a message timestamp (ISO 8601, as stored, or epoch seconds), or None."""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.fromisoformat(str(timestamp)).timestamp()
+    except ValueError:
+        try:
+            return float(timestamp)
+        except (TypeError, ValueError):
+            return None
+
+
+def iter_history(client, account_id, scan_count=SCAN_COUNT):
+    """Every stored message of an account, one conversation at a time, oldest first within each."""
+    keys = []
+    for key in client.scan_iter(match=history_key(account_id, "*"), count=scan_count, _type="list"):
+        keys.append(key)
+        if len(keys) >= scan_count:
+            yield from _read_conversations(client, keys)
+            keys = []
+    yield from _read_conversations(client, keys)
+
+
+def _read_conversations(client, keys):
+    if not keys:
+        return
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.lrange(key, 0, -1)
+    for raw_messages in pipe.execute():
+        for raw in reversed(raw_messages):  # lists are newest first
+            try:
+                yield json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+
+
+def to_ndjson(messages):
+    for message in messages:
+        yield json.dumps(message) + "\n"
+
+
+def to_csv(messages):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for message in messages:
+        row = dict(message)
+        if row.get("media"):
+            row["media"] = json.dumps(row["media"])
+        writer.writerow(row)
+        if buffer.tell() >= 16 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def parse_records(stream, fmt):
+    """Yield (line_number, record dict or None, error) from an NDJSON or CSV byte stream."""
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        for line_number, row in enumerate(csv.DictReader(text), start=2):
+            if row.get("media"):
+                try:
+                    row["media"] = json.loads(row["media"])
+                except json.JSONDecodeError:
+                    yield line_number, None, "media is not valid JSON"
+                    continue
+            yield line_number, row, None
+        return
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"invalid JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "not a JSON object"
+            continue
+        yield line_number, record, None
+
+
+class HistoryImporter:
+    """
+    Turns records into history writes, flushed every batch_size messages in
+    one pipeline. normalize(phone) and next_version(account_id, phone) come
+    from the app; read_heads(account_id, phones) returns {phone: newest stored
+    message or None}, or None if Redis is down; on_message(message_data) sees
+    every imported message (e.g. for search indexing). invalidate(keys)
+    returns a command dropping cached copies of the history keys a batch
+    writes, sent last in its pipeline. write_batch(commands) returns False if
+    Redis is down.
+    """
+
+    def __init__(self, account_id, write_batch, read_heads, normalize, next_version, on_message=None,
+                 invalidate=None, batch_size=IMPORT_BATCH_SIZE, history_limit=100):
+        self.account_id = account_id
+        self.write_batch = write_batch
+        self.read_heads = read_heads
+        self.normalize = normalize
+        self.next_version = next_version
+        self.on_message = on_message
+        self.invalidate = invalidate
+        self.batch_size = batch_size
+        self.history_limit = history_limit
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self._messages = []  # (epoch seconds, message without its version)
+
+    def reject(self, line_number, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "error": error})
+
+    def add(self, line_number, record):
+        """Queue one record; returns False if a batch had to be flushed and Redis was unavailable."""
+        phone_number = self.normalize(str(record.get("phone_number") or ""))
+        error = None
+        if not phone_number:
+            error = "missing phone_number"
+        elif record.get("type") not in MESSAGE_TYPES:
+            error = "type must be 'incoming' or 'outgoing'"
+        elif not record.get("timestamp"):
+            error = "missing timestamp"
+        elif message_time(record["timestamp"]) is None:
+            error = "timestamp must be ISO 8601 or epoch seconds"
+        if error:
+            self.reject(line_number, error)
+            return True
+
+        sent_at = message_time(record["timestamp"])
+        message_data = {
+            "id": record.get("id") or f"import_{record['type']}_{int(sent_at * 1_000_000)}",
+            "text": record.get("text") or "",
+            "type": record["type"],
+            "timestamp": record["timestamp"],
+            "phone_number": phone_number,
+            "account_id": self.account_id,
+        }
+        if record.get("media"):
+            message_data["media"] = record["media"]
+
+        self._messages.append((sent_at, message_data))
+        if len(self._messages) >= self.batch_size:
+            return self.flush()
+        return True
+
+    def _assign_versions(self, heads):
+        """
+        Version every message of the batch; returns the version commands. A
+        message older than its conversation's newest stored one is backfill: its
+        version comes from its timestamp (below the stored head's), so it sorts
+        behind the live messages and isn't reported to ``?since=`` clients; its
+        conversation still gets a new version, since its history changed.
+        """
+        version_commands = {}
+        for sent_at, message_data in sorted(self._messages, key=lambda item: item[0]):
+            phone_number = message_data["phone_number"]
+            head = heads.get(phone_number)
+            head_time = message_time(head.get("timestamp")) if head else None
+            if head_time is not None and sent_at <= head_time:
+                message_data["version"] = int(sent_at * 1_000_000)
+                if head.get("version"):
+                    message_data["version"] = min(message_data["version"], int(head["version"]) - 1)
+            else:
+                message_data["version"], version_commands[phone_number] = self.next_version(self.account_id, phone_number)
+        for phone_number in {message_data["phone_number"] for _, message_data in self._messages} - version_commands.keys():
+            _, version_commands[phone_number] = self.next_version(self.account_id, phone_number)
+        return list(version_commands.values())
+
+    def flush(self):
+        """Write the current batch; returns False (keeping the batch) if Redis is unavailable."""
+        if not self._messages:
+            return True
+        conversations = {}
+        for sent_at, message_data in self._messages:
+            conversations.setdefault(message_data["phone_number"], []).append((sent_at, message_data))
+        heads = self.read_heads(self.account_id, list(conversations))
+        if heads is None:
+            return False
+        commands = self._assign_versions(heads)
+        for phone_number, messages in conversations.items():
+            commands.append(("eval", MERGE_SCRIPT, 1, history_key(self.account_id, phone_number), self.history_limit,
+                             *(json.dumps(message_data) for _, message_data in messages)))
+            # GT: backfill never makes a conversation look more recent than it is
+            newest = max(sent_at for sent_at, _ in messages)
+            commands.append(("zadd", contacts_key(self.account_id), {phone_number: newest},
+                             False, False, False, False, True))
+        if self.invalidate:
+            commands.append(self.invalidate([history_key(self.account_id, phone_number) for phone_number in conversations]))
+        if not self.write_batch([commands]):
+            return False
+        self.imported += len(self._messages)
+        if self.on_message:
+            for _, message_data in self._messages:
+                self.on_message(message_data)
+        self._messages = []
+        return True
+
+    def stats(self):
+        return {"imported": self.imported, "rejected": self.rejected, "errors": self.errors}
@@ -0,0 +1,167 @@
+"""
+Idempotency keys for send endpoints.
+
+A client that retries a send after a timeout repeats its Idempotency-Key
+header. The first request with a key claims it with one Lua call that either
+stores a short-lived "pending" marker or returns what is already stored; once
+the send finishes its response replaces the marker for ttl seconds. A retry
+then costs that single Redis round trip: it gets the stored response replayed,
+or 409 while the first request is still running. A retry with a different body
+under the same key is refused rather than replayed.
+
+Each claim carries a random token. The marker lives lock_ttl seconds and is
+renewed while its request runs (a bulk send can wait in the outbound queue for
+longer), and complete(), renew() and release() only touch the record while it
+still carries the claim's token: a request whose marker expired and was
+claimed by a retry can't overwrite or delete the retry's record.
+"""
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Return the record stored under KEYS[1], or store ARGV[1] for ARGV[2] ms and return nil
+BEGIN_SCRIPT = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    return existing
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return false
+"""
+
+# Owner-only updates: act on KEYS[1] only while it holds the claim with token ARGV[1]
+OWNER_CHECK = """
+local existing = redis.call('GET', KEYS[1])
+if existing and cjson.decode(existing)['token'] ~= ARGV[1] then
+    return 0
+end
+"""
+
+# Store record ARGV[2] for ARGV[3] ms (or create it if the marker has expired and nobody claimed it since)
+COMPLETE_SCRIPT = OWNER_CHECK + """
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return 1
+"""
+
+# Extend the pending marker to ARGV[2] ms (a stored response keeps its own expiry)
+RENEW_SCRIPT = OWNER_CHECK + """
+if not existing or cjson.decode(existing)['state'] ~= 'pending' then
+    return 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+RELEASE_SCRIPT = OWNER_CHECK + """
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+MAX_KEY_LENGTH = 255
+
+# begin() outcomes
+PROCEED = "proceed"
+REPLAY = "replay"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+
+def valid_key(key):
+    return 0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+def record_key(scope, key):
+    return f"idempotency:{scope}:{key}"
+
+
+class IdempotencyStore:
+    def __init__(self, redis_manager, ttl=86400, lock_ttl=60):
+        self.redis_manager = redis_manager
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.replayed = 0
+        self.conflicts = 0
+        self._scripts = {}
+
+    def _script(self, client, source):
+        # Scripts are registered per client (a new client is created after a reconnect)
+        if (id(client), source) not in self._scripts:
+            self._scripts[(id(client), source)] = client.register_script(source)
+        return self._scripts[(id(client), source)]
+
+    def begin(self, scope, key, fingerprint):
+        """
+        Claim key for a request whose body hashes to fingerprint. Returns
+        (PROCEED, token), (REPLAY, {"status", "body"}), (IN_PROGRESS, None) or
+        (MISMATCH, None); (None, None) if Redis is unavailable.
+        """
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None, None
+        token = uuid.uuid4().hex
+        pending = json.dumps({"state": "pending", "fingerprint": fingerprint, "token": token, "started": time.time()})
+        try:
+            existing = self._script(client, BEGIN_SCRIPT)(keys=[record_key(scope, key)],
+                                                          args=[pending, int(self.lock_ttl * 1000)])
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Idempotency check failed: {e}")
+            return None, None
+        if existing is None:
+            return PROCEED, token
+        record = json.loads(existing)
+        if record["fingerprint"] != fingerprint:
+            self.conflicts += 1
+            return MISMATCH, None
+        if record["state"] == "pending":
+            self.conflicts += 1
+            return IN_PROGRESS, None
+        self.replayed += 1
+        return REPLAY, record
+
+    def complete(self, scope, key, token, fingerprint, status, body):
+        """Store a request's response for replay; it may be replaced by a later complete() of the same claim."""
+        record = json.dumps({"state": "done", "fingerprint": fingerprint, "token": token, "status": status, "body": body})
+        return self._run(COMPLETE_SCRIPT, scope, key, token, record, int(self.ttl * 1000))
+
+    def renew(self, scope, key, token):
+        """Extend the pending marker of a request that is still running."""
+        return self._run(RENEW_SCRIPT, scope, key, token, int(self.lock_ttl * 1000))
+
+    def release(self, scope, key, token):
+        """Forget a claim whose request failed before sending anything, so that a retry runs again."""
+        return self._run(RELEASE_SCRIPT, scope, key, token)
+
+    @contextmanager
+    def hold(self, scope, key, token):
+        """Renew the claim's marker every lock_ttl / 3 seconds until the block exits."""
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lock_ttl / 3):
+                self.renew(scope, key, token)
+
+        threading.Thread(target=renew, name="idempotency-renew", daemon=True).start()
+        try:
+            yield
+        finally:
+            stop.set()
+
+    def _run(self, script, scope, key, token, *args):
+        # Not buffered for replay: a late write could clobber the record of a later retry
+        client = self.redis_manager.get_client()
+        if client is None:
+            print("⚠️ Redis unavailable; idempotency record left to expire")
+            return False
+        try:
+            return bool(self._script(client, script)(keys=[record_key(scope, key)], args=[token, *args]))
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Could not update idempotency record: {e}")
+            return False
+
+    def stats(self):
+        return {"replayed": self.replayed, "conflicts": self.conflicts}
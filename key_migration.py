@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Online migration of Redis keys to the hash-tagged key schema (see key_schema).
+
+Run it once every worker runs the new schema; from then on they only write
+the new keys. It SCANs the source in batches for keys in the old layout and
+moves each to its new name on the target, which may be the same server or a
+new Redis Cluster:
+
+- a key whose new name doesn't exist yet is copied whole (DUMP/RESTORE,
+  keeping its TTL) in one pipelined round trip per batch;
+- a key the app has written to since the deploy is merged by what it holds:
+  older messages go behind the newer ones, counters are added up, versions,
+  timestamps and due times take the max, HyperLogLogs are merged; for the
+  rest the new key wins. Streams can't take older entries, so an old stream
+  whose new one already exists is left in place and reported.
+
+Every conversation moved is also added to its account's ``{acct}:contacts``
+index (scored by its newest message), which worker warm-up and the contact
+listing read: conversations stored before that index existed aren't in it.
+
+The old ``whatsapp_accounts`` document is split into one key per account.
+Each old key is deleted once moved, so the tool can be stopped and run again
+at any time, and the workers keep serving throughout: a conversation shows
+its full history as soon as its key has been moved.
+
+Usage: python key_migration.py [--source redis://host:port/0] [--target redis://host:port/0] [--target-cluster] [--batch 500] [--dry-run]
+"""
+
+import argparse
+import json
+import re
+import sys
+
+import redis
+from redis.cluster import RedisCluster
+
+from account_stats import active_key, traffic_key, unread_key, unread_total_key
+from auto_responder import rules_key, rules_version_key
+from conversation_versions import versions_key
+from history_transfer import message_time
+from key_schema import ACCOUNTS_INDEX, account_key, account_record_key
+from message_scheduler import DUE_KEY, PROCESSING_KEY, account_jobs_key, job_key
+from message_stream import stream_key
+from service_window import window_key
+from storage import HISTORY_LIMIT, contacts_key, history_key
+
+LEGACY_ACCOUNTS_KEY = "whatsapp_accounts"
+
+# How a moved key is combined with a new key the app has already written to
+APPEND = "append"  # message lists: old (older) messages behind the new ones
+SUM = "sum"
+MAX = "max"
+UNION = "union"
+KEEP = "keep"  # the new key wins
+
+ACCOUNT = r"([^:{}]+)"
+
+# (old key pattern, new key from the pattern's groups, merge)
+LEGACY_KEYS = [
+    (rf"messages:{ACCOUNT}:(.+)", history_key, APPEND),
+    (rf"contacts:{ACCOUNT}", contacts_key, MAX),
+    (rf"versions:{ACCOUNT}", versions_key, MAX),
+    (rf"last_inbound:{ACCOUNT}", window_key, MAX),
+    (rf"stream:messages:{ACCOUNT}", stream_key, KEEP),
+    (rf"auto_rules:{ACCOUNT}:version", rules_version_key, KEEP),
+    (rf"auto_rules:{ACCOUNT}", rules_key, KEEP),
+    (rf"media:{ACCOUNT}", lambda account_id: account_key(account_id, "media"), KEEP),
+    (rf"unread:{ACCOUNT}", unread_key, SUM),
+    (rf"unread_total:{ACCOUNT}", unread_total_key, SUM),
+    (rf"traffic:{ACCOUNT}:(\d{{10}})", traffic_key, SUM),
+    (rf"active:{ACCOUNT}:(\d{{8}})", active_key, UNION),
+    (r"scheduled:job:(.+)", job_key, KEEP),
+    (rf"scheduled:account:{ACCOUNT}", account_jobs_key, MAX),
+    (r"scheduled:due", lambda: DUE_KEY, MAX),
+    (r"scheduled:processing", lambda: PROCESSING_KEY, MAX),
+]
+LEGACY_PATTERNS = [(re.compile(pattern), new_key, merge) for pattern, new_key, merge in LEGACY_KEYS]
+LEGACY_HISTORY = LEGACY_PATTERNS[0][0]
+
+
+def new_name(key):
+    """(new key, merge) for a key in the old layout, or (None, None)."""
+    for pattern, new_key, merge in LEGACY_PATTERNS:
+        match = pattern.fullmatch(key)
+        if match:
+            return new_key(*match.groups()), merge
+    return None, None
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class KeyMigrator:
+    """source and target are clients without decode_responses (DUMP payloads are binary)."""
+
+    def __init__(self, source, target, batch_size=500, history_limit=HISTORY_LIMIT, dry_run=False):
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.history_limit = history_limit
+        self.dry_run = dry_run
+        self.stats = {"scanned": 0, "copied": 0, "merged": 0, "left": 0, "accounts": 0}
+
+    def run(self):
+        batch = []
+        for key in self.source.scan_iter(count=self.batch_size):
+            key = _text(key)
+            self.stats["scanned"] += 1
+            if key == LEGACY_ACCOUNTS_KEY:
+                self.migrate_accounts()
+                continue
+            new_key, merge = new_name(key)
+            if new_key is None:
+                continue  # already in the new layout, or not ours
+            batch.append((key, new_key, merge))
+            if len(batch) >= self.batch_size:
+                self._migrate(batch)
+                batch = []
+        self._migrate(batch)
+        return self.stats
+
+    def migrate_accounts(self):
+        raw = self.source.get(LEGACY_ACCOUNTS_KEY)
+        accounts = json.loads(raw) if raw else {}
+        self.stats["accounts"] += len(accounts)
+        if self.dry_run:
+            return
+        pipe = self.target.pipeline(transaction=False)
+        for account_id, config in accounts.items():
+            pipe.set(account_record_key(account_id), json.dumps(config), nx=True)  # saved since the deploy: newer
+            pipe.sadd(ACCOUNTS_INDEX, account_id)
+        pipe.execute()
+        self.source.delete(LEGACY_ACCOUNTS_KEY)
+
+    def _migrate(self, batch):
+        if not batch:
+            return
+        pipe = self.source.pipeline(transaction=False)
+        for old_key, _, _ in batch:
+            pipe.type(old_key)
+            pipe.pttl(old_key)
+            pipe.dump(old_key)
+        replies = pipe.execute()
+        pipe = self.target.pipeline(transaction=False)
+        for _, new_key, _ in batch:
+            pipe.exists(new_key)
+        existing = pipe.execute()
+
+        copies, merges = [], []
+        for index, (item, exists) in enumerate(zip(batch, existing)):
+            kind, ttl, dump = _text(replies[3 * index]), replies[3 * index + 1], replies[3 * index + 2]
+            if dump is None:
+                continue  # expired or deleted since the SCAN
+            (merges if exists else copies).append(item + (kind, max(ttl, 0), dump))
+        if self.dry_run:
+            self.stats["copied"] += len(copies)
+            self.stats["merged"] += len(merges)
+            return
+
+        moved = []
+        pipe = self.target.pipeline(transaction=False)
+        for _, new_key, _, _, ttl, dump in copies:
+            pipe.restore(new_key, ttl, dump)
+        for item, result in zip(copies, pipe.execute(raise_on_error=False)):
+            if isinstance(result, Exception):
+                if "BUSYKEY" not in str(result):
+                    raise result
+                merges.append(item)  # the app wrote the new key in the meantime
+            else:
+                self.stats["copied"] += 1
+                moved.append(item[0])
+        for item in merges:
+            if self._merge(*item):
+                self.stats["merged"] += 1
+                moved.append(item[0])
+            else:
+                self.stats["left"] += 1
+                print(f"⚠️ Left {item[0]} in place: {item[1]} already exists and a {item[3]} can't be merged")
+
+        self._index_contacts([LEGACY_HISTORY.fullmatch(old_key) for old_key in moved])
+        pipe = self.source.pipeline(transaction=False)
+        for old_key in moved:
+            pipe.delete(old_key)
+        pipe.execute()
+
+    def _index_contacts(self, matches):
+        """Add moved conversations to their account's contacts index, keeping any newer score."""
+        conversations = [match.groups() for match in matches if match]
+        if not conversations:
+            return
+        pipe = self.target.pipeline(transaction=False)
+        for account_id, phone_number in conversations:
+            pipe.lindex(history_key(account_id, phone_number), 0)
+        newest = pipe.execute()
+        pipe = self.target.pipeline(transaction=False)
+        for (account_id, phone_number), raw in zip(conversations, newest):
+            try:
+                sent_at = message_time(json.loads(raw).get("timestamp"))
+            except (TypeError, ValueError, AttributeError):
+                sent_at = None  # unreadable: listed last
+            pipe.zadd(contacts_key(account_id), {phone_number: sent_at or 0}, gt=True)
+        pipe.execute()
+
+    def _merge(self, old_key, new_key, merge, kind, ttl, dump):
+        source, target = self.source, self.target
+        if kind == "list":
+            items = source.lrange(old_key, 0, -1)
+            if items:
+                target.rpush(new_key, *items)
+            if merge == APPEND:
+                target.ltrim(new_key, 0, self.history_limit - 1)
+        elif kind == "hash":
+            fields = source.hgetall(old_key)
+            if fields and merge == MAX:
+                current = dict(zip(fields, target.hmget(new_key, list(fields))))
+                fields = {field: value for field, value in fields.items()
+                          if current[field] is None or float(value) > float(current[field])}
+            pipe = target.pipeline(transaction=False)
+            for field, value in fields.items():
+                if merge == SUM:
+                    pipe.hincrby(new_key, field, int(value))
+                elif merge == MAX:
+                    pipe.hset(new_key, field, value)
+                else:
+                    pipe.hsetnx(new_key, field, value)
+            pipe.execute()
+        elif kind == "zset":
+            members = dict(source.zrange(old_key, 0, -1, withscores=True))
+            if members:
+                target.zadd(new_key, members, gt=merge == MAX, nx=merge != MAX)
+        elif kind == "set":
+            members = source.smembers(old_key)
+            if members:
+                target.sadd(new_key, *members)
+        elif kind == "string":
+            if merge == SUM:
+                target.incrby(new_key, int(source.get(old_key) or 0))
+            elif merge == UNION:
+                # Same hash tag as new_key, so PFMERGE works in a cluster too
+                scratch = new_key + ":migrating"
+                target.restore(scratch, 0, dump, replace=True)
+                target.pfmerge(new_key, new_key, scratch)
+                target.delete(scratch)
+        else:
+            return False
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", help="Redis URL holding the old keys (default: the app's Redis)")
+    parser.add_argument("--target", help="Redis URL to move them to (default: the app's Redis)")
+    parser.add_argument("--target-cluster", action="store_true", help="the target is a Redis Cluster (default: REDIS_CLUSTER)")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="count what would be moved or merged")
+    args = parser.parse_args()
+
+    import whatsapp_bot  # only for the app's Redis settings
+
+    def app_redis(cluster):
+        options = dict(host=whatsapp_bot.REDIS_HOST, port=whatsapp_bot.REDIS_PORT,
+                       username=whatsapp_bot.REDIS_USERNAME, password=whatsapp_bot.REDIS_PASSWORD)
+        return RedisCluster(**options) if cluster else redis.Redis(**options)
+
+    source = redis.Redis.from_url(args.source) if args.source else app_redis(whatsapp_bot.REDIS_CLUSTER)
+    if args.target:
+        target = RedisCluster.from_url(args.target) if args.target_cluster else redis.Redis.from_url(args.target)
+    else:
+        target = app_redis(args.target_cluster or whatsapp_bot.REDIS_CLUSTER)
+    stats = KeyMigrator(source, target, batch_size=args.batch, dry_run=args.dry_run).run()
+    print(f"{'🔍 Dry run: ' if args.dry_run else '✅ '}scanned {stats['scanned']} key(s): {stats['copied']} copied, "
+          f"{stats['merged']} merged, {stats['accounts']} account(s) split out, {stats['left']} left in place")
+    return 1 if stats["left"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Redis key schema.
+
+Every key and pub/sub channel that belongs to an account starts with the
+account's hash tag, ``{account_id}:...`` (e.g. ``{main}:messages:2348...``).
+Redis Cluster places keys by the hash of their tag, so an account's keys
+live together in one slot: pipelines, scripts and multi-key reads over one
+account keep working, and accounts spread evenly over the shards as shards
+are added. Channels follow the same rule so that sharded pub/sub (SPUBLISH)
+keeps an account's events on the shard that owns the account.
+
+Keys that aren't per account are few and small: the account index below, the
+scheduler's queue (one ``{scheduled}`` slot, see message_scheduler) and the
+idempotency records, which spread across slots by their own names.
+"""
+
+# Set of all stored account ids (their configs are under account_record_key())
+ACCOUNTS_INDEX = "accounts"
+
+
+def account_tag(account_id):
+    return "{" + str(account_id) + "}"
+
+
+def account_key(account_id, *parts):
+    """``{account_id}:part:part...``"""
+    return ":".join((account_tag(account_id),) + tuple(str(part) for part in parts))
+
+
+def account_channel(account_id, name):
+    return account_key(account_id, name)
+
+
+def account_record_key(account_id):
+    return account_key(account_id, "account")
+
+
+def account_of(key):
+    """The account id a key or channel is tagged with, or None."""
+    if key.startswith("{"):
+        end = key.find("}")
+        if end > 1:
+            return key[1:end]
+    return None
+
+
+def strip_tag(key):
+    """A key without its account tag: ``{main}:messages:1`` -> ``messages:1``."""
+    account_id = account_of(key)
+    return key if account_id is None else key[len(account_id) + 3:]
@@ -0,0 +1,211 @@
+"""
+Media message ingestion and storage.
+
+Inbound images, voice notes, videos and documents are fetched by a pool of
+background download threads: the Graph API is asked for the media URL, and
+the file is streamed in chunks into a content-addressed local store while it
+is hashed, so no file is ever held in memory. Identical files (same SHA-256)
+are stored once. Messages only keep a compact reference to the media ID.
+
+Downloads are not retried, so a failed one is final: on_failure is told why
+(NOT_FOUND when the Graph API no longer has the media, TOO_LARGE, REJECTED
+when the download queue was full, FAILED for anything else), and callers can
+answer for the media ID instead of reporting it as still downloading.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+
+import requests
+
+# WhatsApp message types that carry a downloadable media object
+MEDIA_MESSAGE_TYPES = ("image", "audio", "video", "document", "sticker")
+
+CHUNK_SIZE = 64 * 1024
+
+# Reasons passed to on_failure
+NOT_FOUND = "not_found"
+TOO_LARGE = "too_large"
+REJECTED = "rejected"
+FAILED = "failed"
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+def failure_reason(error):
+    if isinstance(error, MediaTooLarge):
+        return TOO_LARGE
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None and response.status_code in (400, 404, 410):
+        return NOT_FOUND  # expired or unknown media ID
+    return FAILED
+
+
+class MediaStore:
+    """Content-addressed files under root/<aa>/<bb>/<sha256>, with a small JSON sidecar."""
+
+    def __init__(self, root, max_bytes=100 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def metadata(self, digest):
+        try:
+            with open(self.path_for(digest) + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def ingest(self, chunks, mime_type=None, filename=None):
+        """
+        Write an iterable of byte chunks to the store, hashing as it goes.
+
+        Returns (sha256, size, deduplicated). The data lands in a temporary
+        file first and is renamed into place, so readers never see a partial
+        file and concurrent downloads of the same content are harmless.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".incoming-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MediaTooLarge(f"media exceeds {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            sha256 = digest.hexdigest()
+            final_path = self.path_for(sha256)
+            if os.path.exists(final_path):
+                os.remove(tmp_path)
+                return sha256, size, True
+
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            with open(final_path + ".json", "w", encoding="utf-8") as f:
+                json.dump({"mime_type": mime_type, "filename": filename, "size": size}, f)
+            os.replace(tmp_path, final_path)
+            return sha256, size, False
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class MediaDownloader:
+    """
+    Background download threads for inbound media.
+
+    get_token(account_id) returns the access token for an account;
+    on_complete(job, sha256, size) is called after a successful download and
+    on_failure(job, reason, error) after one that failed or couldn't be queued.
+    """
+
+    def __init__(self, store, graph_api_version, get_token, on_complete, on_failure=None,
+                 workers=2, timeout=30, queue_size=1000):
+        self.store = store
+        self.graph_api_version = graph_api_version
+        self.get_token = get_token
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.workers = workers
+        self.timeout = timeout
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"media-download-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "downloaded": self.downloaded,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+        }
+
+    def enqueue(self, account_id, media_id, mime_type=None, filename=None):
+        """Schedule a media download; returns False if the download queue is full."""
+        if not self._threads:
+            self.start()
+        job = {"account_id": account_id, "media_id": media_id, "mime_type": mime_type, "filename": filename}
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            self._fail(job, REJECTED, "download queue is full")
+            return False
+
+    def download(self, job):
+        """Resolve the media URL through the Graph API and stream it into the store."""
+        headers = {"Authorization": f"Bearer {self.get_token(job['account_id'])}"}
+        meta_url = f"https://graph.facebook.com/{self.graph_api_version}/{job['media_id']}"
+        with requests.Session() as session:
+            meta = session.get(meta_url, headers=headers, timeout=self.timeout)
+            meta.raise_for_status()
+            info = meta.json()
+            mime_type = job.get("mime_type") or info.get("mime_type")
+
+            with session.get(info["url"], headers=headers, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                sha256, size, deduplicated = self.store.ingest(
+                    response.iter_content(chunk_size=CHUNK_SIZE),
+                    mime_type=mime_type,
+                    filename=job.get("filename")
+                )
+        job["mime_type"] = mime_type
+        return sha256, size, deduplicated
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                sha256, size, deduplicated = self.download(job)
+                if deduplicated:
+                    self.deduplicated += 1
+                else:
+                    self.downloaded += 1
+                self.on_complete(job, sha256, size)
+            except Exception as e:
+                self._fail(job, failure_reason(e), str(e))
+            finally:
+                self._queue.task_done()
+
+    def _fail(self, job, reason, error):
+        self.failed += 1
+        print(f"⚠️ Media download failed for {job['media_id']} (Account: {job['account_id']}): {error}")
+        if self.on_failure is not None:
+            try:
+                self.on_failure(job, reason, error)
+            except Exception as e:
+                print(f"⚠️ Media failure callback failed: {e}")
+
+    def flush(self):
+        """Block until every queued download has finished."""
+        if self._threads:
+            self._queue.join()
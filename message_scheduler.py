@@ -0,0 +1,350 @@
+"""
+Scheduled and delayed message sending.
+
+Jobs live in Redis: the job itself under ``{scheduled}:job:{id}``, its due
+time as the score of one global sorted set (``{scheduled}:due``), and a
+per-account sorted set for listing. All of these share the ``{scheduled}``
+hash tag, so in Redis Cluster the queue is one slot and its transactions and
+scripts keep working. One worker at a time holds a short leader lease and
+runs the dispatcher, which claims due jobs a batch at a time with a Lua script
+(moving them to ``{scheduled}:processing`` with a lease deadline, so jobs of a
+dispatcher that died mid-batch are claimed again) and hands them to the send
+callback. Between batches it sleeps until the earliest due time (or until a
+job is scheduled in this worker), so idle cost doesn't depend on how many jobs
+are pending.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DUE_KEY = "{scheduled}:due"
+PROCESSING_KEY = "{scheduled}:processing"
+LEADER_KEY = "{scheduled}:leader"
+
+# Requeue expired claims, then move up to ARGV[2] due jobs to processing with
+# lease deadline ARGV[3]; returns the claimed job ids.
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], ARGV[1], id)
+end
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+end
+return ids
+"""
+
+# Extend the leader lease only if this worker still holds it
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Give up the leader lease only if this worker still holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def job_key(job_id):
+    return f"{{scheduled}}:job:{job_id}"
+
+
+def account_jobs_key(account_id):
+    return f"{{scheduled}}:account:{account_id}"
+
+
+def resolve_due_time(spec, now=None, last_inbound=None):
+    """
+    Epoch seconds at which a job is due. spec holds exactly one of:
+
+    - "send_at": ISO 8601 datetime (naive times are read in "timezone", else local time)
+    - "local_time": "HH:MM", the next such time in "timezone" (IANA name)
+    - "delay_seconds": seconds from now
+    - "after_last_inbound_seconds": seconds after the contact's last inbound
+      message (last_inbound, epoch seconds)
+
+    Raises ValueError with a message suitable for the API.
+    """
+    now = now or time.time()
+    given = [name for name in ("send_at", "local_time", "delay_seconds", "after_last_inbound_seconds")
+             if spec.get(name) not in (None, "")]
+    if len(given) != 1:
+        raise ValueError("Give exactly one of 'send_at', 'local_time', 'delay_seconds' or 'after_last_inbound_seconds'")
+
+    zone = None
+    if spec.get("timezone"):
+        try:
+            zone = ZoneInfo(spec["timezone"])
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone: {spec['timezone']}")
+
+    name = given[0]
+    if name == "send_at":
+        try:
+            when = datetime.fromisoformat(str(spec["send_at"]))
+        except ValueError:
+            raise ValueError("'send_at' must be an ISO 8601 datetime")
+        if when.tzinfo is None and zone is not None:
+            when = when.replace(tzinfo=zone)
+        return when.timestamp()
+
+    if name == "local_time":
+        try:
+            hour, minute = (int(part) for part in str(spec["local_time"]).split(":"))
+            today = datetime.fromtimestamp(now, zone).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        except ValueError:
+            raise ValueError("'local_time' must be HH:MM")
+        due = today if today.timestamp() > now else today + timedelta(days=1)
+        return due.timestamp()
+
+    try:
+        seconds = float(spec[name])
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number of seconds")
+    if seconds < 0:
+        raise ValueError(f"'{name}' must not be negative")
+    if name == "delay_seconds":
+        return now + seconds
+    if last_inbound is None:
+        raise ValueError("No inbound message from this contact to schedule after")
+    return max(last_inbound + seconds, now)
+
+
+class MessageScheduler:
+    """
+    Redis-backed timer queue for outgoing messages.
+
+    send(job) performs the send and returns the result dict of
+    send_whatsapp_message(); it runs on a small thread pool in whichever
+    worker currently holds the leader lease.
+    """
+
+    def __init__(self, redis_manager, send, batch_size=100, lease_seconds=60, leader_ttl=10,
+                 max_idle=1.0, concurrency=4, result_ttl=7 * 86400):
+        self.redis_manager = redis_manager
+        self.send = send
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.leader_ttl = leader_ttl
+        self.max_idle = max_idle
+        self.concurrency = concurrency
+        self.result_ttl = result_ttl
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.dispatched = 0
+        self.failed = 0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._scripts = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name="message-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop claiming jobs, wait (up to timeout seconds) for the sends already
+        dispatched and hand the leader lease over; True if they all finished.
+        """
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+        client = self.redis_manager.get_client()
+        if self.is_leader and client is not None:
+            try:
+                self._script(client, RELEASE_SCRIPT)(keys=[LEADER_KEY], args=[self.worker_id])
+            except Exception as e:
+                self.redis_manager.record_error(e)
+        self.is_leader = False
+        return True
+
+    def _script(self, client, source):
+        # Scripts are registered per client (a new client is created after a reconnect)
+        key = (id(client), source)
+        if key not in self._scripts:
+            self._scripts[key] = client.register_script(source)
+        return self._scripts[key]
+
+    def schedule(self, account_id, to, due, message, message_type="text", template=None, fallback_template=None):
+        """Store a job; returns it, or None if Redis is unavailable."""
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None
+        job = {
+            "id": uuid.uuid4().hex,
+            "account_id": account_id,
+            "to": to,
+            "message": message,
+            "type": message_type,
+            "template": template,
+            "fallback_template": fallback_template,
+            "due": due,
+            "created": time.time(),
+            "status": "pending",
+        }
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.set(job_key(job["id"]), json.dumps(job))
+            pipe.zadd(account_jobs_key(account_id), {job["id"]: due})
+            pipe.zadd(DUE_KEY, {job["id"]: due})
+            pipe.execute()
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Could not schedule message: {e}")
+            return None
+        self._wake.set()  # the dispatcher may be sleeping past this job's due time
+        return job
+
+    def get(self, job_id):
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None
+        raw = client.get(job_key(job_id))
+        return json.loads(raw) if raw else None
+
+    def cancel(self, account_id, job_id):
+        """
+        Cancel a pending job. Returns "cancelled" (also for a job that already
+        was), "not_found", or the status of a job that can no longer be
+        cancelled ("dispatching", "sent", "failed"); None if Redis is unavailable.
+        """
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None
+        job = self.get(job_id)
+        if not job or job["account_id"] != account_id:
+            return "not_found"
+        if job["status"] != "pending":
+            return job["status"]
+        # Whoever removes the job from the due set owns it; after a claim, ZREM returns 0
+        if not client.zrem(DUE_KEY, job_id):
+            return "dispatching"
+        job["status"] = "cancelled"
+        self._finish(client, job)
+        return "cancelled"
+
+    def list(self, account_id, offset=0, limit=100):
+        """Pending jobs of an account by due time, and how many there are in total."""
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None, 0
+        job_ids = client.zrange(account_jobs_key(account_id), offset, offset + limit - 1)
+        total = client.zcard(account_jobs_key(account_id))
+        if not job_ids:
+            return [], total
+        return [json.loads(raw) for raw in client.mget([job_key(job_id) for job_id in job_ids]) if raw], total
+
+    def stats(self):
+        stats = {"leader": self.is_leader, "dispatched": self.dispatched, "failed": self.failed}
+        client = self.redis_manager.get_client()
+        if client is not None:
+            try:
+                stats["pending"] = client.zcard(DUE_KEY)
+                stats["in_flight"] = client.zcard(PROCESSING_KEY)
+            except Exception as e:
+                self.redis_manager.record_error(e)
+        return stats
+
+    def _finish(self, client, job):
+        pipe = client.pipeline(transaction=True)
+        pipe.zrem(PROCESSING_KEY, job["id"])
+        pipe.zrem(account_jobs_key(job["account_id"]), job["id"])
+        pipe.set(job_key(job["id"]), json.dumps(job), ex=self.result_ttl)
+        pipe.execute()
+
+    def _elect(self, client):
+        """Take or keep the leader lease."""
+        ttl_ms = int(self.leader_ttl * 1000)
+        if self.is_leader:
+            self.is_leader = bool(self._script(client, RENEW_SCRIPT)(keys=[LEADER_KEY], args=[self.worker_id, ttl_ms]))
+        if not self.is_leader:
+            self.is_leader = bool(client.set(LEADER_KEY, self.worker_id, nx=True, px=ttl_ms))
+        return self.is_leader
+
+    def claim(self, client, now=None):
+        """Claim the next batch of due jobs; returns the jobs."""
+        now = now or time.time()
+        claim = self._script(client, CLAIM_SCRIPT)
+        job_ids = claim(keys=[DUE_KEY, PROCESSING_KEY], args=[now, self.batch_size, now + self.lease_seconds])
+        if not job_ids:
+            return []
+        jobs = []
+        for job_id, raw in zip(job_ids, client.mget([job_key(job_id) for job_id in job_ids])):
+            if raw:
+                jobs.append(json.loads(raw))
+            else:
+                client.zrem(PROCESSING_KEY, job_id)  # deleted underneath us
+        return jobs
+
+    def _dispatch(self, client, job):
+        try:
+            result = self.send(job)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        job["status"] = "sent" if result.get("success") else "failed"
+        job["result"] = {key: result.get(key) for key in ("message_id", "sent_as", "error") if result.get(key)}
+        job["dispatched_at"] = time.time()
+        if result.get("success"):
+            self.dispatched += 1
+        else:
+            self.failed += 1
+            print(f"⚠️ Scheduled message {job['id']} to {job['to']} failed: {result.get('error')}")
+        self._finish(client, job)
+
+    def dispatch_due(self, client, pool=None, now=None):
+        """Claim and send one batch of due jobs; returns how many were claimed."""
+        jobs = self.claim(client, now)
+        if pool is None or len(jobs) < 2:
+            for job in jobs:
+                self._dispatch(client, job)
+        else:
+            list(pool.map(lambda job: self._dispatch(client, job), jobs))
+        return len(jobs)
+
+    def _next_due_in(self, client):
+        first = client.zrange(DUE_KEY, 0, 0, withscores=True)
+        if not first:
+            return self.max_idle
+        return min(max(first[0][1] - time.time(), 0), self.max_idle)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="scheduled-send") as pool:
+            while not self._stopping:
+                wait = self.max_idle
+                client = self.redis_manager.get_client()
+                if client is not None:
+                    try:
+                        if self._elect(client):
+                            if self.dispatch_due(client, pool) >= self.batch_size:
+                                continue  # more are due right now
+                            wait = self._next_due_in(client)
+                        else:
+                            wait = self.leader_ttl / 2
+                    except Exception as e:
+                        self.redis_manager.record_error(e)
+                        print(f"⚠️ Message scheduler error: {e}")
+                self._wake.wait(wait)
+                self._wake.clear()
@@ -0,0 +1,349 @@
+"""
+Full-text search over conversation history.
+
+A SQLite FTS5 sidecar index, maintained incrementally: store_message() queues
+each message and a background thread inserts the queue in batched
+transactions. Searches are scoped to one account (and optionally one contact),
+ranked with BM25 and paginated, so they stay fast however much history the
+account has.
+
+Messages are rows of search_messages keyed by (account, message id), which
+the FTS table indexes as external content: a replayed or re-imported message
+replaces its row instead of adding a duplicate. Like the stored histories,
+each conversation keeps only its newest history_limit messages (by version),
+so search doesn't find messages the history has already trimmed.
+
+Only the rank_window most recent matches are ranked. When there are older
+ones the search says so and returns a cursor for the next, older window.
+
+History stored before the index existed (or while it was off) can be indexed
+once with:
+
+    python message_search.py --backfill [--account main]
+"""
+
+import argparse
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+
+from storage import HISTORY_LIMIT
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS search_messages (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        account TEXT NOT NULL,
+        phone_number TEXT NOT NULL,
+        account_id TEXT NOT NULL,
+        message_id TEXT,
+        timestamp TEXT,
+        type TEXT,
+        version INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (account_id, message_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS search_messages_by_conversation ON search_messages (account_id, phone_number, version)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        text,
+        account,
+        phone_number,
+        account_id UNINDEXED,
+        message_id UNINDEXED,
+        timestamp UNINDEXED,
+        type UNINDEXED,
+        content = 'search_messages',
+        content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_messages_insert AFTER INSERT ON search_messages BEGIN
+        INSERT INTO messages_fts (rowid, text, account, phone_number, account_id, message_id, timestamp, type)
+        VALUES (new.id, new.text, new.account, new.phone_number, new.account_id, new.message_id, new.timestamp, new.type);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_messages_delete AFTER DELETE ON search_messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text, account, phone_number, account_id, message_id, timestamp, type)
+        VALUES ('delete', old.id, old.text, old.account, old.phone_number, old.account_id, old.message_id, old.timestamp, old.type);
+    END
+    """,
+)
+
+# Drops the messages of a conversation beyond its newest history_limit (by version)
+PRUNE = (
+    "DELETE FROM search_messages WHERE account_id = ? AND phone_number = ? AND id NOT IN ("
+    "SELECT id FROM search_messages WHERE account_id = ? AND phone_number = ? "
+    "ORDER BY version DESC, id DESC LIMIT ?)"
+)
+
+INDEX_BATCH_SIZE = 500
+
+# Very common terms can match a large share of an account's history; only the
+# most recent matches (by rowid) are ranked at a time, so their cost stays bounded
+RANK_WINDOW = 5000
+
+NEWEST = 2 ** 63 - 1  # a window cursor above every rowid
+
+
+def account_token(account_id):
+    """Account IDs are indexed as a single hex token so any ID can be matched exactly."""
+    return "a" + account_id.encode("utf-8").hex()
+
+
+def query_terms(query):
+    return [term for term in query.split() if re.search(r"\w", term)]
+
+
+def build_match(account_id, terms, phone_number=None):
+    """
+    Turn free text into an FTS5 MATCH expression: every term must appear in
+    the message text (each term is quoted, so punctuation like "ORD-1234"
+    becomes a phrase) and the last term also matches as a prefix.
+    """
+    phrases = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+    phrases[-1] += "*"
+    match = f"account : {account_token(account_id)} AND text : ({' AND '.join(phrases)})"
+    if phone_number:
+        match += f' AND phone_number : "{phone_number}"'
+    return match
+
+
+def _row(message_data):
+    return (
+        message_data.get("text") or "",
+        account_token(message_data["account_id"]),
+        message_data["phone_number"],
+        message_data["account_id"],
+        message_data.get("id"),
+        message_data.get("timestamp"),
+        message_data.get("type"),
+        int(message_data.get("version") or 0),
+    )
+
+
+def _create_schema(conn):
+    """
+    Create the tables, moving an index from before messages were keyed by ID
+    (a standalone FTS table) into search_messages, duplicates dropped.
+    """
+    conn.execute("BEGIN IMMEDIATE")  # one worker migrates; the others find it done
+    try:
+        existing = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        legacy = existing is not None and "search_messages" not in existing[0]
+        if legacy:
+            conn.execute("ALTER TABLE messages_fts RENAME TO messages_fts_legacy")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        if legacy:
+            conn.execute(
+                "INSERT OR REPLACE INTO search_messages "
+                "(text, account, phone_number, account_id, message_id, timestamp, type) "
+                "SELECT text, account, phone_number, account_id, message_id, timestamp, type "
+                "FROM messages_fts_legacy ORDER BY rowid"
+            )
+            conn.execute("DROP TABLE messages_fts_legacy")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+class MessageSearchIndex:
+    """SQLite FTS5 index of messages, shared by all workers on a host (WAL mode)."""
+
+    def __init__(self, path, queue_size=10000, rank_window=RANK_WINDOW, history_limit=HISTORY_LIMIT):
+        self.path = path
+        self.rank_window = rank_window
+        self.history_limit = history_limit
+        self.indexed_messages = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA recursive_triggers=ON")  # REPLACE fires the delete trigger for the row it replaces
+            _create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Start the background indexing thread (also done on first add())."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="search-index", daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        return {"indexed_messages": self.indexed_messages, "queued": self._queue.qsize()}
+
+    def add(self, message_data):
+        """Queue a stored message for indexing; indexes inline if the queue is full."""
+        if self._thread is None:
+            self.start()
+        row = _row(message_data)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._insert([row])
+
+    def _insert(self, rows):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO search_messages "
+                "(text, account, phone_number, account_id, message_id, timestamp, type, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(PRUNE, [
+                (account_id, phone_number, account_id, phone_number, self.history_limit)
+                for account_id, phone_number in {(row[3], row[2]) for row in rows}
+            ])
+        self.indexed_messages += len(rows)
+
+    def _run(self):
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < INDEX_BATCH_SIZE:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._insert(rows)
+            except Exception as e:
+                print(f"⚠️ Search indexing failed for {len(rows)} message(s): {e}")
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until everything queued so far is indexed."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def search(self, account_id, query, page=1, per_page=20, phone_number=None, before=None):
+        """
+        Ranked search within one account, over the rank_window most recent
+        matches (older than the cursor before, if given). Returns (hits,
+        has_more, older): hits are the best matches first, and older is the
+        cursor of the next window, or None if there are no older matches.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], False, None
+        conn = self._connect()
+        params = {
+            "match": build_match(account_id, terms, phone_number),
+            "before": NEWEST if before is None else before,
+            "window": self.rank_window,
+            "limit": per_page + 1,
+            "offset": (page - 1) * per_page,
+        }
+        params["oldest"] = conn.execute(
+            "SELECT min(rowid) FROM ("
+            "  SELECT rowid FROM messages_fts WHERE messages_fts MATCH :match AND rowid < :before"
+            "  ORDER BY rowid DESC LIMIT :window"
+            ")",
+            params
+        ).fetchone()[0]
+        if params["oldest"] is None:
+            return [], False, None
+        rows = conn.execute(
+            "SELECT account_id, phone_number, message_id, timestamp, type, text, bm25(messages_fts) "
+            "FROM messages_fts WHERE messages_fts MATCH :match AND rowid >= :oldest AND rowid < :before "
+            "ORDER BY rank LIMIT :limit OFFSET :offset",
+            params
+        ).fetchall()
+        truncated = conn.execute(
+            "SELECT 1 FROM messages_fts WHERE messages_fts MATCH :match AND rowid < :oldest LIMIT 1", params
+        ).fetchone() is not None
+        hits = [
+            {
+                "account_id": row[0],
+                "phone_number": row[1],
+                "id": row[2],
+                "timestamp": row[3],
+                "type": row[4],
+                "text": row[5],
+                "score": round(-row[6], 4),
+            }
+            for row in rows[:per_page]
+        ]
+        return hits, len(rows) > per_page, params["oldest"] if truncated else None
+
+    def backfill(self, messages):
+        """
+        Index stored messages ({"account_id", "phone_number", "id", ...}) that
+        aren't indexed yet, by message ID. Returns how many were added.
+        """
+        conn = self._connect()
+        indexed = {}  # account_id -> message IDs already in the index
+        batch, added = [], 0
+        for message_data in messages:
+            account_id = message_data.get("account_id")
+            if not account_id or not message_data.get("phone_number"):
+                continue
+            if account_id not in indexed:
+                indexed[account_id] = {row[0] for row in conn.execute(
+                    "SELECT message_id FROM search_messages WHERE account_id = ?", (account_id,)
+                )}
+            if message_data.get("id") in indexed[account_id]:
+                continue
+            indexed[account_id].add(message_data.get("id"))
+            batch.append(message_data)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                self._insert([_row(m) for m in batch])
+                added += len(batch)
+                batch = []
+        if batch:
+            self._insert([_row(m) for m in batch])
+            added += len(batch)
+        return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index stored message history for full-text search")
+    parser.add_argument("--backfill", action="store_true", help="index the Redis history of every (or one) account")
+    parser.add_argument("--account", action="append", help="only this account (repeatable)")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return 2
+
+    import redis
+    from redis.cluster import RedisCluster
+
+    import whatsapp_bot  # only for the app's Redis settings, accounts and index path
+    from history_transfer import iter_history
+    from key_schema import ACCOUNTS_INDEX
+
+    options = dict(host=whatsapp_bot.REDIS_HOST, port=whatsapp_bot.REDIS_PORT, username=whatsapp_bot.REDIS_USERNAME,
+                   password=whatsapp_bot.REDIS_PASSWORD, decode_responses=True)
+    client = RedisCluster(**options) if whatsapp_bot.REDIS_CLUSTER else redis.Redis(**options)
+    account_ids = args.account or sorted(set(whatsapp_bot.load_accounts_from_env()) | client.smembers(ACCOUNTS_INDEX))
+    index = MessageSearchIndex(whatsapp_bot.SEARCH_INDEX_PATH)
+    for account_id in account_ids:
+        added = index.backfill(dict(message, account_id=account_id) for message in iter_history(client, account_id))
+        print(f"✅ Indexed {added} message(s) of account {account_id}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
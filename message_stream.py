@@ -0,0 +1,159 @@
+"""
+Per-account Redis Stream of stored messages.
+
+store_message() appends every message to ``{account_id}:stream:messages`` in
+the same pipeline as the history write. Downstream processors (analytics, CRM
+sync, auto-responders) attach through consumer groups, read at their own pace
+and acknowledge what they have handled; anything read but not acknowledged
+stays pending and can be re-read, or claimed by another consumer once it has
+sat idle (the consumer that read it crashed), so no event is lost.
+"""
+
+import json
+import time
+
+import redis
+
+from key_schema import account_key
+
+
+def stream_key(account_id):
+    return account_key(account_id, "stream", "messages")
+
+
+def append_command(account_id, message_data, maxlen=100000, retention_hours=0):
+    """
+    Build the XADD command (for RedisManager.write) that appends a message.
+
+    The stream is trimmed approximately, either by age (retention_hours, via
+    MINID) or by length (maxlen, via MAXLEN).
+    """
+    fields = {
+        "phone_number": message_data["phone_number"],
+        "type": message_data["type"],
+        "message": json.dumps(message_data),
+    }
+    if retention_hours:
+        min_id = int((time.time() - retention_hours * 3600) * 1000)
+        return ("xadd", stream_key(account_id), fields, "*", None, True, False, min_id)
+    return ("xadd", stream_key(account_id), fields, "*", maxlen, True)
+
+
+def _decode_entries(entries):
+    return [
+        {"id": entry_id, "message": json.loads(fields["message"])}
+        for entry_id, fields in entries
+        if fields and "message" in fields
+    ]
+
+
+def create_group(client, account_id, group, start="$"):
+    """
+    Create a consumer group. start="$" delivers only new messages, "0" replays
+    the whole retained stream. Returns False if the group already exists.
+    """
+    try:
+        client.xgroup_create(stream_key(account_id), group, id=start, mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" in str(e):
+            return False
+        raise
+    return True
+
+
+def group_missing(error):
+    """Whether a Redis error says the stream or the consumer group doesn't exist."""
+    return isinstance(error, redis.exceptions.ResponseError) and (
+        str(error).startswith("NOGROUP") or "requires the key to exist" in str(error)
+    )
+
+
+def delete_group(client, account_id, group):
+    """Returns False if the group (or the stream) doesn't exist."""
+    try:
+        return bool(client.xgroup_destroy(stream_key(account_id), group))
+    except redis.exceptions.ResponseError as e:
+        if group_missing(e):
+            return False
+        raise
+
+
+def list_groups(client, account_id):
+    """Consumer groups with their backlog: lag (never delivered) and pending (unacked)."""
+    key = stream_key(account_id)
+    try:
+        groups = client.xinfo_groups(key)
+    except redis.exceptions.ResponseError:
+        return []  # stream doesn't exist yet
+    return [
+        {
+            "name": group["name"],
+            "consumers": group["consumers"],
+            "pending": group["pending"],
+            "lag": group.get("lag"),
+            "last_delivered_id": group["last-delivered-id"],
+        }
+        for group in groups
+    ]
+
+
+def read_group(client, account_id, group, consumer, count=100, pending=False):
+    """
+    Read messages for a consumer. By default returns messages never delivered
+    to the group; pending=True re-reads this consumer's unacknowledged ones.
+    """
+    response = client.xreadgroup(group, consumer, {stream_key(account_id): "0" if pending else ">"}, count=count)
+    if not response:
+        return []
+    return _decode_entries(response[0][1])
+
+
+def claim(client, account_id, group, consumer, min_idle_ms, count=100):
+    """
+    Take over entries delivered to other consumers of the group and left
+    unacknowledged for at least min_idle_ms. They become this consumer's
+    pending entries, to be acknowledged once handled.
+    """
+    response = client.xautoclaim(stream_key(account_id), group, consumer, min_idle_ms, start_id="0-0", count=count)
+    return _decode_entries(response[1])
+
+
+def ack(client, account_id, group, ids):
+    if not ids:
+        return 0
+    return client.xack(stream_key(account_id), group, *ids)
+
+
+def pending_summary(client, account_id, group, count=100):
+    """Pending entries of a group: totals per consumer plus the oldest entries."""
+    key = stream_key(account_id)
+    summary = client.xpending(key, group)
+    oldest = client.xpending_range(key, group, min="-", max="+", count=count) if summary["pending"] else []
+    return {
+        "pending": summary["pending"],
+        "min_id": summary["min"],
+        "max_id": summary["max"],
+        "consumers": summary["consumers"],
+        "entries": [
+            {
+                "id": entry["message_id"],
+                "consumer": entry["consumer"],
+                "idle_ms": entry["time_since_delivered"],
+                "deliveries": entry["times_delivered"],
+            }
+            for entry in oldest
+        ],
+    }
+
+
+def stream_info(client, account_id):
+    try:
+        info = client.xinfo_stream(stream_key(account_id))
+    except redis.exceptions.ResponseError:
+        return {"length": 0, "groups": 0, "first_id": None, "last_id": None}
+    return {
+        "length": info["length"],
+        "groups": info["groups"],
+        "first_id": info["first-entry"][0] if info.get("first-entry") else None,
+        "last_id": info["last-generated-id"],
+    }
@@ -0,0 +1,159 @@
+"""
+Per-worker near cache for hot Redis reads.
+
+Conversation slices an agent keeps re-reading are served from an LRU in the
+worker instead of a Redis round trip. Coherence comes from invalidations on a
+pub/sub channel per account (``{account}:cache:invalidate``, sharded in Redis
+Cluster): writers publish the keys they changed (store_message() sends the
+publish in the same pipeline as the write, so it can't arrive before the
+data), and every worker's listener thread drops those keys. Keys without an
+account tag go over the one global ``cache:invalidate`` channel; that's how
+account records, which change rarely, reach workers that don't know the
+account yet. Handlers can also be registered for kinds of keys, e.g. to
+reload an account record another worker changed.
+
+The cache only serves while the listener is subscribed: when the subscription
+drops (Redis outage, network error) invalidations may be missed, so the cache
+is cleared and reads go to the backend until it is back. A TTL bounds the
+staleness of anything missed anyway.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from key_schema import account_channel, account_of, strip_tag
+
+CHANNEL = "cache:invalidate"
+
+
+def invalidation_channel(account_id):
+    return CHANNEL if account_id is None else account_channel(account_id, CHANNEL)
+
+
+class NearCache:
+    """
+    Caches keys tagged with an account (see key_schema). accounts() gives the
+    account ids whose invalidation channels the listener subscribes to, on top
+    of the global one; it is asked again every second, so new accounts are
+    picked up.
+    """
+
+    def __init__(self, redis_manager, accounts, max_entries=10000, ttl=30.0):
+        self.redis_manager = redis_manager
+        self.accounts = accounts
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.connected = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (value, expires at)
+        self._handlers = []  # (untagged key prefix, callback(key))
+        self._epoch = 0  # bumped by every invalidation; loads that raced one aren't cached
+        self._subscribed = set()  # accounts whose invalidations the listener receives (None: the global channel)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="near-cache", daemon=True)
+                self._thread.start()
+
+    def on_invalidate(self, prefix, callback):
+        """Call callback(key) for every invalidated key whose untagged part starts with prefix."""
+        self._handlers.append((prefix, callback))
+
+    def get(self, key, load):
+        """The cached value of key, or load() (cached when possible)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            epoch = self._epoch
+        value = load()
+        if value is None or not self.connected or account_of(key) not in self._subscribed:
+            return value
+        with self._lock:
+            if self._epoch == epoch:
+                self._entries[key] = (value, now + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys):
+        """Drop keys in this worker (other workers learn of it from invalidation_command())."""
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(keys)
+            for key in keys:
+                self._entries.pop(key, None)
+        for key in keys:
+            for prefix, callback in self._handlers:
+                if strip_tag(key).startswith(prefix):
+                    try:
+                        callback(key)
+                    except Exception as e:
+                        print(f"⚠️ Cache invalidation handler failed for {key}: {e}")
+
+    def invalidation_command(self, *keys):
+        """A publish command telling every worker to drop keys (all of one account, or untagged), for the writer's pipeline."""
+        return self.redis_manager.publish_command(invalidation_channel(account_of(keys[0])), json.dumps(keys))
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def _listen(self):
+        while True:
+            client = self.redis_manager.get_client()
+            if client is None:
+                time.sleep(1)
+                continue
+            pubsub = client.pubsub()
+            try:
+                self.clear()  # anything cached before may have missed invalidations
+                while True:
+                    accounts = ({None} | set(self.accounts())) - self._subscribed
+                    if accounts:
+                        self.redis_manager.subscribe(pubsub, *(invalidation_channel(a) for a in sorted(accounts, key=str)))
+                        self._subscribed |= accounts
+                    self.connected = True
+                    message = self.redis_manager.get_message(pubsub, timeout=1.0)
+                    if message and message["type"] in ("message", "smessage"):
+                        try:
+                            keys = json.loads(message["data"])
+                        except (TypeError, ValueError):
+                            continue
+                        self.invalidate(*keys)
+            except Exception as e:
+                self.redis_manager.record_error(e)
+                print(f"⚠️ Near cache lost its invalidation subscription: {e}")
+            finally:
+                self.connected = False
+                self._subscribed = set()
+                self.clear()
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(1)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "connected": self.connected,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,185 @@
+"""
+Outbound send scheduling.
+
+Every Graph API send of a worker goes through one OutboundScheduler: a fixed
+pool of sender threads fed from priority lanes, "interactive" (chat UI and API
+replies, auto-responses) always ahead of "bulk" (scheduled and campaign
+traffic). Within a lane, accounts share the senders in proportion to their
+weights by self-clocked weighted fair queueing: each send gets a virtual
+finish tag of max(lane clock, the account's previous tag) + 1 / weight and the
+smallest tag goes next, so an account with ten thousand queued messages delays
+another account's next message by at most one send per unit of weight.
+
+Bulk sends may also only occupy concurrency - reserved_interactive senders,
+so an interactive send never waits behind a pool full of slow bulk sends.
+"""
+
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)  # highest priority first
+
+WAIT_SAMPLES = 1000
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Lane:
+    def __init__(self, name):
+        self.name = name
+        self.heap = []  # (finish tag, sequence, account id, enqueued at, future, call)
+        self.clock = 0.0
+        self.last_tag = {}  # account id -> finish tag of its last queued send
+        self.running = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, wait):
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.waits.append(wait)
+
+    def stats(self):
+        waits = sorted(self.waits)
+
+        def percentile(p):
+            return round(waits[min(int(len(waits) * p), len(waits) - 1)] * 1000, 1) if waits else 0.0
+
+        return {
+            "queued": len(self.heap),
+            "accounts_queued": len(self.last_tag),
+            "running": self.running,
+            "dispatched": self.dispatched,
+            "wait_ms": {
+                "avg": round(self.total_wait / self.dispatched * 1000, 1) if self.dispatched else 0.0,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(self.max_wait * 1000, 1),
+            },
+        }
+
+
+class OutboundScheduler:
+    """
+    run(lane, account_id, func, ...) queues func(...) and returns its result
+    once a sender thread has run it; submit() returns the Future instead.
+    weight(account_id) gives an account's share (default 1 for everyone).
+    """
+
+    def __init__(self, concurrency=4, weight=None, reserved_interactive=1, max_queue=10000):
+        self.concurrency = max(int(concurrency), 1)
+        self.weight = weight or (lambda account_id: 1)
+        self.reserved_interactive = min(max(int(reserved_interactive), 0), self.concurrency - 1)
+        self.max_queue = max_queue
+        self.lanes = {name: _Lane(name) for name in LANES}
+        self.rejected = 0
+        self._sequence = itertools.count()
+        self._queued = 0
+        self._ready = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        with self._ready:
+            if self._threads:
+                return
+            for index in range(self.concurrency):
+                thread = threading.Thread(target=self._run, name=f"outbound-send-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, lane, account_id, func, *args, **kwargs):
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        self.start()
+        weight = self.weight(account_id)
+        weight = weight if weight and weight > 0 else 1
+        future = Future()
+        context = contextvars.copy_context()  # the caller's trace continues on the sender thread
+        call = (context, func, args, kwargs)
+        with self._ready:
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"Outbound queue is full ({self.max_queue} sends waiting)")
+            queue = self.lanes[lane]
+            tag = max(queue.clock, queue.last_tag.get(account_id, 0.0)) + 1.0 / weight
+            queue.last_tag[account_id] = tag
+            heapq.heappush(queue.heap, (tag, next(self._sequence), account_id, time.monotonic(), future, call))
+            self._queued += 1
+            self._ready.notify()
+        return future
+
+    def run(self, lane, account_id, func, *args, **kwargs):
+        return self.submit(lane, account_id, func, *args, **kwargs).result()
+
+    def drain(self, timeout=None):
+        """Wait (up to timeout seconds) for every queued and running send to finish; True once idle."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._ready:
+            while self._queued or any(queue.running for queue in self.lanes.values()):
+                remaining = 0.05 if deadline is None else min(deadline - time.monotonic(), 0.05)
+                if remaining <= 0:
+                    return False
+                self._ready.wait(remaining)  # senders notify one waiter, so poll
+            return True
+
+    def _take(self):
+        """The next send to run, or None if nothing may run now (caller holds the lock)."""
+        for name in LANES:
+            queue = self.lanes[name]
+            if not queue.heap:
+                continue
+            if name != INTERACTIVE and self._bulk_running() >= self.concurrency - self.reserved_interactive:
+                continue
+            tag, _, account_id, enqueued, future, call = heapq.heappop(queue.heap)
+            queue.clock = tag
+            if queue.last_tag.get(account_id) == tag:
+                del queue.last_tag[account_id]  # nothing else of this account is queued in the lane
+            queue.running += 1
+            queue.record_wait(time.monotonic() - enqueued)
+            self._queued -= 1
+            return queue, enqueued, future, call
+        return None
+
+    def _bulk_running(self):
+        return sum(queue.running for name, queue in self.lanes.items() if name != INTERACTIVE)
+
+    def _run(self):
+        while True:
+            with self._ready:
+                job = self._take()
+                while job is None:
+                    self._ready.wait()
+                    job = self._take()
+            queue, enqueued, future, (context, func, args, kwargs) = job
+            future.queue_wait = time.monotonic() - enqueued
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(context.run(func, *args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._ready:
+                    queue.running -= 1
+                    self._ready.notify()  # a bulk slot may have freed up
+
+    def stats(self):
+        with self._ready:
+            return {
+                "concurrency": self.concurrency,
+                "reserved_interactive": self.reserved_interactive,
+                "rejected": self.rejected,
+                "lanes": {name: queue.stats() for name, queue in self.lanes.items()},
+            }
@@ -0,0 +1,213 @@
+"""
+Phone number normalization to E.164 digits (no leading "+").
+
+Every conversation is keyed by the normalized number, so the same contact must
+always normalize to the same digits, whatever the input formatting. Numbers
+written internationally ("+44 7911 123456", "0044...") are split on their
+country calling code with a prefix trie built once from PHONE_REGIONS; local
+numbers ("07911 123456") are read against the account's default region, whose
+national trunk prefix is dropped before the calling code is added.
+
+Region data only covers mobile numbers (that's what WhatsApp uses): the
+calling code, the national trunk prefix and the accepted lengths of the
+national significant number.
+"""
+
+import re
+from functools import lru_cache
+
+# region -> (calling code, trunk prefix, national number lengths)
+PHONE_REGIONS = {
+    # Africa
+    "NG": ("234", "0", (10,)),
+    "GH": ("233", "0", (9,)),
+    "KE": ("254", "0", (9,)),
+    "UG": ("256", "0", (9,)),
+    "TZ": ("255", "0", (9,)),
+    "RW": ("250", "0", (9,)),
+    "ET": ("251", "0", (9,)),
+    "CM": ("237", "", (9,)),
+    "CI": ("225", "", (10,)),
+    "SN": ("221", "", (9,)),
+    "BJ": ("229", "", (10,)),
+    "TG": ("228", "", (8,)),
+    "NE": ("227", "", (8,)),
+    "ZA": ("27", "0", (9,)),
+    "ZM": ("260", "0", (9,)),
+    "ZW": ("263", "0", (9,)),
+    "EG": ("20", "0", (10,)),
+    "MA": ("212", "0", (9,)),
+    "DZ": ("213", "0", (9,)),
+    "TN": ("216", "", (8,)),
+    # Europe
+    "GB": ("44", "0", (10,)),
+    "IE": ("353", "0", (9,)),
+    "FR": ("33", "0", (9,)),
+    "DE": ("49", "0", (10, 11)),
+    "IT": ("39", "", (9, 10)),
+    "ES": ("34", "", (9,)),
+    "PT": ("351", "", (9,)),
+    "NL": ("31", "0", (9,)),
+    "BE": ("32", "0", (9,)),
+    "CH": ("41", "0", (9,)),
+    "AT": ("43", "0", (10, 11, 12, 13)),
+    "SE": ("46", "0", (9,)),
+    "NO": ("47", "", (8,)),
+    "DK": ("45", "", (8,)),
+    "FI": ("358", "0", (9, 10)),
+    "PL": ("48", "", (9,)),
+    "CZ": ("420", "", (9,)),
+    "HU": ("36", "06", (9,)),
+    "RO": ("40", "0", (9,)),
+    "GR": ("30", "", (10,)),
+    "UA": ("380", "0", (9,)),
+    "RU": ("7", "8", (10,)),
+    "TR": ("90", "0", (10,)),
+    # Middle East and Asia
+    "IL": ("972", "0", (9,)),
+    "AE": ("971", "0", (9,)),
+    "SA": ("966", "0", (9,)),
+    "QA": ("974", "", (8,)),
+    "KW": ("965", "", (8,)),
+    "IN": ("91", "0", (10,)),
+    "PK": ("92", "0", (10,)),
+    "BD": ("880", "0", (10,)),
+    "LK": ("94", "0", (9,)),
+    "CN": ("86", "0", (11,)),
+    "HK": ("852", "", (8,)),
+    "TW": ("886", "0", (9,)),
+    "JP": ("81", "0", (10,)),
+    "KR": ("82", "0", (9, 10)),
+    "SG": ("65", "", (8,)),
+    "MY": ("60", "0", (9, 10)),
+    "ID": ("62", "0", (9, 10, 11, 12)),
+    "PH": ("63", "0", (10,)),
+    "TH": ("66", "0", (9,)),
+    "VN": ("84", "0", (9,)),
+    "AU": ("61", "0", (9,)),
+    "NZ": ("64", "0", (8, 9, 10)),
+    # Americas
+    "US": ("1", "1", (10,)),
+    "CA": ("1", "1", (10,)),
+    "MX": ("52", "", (10,)),
+    "BR": ("55", "0", (11,)),
+    "AR": ("54", "0", (10, 11)),
+    "CO": ("57", "", (10,)),
+    "CL": ("56", "", (9,)),
+    "PE": ("51", "", (9,)),
+    "VE": ("58", "0", (10,)),
+    "EC": ("593", "0", (9,)),
+}
+
+DEFAULT_REGION = "NG"
+CACHE_SIZE = 65536
+
+# E.164 caps numbers at 15 digits; anything longer is kept as typed
+MAX_DIGITS = 15
+
+_NON_DIGITS = re.compile(r"[^0-9]")
+_INTERNATIONAL_PREFIX = "00"
+
+
+def _build_trie(regions):
+    """Calling code digit trie; a node's "" entry names the region for the code ending there."""
+    trie = {}
+    for region, (code, _, _) in regions.items():
+        node = trie
+        for digit in code:
+            node = node.setdefault(digit, {})
+        node.setdefault("", region)  # shared codes (US/CA) resolve to the first listed
+    return trie
+
+
+class PhoneNormalizer:
+    """
+    normalize(raw, region) with an LRU memo of recent inputs, and
+    normalize_many() for recipient lists. region is an ISO 3166 code from
+    PHONE_REGIONS; None (or an unknown code) means default_region.
+    """
+
+    def __init__(self, default_region=DEFAULT_REGION, regions=PHONE_REGIONS, cache_size=CACHE_SIZE):
+        self.regions = regions
+        self.default_region = default_region if default_region in regions else DEFAULT_REGION
+        self._trie = _build_trie(regions)
+        self._normalize = lru_cache(maxsize=cache_size)(self._normalize_uncached)
+
+    def region_for(self, region):
+        region = (region or "").upper()
+        return region if region in self.regions else self.default_region
+
+    def split_calling_code(self, digits):
+        """(calling code, region) of an international number, or (None, None)."""
+        node = self._trie
+        for index, digit in enumerate(digits):
+            node = node.get(digit)
+            if node is None:
+                return None, None
+            if "" in node:
+                return digits[:index + 1], node[""]
+        return None, None
+
+    def _national(self, digits, region):
+        """The national significant number, if digits are a local number of region."""
+        _, trunk, lengths = self.regions[region]
+        if trunk and digits.startswith(trunk) and len(digits) - len(trunk) in lengths:
+            return digits[len(trunk):]
+        if len(digits) in lengths:
+            return digits
+        return None
+
+    def _from_international(self, digits):
+        code, region = self.split_calling_code(digits)
+        if code is None:
+            return digits
+        national = self._national(digits[len(code):], region)  # drops a stray trunk "0" after the code
+        return code + national if national else digits
+
+    def _normalize_uncached(self, raw, region):
+        international = raw.lstrip().startswith("+")
+        if not raw.isascii():
+            # Full-width and other Unicode decimal digits
+            raw = "".join(str(int(char)) if char.isdecimal() else char for char in raw)
+        digits = _NON_DIGITS.sub("", raw)
+        if not digits or len(digits) > MAX_DIGITS + len(_INTERNATIONAL_PREFIX):
+            return digits
+        if not international and digits.startswith(_INTERNATIONAL_PREFIX):
+            international, digits = True, digits[len(_INTERNATIONAL_PREFIX):]
+        if international:
+            return self._from_international(digits)
+
+        national = self._national(digits, region)
+        if national:
+            return self.regions[region][0] + national
+        # Already international, just without the "+"
+        return self._from_international(digits)
+
+    def normalize(self, phone_number, region=None):
+        if not phone_number:
+            return phone_number
+        return self._normalize(str(phone_number), self.region_for(region))
+
+    def normalize_many(self, phone_numbers, region=None):
+        """{input: normalized} for a list of numbers; each distinct input is normalized once."""
+        region = self.region_for(region)
+        normalize = self._normalize
+        return {
+            phone: normalize(phone, region)
+            for phone in dict.fromkeys(str(phone) for phone in phone_numbers if phone)
+        }
+
+    def is_valid(self, normalized):
+        """Whether normalized digits have a known calling code and a plausible length for it."""
+        code, region = self.split_calling_code(normalized)
+        return code is not None and len(normalized) - len(code) in self.regions[region][2]
+
+    def cache_info(self):
+        return self._normalize.cache_info()
+
+    def client_rules(self):
+        """Region table for the browser's copy of the normalizer (static/js/chat.js)."""
+        return {
+            region: {"code": code, "trunk": trunk, "lengths": list(lengths)}
+            for region, (code, trunk, lengths) in self.regions.items()
+        }
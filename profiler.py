@@ -0,0 +1,252 @@
+"""
+On-demand sampling profiler for a live worker.
+
+A background thread wakes every interval, reads the current Python stack of
+every thread (sys._current_frames(), no tracing hooks, so the code being
+profiled runs at full speed) and counts the stacks. Samples are attributed to
+the Flask endpoint the thread is serving (request_started/request_finished
+hooks, active only while a profile runs, which also measure each request's
+CPU time with time.thread_time()), to the "focus" functions found on the
+stack, and to where the time goes: the outermost library on the stack below
+application code (JSON, Redis, Graph API HTTP, Socket.IO, SQLite).
+
+Results are written as JSON to a directory shared by the workers on a host,
+so the profile can be fetched from whichever worker answers the next request.
+Stacks are in collapsed ("folded") form, ready for flamegraph.pl or
+speedscope.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+MAX_SECONDS = 120
+MAX_DEPTH = 64
+MIN_INTERVAL = 0.001
+KEEP_PROFILES = 20
+
+# Module prefix -> category, checked from the outermost frame inwards
+LIBRARY_CATEGORIES = (
+    ("json", "json"),
+    ("redis", "redis"),
+    ("requests", "graph_api"),
+    ("urllib3", "graph_api"),
+    ("flask_socketio", "socketio"),
+    ("socketio", "socketio"),
+    ("engineio", "socketio"),
+    ("sqlite3", "sqlite"),
+    ("jinja2", "templates"),
+)
+
+# Leaf frames of threads that are just waiting for work
+IDLE_FRAMES = {
+    ("threading", "wait"), ("threading", "_wait_for_tstate_lock"), ("queue", "get"),
+    ("selectors", "select"), ("socketserver", "serve_forever"), ("socket", "accept"),
+    ("concurrent.futures.thread", "_worker"), ("profiler", "wait"),
+}
+
+DEFAULT_FOCUS = ("handle_webhook", "send_whatsapp_message", "store_message", "conversation_response",
+                 "get_stored_messages", "get_all_messages", "get_contacts")
+
+
+def _category(module):
+    for prefix, category in LIBRARY_CATEGORIES:
+        if module == prefix or module.startswith(prefix + "."):
+            return category
+    return None
+
+
+def collapsed(stacks):
+    """Folded stack lines ("frame;frame;frame count"), heaviest first."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+class SamplingProfiler:
+    def __init__(self, directory, keep=KEEP_PROFILES):
+        self.directory = directory
+        self.keep = keep
+        self.active = None  # profile id while sampling
+        self._requests = {}  # thread ident -> (endpoint, thread CPU time at start)
+        self._route_cpu = defaultdict(float)
+        self._route_requests = Counter()
+        self._lock = threading.Lock()
+
+    # --- request hooks (cheap no-ops unless a profile is running) ---
+
+    def request_started(self, endpoint):
+        if self.active:
+            self._requests[threading.get_ident()] = (endpoint or "<unknown>", time.thread_time())
+
+    def request_finished(self):
+        if self.active:
+            started = self._requests.pop(threading.get_ident(), None)
+            if started:
+                endpoint, cpu_started = started
+                self._route_cpu[endpoint] += time.thread_time() - cpu_started
+                self._route_requests[endpoint] += 1
+
+    # --- profiles ---
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def _save(self, profile_id, result):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(profile_id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self._path(profile_id))
+
+    def _prune(self):
+        profiles = sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")),
+            key=os.path.getmtime
+        )
+        for path in profiles[:-self.keep]:
+            os.remove(path)
+
+    def start(self, seconds, interval=0.01, focus=DEFAULT_FOCUS, include_idle=False):
+        """Start sampling in the background; returns the profile id, or None if one is already running."""
+        seconds = min(max(float(seconds), 0.1), MAX_SECONDS)
+        interval = max(float(interval), MIN_INTERVAL)
+        with self._lock:
+            if self.active:
+                return None
+            profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+            self.active = profile_id
+        self._save(profile_id, {"id": profile_id, "status": "running", "pid": os.getpid(),
+                                "seconds": seconds, "started": time.time()})
+        thread = threading.Thread(target=self._sample, args=(profile_id, seconds, interval, tuple(focus), include_idle),
+                                  name="profiler", daemon=True)
+        thread.start()
+        return profile_id
+
+    def result(self, profile_id):
+        """A saved profile, or None if there is no such profile."""
+        if not profile_id.replace("-", "").isalnum():
+            return None
+        try:
+            with open(self._path(profile_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def wait(self, profile_id, timeout):
+        deadline = time.monotonic() + timeout
+        while self.active == profile_id and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.result(profile_id)
+
+    def _sample(self, profile_id, seconds, interval, focus, include_idle):
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        self_samples = Counter()
+        routes = defaultdict(lambda: {"samples": 0, "categories": Counter()})
+        functions = defaultdict(lambda: {"samples": 0, "categories": Counter()})
+        samples = 0
+        overhead = 0.0
+        label_cache = {}
+        focus = set(focus)
+
+        def label(code, module):
+            key = (code, module)
+            if key not in label_cache:
+                label_cache[key] = f"{module}.{code.co_name}"
+            return label_cache[key]
+
+        started = time.monotonic()
+        deadline = started + seconds
+        next_tick = started
+        try:
+            while True:
+                next_tick += interval
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if next_tick > now:
+                    time.sleep(next_tick - now)
+                else:
+                    next_tick = now  # fell behind (GIL contention); don't burst to catch up
+
+                tick_started = time.perf_counter()
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    chain = []
+                    while frame is not None and len(chain) < MAX_DEPTH:
+                        chain.append((frame.f_code, frame.f_globals.get("__name__", "?")))
+                        frame = frame.f_back
+                    if not chain:
+                        continue
+                    leaf_code, leaf_module = chain[0]
+                    if not include_idle and (leaf_module, leaf_code.co_name) in IDLE_FRAMES:
+                        continue
+                    chain.reverse()  # root first
+
+                    category = "app"
+                    on_stack = set()
+                    for code, module in chain:
+                        if category == "app":
+                            category = _category(module) or "app"
+                        if code.co_name in focus:
+                            on_stack.add(code.co_name)
+
+                    request = self._requests.get(ident)
+                    root = request[0] if request else names.get(ident, "thread")
+                    stacks[";".join([root] + [label(code, module) for code, module in chain])] += 1
+                    self_samples[label(leaf_code, leaf_module)] += 1
+                    if request:
+                        routes[request[0]]["samples"] += 1
+                        routes[request[0]]["categories"][category] += 1
+                    for name in on_stack:
+                        functions[name]["samples"] += 1
+                        functions[name]["categories"][category] += 1
+                    samples += 1
+                overhead += time.perf_counter() - tick_started
+        finally:
+            elapsed = time.monotonic() - started
+            route_cpu, route_requests = dict(self._route_cpu), dict(self._route_requests)
+            with self._lock:
+                self.active = None
+                self._requests.clear()
+                self._route_cpu.clear()
+                self._route_requests.clear()
+
+        interval_ms = interval * 1000
+
+        def breakdown(entry):
+            return {
+                "samples": entry["samples"],
+                "wall_ms": round(entry["samples"] * interval_ms, 1),
+                "categories": {name: round(count * interval_ms, 1) for name, count in entry["categories"].most_common()},
+            }
+
+        result = {
+            "id": profile_id,
+            "status": "done",
+            "pid": os.getpid(),
+            "seconds": round(elapsed, 2),
+            "interval_ms": interval_ms,
+            "samples": samples,
+            "overhead_ms": round(overhead * 1000, 1),
+            "routes": {
+                endpoint: dict(breakdown(routes[endpoint]) if endpoint in routes else {"samples": 0},
+                               cpu_ms=round(route_cpu.get(endpoint, 0) * 1000, 1),
+                               requests=route_requests.get(endpoint, 0))
+                for endpoint in set(routes) | set(route_requests)
+            },
+            "functions": {name: breakdown(entry) for name, entry in functions.items()},
+            "top": [{"frame": frame, "self_samples": count} for frame, count in self_samples.most_common(30)],
+            "stacks": dict(stacks),
+        }
+        try:
+            self._save(profile_id, result)
+            self._prune()
+        except OSError as e:
+            print(f"⚠️ Could not save profile {profile_id}: {e}")
+        print(f"🔬 Profile {profile_id} done: {samples} samples in {elapsed:.1f}s, overhead {overhead * 1000:.0f}ms")
@@ -0,0 +1,292 @@
+"""
+Managed Redis connection for the WhatsApp bot.
+
+Wraps a bounded, blocking connection pool with socket timeouts, a background
+health check that reconnects after outages, and a circuit breaker. While the
+circuit is open, callers get no client and fall back to the local in-memory
+store; writes are buffered and replayed in pipelined batches once Redis
+answers again.
+
+With cluster=True the client is a RedisCluster that discovers the shards from
+host:port and routes each command (and each part of a pipeline) to the shard
+owning its key; pub/sub goes through the sharded commands (SPUBLISH and
+SSUBSCRIBE), so a message only travels to the shard owning its channel.
+"""
+
+import threading
+import time
+from collections import deque
+
+import redis
+from redis.cluster import RedisCluster
+
+# Errors that mean "Redis is unreachable", as opposed to a bad command
+OUTAGE_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+REPLAY_BATCH_SIZE = 500
+
+
+class RedisManager:
+    """
+    Owns the shared Redis client and its circuit breaker.
+
+    Nothing here touches the network until the first command or health check,
+    so constructing a manager at import time is free.
+    """
+
+    def __init__(self, host, port, username=None, password=None, max_connections=20,
+                 socket_timeout=2.0, socket_connect_timeout=2.0, pool_timeout=1.0,
+                 health_check_interval=15.0, failure_threshold=3, replay_buffer_size=10000, cluster=False):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
+        self.failure_threshold = failure_threshold
+        self.cluster = cluster
+
+        self.client = None
+        self.healthy = None  # None until the first health check, then True/False
+        self.dropped_writes = 0
+        self.replayed_writes = 0
+        self._failures = 0
+        self._pending_writes = deque(maxlen=replay_buffer_size)
+        self._recovery_callbacks = []
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    # --- Client and circuit state ---
+
+    def get_client(self):
+        """Return the Redis client, or None while the circuit is open."""
+        if self.client is None:
+            self._create_client()
+            self.start_health_check()
+        if self.healthy is False:
+            return None
+        return self.client
+
+    def _create_client(self):
+        with self._lock:
+            if self.client is not None:
+                return
+            if self.cluster:
+                # One pool per shard, each capped at max_connections
+                self.client = RedisCluster(
+                    host=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    decode_responses=True,
+                    max_connections=self.max_connections,
+                    socket_timeout=self.socket_timeout,
+                    socket_connect_timeout=self.socket_connect_timeout,
+                )
+                return
+            pool = redis.BlockingConnectionPool(
+                host=self.host,
+                port=self.port,
+                username=self.username,
+                password=self.password,
+                decode_responses=True,
+                max_connections=self.max_connections,
+                timeout=self.pool_timeout,
+                socket_timeout=self.socket_timeout,
+                socket_connect_timeout=self.socket_connect_timeout,
+                health_check_interval=self.health_check_interval,
+            )
+            self.client = redis.Redis(connection_pool=pool)
+
+    def _disconnect(self):
+        if self.cluster:
+            self.client.disconnect_connection_pools()
+        else:
+            self.client.connection_pool.disconnect()
+
+    def state(self):
+        """Circuit state for status pages: connected, unavailable or connecting."""
+        return {True: "connected", False: "unavailable"}.get(self.healthy, "connecting")
+
+    def stats(self):
+        return {
+            "state": self.state(),
+            "mode": "cluster" if self.cluster else "standalone",
+            "max_connections": self.max_connections,
+            "pending_writes": len(self._pending_writes),
+            "replayed_writes": self.replayed_writes,
+            "dropped_writes": self.dropped_writes,
+        }
+
+    def record_success(self):
+        self._failures = 0
+
+    def record_error(self, error):
+        """Count a failed command; open the circuit after enough connection failures."""
+        if not isinstance(error, OUTAGE_ERRORS):
+            return
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self.healthy is not False:
+                self.healthy = False
+                print(f"❌ Redis circuit opened: {error}")
+
+    def on_recovery(self, callback):
+        """Register a callback to run each time Redis becomes reachable."""
+        self._recovery_callbacks.append(callback)
+
+    # --- Pub/sub ---
+
+    def publish_command(self, channel, message):
+        """A transient write command (see write()) publishing message on channel."""
+        return ("spublish" if self.cluster else "publish", channel, message)
+
+    def subscribe(self, pubsub, *channels):
+        if self.cluster:
+            pubsub.ssubscribe(*channels)
+        else:
+            pubsub.subscribe(*channels)
+
+    def get_message(self, pubsub, timeout):
+        """The next published message ({"type", "channel", "data"}) of a subscription, or None."""
+        if self.cluster:
+            return pubsub.get_sharded_message(ignore_subscribe_messages=True, timeout=timeout)
+        return pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+
+    # --- Writes ---
+
+    def write(self, commands, transient=()):
+        """
+        Run write commands in one pipeline.
+
+        Commands are tuples of a Redis method name followed by its arguments,
+        e.g. ("lpush", key, value). If the circuit is open or Redis drops the
+        connection mid-write, the commands are buffered and replayed on
+        recovery (at-least-once). Transient commands such as publish are sent
+        along with a live write but never buffered.
+
+        Returns True when the write reached Redis.
+        """
+        client = self.get_client()
+        if client is not None:
+            try:
+                self._execute(client, [list(commands) + list(transient)])
+                self.record_success()
+                return True
+            except OUTAGE_ERRORS as e:
+                self.record_error(e)
+        self._buffer(commands)
+        return False
+
+    def write_batch(self, batch):
+        """
+        Run several lists of write commands in one pipeline without buffering.
+
+        Returns False when Redis is unavailable, leaving retries to the caller.
+        """
+        client = self.get_client()
+        if client is None:
+            return False
+        try:
+            self._execute(client, batch)
+        except OUTAGE_ERRORS as e:
+            self.record_error(e)
+            return False
+        self.record_success()
+        return True
+
+    def _buffer(self, commands):
+        with self._lock:
+            if len(self._pending_writes) == self._pending_writes.maxlen:
+                self.dropped_writes += 1
+            self._pending_writes.append(list(commands))
+
+    @staticmethod
+    def _execute(client, batch):
+        pipe = client.pipeline(transaction=False)
+        for commands in batch:
+            for name, *args in commands:
+                getattr(pipe, name)(*args)
+        pipe.execute()
+
+    def replay_pending_writes(self):
+        """Replay buffered writes in pipelined batches; returns how many were sent."""
+        replayed = 0
+        while True:
+            with self._lock:
+                batch = [self._pending_writes.popleft()
+                         for _ in range(min(REPLAY_BATCH_SIZE, len(self._pending_writes)))]
+            if not batch:
+                break
+            try:
+                self._execute(self.client, batch)
+            except Exception:
+                with self._lock:
+                    self._pending_writes.extendleft(reversed(batch))
+                raise
+            replayed += len(batch)
+        self.replayed_writes += replayed
+        return replayed
+
+    # --- Health checks ---
+
+    def check_health(self):
+        """Ping Redis once and update the circuit. Returns True when Redis is reachable."""
+        if self.client is None:
+            self._create_client()
+        try:
+            self.client.ping()
+            if self.healthy is not True:
+                replayed = self.replay_pending_writes()
+                if replayed:
+                    print(f"🔁 Replayed {replayed} buffered Redis write(s)")
+        except Exception as e:
+            if self.healthy is not False:
+                print(f"❌ Redis connection failed: {e}")
+            self.healthy = False
+            self._disconnect()
+            return False
+
+        if self.healthy is not True:
+            self.healthy = True
+            self.record_success()
+            print("✅ Redis connection successful!")
+            # Pick up anything buffered while the first replay was running
+            self.replay_pending_writes()
+            for callback in self._recovery_callbacks:
+                callback()
+        return True
+
+    def close(self):
+        """Replay buffered writes if Redis is reachable, then close the pool's connections; True if none are left."""
+        if self.client is None:
+            return not self._pending_writes
+        if self.healthy:
+            try:
+                self.replay_pending_writes()
+            except Exception as e:
+                self.record_error(e)
+                print(f"⚠️ Could not replay buffered Redis writes: {e}")
+        try:
+            self._disconnect()
+        except Exception as e:
+            print(f"⚠️ Redis disconnect failed: {e}")
+        return not self._pending_writes
+
+    def _health_loop(self):
+        while True:
+            try:
+                self.check_health()
+            except Exception as e:
+                print(f"⚠️ Redis health check failed: {e}")
+            time.sleep(self.health_check_interval)
+
+    def start_health_check(self):
+        """Start the background thread that connects to Redis and reconnects after outages."""
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="redis-health", daemon=True)
+                self._health_thread.start()
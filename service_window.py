@@ -0,0 +1,159 @@
+"""
+24-hour customer service window index.
+
+WhatsApp only accepts free-form messages within 24 hours of the contact's
+last inbound message. store_message() records the time of every incoming
+message per (account, contact) in a Redis hash (``{account_id}:last_inbound``)
+and in a local dict, so the send path can check the window in O(1) and
+switch to a template, or refuse locally, instead of paying for a Graph call
+that Meta will reject.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+
+from key_schema import account_key
+from storage import history_key
+
+WINDOW_SECONDS = 24 * 3600
+
+# Hash value for a contact whose history was searched and has no inbound message
+NO_INBOUND = "0"
+
+
+def window_key(account_id):
+    return account_key(account_id, "last_inbound")
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class ServiceWindowIndex:
+    """
+    Last-inbound timestamps per (account, contact).
+
+    A local timestamp that is still inside the window is trusted; anything
+    else is re-read from Redis (another worker may have seen a newer inbound
+    message), with misses cached for negative_ttl seconds. Contacts missing
+    from the hash are backfilled once from their stored history; those without
+    an inbound message get NO_INBOUND, so their history isn't searched again
+    (an inbound message later overwrites it). When Redis
+    can't be asked and nothing is known locally, the window is reported as
+    unknown ("open": None) rather than closed.
+    """
+
+    def __init__(self, redis_manager, window_seconds=WINDOW_SECONDS, negative_ttl=30):
+        self.redis_manager = redis_manager
+        self.window_seconds = window_seconds
+        self.negative_ttl = negative_ttl
+        self._last_inbound = {}  # (account_id, phone) -> epoch seconds
+        self._checked_at = {}  # (account_id, phone) -> when Redis was last asked
+        self._lock = threading.Lock()
+
+    def record_inbound(self, account_id, phone_number, timestamp=None):
+        """Note an inbound message; returns the Redis command to store it (see RedisManager.write)."""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            key = (account_id, phone_number)
+            if timestamp > self._last_inbound.get(key, 0):
+                self._last_inbound[key] = timestamp
+        return ("hset", window_key(account_id), phone_number, str(timestamp))
+
+    def _is_fresh(self, key, now):
+        timestamp = self._last_inbound.get(key)
+        if timestamp and now - timestamp < self.window_seconds:
+            return True
+        checked_at = self._checked_at.get(key)
+        return checked_at is not None and now - checked_at < self.negative_ttl
+
+    def _refresh(self, account_id, phone_numbers, now):
+        """Read last-inbound times for several contacts from Redis in one round trip; False if Redis is unavailable."""
+        if not phone_numbers:
+            return True
+        client = self.redis_manager.get_client()
+        if client is None:
+            return False
+        try:
+            values = client.hmget(window_key(account_id), phone_numbers)
+            missing = [phone for phone, value in zip(phone_numbers, values) if value is None]
+            backfilled = self._backfill(client, account_id, missing)
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Service window lookup failed: {e}")
+            return False
+
+        with self._lock:
+            for phone, value in zip(phone_numbers, values):
+                key = (account_id, phone)
+                timestamp = float(value) if value is not None else backfilled.get(phone)
+                if timestamp and timestamp > self._last_inbound.get(key, 0):
+                    self._last_inbound[key] = timestamp
+                self._checked_at[key] = now
+        return True
+
+    def _backfill(self, client, account_id, phone_numbers):
+        """
+        Find the newest incoming message in the stored history of contacts the
+        hash doesn't know, and store it (or NO_INBOUND) for each of them.
+        """
+        if not phone_numbers:
+            return {}
+        pipe = client.pipeline(transaction=False)
+        for phone in phone_numbers:
+            pipe.lrange(history_key(account_id, phone), 0, -1)
+        found = {}
+        for phone, history in zip(phone_numbers, pipe.execute()):
+            for raw in history:  # newest first
+                try:
+                    message = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                if message.get("type") == "incoming":
+                    timestamp = _parse_timestamp(message.get("timestamp"))
+                    if timestamp:
+                        found[phone] = timestamp
+                    break
+        # HSETNX: an inbound message recorded meanwhile must not be overwritten
+        pipe = client.pipeline(transaction=False)
+        for phone in phone_numbers:
+            pipe.hsetnx(window_key(account_id), phone, str(found[phone]) if phone in found else NO_INBOUND)
+        pipe.execute()
+        return found
+
+    def status(self, account_id, phone_number, now=None):
+        return self.bulk_status(account_id, [phone_number], now)[phone_number]
+
+    def last_inbound(self, account_id, phone_number, now=None):
+        """Epoch seconds of the contact's last inbound message, or None if none is known."""
+        self.status(account_id, phone_number, now)
+        return self._last_inbound.get((account_id, phone_number))
+
+    def is_open(self, account_id, phone_number, now=None):
+        """True/False, or None if the window can't be determined right now."""
+        return self.status(account_id, phone_number, now)["open"]
+
+    def bulk_status(self, account_id, phone_numbers, now=None):
+        """Window status for many contacts, with one Redis round trip for all cache misses."""
+        now = now or time.time()
+        stale = [phone for phone in phone_numbers if not self._is_fresh((account_id, phone), now)]
+        unknown = set() if self._refresh(account_id, stale, now) else set(stale)
+        return {
+            phone: self._describe(self._last_inbound.get((account_id, phone)), now, phone in unknown)
+            for phone in phone_numbers
+        }
+
+    def _describe(self, last_inbound, now, unknown=False):
+        if not last_inbound:
+            return {"open": None if unknown else False, "last_inbound": None, "expires_at": None}
+        expires_at = last_inbound + self.window_seconds
+        return {
+            "open": now < expires_at,
+            "last_inbound": datetime.fromtimestamp(last_inbound).isoformat(),
+            "expires_at": datetime.fromtimestamp(expires_at).isoformat(),
+        }
@@ -0,0 +1,202 @@
+"""
+Bounded per-client delivery of Socket.IO events.
+
+store_message() and friends publish() an event for an account; publishing only
+appends it to the queue of every client watching that account and never
+touches a socket, so ingest throughput doesn't depend on how fast any client
+reads. One sender thread drains the queues, keeping at most window events per
+client unacknowledged (clients ack every event; an ack that doesn't come
+within ack_timeout frees its slot anyway), so a slow client's backlog waits in
+its bounded queue instead of piling up in the server's socket buffers.
+
+When a client's queue is full its pending events are dropped and replaced by
+a single "resync" event: the client reloads what it is showing instead of
+replaying stale updates. Further events are coalesced into that resync until
+it has been sent. Each account accepts at most max_clients_per_account
+connections per worker.
+
+close() ends it for a worker that is shutting down: new connections are
+refused, queued events get a moment to go out and every client is
+disconnected, so browsers reconnect to another worker right away.
+"""
+
+import functools
+import itertools
+import threading
+import time
+from collections import deque
+
+RESYNC = "resync"
+
+
+class _Client:
+    def __init__(self, sid, account_id):
+        self.sid = sid
+        self.account_id = account_id
+        self.queue = deque()  # (event, data)
+        self.in_flight = {}  # sequence -> sent at
+        self.resync_queued = False
+
+
+class SocketFanout:
+    def __init__(self, socketio, max_queue=100, max_clients_per_account=50, window=8, ack_timeout=10.0):
+        self.socketio = socketio
+        self.max_queue = max(int(max_queue), 1)
+        self.max_clients_per_account = max_clients_per_account
+        self.window = max(int(window), 1)
+        self.ack_timeout = ack_timeout
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.ack_timeouts = 0
+        self.rejected = 0
+        self.closed = False
+        self._clients = {}  # sid -> _Client
+        self._accounts = {}  # account id -> {sid}
+        self._sequence = itertools.count()
+        self._ready = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._ready:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="socket-fanout", daemon=True)
+                self._thread.start()
+
+    def connect(self, sid, account_id):
+        """Register a client watching account_id; False if the account is at its connection limit."""
+        with self._ready:
+            if self.closed or not self._has_room(account_id):
+                self.rejected += 1
+                return False
+            self._clients[sid] = _Client(sid, account_id)
+            self._accounts.setdefault(account_id, set()).add(sid)
+            return True
+
+    def subscribe(self, sid, account_id):
+        """Move a client to another account, dropping what it had queued; False if refused."""
+        with self._ready:
+            client = self._clients.get(sid)
+            if client is None:
+                return False
+            if client.account_id == account_id:
+                return True
+            if not self._has_room(account_id):
+                self.rejected += 1
+                return False
+            self._detach(client)
+            self.dropped += len(client.queue)
+            client.queue.clear()
+            client.resync_queued = False
+            client.account_id = account_id
+            self._accounts.setdefault(account_id, set()).add(sid)
+            return True
+
+    def disconnect(self, sid):
+        with self._ready:
+            client = self._clients.pop(sid, None)
+            if client is not None:
+                self._detach(client)
+
+    def close(self, timeout=5.0):
+        """Refuse new clients, give queued events up to timeout seconds to go out, then disconnect everyone."""
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            self.closed = True
+            while any(client.queue for client in self._clients.values()):
+                remaining = min(deadline - time.monotonic(), 0.05)
+                if remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            sent = not any(client.queue for client in self._clients.values())
+            sids = list(self._clients)
+        for sid in sids:
+            try:
+                self.socketio.server.disconnect(sid)
+            except Exception as e:
+                print(f"⚠️ WebSocket disconnect failed: {e}")
+            self.disconnect(sid)
+        return sent
+
+    def _has_room(self, account_id):
+        return len(self._accounts.get(account_id, ())) < self.max_clients_per_account
+
+    def _detach(self, client):
+        sids = self._accounts.get(client.account_id)
+        if sids is not None:
+            sids.discard(client.sid)
+            if not sids:
+                del self._accounts[client.account_id]
+
+    def publish(self, event, data, account_id):
+        """Queue an event for every client watching account_id. Never blocks on a client."""
+        with self._ready:
+            self.published += 1
+            for sid in self._accounts.get(account_id, ()):
+                client = self._clients[sid]
+                if client.resync_queued:
+                    self.dropped += 1  # the pending resync covers it
+                elif len(client.queue) >= self.max_queue:
+                    self.dropped += len(client.queue) + 1
+                    self.resyncs += 1
+                    client.queue.clear()
+                    client.queue.append((RESYNC, {"account_id": client.account_id}))
+                    client.resync_queued = True
+                else:
+                    client.queue.append((event, data))
+            self._ready.notify()
+
+    def ack(self, sid, sequence, *args):
+        with self._ready:
+            client = self._clients.get(sid)
+            if client is not None and client.in_flight.pop(sequence, None) is not None:
+                self._ready.notify()
+
+    def _take(self, now):
+        """Events that may be sent now (caller holds the lock)."""
+        batch = []
+        for client in self._clients.values():
+            for sequence, sent_at in list(client.in_flight.items()):
+                if now - sent_at > self.ack_timeout:
+                    del client.in_flight[sequence]
+                    self.ack_timeouts += 1
+            while client.queue and len(client.in_flight) < self.window:
+                event, data = client.queue.popleft()
+                if event == RESYNC:
+                    client.resync_queued = False
+                sequence = next(self._sequence)
+                client.in_flight[sequence] = now
+                batch.append((client.sid, sequence, event, data))
+        return batch
+
+    def _run(self):
+        while True:
+            with self._ready:
+                batch = self._take(time.monotonic())
+                while not batch:
+                    self._ready.wait(timeout=min(self.ack_timeout, 1.0))  # also wakes up to expire missing acks
+                    batch = self._take(time.monotonic())
+                self.sent += len(batch)
+            for sid, sequence, event, data in batch:
+                try:
+                    self.socketio.emit(event, data, to=sid, callback=functools.partial(self.ack, sid, sequence))
+                except Exception as e:
+                    print(f"⚠️ WebSocket emit failed: {e}")
+                    self.ack(sid, sequence)
+
+    def stats(self):
+        with self._ready:
+            depths = [len(client.queue) for client in self._clients.values()]
+            return {
+                "clients": len(self._clients),
+                "clients_per_account": {account_id: len(sids) for account_id, sids in self._accounts.items()},
+                "queue_depth": {"total": sum(depths), "max": max(depths, default=0), "limit": self.max_queue},
+                "in_flight": sum(len(client.in_flight) for client in self._clients.values()),
+                "published": self.published,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "resyncs": self.resyncs,
+                "ack_timeouts": self.ack_timeouts,
+                "rejected_connections": self.rejected,
+            }
@@ -8,7 +8,7 @@ echo "Environment: Production"
 # Start the Flask app with Gunicorn for production
 if [ "$PORT" ]; then
     echo "Using Gunicorn for production..."
-    gunicorn --bind 0.0.0.0:$PORT --workers 2 --timeout 120 whatsapp_bot:app
+    gunicorn --bind 0.0.0.0:$PORT --workers 2 --timeout 120 "whatsapp_bot:create_app()"
 else
     echo "Using Flask development server..."
     python whatsapp_bot.py
@@ -1,5 +1,256 @@
 // Enhanced WhatsApp Bot Chat Interface JavaScript
 
+// Keyed, virtualized list: only the rows in (or near) the viewport are in the
+// DOM, rows are re-rendered only when their signature changes, and spacers
+// stand in for everything scrolled out of view.
+class VirtualList {
+    constructor(container, options) {
+        this.container = container;
+        this.keyOf = options.keyOf;
+        this.signatureOf = options.signatureOf;
+        this.renderRow = options.renderRow;
+        this.estimatedHeight = options.estimatedHeight || 60;
+        this.rowSpacing = options.rowSpacing || 0;
+        this.overscan = options.overscan || 10;
+        this.stickToBottom = options.stickToBottom || false;
+        this.onReachTop = options.onReachTop || null;
+
+        this.items = [];
+        this.heights = new Map();  // key -> measured row height, spacing included
+        this.rows = new Map();     // key -> {element, signature}, rendered rows only
+        this.offsets = [0];
+        this.offsetsDirty = true;
+        this.framePending = false;
+        this.mounted = false;      // false while the container shows a placeholder
+
+        this.topSpacer = document.createElement('div');
+        this.bottomSpacer = document.createElement('div');
+
+        this.container.addEventListener('scroll', () => {
+            this.scheduleRender();
+            if (this.onReachTop && this.mounted && this.container.scrollTop < 200) {
+                this.onReachTop();
+            }
+        });
+        window.addEventListener('resize', () => this.scheduleRender());
+    }
+
+    mount() {
+        this.container.innerHTML = '';
+        this.container.append(this.topSpacer, this.bottomSpacer);
+        this.rows.clear();
+        this.mounted = true;
+    }
+
+    showPlaceholder(html) {
+        this.items = [];
+        this.rows.clear();
+        this.offsetsDirty = true;
+        this.mounted = false;
+        this.container.innerHTML = html;
+    }
+
+    setItems(items) {
+        const stick = this.stickToBottom && this.mounted && this.isAtBottom();
+        if (!this.mounted) this.mount();
+
+        this.items = items;
+        const keys = new Set(items.map(item => this.keyOf(item)));
+        for (const key of this.heights.keys()) {
+            if (!keys.has(key)) this.heights.delete(key);
+        }
+        this.offsetsDirty = true;
+        this.render();
+        if (stick) this.scrollToBottom();
+    }
+
+    append(items) {
+        this.setItems(this.items.concat(items));
+    }
+
+    prepend(items) {
+        // Keep the rows the user is looking at in place
+        const previousHeight = this.container.scrollHeight;
+        const previousTop = this.container.scrollTop;
+        this.setItems(items.concat(this.items));
+        this.container.scrollTop = previousTop + (this.container.scrollHeight - previousHeight);
+        this.render();
+    }
+
+    isAtBottom() {
+        const c = this.container;
+        return c.scrollHeight - c.scrollTop - c.clientHeight < 50;
+    }
+
+    scrollToBottom() {
+        // Twice: rows rendered at the bottom may measure taller than estimated
+        this.container.scrollTop = this.container.scrollHeight;
+        this.render();
+        this.container.scrollTop = this.container.scrollHeight;
+    }
+
+    scheduleRender() {
+        if (this.framePending) return;
+        this.framePending = true;
+        requestAnimationFrame(() => {
+            this.framePending = false;
+            this.render();
+        });
+    }
+
+    computeOffsets() {
+        if (!this.offsetsDirty) return;
+        const offsets = new Array(this.items.length + 1);
+        offsets[0] = 0;
+        for (let i = 0; i < this.items.length; i++) {
+            const height = this.heights.get(this.keyOf(this.items[i])) || this.estimatedHeight;
+            offsets[i + 1] = offsets[i] + height;
+        }
+        this.offsets = offsets;
+        this.offsetsDirty = false;
+    }
+
+    indexAt(offset) {
+        // First row whose bottom edge is below the offset
+        let low = 0;
+        let high = this.items.length;
+        while (low < high) {
+            const mid = (low + high) >> 1;
+            if (this.offsets[mid + 1] <= offset) low = mid + 1;
+            else high = mid;
+        }
+        return low;
+    }
+
+    render() {
+        if (!this.mounted) return;
+        this.computeOffsets();
+
+        const c = this.container;
+        const count = this.items.length;
+        const start = Math.max(0, this.indexAt(c.scrollTop) - this.overscan);
+        const end = Math.min(count, this.indexAt(c.scrollTop + c.clientHeight) + 1 + this.overscan);
+
+        // Patch the visible window in place: reuse unchanged rows, re-render changed ones
+        const visible = new Set();
+        let cursor = this.topSpacer.nextSibling;
+        for (let i = start; i < end; i++) {
+            const item = this.items[i];
+            const key = this.keyOf(item);
+            const signature = this.signatureOf(item);
+            visible.add(key);
+
+            let row = this.rows.get(key);
+            if (!row || row.signature !== signature) {
+                const element = this.renderRow(item);
+                if (row && row.element.parentNode) {
+                    if (cursor === row.element) cursor = element;
+                    row.element.replaceWith(element);
+                }
+                row = { element, signature };
+                this.rows.set(key, row);
+            }
+
+            if (row.element === cursor) {
+                cursor = cursor.nextSibling;
+            } else {
+                c.insertBefore(row.element, cursor);
+            }
+        }
+
+        for (const [key, row] of this.rows) {
+            if (!visible.has(key)) {
+                row.element.remove();
+                this.rows.delete(key);
+            }
+        }
+
+        // Measure what was rendered; estimates are replaced by real heights
+        for (const key of visible) {
+            const height = this.rows.get(key).element.offsetHeight + this.rowSpacing;
+            if (this.heights.get(key) !== height) {
+                this.heights.set(key, height);
+                this.offsetsDirty = true;
+            }
+        }
+        this.computeOffsets();
+
+        this.topSpacer.style.height = `${this.offsets[start]}px`;
+        this.bottomSpacer.style.height = `${this.offsets[count] - this.offsets[end]}px`;
+    }
+}
+
+// Browser copy of phone_numbers.PhoneNormalizer, driven by the same region
+// table (window.PHONE_RULES, rendered by the server), so contacts typed in the
+// UI get the same E.164 keys as the server's history keys.
+class PhoneNormalizer {
+    constructor(rules) {
+        this.regions = rules.regions || {};
+        this.defaultRegion = rules.default_region || 'NG';
+        this.trie = {};
+        Object.entries(this.regions).forEach(([region, { code }]) => {
+            let node = this.trie;
+            for (const digit of code) node = node[digit] = node[digit] || {};
+            if (!('' in node)) node[''] = region;
+        });
+        this.cache = new Map();
+        this.cacheSize = 5000;
+    }
+
+    splitCallingCode(digits) {
+        let node = this.trie;
+        for (let i = 0; i < digits.length; i++) {
+            node = node[digits[i]];
+            if (!node) break;
+            if ('' in node) return [digits.slice(0, i + 1), node['']];
+        }
+        return [null, null];
+    }
+
+    national(digits, region) {
+        const { trunk, lengths } = this.regions[region];
+        if (trunk && digits.startsWith(trunk) && lengths.includes(digits.length - trunk.length)) {
+            return digits.slice(trunk.length);
+        }
+        return lengths.includes(digits.length) ? digits : null;
+    }
+
+    fromInternational(digits) {
+        const [code, region] = this.splitCallingCode(digits);
+        if (!code) return digits;
+        const national = this.national(digits.slice(code.length), region);
+        return national ? code + national : digits;
+    }
+
+    normalize(raw, region) {
+        if (!raw) return raw;
+        region = this.regions[region] ? region : this.defaultRegion;
+        const cacheKey = `${region}|${raw}`;
+        let result = this.cache.get(cacheKey);
+        if (result === undefined) {
+            result = this.normalizeUncached(String(raw), region);
+            if (this.cache.size >= this.cacheSize) this.cache.delete(this.cache.keys().next().value);
+            this.cache.set(cacheKey, result);
+        }
+        return result;
+    }
+
+    normalizeUncached(raw, region) {
+        let international = raw.trim().startsWith('+');
+        let digits = raw.normalize('NFKC').replace(/[^0-9]/g, '');  // NFKC folds full-width digits
+        if (!digits || digits.length > 17) return digits;
+        if (!international && digits.startsWith('00')) {
+            international = true;
+            digits = digits.slice(2);
+        }
+        if (international) return this.fromInternational(digits);
+
+        const national = this.national(digits, region);
+        if (national) return this.regions[region].code + national;
+        return this.fromInternational(digits);
+    }
+}
+
 class WhatsAppChat {
     constructor() {
         console.log('🚀 [ENHANCED CHAT] Initializing Enhanced Chat Interface...');
@@ -10,12 +261,16 @@ class WhatsAppChat {
 
         this.contacts = JSON.parse(localStorage.getItem(`whatsapp_contacts_${this.activeAccountId}`) || '[]');
         this.activeContact = null;
-        this.messageHistory = {};
+        this.messageHistory = {};   // normalized phone -> messages, oldest first
+        this.messageVersions = {};  // normalized phone -> version of the last load
+        this.historyState = {};     // normalized phone -> {hasMore, loadingOlder}
+        this.pageSize = 50;
 
         console.log('📱 [ENHANCED CHAT] Loaded contacts from localStorage:', this.contacts);
         console.log('🏢 [ENHANCED CHAT] Active account:', this.activeAccountId);
 
         this.initializeElements();
+        this.initializeLists();
         console.log('🔧 [ENHANCED CHAT] Elements initialized');
 
         this.loadAccountsFromServer();
@@ -30,8 +285,10 @@ class WhatsAppChat {
         this.checkBotStatus();
         console.log('🤖 [ENHANCED CHAT] Checking bot status...');
 
-        // Check bot status every 30 seconds
+        // Check bot status every 30 seconds, unless the tab is hidden or the
+        // WebSocket is connected (which already proves the bot is up)
         setInterval(() => {
+            if (document.hidden || (this.socket && this.socket.connected)) return;
             console.log('⏰ [ENHANCED CHAT] Periodic bot status check...');
             this.checkBotStatus();
         }, 30000);
@@ -55,17 +312,47 @@ class WhatsAppChat {
         this.accountSelect = document.getElementById('accountSelect');
     }
 
+    initializeLists() {
+        this.contactList = new VirtualList(this.contactsList, {
+            keyOf: contact => this.normalizePhoneNumber(contact.phone),
+            signatureOf: contact => [
+                contact.name, contact.lastMessage, contact.messageCount, this.isActiveContact(contact)
+            ].join('|'),
+            renderRow: contact => this.renderContactRow(contact),
+            estimatedHeight: 90,
+            rowSpacing: 5
+        });
+
+        this.messageList = new VirtualList(this.chatMessages, {
+            keyOf: message => this.messageKey(message),
+            signatureOf: message => `${message.text}|${message.media ? message.media.url : ''}`,
+            renderRow: message => this.renderMessageRow(message),
+            estimatedHeight: 70,
+            rowSpacing: 10,
+            stickToBottom: true,
+            onReachTop: () => this.loadOlderMessages()
+        });
+    }
+
     normalizePhoneNumber(phoneNumber) {
-        // Remove + prefix and any non-digit characters for consistent comparison
-        if (!phoneNumber) return phoneNumber;
-        return phoneNumber.replace(/[^\d]/g, '');
+        // Same E.164 digits as the server's normalize_phone_number() for this account
+        const rules = window.PHONE_RULES || { regions: {}, account_regions: {} };
+        if (!this.phoneNormalizer) this.phoneNormalizer = new PhoneNormalizer(rules);
+        return this.phoneNormalizer.normalize(phoneNumber, (rules.account_regions || {})[this.activeAccountId]);
     }
 
     initializeWebSocket() {
         console.log('🔌 [ENHANCED CHAT] Connecting to WebSocket...');
 
-        // Initialize Socket.IO connection
-        this.socket = io();
+        // Initialize Socket.IO connection, receiving the active account's events
+        this.socket = io({ auth: { account_id: this.activeAccountId } });
+
+        // The server sends a client only a few unacknowledged events at a time,
+        // so every event is acked once handled
+        const acked = handler => (data, ack) => {
+            handler(data);
+            if (typeof ack === 'function') ack();
+        };
 
         this.socket.on('connect', () => {
             console.log('✅ [ENHANCED CHAT] WebSocket connected successfully!');
@@ -80,10 +367,23 @@ class WhatsAppChat {
             console.log('❌ [ENHANCED CHAT] WebSocket disconnected');
         });
 
-        this.socket.on('new_message', (data) => {
+        this.socket.on('new_message', acked(data => {
             console.log('📨 [ENHANCED CHAT] Received real-time message:', data);
             this.handleNewMessage(data);
-        });
+        }));
+
+        // Sent instead of the updates this client fell too far behind on
+        this.socket.on('resync', acked(data => {
+            if (data.account_id !== this.activeAccountId) return;
+            console.log('🔄 [ENHANCED CHAT] Missed real-time updates, reloading...');
+            this.loadContactsFromServer();
+            if (this.activeContact) {
+                this.loadMessagesForContact(this.activeContact.phone);
+            }
+        }));
+
+        this.socket.on('media_ready', acked(() => {}));
+        this.socket.on('messages_read', acked(() => {}));
 
         this.socket.on('connect_error', (error) => {
             console.error('💥 [ENHANCED CHAT] WebSocket connection error:', error);
@@ -100,87 +400,42 @@ class WhatsAppChat {
             return;
         }
 
-        // Update message history
-        if (!this.messageHistory[phone_number]) {
-            this.messageHistory[phone_number] = [];
-        }
-        this.messageHistory[phone_number].push(message);
-
-        // If this is the active contact, update the chat display
-        if (this.activeContact) {
-            const activePhoneNormalized = this.normalizePhoneNumber(this.activeContact.phone);
-            console.log(`🔍 [ENHANCED CHAT] Checking if message is for active contact:`);
-            console.log(`   Active contact phone: ${this.activeContact.phone}`);
-            console.log(`   Active normalized: ${activePhoneNormalized}`);
-            console.log(`   Message phone: ${phone_number}`);
-            console.log(`   Match: ${activePhoneNormalized === phone_number}`);
+        // Update message history (ignoring echoes of messages already shown)
+        message._fresh = true;
+        const added = this.mergeMessages(phone_number, [message]);
 
-            if (activePhoneNormalized === phone_number) {
-                console.log(`✅ [ENHANCED CHAT] Message is for active contact, updating display`);
-                this.displayMessages();
-            }
-        } else {
-            console.log(`ℹ️ [ENHANCED CHAT] No active contact selected`);
+        // If this is the active contact, append it without re-rendering the chat
+        if (added.length && this.activeContact && this.normalizePhoneNumber(this.activeContact.phone) === phone_number) {
+            console.log(`✅ [ENHANCED CHAT] Message is for active contact, appending to display`);
+            this.messageList.append(added);
         }
 
         // Update contact list to show new message
-        this.updateContactInList(phone_number, message);
+        if (added.length) {
+            this.updateContactInList(phone_number, message);
+        }
     }
 
     updateContactInList(phone_number, message) {
         console.log(`📋 [ENHANCED CHAT] Updating contact list for ${phone_number} with new message`);
 
-        // Find or create contact in the list
-        let contact = this.contacts.find(c => this.normalizePhoneNumber(c.phone) === phone_number);
-
-        if (!contact) {
-            // Create new contact if not exists
-            contact = {
-                name: `+${phone_number}`,
-                phone: `+${phone_number}`,
-                lastMessage: message.text,
-                lastMessageTime: message.timestamp,
-                messageCount: 1
-            };
-            this.contacts.unshift(contact); // Add to beginning of list
-            console.log(`➕ [ENHANCED CHAT] Created new contact for ${phone_number}`);
-        } else {
-            // Update existing contact
-            contact.lastMessage = message.text;
-            contact.lastMessageTime = message.timestamp;
-            contact.messageCount = (contact.messageCount || 0) + 1;
-            console.log(`🔄 [ENHANCED CHAT] Updated existing contact for ${phone_number}`);
-        }
+        // Find or create the contact and move it to the top of the list
+        const index = this.contacts.findIndex(c => this.normalizePhoneNumber(c.phone) === phone_number);
+        const contact = index >= 0 ? this.contacts.splice(index, 1)[0] : {
+            name: `+${phone_number}`,
+            phone: `+${phone_number}`,
+            messageCount: 0
+        };
+        contact.lastMessage = message.text;
+        contact.lastMessageTime = message.timestamp;
+        contact.messageCount = (contact.messageCount || 0) + 1;
+        this.contacts.unshift(contact);
 
         // Save to localStorage
-        localStorage.setItem('whatsapp_contacts', JSON.stringify(this.contacts));
-
-        // Refresh the contact list display
-        this.displayContacts();
-
-        console.log(`✅ [ENHANCED CHAT] Contact list updated for ${phone_number}`);
-    }
-
-    updateContactInList(phone_number, message) {
-        // Find and update the contact in the list to show the latest message
-        const contactItems = document.querySelectorAll('.contact-item');
-        contactItems.forEach(item => {
-            const contactPhone = item.dataset.phone;
-            if (this.normalizePhoneNumber(contactPhone) === this.normalizePhoneNumber(phone_number)) {
-                // Update last message preview
-                const lastMessageElement = item.querySelector('.contact-last-message');
-                if (lastMessageElement) {
-                    const preview = message.text.length > 30 ? message.text.substring(0, 30) + '...' : message.text;
-                    lastMessageElement.textContent = preview;
-                }
+        localStorage.setItem(`whatsapp_contacts_${this.activeAccountId}`, JSON.stringify(this.contacts));
 
-                // Update message count if available
-                const messageCountElement = item.querySelector('.contact-message-count');
-                if (messageCountElement && this.messageHistory[phone_number]) {
-                    messageCountElement.textContent = this.messageHistory[phone_number].length;
-                }
-            }
-        });
+        // Only the changed row is re-rendered; the others are just reordered
+        this.loadContacts();
     }
 
     setupEventListeners() {
@@ -198,31 +453,42 @@ class WhatsAppChat {
     }
 
     loadContacts() {
-        this.contactsList.innerHTML = '';
-        
         if (this.contacts.length === 0) {
-            this.contactsList.innerHTML = '<div style="padding: 20px; text-align: center; color: #666;">No contacts yet. Add your first contact!</div>';
+            this.contactList.showPlaceholder('<div style="padding: 20px; text-align: center; color: #666;">No contacts yet. Add your first contact!</div>');
             return;
         }
 
-        this.contacts.forEach(contact => {
-            const contactElement = document.createElement('div');
-            contactElement.className = 'contact-item';
+        this.contactList.setItems(this.contacts.slice());
+    }
+
+    isActiveContact(contact) {
+        return Boolean(this.activeContact) &&
+            this.normalizePhoneNumber(this.activeContact.phone) === this.normalizePhoneNumber(contact.phone);
+    }
+
+    renderContactRow(contact) {
+        const contactElement = document.createElement('div');
+        contactElement.className = this.isActiveContact(contact) ? 'contact-item active' : 'contact-item';
+        contactElement.dataset.phone = contact.phone;
 
-            const lastMessageInfo = contact.lastMessage ?
-                `<div class="contact-last-message">${contact.lastMessage}</div>
-                 <div class="contact-message-count">${contact.messageCount || 0} messages</div>` :
-                '<div class="contact-last-message">No messages yet</div>';
+        const lastMessageInfo = contact.lastMessage ?
+            `<div class="contact-last-message">${this.escapeHtml(contact.lastMessage)}</div>
+             <div class="contact-message-count">${contact.messageCount || 0} messages</div>` :
+            '<div class="contact-last-message">No messages yet</div>';
 
-            contactElement.innerHTML = `
-                <div class="contact-name">${contact.name}</div>
-                <div class="contact-phone">${contact.phone}</div>
-                ${lastMessageInfo}
-            `;
+        contactElement.innerHTML = `
+            <div class="contact-name">${this.escapeHtml(contact.name)}</div>
+            <div class="contact-phone">${this.escapeHtml(contact.phone)}</div>
+            ${lastMessageInfo}
+        `;
 
-            contactElement.addEventListener('click', () => this.selectContact(contact));
-            this.contactsList.appendChild(contactElement);
+        // Look the contact up on click: the list may have been reloaded since this row was rendered
+        const key = this.normalizePhoneNumber(contact.phone);
+        contactElement.addEventListener('click', () => {
+            const current = this.contacts.find(c => this.normalizePhoneNumber(c.phone) === key);
+            if (current) this.selectContact(current);
         });
+        return contactElement;
     }
 
     async loadAccountsFromServer() {
@@ -315,22 +581,29 @@ class WhatsAppChat {
     }
 
     async loadMessagesForContact(phoneNumber) {
+        const key = this.normalizePhoneNumber(phoneNumber);
         try {
             console.log(`💬 [ENHANCED CHAT] Loading messages for contact: ${phoneNumber} (Account: ${this.activeAccountId})`);
 
-            // Remove + prefix for API call
-            const normalizedPhone = phoneNumber.replace('+', '');
-            console.log(`🔄 [ENHANCED CHAT] Normalized phone for API: ${normalizedPhone}`);
-
-            const response = await fetch(`/api/messages/${normalizedPhone}?account_id=${this.activeAccountId}`);
+            // Only ask for what changed since the version we already hold;
+            // otherwise fetch the newest page and load older ones on scroll
+            const since = this.messageVersions[key];
+            const delta = Boolean(since && this.messageHistory[key]);
+            const query = delta ? `since=${since}` : `limit=${this.pageSize}`;
+            const response = await fetch(`/api/messages/${key}?account_id=${this.activeAccountId}&${query}`);
             const data = await response.json();
 
-            console.log(`📨 [ENHANCED CHAT] Server response for messages (${normalizedPhone}, Account: ${this.activeAccountId}):`, data);
+            console.log(`📨 [ENHANCED CHAT] Server response for messages (${key}, Account: ${this.activeAccountId}):`, data);
 
             if (data.status === 'success') {
-                console.log(`✅ [ENHANCED CHAT] Found ${data.messages.length} messages for ${phoneNumber}`);
-                this.messageHistory[phoneNumber] = data.messages;
-                console.log(`📋 [ENHANCED CHAT] Updated message history for ${phoneNumber}:`, data.messages);
+                console.log(`✅ [ENHANCED CHAT] Found ${data.messages.length} ${delta ? 'new ' : ''}messages for ${phoneNumber}`);
+                if (delta) {
+                    this.mergeMessages(key, data.messages);
+                } else {
+                    this.messageHistory[key] = data.messages;
+                    this.historyState[key] = { hasMore: data.has_more, loadingOlder: false };
+                }
+                this.messageVersions[key] = data.version;
                 this.displayMessages();
             } else {
                 console.error(`❌ [ENHANCED CHAT] Server returned error for ${phoneNumber}:`, data);
@@ -340,135 +613,132 @@ class WhatsAppChat {
             // Fall back to local storage
             console.log(`🔄 [ENHANCED CHAT] Falling back to localStorage for ${phoneNumber}...`);
             const localMessages = JSON.parse(localStorage.getItem('whatsapp_messages') || '{}');
-            this.messageHistory[phoneNumber] = localMessages[phoneNumber] || [];
-            console.log(`📱 [ENHANCED CHAT] Local messages for ${phoneNumber}:`, this.messageHistory[phoneNumber]);
+            this.messageHistory[key] = localMessages[key] || localMessages[phoneNumber] || [];
+            console.log(`📱 [ENHANCED CHAT] Local messages for ${phoneNumber}:`, this.messageHistory[key]);
             this.displayMessages();
         }
     }
 
-    // Removed refreshMessages - using WebSocket real-time updates instead
+    async loadOlderMessages() {
+        if (!this.activeContact) return;
+
+        const key = this.normalizePhoneNumber(this.activeContact.phone);
+        const state = this.historyState[key];
+        const oldest = (this.messageHistory[key] || []).find(message => message.version);
+        if (!state || !state.hasMore || state.loadingOlder || !oldest) return;
+
+        state.loadingOlder = true;
+        try {
+            console.log(`⏪ [ENHANCED CHAT] Loading messages older than version ${oldest.version} for ${key}`);
+            const response = await fetch(`/api/messages/${key}?account_id=${this.activeAccountId}&limit=${this.pageSize}&before=${oldest.version}`);
+            const data = await response.json();
+
+            if (data.status === 'success') {
+                const known = new Set(this.messageHistory[key].map(message => this.messageKey(message)));
+                const older = data.messages.filter(message => !known.has(this.messageKey(message)));
+                this.messageHistory[key] = older.concat(this.messageHistory[key]);
+                state.hasMore = data.has_more;
+
+                if (this.activeContact && this.normalizePhoneNumber(this.activeContact.phone) === key && older.length) {
+                    this.messageList.prepend(older);
+                }
+            }
+        } catch (error) {
+            console.error(`💥 [ENHANCED CHAT] Error loading older messages for ${key}:`, error);
+        } finally {
+            state.loadingOlder = false;
+        }
+    }
+
+    messageKey(message) {
+        return message.id || `${message.type}-${message.timestamp}-${message.text}`;
+    }
+
+    mergeMessages(key, messages) {
+        // Append messages not already in the history; returns the ones added
+        const history = this.messageHistory[key] || (this.messageHistory[key] = []);
+        const known = new Set(history.map(message => this.messageKey(message)));
+        const added = messages.filter(message => !known.has(this.messageKey(message)));
+        history.push(...added);
+        return added;
+    }
 
     selectContact(contact) {
         this.activeContact = contact;
-        
-        // Update UI
-        document.querySelectorAll('.contact-item').forEach(item => {
-            item.classList.remove('active');
-        });
-        
-        event.currentTarget.classList.add('active');
-        
+
+        // Update UI (re-renders just the previously and newly active rows)
+        this.loadContacts();
+
         this.chatTitle.textContent = contact.name;
         this.chatStatus.textContent = `📱 ${contact.phone}`;
         this.chatInputContainer.style.display = 'flex';
-        
-        // Load message history from server
+
+        // Show what we already have, then fetch what changed from the server
+        this.displayMessages();
+        this.messageList.scrollToBottom();
         this.loadMessagesForContact(contact.phone);
         this.messageInput.focus();
     }
 
-    loadMessageHistory(phone) {
-        const messages = this.messageHistory[phone] || [];
-        this.chatMessages.innerHTML = '';
-        
-        if (messages.length === 0) {
-            this.addSystemMessage(`Start chatting with ${this.activeContact.name}! 💬`);
-            return;
-        }
-
-        messages.forEach(msg => {
-            this.addMessage(msg.text, msg.type, msg.timestamp);
-        });
-    }
-
     displayMessages() {
         if (!this.activeContact) return;
 
-        const messages = this.messageHistory[this.activeContact.phone] || [];
-        this.chatMessages.innerHTML = '';
+        const key = this.normalizePhoneNumber(this.activeContact.phone);
+        const messages = this.messageHistory[key] || [];
 
         if (messages.length === 0) {
             this.addSystemMessage(`Start chatting with ${this.activeContact.name}! 💬`);
             return;
         }
 
-        messages.forEach(msg => {
-            this.addMessageFromServer(msg);
-        });
+        // Keyed diff against what is on screen; a new contact starts at the bottom
+        const switched = this.displayedPhone !== key;
+        this.displayedPhone = key;
+        this.messageList.setItems(messages.slice());
+        if (switched) this.messageList.scrollToBottom();
     }
 
-    addMessageFromServer(messageData) {
+    renderMessageRow(messageData) {
         const messageDiv = document.createElement('div');
         const messageType = messageData.type === 'incoming' ? 'received' : 'sent';
         messageDiv.className = `message ${messageType}`;
+        if (messageData._fresh) {
+            // Animate messages as they arrive, not rows scrolled back into view
+            messageDiv.classList.add('fresh');
+            delete messageData._fresh;
+        }
 
         const timeStr = new Date(messageData.timestamp).toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
 
+        const mediaLink = messageData.media ?
+            `<div><a href="${this.escapeHtml(messageData.media.url)}" target="_blank">📎 View ${this.escapeHtml(messageData.media.kind)}</a></div>` : '';
+
         messageDiv.innerHTML = `
+            ${mediaLink}
             <div>${this.escapeHtml(messageData.text)}</div>
             <div class="message-time">${timeStr}</div>
         `;
 
-        this.chatMessages.appendChild(messageDiv);
-        this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
-    }
-
-    addMessage(text, type, timestamp = null) {
-        const messageDiv = document.createElement('div');
-        messageDiv.className = `message ${type}`;
-        
-        const timeStr = timestamp ? new Date(timestamp).toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'}) 
-                                  : new Date().toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
-        
-        messageDiv.innerHTML = `
-            <div>${this.escapeHtml(text)}</div>
-            <div class="message-time">${timeStr}</div>
-        `;
-        
-        this.chatMessages.appendChild(messageDiv);
-        this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
-        
-        // Save to history
-        if (this.activeContact) {
-            this.saveMessageToHistory(text, type, timestamp);
-        }
+        return messageDiv;
     }
 
     addSystemMessage(text) {
-        const messageDiv = document.createElement('div');
-        messageDiv.className = 'message received';
-        messageDiv.style.background = '#e3f2fd';
-        messageDiv.style.borderColor = '#2196f3';
-        
-        messageDiv.innerHTML = `
-            <div>🤖 ${this.escapeHtml(text)}</div>
-            <div class="message-time">System</div>
-        `;
-        
-        this.chatMessages.appendChild(messageDiv);
-        this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        this.displayedPhone = null;
+        this.messageList.showPlaceholder(`
+            <div class="message received" style="background: #e3f2fd; border-color: #2196f3;">
+                <div>🤖 ${this.escapeHtml(text)}</div>
+                <div class="message-time">System</div>
+            </div>
+        `);
     }
 
-    saveMessageToHistory(text, type, timestamp = null) {
-        if (!this.activeContact) return;
-        
-        const phone = this.activeContact.phone;
-        if (!this.messageHistory[phone]) {
-            this.messageHistory[phone] = [];
-        }
-        
-        this.messageHistory[phone].push({
-            text: text,
-            type: type,
-            timestamp: timestamp || Date.now()
-        });
-        
+    saveMessageHistory() {
         // Keep only last 100 messages per contact
-        if (this.messageHistory[phone].length > 100) {
-            this.messageHistory[phone] = this.messageHistory[phone].slice(-100);
-        }
-        
-        localStorage.setItem('whatsapp_messages', JSON.stringify(this.messageHistory));
+        const recent = {};
+        Object.keys(this.messageHistory).forEach(phone => {
+            recent[phone] = this.messageHistory[phone].slice(-100);
+        });
+        localStorage.setItem('whatsapp_messages', JSON.stringify(recent));
     }
 
     async sendMessage() {
@@ -486,8 +756,17 @@ class WhatsAppChat {
 
         console.log(`📤 [ENHANCED CHAT] Sending message to ${this.activeContact.phone}: "${message}" (Account: ${this.activeAccountId})`);
 
-        // Add sent message to chat
-        this.addMessage(message, 'sent');
+        // Add sent message to chat right away; it is swapped for the stored copy once sent
+        const key = this.normalizePhoneNumber(this.activeContact.phone);
+        const localMessage = {
+            id: `local-${Date.now()}`,
+            text: message,
+            type: 'outgoing',
+            timestamp: new Date().toISOString(),
+            _fresh: true
+        };
+        this.mergeMessages(key, [localMessage]);
+        this.displayMessages();
         this.messageInput.value = '';
 
         // Disable send button and show loading
@@ -524,9 +803,7 @@ class WhatsAppChat {
             if (response.ok) {
                 console.log('✅ [ENHANCED CHAT] Message sent successfully!');
                 this.showNotification('Message sent successfully!', 'success');
-                // Refresh messages to show the sent message from server
-                console.log('🔄 [ENHANCED CHAT] Refreshing messages after send...');
-                setTimeout(() => this.loadMessagesForContact(this.activeContact.phone), 1000);
+                this.confirmLocalMessage(key, localMessage, result.message_id);
             } else {
                 console.error('❌ [ENHANCED CHAT] Failed to send message:', result);
                 this.showNotification(`Failed to send: ${result.message || 'Unknown error'}`, 'error');
@@ -540,6 +817,22 @@ class WhatsAppChat {
         }
     }
 
+    confirmLocalMessage(key, localMessage, messageId) {
+        // The WebSocket echo of the stored message may already have arrived
+        const history = this.messageHistory[key] || [];
+        const index = history.indexOf(localMessage);
+        if (index < 0) return;
+        if (messageId && history.some(message => message.id === messageId)) {
+            history.splice(index, 1);
+        } else if (messageId) {
+            localMessage.id = messageId;
+        }
+        this.saveMessageHistory();
+        if (this.activeContact && this.normalizePhoneNumber(this.activeContact.phone) === key) {
+            this.displayMessages();
+        }
+    }
+
     showAddContactModal() {
         this.addContactModal.style.display = 'block';
         document.getElementById('contactName').focus();
@@ -584,11 +877,14 @@ class WhatsAppChat {
 
     clearChat() {
         if (!this.activeContact) return;
-        
+
         if (confirm(`Clear chat history with ${this.activeContact.name}?`)) {
-            delete this.messageHistory[this.activeContact.phone];
-            localStorage.setItem('whatsapp_messages', JSON.stringify(this.messageHistory));
-            this.loadMessageHistory(this.activeContact.phone);
+            const key = this.normalizePhoneNumber(this.activeContact.phone);
+            delete this.messageHistory[key];
+            delete this.messageVersions[key];
+            delete this.historyState[key];
+            this.saveMessageHistory();
+            this.displayMessages();
             this.showNotification('Chat history cleared', 'info');
         }
     }
@@ -610,14 +906,24 @@ class WhatsAppChat {
         // Switch to new account
         this.activeAccountId = newAccountId;
         localStorage.setItem('whatsapp_active_account', newAccountId);
+        if (this.socket) {
+            this.socket.auth.account_id = newAccountId;  // used again on reconnect
+            this.socket.emit('subscribe', { account_id: newAccountId }, accepted => {
+                if (!accepted) console.warn(`⚠️ [ENHANCED CHAT] No real-time updates for ${newAccountId}: too many open tabs`);
+            });
+        }
 
         // Load contacts for new account
         this.contacts = JSON.parse(localStorage.getItem(`whatsapp_contacts_${this.activeAccountId}`) || '[]');
+        this.messageHistory = {};
+        this.messageVersions = {};
+        this.historyState = {};
 
         // Clear current chat
         this.activeContact = null;
         this.chatTitle.textContent = 'Select a contact to start chatting';
-        this.chatMessages.innerHTML = '<div class="empty-state"><h3>Welcome to WhatsApp Bot Chat! 🤖</h3><p>Add a contact and start sending messages through WhatsApp Business API</p></div>';
+        this.displayedPhone = null;
+        this.messageList.showPlaceholder('<div class="empty-state"><h3>Welcome to WhatsApp Bot Chat! 🤖</h3><p>Add a contact and start sending messages through WhatsApp Business API</p></div>');
         this.chatInputContainer.style.display = 'none';
 
         // Reload contacts from server for new account
@@ -0,0 +1,405 @@
+"""
+Storage backends for message history, contacts and accounts.
+
+The app talks to one StorageBackend (STORAGE_BACKEND):
+
+- RedisStorage, the default: each conversation is a capped list
+  (``{account}:messages:{phone}``, newest first), contacts are a sorted set per
+  account scored by last activity, and each account's config is its own JSON
+  string (``{account}:account``), listed in the ``accounts`` set, so that
+  workers changing different accounts never touch the same key (see
+  key_schema for the hash tags).
+- SQLiteStorage, an embedded single-node store for small deployments and
+  tests: one SQLite file in WAL mode, shared by the workers on a host. Appends
+  are committed by a background thread in batched transactions and are
+  readable by this worker right away (reads merge the uncommitted batch).
+
+append_commands() lets store_message() put the Redis writes of an append into
+the same pipeline as its other writes; backends that don't live in Redis
+store the message themselves and return no commands.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from key_schema import ACCOUNTS_INDEX, account_key, account_record_key
+
+# Messages kept per conversation (the Redis list is trimmed to this)
+HISTORY_LIMIT = 100
+
+
+def history_key(account_id, phone_number):
+    return account_key(account_id, "messages", phone_number)
+
+
+def contacts_key(account_id):
+    return account_key(account_id, "contacts")
+
+
+def _decode(raw_messages):
+    messages = []
+    for raw in raw_messages:
+        try:
+            messages.append(json.loads(raw))
+        except (TypeError, json.JSONDecodeError):
+            continue
+    return messages
+
+
+class StorageBackend:
+    """
+    history() and contacts() take LRANGE-style ranges counted from the newest
+    entry (stop -1 means "to the end"); history() returns its slice oldest
+    first, contacts() most recently active first.
+    """
+
+    def append_message(self, account_id, phone_number, message):
+        """Store a message; returns False if it could only be buffered."""
+        raise NotImplementedError
+
+    def append_commands(self, account_id, phone_number, message):
+        """Redis commands that store a message, for the caller's pipeline."""
+        self.append_message(account_id, phone_number, message)
+        return []
+
+    def history(self, account_id, phone_number, start=0, stop=-1):
+        raise NotImplementedError
+
+    def histories(self, account_id, phone_numbers, start=0, stop=-1):
+        """{phone_number: history()} for several conversations of an account, or None if the store is unavailable."""
+        return {phone_number: self.history(account_id, phone_number, start, stop) for phone_number in phone_numbers}
+
+    def contacts(self, account_id, start=0, stop=-1):
+        """
+        [{"phone_number", "last_message", "message_count", "updated"}] of
+        conversations, or None if the store is unavailable.
+        """
+        raise NotImplementedError
+
+    def upsert_account(self, account_id, config):
+        raise NotImplementedError
+
+    def delete_account(self, account_id):
+        raise NotImplementedError
+
+    def accounts(self):
+        """{account_id: config} of stored accounts, or None if the store is unavailable."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Make buffered appends durable."""
+
+    def stats(self):
+        return {}
+
+
+class RedisStorage(StorageBackend):
+    def __init__(self, redis_manager, history_limit=HISTORY_LIMIT):
+        self.redis_manager = redis_manager
+        self.history_limit = history_limit
+
+    def append_commands(self, account_id, phone_number, message):
+        key = history_key(account_id, phone_number)
+        return [
+            ("lpush", key, json.dumps(message)),
+            ("ltrim", key, 0, self.history_limit - 1),
+            ("zadd", contacts_key(account_id), {phone_number: time.time()}),
+        ]
+
+    def append_message(self, account_id, phone_number, message):
+        return self.redis_manager.write(self.append_commands(account_id, phone_number, message))
+
+    def history(self, account_id, phone_number, start=0, stop=-1):
+        client = self.redis_manager.get_client()
+        if client is None:
+            return []
+        try:
+            raw_messages = client.lrange(history_key(account_id, phone_number), start, stop)
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Redis get messages failed: {e}")
+            return []
+        return _decode(reversed(raw_messages))
+
+    def histories(self, account_id, phone_numbers, start=0, stop=-1):
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None
+        if not phone_numbers:
+            return {}
+        try:
+            pipe = client.pipeline(transaction=False)  # one round trip; the account's keys share a slot
+            for phone_number in phone_numbers:
+                pipe.lrange(history_key(account_id, phone_number), start, stop)
+            replies = pipe.execute()
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Redis get messages failed: {e}")
+            return None
+        return {phone_number: _decode(reversed(raw_messages)) for phone_number, raw_messages in zip(phone_numbers, replies)}
+
+    def contacts(self, account_id, start=0, stop=-1):
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None
+        try:
+            entries = client.zrevrange(contacts_key(account_id), start, stop, withscores=True)
+            pipe = client.pipeline(transaction=False)
+            for phone_number, _ in entries:
+                pipe.lindex(history_key(account_id, phone_number), 0)
+                pipe.llen(history_key(account_id, phone_number))
+            replies = pipe.execute() if entries else []
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            print(f"⚠️ Redis contact listing failed: {e}")
+            return None
+        contacts = []
+        for index, (phone_number, updated) in enumerate(entries):
+            last_raw, count = replies[2 * index], replies[2 * index + 1]
+            if not count:
+                continue  # history expired or deleted
+            last_message = _decode([last_raw])
+            contacts.append({
+                "phone_number": phone_number,
+                "last_message": last_message[0] if last_message else None,
+                "message_count": count,
+                "updated": updated,
+            })
+        return contacts
+
+    def upsert_account(self, account_id, config):
+        return self.redis_manager.write([
+            ("set", account_record_key(account_id), json.dumps(config)),
+            ("sadd", ACCOUNTS_INDEX, account_id),
+        ])
+
+    def delete_account(self, account_id):
+        return self.redis_manager.write([
+            ("delete", account_record_key(account_id)),
+            ("srem", ACCOUNTS_INDEX, account_id),
+        ])
+
+    def accounts(self):
+        client = self.redis_manager.get_client()
+        if client is None:
+            return None
+        try:
+            account_ids = sorted(client.smembers(ACCOUNTS_INDEX))
+            pipe = client.pipeline(transaction=False)  # one GET per account's slot
+            for account_id in account_ids:
+                pipe.get(account_record_key(account_id))
+            configs = pipe.execute() if account_ids else []
+        except Exception as e:
+            self.redis_manager.record_error(e)
+            return None
+        return {account_id: json.loads(raw) for account_id, raw in zip(account_ids, configs) if raw}
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (account_id, phone_number, seq);
+CREATE TABLE IF NOT EXISTS contacts (
+    account_id TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    last_seq INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (account_id, phone_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS contacts_by_activity ON contacts (account_id, updated);
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id TEXT PRIMARY KEY,
+    config TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Messages appended in this worker are committed every max_delay seconds or
+    batch_size messages, whichever comes first; flush() commits right away.
+    Messages not yet committed are lost if the process dies. Like the Redis
+    lists, each conversation keeps its newest history_limit messages: every
+    commit prunes the conversations it wrote to.
+    """
+
+    def __init__(self, path, batch_size=500, max_delay=0.01, history_limit=HISTORY_LIMIT):
+        self.path = path
+        self.history_limit = history_limit
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.committed = 0
+        self.commits = 0
+        self._pending = []  # (account_id, phone_number, message JSON, appended at)
+        self._pending_lock = threading.Condition()
+        self._db_lock = threading.Lock()  # commits and reads; readers never see a batch twice
+        self._thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    def start(self):
+        """Start the background committer (also done on first append)."""
+        with self._pending_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-storage", daemon=True)
+                self._thread.start()
+
+    def append_message(self, account_id, phone_number, message):
+        if self._thread is None:
+            self.start()
+        with self._pending_lock:
+            self._pending.append((account_id, phone_number, json.dumps(message), time.time()))
+            if len(self._pending) in (1, self.batch_size):  # a batch to gather, or a full one
+                self._pending_lock.notify()
+        return True
+
+    def _commit(self):
+        with self._db_lock:
+            with self._pending_lock:
+                batch = self._pending[:self.batch_size]
+            if not batch:
+                return 0
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for account_id, phone_number, raw, appended in batch:
+                    seq = conn.execute(
+                        "INSERT INTO messages (account_id, phone_number, message) VALUES (?, ?, ?)",
+                        (account_id, phone_number, raw)
+                    ).lastrowid
+                    conn.execute(
+                        "INSERT INTO contacts (account_id, phone_number, last_seq, message_count, updated) "
+                        "VALUES (?, ?, ?, 1, ?) ON CONFLICT (account_id, phone_number) DO UPDATE SET "
+                        "last_seq = excluded.last_seq, message_count = MIN(message_count + 1, ?), "
+                        "updated = excluded.updated",
+                        (account_id, phone_number, seq, appended, self.history_limit)
+                    )
+                for account_id, phone_number in {(account, phone) for account, phone, _, _ in batch}:
+                    conn.execute(
+                        "DELETE FROM messages WHERE account_id = ? AND phone_number = ? AND seq <= ("
+                        "SELECT seq FROM messages WHERE account_id = ? AND phone_number = ? "
+                        "ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                        (account_id, phone_number, account_id, phone_number, self.history_limit)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            with self._pending_lock:
+                del self._pending[:len(batch)]
+            self.committed += len(batch)
+            self.commits += 1
+            return len(batch)
+
+    def _due_in(self):
+        """
+        Seconds until the pending appends are due for a commit: 0 for a full
+        batch or once the oldest is max_delay old, None with nothing pending.
+        Called with _pending_lock held.
+        """
+        if not self._pending:
+            return None
+        if len(self._pending) >= self.batch_size:
+            return 0
+        age = time.time() - self._pending[0][3]
+        return max(min(self.max_delay - age, self.max_delay), 0)  # a clock stepping back waits max_delay at most
+
+    def _run(self):
+        while True:
+            with self._pending_lock:
+                # Wake-ups from appends only re-check the deadline; the batch gathers until it is due
+                due_in = self._due_in()
+                while due_in != 0:
+                    self._pending_lock.wait(due_in)
+                    due_in = self._due_in()
+            try:
+                self._commit()
+            except Exception as e:
+                print(f"⚠️ SQLite storage commit failed: {e}")
+                time.sleep(self.max_delay)
+
+    def flush(self):
+        while self._commit():
+            pass
+
+    def _uncommitted(self, account_id, phone_number=None):
+        with self._pending_lock:
+            return [
+                (phone, raw, appended) for account, phone, raw, appended in self._pending
+                if account == account_id and (phone_number is None or phone == phone_number)
+            ]
+
+    def history(self, account_id, phone_number, start=0, stop=-1):
+        with self._db_lock:
+            newest = [raw for _, raw, _ in reversed(self._uncommitted(account_id, phone_number))]
+            selected = newest[start:] if stop < 0 else newest[start:stop + 1]
+            offset = max(start - len(newest), 0)
+            limit = -1 if stop < 0 else stop + 1 - len(newest) - offset
+            if limit != 0 and (stop < 0 or limit > 0):
+                selected += [row[0] for row in self._conn.execute(
+                    "SELECT message FROM messages WHERE account_id = ? AND phone_number = ? "
+                    "ORDER BY seq DESC LIMIT ? OFFSET ?",
+                    (account_id, phone_number, limit, offset)
+                )]
+        return _decode(reversed(selected))
+
+    def contacts(self, account_id, start=0, stop=-1):
+        with self._db_lock:
+            uncommitted = self._uncommitted(account_id)
+            # Uncommitted conversations can take at most one place each in the requested page
+            limit = -1 if stop < 0 else stop + 1 + len({phone for phone, _, _ in uncommitted})
+            rows = self._conn.execute(
+                "SELECT c.phone_number, m.message, c.message_count, c.updated FROM contacts c "
+                "JOIN messages m ON m.seq = c.last_seq WHERE c.account_id = ? ORDER BY c.updated DESC LIMIT ?",
+                (account_id, limit)
+            ).fetchall()
+        contacts = {phone: [raw, count, updated] for phone, raw, count, updated in rows}
+        for phone, raw, appended in uncommitted:
+            entry = contacts.setdefault(phone, [raw, 0, appended])
+            entry[0], entry[1], entry[2] = raw, min(entry[1] + 1, self.history_limit), appended
+        ordered = sorted(contacts.items(), key=lambda item: item[1][2], reverse=True)
+        ordered = ordered[start:] if stop < 0 else ordered[start:stop + 1]
+        return [
+            {"phone_number": phone, "last_message": json.loads(raw), "message_count": count, "updated": updated}
+            for phone, (raw, count, updated) in ordered
+        ]
+
+    def upsert_account(self, account_id, config):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO accounts (account_id, config) VALUES (?, ?) "
+                "ON CONFLICT (account_id) DO UPDATE SET config = excluded.config",
+                (account_id, json.dumps(config))
+            )
+        return True
+
+    def delete_account(self, account_id):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM accounts WHERE account_id = ?", (account_id,))
+        return True
+
+    def accounts(self):
+        with self._db_lock:
+            return {account_id: json.loads(config)
+                    for account_id, config in self._conn.execute("SELECT account_id, config FROM accounts")}
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {"backend": "sqlite", "pending": pending, "committed": self.committed, "commits": self.commits}
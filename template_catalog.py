@@ -0,0 +1,202 @@
+"""
+Approved message template catalog, cached per account.
+
+The catalog is fetched from the Graph API once and kept for a TTL; after that
+the stale copy keeps being served while a background thread refreshes it.
+Template sends are validated against the catalog locally (template exists,
+is approved in that language, and gets exactly the parameters its header,
+body and buttons expect), so malformed sends never cost a Graph round trip.
+If the catalog can't be fetched, validation is skipped rather than blocking
+sends. Concurrent misses for an account share a single fetch.
+"""
+
+import re
+import threading
+import time
+
+import requests
+
+PLACEHOLDER = re.compile(r"{{\s*(\w+)\s*}}")
+MEDIA_HEADER_FORMATS = ("IMAGE", "VIDEO", "DOCUMENT")
+
+
+def _placeholders(text):
+    return len(set(PLACEHOLDER.findall(text or "")))
+
+
+def fetch_templates(graph_api_version, business_account_id, token, timeout=10):
+    """Fetch every message template of a WhatsApp Business Account, following paging."""
+    url = f"https://graph.facebook.com/{graph_api_version}/{business_account_id}/message_templates"
+    params = {"fields": "name,language,status,category,components", "limit": 250}
+    headers = {"Authorization": f"Bearer {token}"}
+    templates = []
+    while url:
+        response = requests.get(url, headers=headers, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        templates.extend(data.get("data", []))
+        url = data.get("paging", {}).get("next")
+        params = None  # the next URL already carries them
+    return templates
+
+
+class TemplateCatalog:
+    """
+    Per-account template cache. fetch(account_id) returns the account's
+    template list from the Graph API.
+    """
+
+    def __init__(self, fetch, ttl=3600, retry_after=60):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._catalogs = {}  # account_id -> (fetched_at, {(name, language): template})
+        self._failed_at = {}  # account_id -> time of the last failed first load
+        self._refreshing = set()
+        self._loading = {}  # account_id -> {"done": Event, "catalog", "error"} of the fetch in flight
+        self._lock = threading.Lock()
+
+    def _load(self, account_id):
+        templates = self.fetch(account_id)
+        catalog = {(t["name"], t["language"]): t for t in templates}
+        with self._lock:
+            self._catalogs[account_id] = (time.monotonic(), catalog)
+        print(f"📋 Loaded {len(catalog)} message template(s) for account {account_id}")
+        return catalog
+
+    def _load_once(self, account_id):
+        """_load(), with callers arriving while a fetch is in flight waiting for its result."""
+        with self._lock:
+            flight = self._loading.get(account_id)
+            leader = flight is None
+            if leader:
+                flight = self._loading[account_id] = {"done": threading.Event(), "catalog": None, "error": None}
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["catalog"]
+        try:
+            flight["catalog"] = self._load(account_id)
+            return flight["catalog"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(account_id, None)
+            flight["done"].set()
+
+    def _refresh_in_background(self, account_id):
+        with self._lock:
+            if account_id in self._refreshing:
+                return
+            self._refreshing.add(account_id)
+
+        def refresh():
+            try:
+                self._load_once(account_id)
+            except Exception as e:
+                print(f"⚠️ Template catalog refresh failed for account {account_id}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(account_id)
+
+        threading.Thread(target=refresh, name=f"templates-{account_id}", daemon=True).start()
+
+    def warm(self, account_ids):
+        """Load catalogs for several accounts in the background."""
+        for account_id in account_ids:
+            self._refresh_in_background(account_id)
+
+    def get(self, account_id, refresh=False):
+        """
+        Return {(name, language): template} for an account, or None if the
+        catalog has never been fetched successfully. Stale catalogs are
+        served while a background refresh runs.
+        """
+        cached = self._catalogs.get(account_id)
+        if cached is None or refresh:
+            # Don't retry a failing Graph API on every send
+            failed_at = self._failed_at.get(account_id)
+            if cached is None and not refresh and failed_at and time.monotonic() - failed_at < self.retry_after:
+                return None
+            try:
+                return self._load_once(account_id)
+            except Exception as e:
+                self._failed_at[account_id] = time.monotonic()
+                print(f"⚠️ Could not load template catalog for account {account_id}: {e}")
+                return cached[1] if cached else None
+
+        fetched_at, catalog = cached
+        if time.monotonic() - fetched_at > self.ttl:
+            self._refresh_in_background(account_id)
+        return catalog
+
+    def invalidate(self, account_id):
+        with self._lock:
+            self._catalogs.pop(account_id, None)
+
+    def validate(self, account_id, name, language, components=None):
+        """Return a list of problems with a template send (empty if it looks valid or can't be checked)."""
+        catalog = self.get(account_id)
+        if catalog is None:
+            return []
+        return validate_template_send(catalog, name, language, components or [])
+
+
+def _check_parameters(errors, label, parameters, expected, media_format=None):
+    if len(parameters) != expected:
+        errors.append(f"{label} expects {expected} parameter(s), got {len(parameters)}")
+        return
+    for parameter in parameters:
+        if not isinstance(parameter, dict) or "type" not in parameter:
+            errors.append(f"{label} parameters must be objects with a 'type'")
+        elif media_format and parameter["type"] != media_format.lower():
+            errors.append(f"{label} expects a {media_format.lower()} parameter")
+        elif parameter["type"] == "text" and not str(parameter.get("text", "")).strip():
+            errors.append(f"{label} has an empty text parameter")
+
+
+def validate_template_send(catalog, name, language, components):
+    """Check send components against a template definition from the catalog."""
+    template = catalog.get((name, language))
+    if template is None:
+        languages = sorted(lang for (tname, lang) in catalog if tname == name)
+        if languages:
+            return [f"Template '{name}' is not available in '{language}' (available: {', '.join(languages)})"]
+        return [f"Template '{name}' does not exist for this account"]
+    if template.get("status") != "APPROVED":
+        return [f"Template '{name}' ({language}) is {template.get('status', 'not approved')}"]
+
+    sent = {}
+    for component in components:
+        key = component.get("type", "").lower()
+        if key == "button":
+            key = f"button:{component.get('index')}"
+        sent[key] = component.get("parameters", [])
+
+    errors = []
+    for definition in template.get("components", []):
+        kind = definition.get("type", "").upper()
+        if kind == "HEADER":
+            header_format = definition.get("format", "TEXT")
+            if header_format in MEDIA_HEADER_FORMATS:
+                _check_parameters(errors, "Header", sent.pop("header", []), 1, media_format=header_format)
+            else:
+                _check_parameters(errors, "Header", sent.pop("header", []), _placeholders(definition.get("text")))
+        elif kind == "BODY":
+            _check_parameters(errors, "Body", sent.pop("body", []), _placeholders(definition.get("text")))
+        elif kind == "BUTTONS":
+            for index, button in enumerate(definition.get("buttons", [])):
+                parameters = sent.pop(f"button:{index}", [])
+                if button.get("type") == "QUICK_REPLY":
+                    continue  # an optional payload parameter
+                expected = _placeholders(button.get("url")) if button.get("type") == "URL" else 0
+                if expected or parameters:
+                    _check_parameters(errors, f"Button {index}", parameters, expected)
+
+    for leftover in sent:
+        if sent[leftover]:
+            errors.append(f"Template '{name}' has no {leftover} that takes parameters")
+    return errors
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# Point the bot at a Redis that is never there, so tests run offline and fast
+os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+os.environ.setdefault("REDIS_PORT", "1")
+os.environ.setdefault("REDIS_CONNECT_TIMEOUT", "0.2")
+os.environ.setdefault("SCHEDULER_ENABLED", "false")  # tests drive the dispatcher directly
+os.environ.setdefault("TEMPLATE_WARMUP", "false")  # no Graph API calls with the placeholder tokens
+
+# Keep local sidecar files (search index, write-ahead logs) out of the repo
+_data_dir = tempfile.mkdtemp(prefix="whatsapp-bot-tests-")
+os.environ.setdefault("SEARCH_INDEX_PATH", os.path.join(_data_dir, "search.db"))
+os.environ.setdefault("WRITE_BEHIND_WAL_DIR", os.path.join(_data_dir, "wal"))
+os.environ.setdefault("MEDIA_STORE_DIR", os.path.join(_data_dir, "media"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_data_dir, "profiles"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,35 @@
+import redis
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, *args))
+
+    def execute(self):
+        if not self.client.up:
+            raise redis.exceptions.ConnectionError("down")
+        self.client.executed.extend(self.commands)
+
+
+class FakeRedis:
+    """Just enough of redis.Redis to drive the circuit breaker."""
+
+    def __init__(self):
+        self.up = False
+        self.executed = []
+        self.connection_pool = self
+
+    def ping(self):
+        if not self.up:
+            raise redis.exceptions.ConnectionError("down")
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def disconnect(self):
+        pass
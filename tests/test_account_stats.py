@@ -0,0 +1,156 @@
+import time
+
+import whatsapp_bot
+from account_stats import COUNT_SCRIPT, MARK_READ_SCRIPT, AccountStats, active_key, traffic_key, hour_bucket
+
+
+class CounterRedis:
+    """Counters, hashes and HyperLogLogs (as sets), and the mark-read script."""
+
+    def __init__(self):
+        self.data = {}
+        self.expiries = {}
+        self.round_trips = 0
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+
+    def hincrby(self, key, field, amount):
+        values = self.data.setdefault(key, {})
+        values[field] = values.get(field, 0) + amount
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+    def hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def pfadd(self, key, member):
+        self.data.setdefault(key, set()).add(member)
+
+    def pfcount(self, *keys):
+        return len(set().union(*(self.data.get(key, set()) for key in keys)))
+
+    def expire(self, key, seconds):
+        self.expiries[key] = seconds
+
+    def sadd(self, key, member):
+        members = self.data.setdefault(key, set())
+        added = member not in members
+        members.add(member)
+        return int(added)
+
+    def eval(self, script, numkeys, *args):
+        if script == COUNT_SCRIPT:
+            counted, unread, total, hour, message_id, ttl, phone_number, direction, retention = args
+            if not self.sadd(counted, message_id):
+                return 0
+            self.expire(counted, ttl)
+            if phone_number:
+                self.hincrby(unread, phone_number, 1)
+                self.incr(total)
+            self.hincrby(hour, direction, 1)
+            self.expire(hour, retention)
+            return 1
+        assert script == MARK_READ_SCRIPT
+        unread, total, phone_number = args
+        count = self.data.get(unread, {}).pop(phone_number, 0)
+        self.data[total] = int(self.data.get(total, 0)) - count
+        return count
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None  # the rest of store_message()'s writes
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.calls = []
+
+            def __getattr__(self, name):
+                return lambda *args: self.calls.append((name, args))
+
+            def execute(self):
+                client.round_trips += 1
+                return [getattr(client, name)(*args) for name, args in self.calls]
+
+        return Pipeline()
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+    def publish_command(self, channel, message):
+        return ("publish", channel, message)
+
+    def write(self, commands, transient=()):
+        pipe = self.client.pipeline()
+        for name, *args in commands:
+            getattr(pipe, name)(*args)
+        pipe.execute()
+        return True
+
+
+def test_counters_and_one_round_trip_read():
+    client = CounterRedis()
+    stats = AccountStats(Manager(client), retention_days=2)
+    now = time.time()
+    for index, (phone, sender, at) in enumerate([("111", "incoming", now - 7200), ("111", "incoming", now),
+                                                 ("222", "incoming", now), ("111", "outgoing", now),
+                                                 ("333", "outgoing", now - 86400)]):
+        commands = stats.record_commands("main", phone, sender, now=at, message_id=f"wamid.{index}")
+        Manager(client).write(commands)
+        Manager(client).write(commands)  # replayed: counted once
+    assert client.expiries[traffic_key("main", hour_bucket(now))] == 2 * 86400
+
+    client.round_trips = 0
+    result = stats.read("main", hours=3, days=2, phone_number="111", now=now)
+    assert client.round_trips == 1
+    assert result["unread"] == {"total": 3, "contacts": 2, "contact": {"phone_number": "111", "unread": 2}}
+    assert [(bucket["in"], bucket["out"]) for bucket in result["traffic"]["hours"]] == [(1, 0), (0, 0), (2, 1)]
+    assert (result["traffic"]["in"], result["traffic"]["out"]) == (3, 1)
+    assert result["active_contacts"]["today"] == len(client.data[active_key("main", time.strftime("%Y%m%d", time.gmtime(now)))])
+    assert result["active_contacts"]["period"] == 3
+
+    stats.mark_read("main", "111")
+    stats.mark_read("main", "111")
+    assert stats.read("main", phone_number="111", now=now)["unread"] == {
+        "total": 1, "contacts": 1, "contact": {"phone_number": "111", "unread": 0}}
+    assert AccountStats(Manager(None)).read("main") is None
+
+
+def test_stats_and_mark_read_api(monkeypatch):
+    app = whatsapp_bot.create_app()
+    manager = Manager(CounterRedis())
+    monkeypatch.setattr(whatsapp_bot, "write_behind", None)
+    monkeypatch.setattr(whatsapp_bot, "redis_manager", manager)
+    monkeypatch.setattr(whatsapp_bot, "storage", whatsapp_bot.RedisStorage(manager))
+    monkeypatch.setattr(whatsapp_bot, "account_stats", AccountStats(manager))
+    monkeypatch.setattr(whatsapp_bot.conversation_versions, "redis_manager", manager)
+    whatsapp_bot.store_message("08055550011", "hi", "incoming", account_id="main")
+    whatsapp_bot.store_message("08055550011", "again", "incoming", account_id="main")
+    whatsapp_bot.store_message("08055550011", "hello", "outgoing", account_id="main")
+
+    client = app.test_client()
+    body = client.get("/api/accounts/main/stats?hours=1&phone=08055550011").get_json()
+    assert body["unread"]["total"] == 2 and body["unread"]["contact"]["unread"] == 2
+    assert (body["traffic"]["in"], body["traffic"]["out"]) == (2, 1)
+    assert body["active_contacts"]["today"] == 1
+
+    assert client.post("/api/accounts/main/contacts/08055550011/read").get_json()["status"] == "success"
+    assert client.get("/api/accounts/main/stats").get_json()["unread"]["total"] == 0
+    assert client.get("/api/accounts/main/stats?hours=0").status_code == 400
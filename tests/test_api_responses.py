@@ -0,0 +1,38 @@
+import gzip
+import json
+
+import whatsapp_bot
+from api_responses import stream_json
+
+
+def test_stream_json_matches_the_buffered_document():
+    body = "".join(stream_json({"status": "success"}, "items", iter([{"a": 1}, {"b": 2}])))
+    assert json.loads(body) == {"status": "success", "items": [{"a": 1}, {"b": 2}], "count": 2}
+    assert json.loads("".join(stream_json({}, "items", iter([])))) == {"items": [], "count": 0}
+
+
+def test_large_listings_are_gzipped_and_streamable():
+    client = whatsapp_bot.app.test_client()
+    for i in range(40):
+        whatsapp_bot.store_message(f"23480000010{i:02d}", f"hello number {i} " * 5, "incoming", account_id="main")
+
+    plain = client.get("/api/contacts")
+    assert "Content-Encoding" not in plain.headers
+
+    compressed = client.get("/api/contacts", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"].startswith('W/')
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+    assert len(compressed.data) < len(plain.data)
+
+    streamed = client.get("/api/contacts?stream=json", headers={"Accept-Encoding": "gzip"})
+    assert json.loads(gzip.decompress(streamed.data))["contacts"] == plain.get_json()["contacts"]
+
+    lines = client.get("/api/messages?stream=ndjson").data.decode().splitlines()
+    timestamps = [json.loads(line)["timestamp"] for line in lines]
+    assert len(lines) >= 40 and timestamps == sorted(timestamps, reverse=True)
+
+    # The weakened ETag of the compressed representation still revalidates
+    assert client.get("/api/contacts", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": compressed.headers["ETag"]
+    }).status_code == 304
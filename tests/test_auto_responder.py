@@ -0,0 +1,106 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import whatsapp_bot
+from auto_responder import AutoResponder, RuleError, RuleSet, required_literal
+
+
+class StringRedis:
+    def __init__(self):
+        self.strings = {}
+
+    def mget(self, keys):
+        return [self.strings.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.strings[key] = str(value)
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+
+def test_rules_match_by_priority():
+    ruleset = RuleSet([
+        {"id": "greeting", "keywords": ["hello", "hi"], "response": "Hi!"},
+        {"id": "pricing", "type": "intent", "keywords": ["price", "cost", "how much"], "min_matches": 2,
+         "response": "Our prices...", "priority": 50},
+        {"id": "order", "type": "regex", "pattern": r"order\s*#?\d{4,}", "response": "Checking", "priority": 10},
+        {"id": "off", "keywords": ["hello"], "response": "never", "priority": 1, "enabled": False},
+    ])
+    assert ruleset.match("Hello there")["id"] == "greeting"
+    assert ruleset.match("Ship it") is None  # "hi" inside a word
+    assert ruleset.match("price?") is None  # one of two intent terms
+    assert ruleset.match("What's the PRICE, how much does it cost?")["id"] == "pricing"
+    assert ruleset.match("hi, where is ORDER #123456")["id"] == "order"
+    assert ruleset.match("hi, where is my order")["id"] == "greeting"
+
+    assert required_literal(r"\bcancel(led)? my order") == " my order"
+    assert required_literal(r"(refund|return)") is None
+
+    with pytest.raises(RuleError) as error:
+        RuleSet([{"id": "bad", "type": "regex", "pattern": "(", "response": "x"}, {"keywords": ["x"]}])
+    assert [e["rule"] for e in error.value.errors] == ["bad", "rule-1"]
+
+
+def test_thousands_of_rules():
+    rules = [{"id": f"k{i}", "keywords": [f"word{i}"], "response": "k"} for i in range(5000)]
+    rules += [{"id": f"r{i}", "type": "regex", "pattern": f"ticket-{i}-\\d+", "response": "r"} for i in range(5000)]
+    ruleset = RuleSet(rules)
+    assert ruleset.describe()["unfiltered_regexes"] == 0
+    assert ruleset.match("about ticket-4321-77 and word12")["id"] == "k12"
+    assert ruleset.match("about ticket-4321-77")["id"] == "r4321"
+    assert ruleset.match("word50000 ticket-4321") is None
+
+
+def test_replaced_rules_reach_other_workers():
+    client = StringRedis()
+    first = AutoResponder(Manager(client), send=None, refresh_interval=0)
+    second = AutoResponder(Manager(client), send=None, refresh_interval=0)
+    assert second.ruleset("main").rules == []
+
+    _, commands = first.replace("main", [{"id": "hours", "keywords": ["open"], "response": "9-5"}])
+    for _, key, value in commands:
+        client.set(key, value)
+    assert second.ruleset("main").match("are you open?")["id"] == "hours"
+
+
+def test_incoming_webhook_message_gets_auto_response(monkeypatch):
+    whatsapp_bot.create_app()
+    sent = []
+    responder = AutoResponder(whatsapp_bot.redis_manager, send=lambda *args: sent.append(args) or {"success": True})
+    monkeypatch.setattr(whatsapp_bot, "auto_responder", responder)
+    client = whatsapp_bot.app.test_client()
+
+    response = client.put("/api/accounts/main/rules", json={"rules": [{"id": "oops", "type": "nope"}]})
+    assert response.status_code == 400
+    response = client.put("/api/accounts/main/rules", json={"rules": [
+        {"id": "hours", "keywords": ["opening hours", "open"], "response": "We're open 9-5"}
+    ]})
+    assert response.get_json()["rules"] == 1
+    assert client.post("/api/accounts/main/rules/test", json={"text": "Opening hours?"}).get_json()["rule"]["id"] == "hours"
+
+    payload = json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "metadata": {"phone_number_id": whatsapp_bot.WHATSAPP_ACCOUNTS["main"]["phone_number_id"]},
+            "messages": [{"from": "2348055550001", "id": "wamid.q", "type": "text", "text": {"body": "Are you open today?"}}]
+        }}]}]
+    }).encode()
+    signature = "sha256=" + hmac.new(whatsapp_bot.APP_SECRET.encode(), payload, hashlib.sha256).hexdigest()
+    response = client.post("/webhook", data=payload,
+                           headers={"X-Hub-Signature-256": signature, "Content-Type": "application/json"})
+    assert response.status_code == 200
+
+    responder.flush()
+    assert [(account_id, phone, rule["id"]) for account_id, phone, rule in sent] == [("main", "2348055550001", "hours")]
@@ -0,0 +1,155 @@
+import whatsapp_bot
+from conversation_versions import ConversationVersions
+from storage import RedisStorage
+
+
+def test_etags_and_since_deltas():
+    whatsapp_bot.create_app()
+    client = whatsapp_bot.app.test_client()
+    phone = "2348000000077"
+    whatsapp_bot.store_message(phone, "first", "incoming", account_id="main")
+
+    response = client.get(f"/api/messages/{phone}")
+    etag, version = response.headers["ETag"], response.get_json()["version"]
+    assert response.get_json()["count"] == 1
+    assert client.get(f"/api/messages/{phone}", headers={"If-None-Match": etag}).status_code == 304
+
+    contacts = client.get("/api/contacts")
+    contacts_etag = contacts.headers["ETag"]
+    assert client.get("/api/contacts", headers={"If-None-Match": contacts_etag}).status_code == 304
+
+    whatsapp_bot.store_message(phone, "second", "outgoing", account_id="main")
+    assert client.get(f"/api/messages/{phone}", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/api/contacts", headers={"If-None-Match": contacts_etag}).status_code == 200
+
+    delta = client.get(f"/api/messages/{phone}?since={version}").get_json()
+    assert [m["text"] for m in delta["messages"]] == ["second"]
+    assert delta["version"] > version
+
+    changed = client.get(f"/api/contacts?since={version}").get_json()["contacts"]
+    assert [c["phone_number"] for c in changed] == [phone]
+    assert client.get("/api/contacts?since=abc").status_code == 400
+
+
+def test_status_answers_304_while_unchanged():
+    client = whatsapp_bot.app.test_client()
+    etag = client.get("/api/status").headers["ETag"]
+    assert client.get("/api/status", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_history_pages_back_by_version():
+    client = whatsapp_bot.app.test_client()
+    phone = "2348000000078"
+    for i in range(7):
+        whatsapp_bot.store_message(phone, f"m{i}", "incoming", account_id="main")
+
+    page = client.get(f"/api/messages/{phone}?limit=3").get_json()
+    assert [m["text"] for m in page["messages"]] == ["m4", "m5", "m6"] and page["has_more"]
+
+    older = client.get(f"/api/messages/{phone}?limit=3&before={page['messages'][0]['version']}").get_json()
+    assert [m["text"] for m in older["messages"]] == ["m1", "m2", "m3"] and older["has_more"]
+
+    oldest = client.get(f"/api/messages/{phone}?limit=3&before={older['messages'][0]['version']}").get_json()
+    assert [m["text"] for m in oldest["messages"]] == ["m0"] and not oldest["has_more"]
+    assert client.get(f"/api/messages/{phone}?limit=0").status_code == 400
+
+
+class SharedRedis:
+    """History lists and sorted sets shared by the workers of a test."""
+
+    def __init__(self):
+        self.lists = {}
+        self.zsets = {}
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.lists.setdefault(key, []).insert(0, value)
+
+    def ltrim(self, key, start, stop):
+        self.lists[key] = self.lists.get(key, [])[start:stop + 1]
+
+    def lindex(self, key, index):
+        items = self.lists.get(key, [])
+        return items[index] if items else None
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def zadd(self, key, mapping, nx=False, xx=False, ch=False, incr=False, gt=False):
+        zset = self.zsets.setdefault(key, {})
+        for member, score in mapping.items():
+            zset[member] = max(score, zset.get(member, score)) if gt else score
+
+    def zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member)
+
+    def zrevrange(self, key, start, stop, withscores=False):
+        entries = sorted(self.zsets.get(key, {}).items(), key=lambda item: -item[1])
+        entries = entries[start:] if stop < 0 else entries[start:stop + 1]
+        return entries if withscores else [member for member, _ in entries]
+
+    def zrangebyscore(self, key, low, high):
+        assert low.startswith("(") and high == "+inf"
+        return [member for member, score in self.zsets.get(key, {}).items() if score > int(low[1:])]
+
+    def pipeline(self, transaction=True):
+        client, replies = self, []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args: replies.append(getattr(client, name)(*args))
+
+            def execute(self):
+                return replies
+        return Pipeline()
+
+
+class SharedManager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+    def write(self, commands, transient=()):
+        for name, *args in commands:
+            getattr(self.client, name)(*args)
+        return True
+
+
+def test_contact_etags_follow_other_workers(monkeypatch):
+    """A conditional GET on one worker sees contacts another worker (or process) stored."""
+    app = whatsapp_bot.create_app()
+    shared = SharedManager(SharedRedis())
+    serving = ConversationVersions(shared)  # this worker, freshly restarted: nothing stored locally
+    monkeypatch.setattr(whatsapp_bot, "redis_manager", shared)
+    monkeypatch.setattr(whatsapp_bot, "storage", RedisStorage(shared))
+    monkeypatch.setattr(whatsapp_bot, "conversation_versions", serving)
+    client = app.test_client()
+
+    other_versions, other_storage = ConversationVersions(shared), RedisStorage(shared)
+
+    def store_on_other_worker(phone, text):
+        version, command = other_versions.bump("main", phone)
+        message = {"id": f"{phone}-{version}", "text": text, "type": "incoming",
+                   "timestamp": "2024-06-01T10:00:00", "version": version}
+        shared.write(other_storage.append_commands("main", phone, message) + [command])
+        return version
+
+    first = store_on_other_worker("2348000000091", "hello")
+    listing = client.get("/api/contacts")
+    etag = listing.headers["ETag"]
+    assert listing.get_json()["version"] == first and etag != '"main:0"'
+    assert client.get("/api/contacts", headers={"If-None-Match": etag}).status_code == 304
+
+    store_on_other_worker("2348000000092", "hi")
+    for path in ("/api/contacts", "/api/accounts/main/contacts"):
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.get_json()["contacts"]) == 2
+
+    changed = client.get(f"/api/contacts?since={first}").get_json()["contacts"]
+    assert [c["phone_number"] for c in changed] == ["2348000000092"]
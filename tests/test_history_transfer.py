@@ -0,0 +1,208 @@
+import csv
+import io
+import json
+from fnmatch import fnmatch
+
+import pytest
+
+import whatsapp_bot
+from history_transfer import MERGE_SCRIPT
+from storage import HISTORY_LIMIT, history_key
+
+
+class ListRedis:
+    """History lists and sorted sets, with a paginated SCAN."""
+
+    def __init__(self):
+        self.lists = {}
+        self.zsets = {}
+        self.published = []
+        self.scans = 0
+
+    def scan(self, cursor=0, match="*", count=10, _type=None):
+        self.scans += 1
+        keys = sorted(key for key in self.lists if fnmatch(key, match))
+        batch = keys[cursor:cursor + count]
+        return (cursor + count if cursor + count < len(keys) else 0), batch
+
+    def scan_iter(self, match="*", count=10, _type=None):
+        cursor = 0
+        while True:
+            cursor, keys = self.scan(cursor, match, count, _type)
+            yield from keys
+            if cursor == 0:
+                break
+
+    def zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member)
+
+    def lrange(self, key, start, end):
+        items = self.lists.get(key, [])
+        return list(items[start:] if end < 0 else items[start:end + 1])
+
+    def pipeline(self, transaction=True):
+        return ListPipeline(self)
+
+
+class ListPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.results = []
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.client.lists.setdefault(key, []).insert(0, value)
+        self.results.append(len(self.client.lists[key]))
+
+    def ltrim(self, key, start, end):
+        self.client.lists[key] = self.client.lists.get(key, [])[start:end + 1]
+        self.results.append(True)
+
+    def zadd(self, key, mapping, *flags):
+        zset = self.client.zsets.setdefault(key, {})
+        for member, score in mapping.items():
+            zset[member] = max(score, zset.get(member, score))
+        self.results.append(len(mapping))
+
+    def publish(self, channel, message):
+        self.client.published.append((channel, json.loads(message)))
+        self.results.append(1)
+
+    def lrange(self, key, start, end):
+        items = self.client.lists.get(key, [])
+        self.results.append(list(items[start:] if end < 0 else items[start:end + 1]))
+
+    def eval(self, script, numkeys, key, limit, *messages):
+        assert script == MERGE_SCRIPT
+        entries, seen = [], set()
+        for order, raw in enumerate(self.client.lists.get(key, []) + list(messages)):
+            message = json.loads(raw)
+            if message["id"] not in seen:
+                seen.add(message["id"])
+                entries.append((-message.get("version", 0), order, raw))
+        self.client.lists[key] = [raw for _, _, raw in sorted(entries)][:limit]
+        self.results.append(len(self.client.lists[key]))
+
+    def execute(self):
+        return self.results
+
+
+def test_import_then_export_round_trip(monkeypatch):
+    whatsapp_bot.create_app()
+    fake = ListRedis()
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: fake)
+    client = whatsapp_bot.app.test_client()
+
+    records = [
+        {"phone_number": "2348000000201", "type": "incoming", "timestamp": "2024-01-01T10:00:00", "text": "hi"},
+        {"phone_number": "2348000000201", "type": "outgoing", "timestamp": "2024-01-01T10:01:00", "text": "hello"},
+        {"phone_number": "2348000000202", "type": "incoming", "timestamp": "2024-01-02T09:00:00", "text": "order?",
+         "media": {"id": "m1", "kind": "image"}},
+        {"phone_number": "2348000000203", "type": "sideways", "timestamp": "2024-01-02T09:00:00"},
+    ]
+    body = "\n".join(json.dumps(record) for record in records) + "\nnot json\n"
+    response = client.post("/api/accounts/main/import", data=body, content_type="application/x-ndjson")
+    result = response.get_json()
+    assert response.status_code == 200
+    assert (result["imported"], result["rejected"]) == (3, 2)
+    assert [error["line"] for error in result["errors"]] == [4, 5]
+    assert len(fake.lists[history_key("main", "2348000000201")]) == 2
+
+    # A tiny SCAN count forces several cursor round trips
+    monkeypatch.setattr("history_transfer.SCAN_COUNT", 1)
+    exported = client.get("/api/accounts/main/export?format=ndjson")
+    messages = [json.loads(line) for line in exported.data.decode().splitlines()]
+    assert [m["text"] for m in messages] == ["hi", "hello", "order?"]
+    assert messages[2]["media"]["kind"] == "image"
+
+    csv_export = client.get("/api/accounts/main/export?format=csv")
+    assert csv_export.mimetype == "text/csv"
+    rows = list(csv.DictReader(io.StringIO(csv_export.data.decode())))
+    assert [row["text"] for row in rows] == ["hi", "hello", "order?"]
+
+    whatsapp_bot.WHATSAPP_ACCOUNTS["copy"] = dict(whatsapp_bot.WHATSAPP_ACCOUNTS["main"])
+    try:
+        reimport = client.post("/api/accounts/copy/import", data=csv_export.data, content_type="text/csv")
+        assert reimport.get_json()["imported"] == 3
+        assert json.loads(fake.lists[history_key("copy", "2348000000202")][0])["media"]["id"] == "m1"
+    finally:
+        del whatsapp_bot.WHATSAPP_ACCOUNTS["copy"]
+
+
+def test_import_reports_unavailable_redis():
+    whatsapp_bot.create_app()
+    response = whatsapp_bot.app.test_client().post(
+        "/api/accounts/main/import",
+        data=json.dumps({"phone_number": "2348000000204", "type": "incoming", "timestamp": "2024-01-01T00:00:00"}),
+        content_type="application/x-ndjson"
+    )
+    assert response.status_code == 503
+    assert response.get_json()["imported"] == 0
+
+
+def post_ndjson(client, account_id, records):
+    body = "\n".join(json.dumps(record) for record in records)
+    return client.post(f"/api/accounts/{account_id}/import", data=body, content_type="application/x-ndjson")
+
+
+def test_backfill_goes_behind_live_messages(monkeypatch):
+    whatsapp_bot.create_app()
+    fake = ListRedis()
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: fake)
+    client = whatsapp_bot.app.test_client()
+    key = history_key("main", "2348000000205")
+    live = [{"id": f"live{i}", "text": f"live {i}", "type": "incoming", "timestamp": f"2024-06-{1 + i // 24:02d}T{i % 24:02d}:00:00",
+             "version": 1_717_236_000_000_000 + i} for i in range(HISTORY_LIMIT - 1)]
+    fake.lists[key] = [json.dumps(message) for message in reversed(live)]
+    monkeypatch.setattr(whatsapp_bot.near_cache, "connected", True)
+    monkeypatch.setattr(whatsapp_bot.near_cache, "_subscribed", {"main"})
+    assert len(whatsapp_bot.get_stored_messages("2348000000205", "main")) == HISTORY_LIMIT - 1  # now cached
+    before = whatsapp_bot.conversation_versions.local_version("main", "2348000000205")
+
+    backfill = [{"phone_number": "2348000000205", "type": "incoming", "timestamp": f"2024-01-0{day}T09:00:00",
+                 "text": f"old {day}"} for day in (2, 1, 3)]
+    assert post_ndjson(client, "main", backfill).get_json()["imported"] == 3
+
+    stored = [json.loads(raw) for raw in fake.lists[key]]
+    assert len(stored) == HISTORY_LIMIT
+    assert [m["id"] for m in stored[:HISTORY_LIMIT - 1]] == [m["id"] for m in reversed(live)]  # live messages kept
+    assert stored[-1]["text"] == "old 3"  # the newest of the backfill fills the last slot; older ones are trimmed
+    assert stored[-1]["version"] < live[0]["version"]
+    # The history changed, so the conversation gets a new version (and ETag), and cached copies are dropped
+    assert whatsapp_bot.conversation_versions.local_version("main", "2348000000205") > before
+    assert fake.published[-1][1] == [key]
+    assert len(whatsapp_bot.get_stored_messages("2348000000205", "main")) == HISTORY_LIMIT
+
+    # Importing again doesn't duplicate anything; a newer record is a change
+    post_ndjson(client, "main", backfill)
+    assert [json.loads(raw)["text"] for raw in fake.lists[key]].count("old 3") == 1
+    newer = {"phone_number": "2348000000205", "type": "outgoing", "timestamp": "2024-07-01T00:00:00", "text": "new"}
+    post_ndjson(client, "main", [newer])
+    stored = [json.loads(raw) for raw in fake.lists[key]]
+    assert stored[0]["text"] == "new" and stored[-1]["id"] == "live0"
+    assert whatsapp_bot.conversation_versions.local_version("main", "2348000000205") == stored[0]["version"]
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_export_fails_visibly(monkeypatch, fmt):
+    whatsapp_bot.create_app()
+    client = whatsapp_bot.app.test_client()
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: None)
+    assert client.get(f"/api/accounts/main/export?format={fmt}").status_code == 503
+
+    fake = ListRedis()
+    fake.lists[history_key("main", "2348000000206")] = [json.dumps({"id": "a", "text": "kept"})]
+    fake.lists[history_key("main", "2348000000207")] = [json.dumps({"id": "b", "text": "lost"})]
+
+    def failing_scan_iter(match="*", count=10, _type=None):
+        yield from sorted(fake.lists)[:1]
+        raise ConnectionError("connection reset")
+
+    fake.scan_iter = failing_scan_iter
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: fake)
+    if fmt == "csv":
+        with pytest.raises(ConnectionError):
+            client.get("/api/accounts/main/export?format=csv").data
+        return
+    lines = [json.loads(line) for line in client.get("/api/accounts/main/export").data.decode().splitlines()]
+    assert lines == [{"error": "Export stopped: connection reset", "truncated": True}]
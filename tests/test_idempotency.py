@@ -0,0 +1,163 @@
+import hashlib
+import json
+import time
+
+import idempotency
+import whatsapp_bot
+from idempotency import IdempotencyStore, record_key
+
+
+class StringRedis:
+    """Strings with expiry ignored, and the claim scripts run in Python."""
+
+    def __init__(self):
+        self.strings = {}
+
+    def get(self, key):
+        return self.strings.get(key)
+
+    def set(self, key, value, ex=None):
+        self.strings[key] = value
+        return True
+
+    def delete(self, key):
+        return int(self.strings.pop(key, None) is not None)
+
+    def register_script(self, source):
+        def begin(keys, args):
+            if keys[0] in self.strings:
+                return self.strings[keys[0]]
+            self.strings[keys[0]] = args[0]
+            return None
+
+        def owner_only(keys, args):
+            existing = self.strings.get(keys[0])
+            if existing and json.loads(existing)["token"] != args[0]:
+                return 0
+            if source == idempotency.COMPLETE_SCRIPT:
+                self.strings[keys[0]] = args[1]
+            elif source == idempotency.RENEW_SCRIPT:
+                return int(bool(existing) and json.loads(existing)["state"] == "pending")
+            else:
+                self.strings.pop(keys[0], None)
+            return 1
+        return begin if source == idempotency.BEGIN_SCRIPT else owner_only
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+
+def setup(monkeypatch, redis_client):
+    whatsapp_bot.create_app()
+    monkeypatch.setattr(whatsapp_bot, "OUTBOUND_QUEUE_ENABLED", False)
+    monkeypatch.setattr(whatsapp_bot, "idempotency_store", IdempotencyStore(Manager(redis_client)))
+    sends = []
+
+    def send(to, *args, **kwargs):
+        sends.append(to)
+        if to == "boom":
+            raise RuntimeError("Graph API exploded")
+        return {"success": True, "response": {}, "message_id": f"wamid.{len(sends)}", "phone_number": f"+{to}"}
+
+    monkeypatch.setattr(whatsapp_bot, "send_whatsapp_message", send)
+    return whatsapp_bot.app.test_client(), sends
+
+
+def test_retries_are_replayed_without_a_second_send(monkeypatch):
+    client, sends = setup(monkeypatch, StringRedis())
+    body = {"to": "2348055550004", "message": "Your order shipped"}
+    headers = {"Idempotency-Key": "order-42-shipped"}
+
+    first = client.post("/api/accounts/main/send", json=body, headers=headers)
+    retry = client.post("/api/accounts/main/send", json=body, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json()["message_id"] == first.get_json()["message_id"] == "wamid.1"
+    assert sends == ["2348055550004"]
+
+    changed = client.post("/api/accounts/main/send", json=dict(body, message="Different"), headers=headers)
+    assert changed.status_code == 422
+    assert client.post("/api/accounts/main/send", json=body).status_code == 200  # no key: sent again
+    assert len(sends) == 2
+
+
+def test_concurrent_duplicate_is_locked_out(monkeypatch):
+    redis_client = StringRedis()
+    client, sends = setup(monkeypatch, redis_client)
+    payload = json.dumps({"to": "2348055550005", "message": "hi"}).encode()
+    redis_client.strings[record_key("/api/accounts/main/send", "k1")] = json.dumps(
+        {"state": "pending", "fingerprint": hashlib.sha256(payload).hexdigest()}
+    )
+    response = client.post("/api/accounts/main/send", data=payload, content_type="application/json",
+                           headers={"Idempotency-Key": "k1"})
+    assert response.status_code == 409 and response.headers["Retry-After"] == "1"
+    assert sends == []
+
+
+def test_failures_before_the_send_release_the_key(monkeypatch):
+    redis_client = StringRedis()
+    client, sends = setup(monkeypatch, redis_client)
+    headers = {"Idempotency-Key": "k2"}
+    monkeypatch.setattr(whatsapp_bot, "get_fallback_template", lambda data: 1 / 0)
+    assert client.post("/api/accounts/main/send", json={"to": "2348055550007", "message": "hi"}, headers=headers).status_code == 500
+    assert not redis_client.strings and sends == []
+
+    monkeypatch.undo()
+    client, sends = setup(monkeypatch, redis_client)
+    response = client.post("/api/accounts/main/send", json={"to": "2348055550007", "message": "hi"}, headers=headers)
+    assert response.status_code == 200 and sends == ["2348055550007"]
+
+    assert client.post("/api/accounts/main/send", json={"to": "x"}, headers={"Idempotency-Key": ""}).status_code == 400
+
+
+def test_keys_need_redis(monkeypatch):
+    client, sends = setup(monkeypatch, None)
+    response = client.post("/api/accounts/main/send", json={"to": "2348055550006", "message": "hi"},
+                           headers={"Idempotency-Key": "k3"})
+    assert response.status_code == 503 and sends == []
+
+
+def test_failures_after_the_send_replay_its_outcome(monkeypatch):
+    redis_client = StringRedis()
+    client, sends = setup(monkeypatch, redis_client)
+    monkeypatch.setattr(whatsapp_bot, "store_message", lambda **kwargs: 1 / 0)
+    headers = {"Idempotency-Key": "k4"}
+    body = {"to": "2348055550008", "message": "hi"}
+
+    assert client.post("/api/accounts/main/send", json=body, headers=headers).status_code == 500
+    retry = client.post("/api/accounts/main/send", json=body, headers=headers)
+    assert retry.status_code == 200 and retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json()["message_id"] == "wamid.1" and sends == ["2348055550008"]
+
+    # A send that blew up stays locked (its outcome is unknown) instead of being retried
+    assert client.post("/api/accounts/main/send", json={"to": "boom", "message": "hi"}, headers={"Idempotency-Key": "k5"}).status_code == 500
+    assert client.post("/api/accounts/main/send", json={"to": "boom", "message": "hi"}, headers={"Idempotency-Key": "k5"}).status_code == 409
+    assert sends == ["2348055550008", "boom"]
+
+
+def test_only_the_claim_holder_updates_the_record():
+    redis_client = StringRedis()
+    store = IdempotencyStore(Manager(redis_client), lock_ttl=0.03)
+    state, stale = store.begin("/send", "k6", "f")
+    assert state == idempotency.PROCEED and store.renew("/send", "k6", stale)
+
+    del redis_client.strings[record_key("/send", "k6")]  # the marker expired and a retry claimed the key
+    state, token = store.begin("/send", "k6", "f")
+    assert not store.complete("/send", "k6", stale, "f", 200, {"from": "stale"})
+    assert not store.release("/send", "k6", stale) and not store.renew("/send", "k6", stale)
+
+    renewed = []
+    store.renew = lambda *args: renewed.append(args)
+    with store.hold("/send", "k6", token):
+        time.sleep(0.1)
+    assert renewed and renewed[0] == ("/send", "k6", token)
+    assert store.complete("/send", "k6", token, "f", 200, {"from": "retry"})
+    assert json.loads(redis_client.strings[record_key("/send", "k6")])["body"] == {"from": "retry"}
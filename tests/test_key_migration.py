@@ -0,0 +1,156 @@
+import json
+import pickle
+
+import redis
+
+from account_stats import unread_key
+from key_migration import KeyMigrator, new_name
+from key_schema import ACCOUNTS_INDEX, account_of, account_record_key
+from message_stream import stream_key
+from storage import contacts_key, history_key
+
+
+class TypedRedis:
+    """Keys as (type, value), with DUMP/RESTORE and just the commands the migrator uses."""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.ttls = {}
+
+    def scan_iter(self, count=10):
+        yield from [key.encode() for key in list(self.data)]
+
+    def type(self, key):
+        return (self.data[key][0] if key in self.data else "none").encode()
+
+    def pttl(self, key):
+        return self.ttls.get(key, -1) if key in self.data else -2
+
+    def dump(self, key):
+        return pickle.dumps(self.data[key]) if key in self.data else None
+
+    def restore(self, key, ttl, dump, replace=False):
+        if key in self.data and not replace:
+            raise redis.ResponseError("BUSYKEY Target key name already exists.")
+        self.data[key] = pickle.loads(dump)
+        if ttl:
+            self.ttls[key] = ttl
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def get(self, key):
+        return self.data[key][1] if key in self.data else None
+
+    def set(self, key, value, nx=False):
+        if not (nx and key in self.data):
+            self.data[key] = ("string", value)
+
+    def incrby(self, key, amount):
+        self.data[key] = ("string", int(self.get(key) or 0) + amount)
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, ("set", set()))[1].update(members)
+
+    def lindex(self, key, index):
+        return self.data[key][1][index] if key in self.data else None
+
+    def lrange(self, key, start, stop):
+        return list(self.data[key][1])
+
+    def rpush(self, key, *items):
+        self.data[key][1].extend(items)
+
+    def ltrim(self, key, start, stop):
+        self.data[key] = ("list", self.data[key][1][start:stop + 1])
+
+    def hgetall(self, key):
+        return dict(self.data[key][1])
+
+    def hincrby(self, key, field, amount):
+        values = self.data.setdefault(key, ("hash", {}))[1]
+        values[field] = values.get(field, 0) + amount
+
+    def zrange(self, key, start, stop, withscores=False):
+        return list(self.data[key][1].items())
+
+    def zadd(self, key, mapping, gt=False, nx=False):
+        zset = self.data.setdefault(key, ("zset", {}))[1]
+        for member, score in mapping.items():
+            if member not in zset or (gt and score > zset[member]):
+                zset[member] = score
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.calls = []
+
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+            def execute(self, raise_on_error=True):
+                results = []
+                for name, args, kwargs in self.calls:
+                    try:
+                        results.append(getattr(client, name)(*args, **kwargs))
+                    except redis.ResponseError as e:
+                        if raise_on_error:
+                            raise
+                        results.append(e)
+                return results
+
+        return Pipeline()
+
+
+def test_new_names_are_tagged_per_account():
+    assert new_name("messages:main:2348000000001") == (history_key("main", "2348000000001"), "append")
+    assert account_of(new_name("traffic:shop:2026101912")[0]) == "shop"
+    assert new_name("scheduled:job:abc")[0] == "{scheduled}:job:abc"
+    assert new_name(history_key("main", "1")) == (None, None)
+    assert new_name("idempotency:/send:key") == (None, None)
+
+
+def test_copy_merge_and_account_split():
+    client = TypedRedis({
+        "messages:main:1": ("list", ["m3", "m2", "m1"]),
+        "messages:main:2": ("list", ["old2", "old1"]),
+        "messages:shop:3": ("list", [json.dumps({"id": "s1", "timestamp": "2024-06-01T10:00:00+00:00"})]),
+        "contacts:main": ("zset", {"1": 10.0, "2": 20.0}),
+        "unread:main": ("hash", {"2": 2}),
+        "stream:messages:main": ("stream", ["entry"]),
+        "whatsapp_accounts": ("string", json.dumps({"main": {"name": "Main"}, "shop": {"name": "Shop"}})),
+        "unrelated": ("string", "x"),
+        # Written by the new code since the deploy
+        history_key("main", "2"): ("list", ["new1"]),
+        contacts_key("main"): ("zset", {"2": 30.0}),
+        unread_key("main"): ("hash", {"2": 1}),
+        stream_key("main"): ("stream", ["new entry"]),
+        account_record_key("shop"): ("string", json.dumps({"name": "Shop (renamed)"})),
+    })
+    client.ttls["messages:main:1"] = 5000
+
+    dry = KeyMigrator(client, client, batch_size=2, dry_run=True).run()
+    assert (dry["copied"], dry["merged"], dry["accounts"]) == (2, 4, 2)
+    assert "messages:main:1" in client.data
+
+    stats = KeyMigrator(client, client, batch_size=2, history_limit=2).run()
+    assert (stats["copied"], stats["merged"], stats["left"], stats["accounts"]) == (2, 3, 1, 2)
+    assert client.data[history_key("main", "1")] == ("list", ["m3", "m2", "m1"])
+    assert client.ttls[history_key("main", "1")] == 5000
+    assert client.data[history_key("main", "2")] == ("list", ["new1", "old2"])  # trimmed to the history limit
+    assert client.data[contacts_key("main")] == ("zset", {"1": 10.0, "2": 30.0})
+    assert client.data[contacts_key("shop")] == ("zset", {"3": 1717236000.0})  # indexed from its newest message
+    assert client.data[unread_key("main")] == ("hash", {"2": 3})
+    assert json.loads(client.get(account_record_key("main"))) == {"name": "Main"}
+    assert json.loads(client.get(account_record_key("shop"))) == {"name": "Shop (renamed)"}
+    assert client.data[ACCOUNTS_INDEX] == ("set", {"main", "shop"})
+
+    # Only the stream that couldn't be merged, and keys that aren't ours, are left behind
+    assert sorted(key for key in client.data if account_of(key) is None) == [ACCOUNTS_INDEX, "stream:messages:main", "unrelated"]
+    assert KeyMigrator(client, client).run()["merged"] == 0
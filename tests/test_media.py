@@ -0,0 +1,99 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+import requests
+
+import whatsapp_bot
+from media_store import NOT_FOUND, REJECTED, MediaDownloader, MediaStore, MediaTooLarge, failure_reason
+
+
+def test_ingest_streams_chunks_and_deduplicates(tmp_path):
+    store = MediaStore(str(tmp_path))
+    chunks = [b"abc" * 1000, b"", b"def"]
+
+    sha256, size, deduplicated = store.ingest(iter(chunks), mime_type="image/jpeg")
+    assert sha256 == hashlib.sha256(b"".join(chunks)).hexdigest()
+    assert size == 3003 and not deduplicated
+    assert store.metadata(sha256)["mime_type"] == "image/jpeg"
+
+    assert store.ingest(iter(chunks))[2] is True
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".incoming-")] == []
+
+
+def test_ingest_rejects_oversized_media_without_leaving_files(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=10)
+    with pytest.raises(MediaTooLarge):
+        store.ingest(iter([b"x" * 6, b"x" * 6]))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_media_is_served_with_range_support():
+    body = bytes(range(256)) * 4
+    sha256, _, _ = whatsapp_bot.media_store.ingest(iter([body]), mime_type="audio/ogg")
+    client = whatsapp_bot.app.test_client()
+
+    response = client.get(f"/media/{sha256}")
+    assert response.status_code == 200
+    assert response.data == body
+    assert response.mimetype == "audio/ogg"
+
+    partial = client.get(f"/media/{sha256}", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.data == body[10:20]
+
+    assert client.get(f"/media/{sha256}", headers={"If-None-Match": f'"{sha256}"'}).status_code == 304
+    assert client.get("/media/../../etc/passwd").status_code == 404
+
+
+def test_webhook_stores_media_reference_and_queues_download(monkeypatch):
+    whatsapp_bot.create_app()
+    queued = []
+    monkeypatch.setattr(whatsapp_bot.media_downloader, "enqueue", lambda *args, **kwargs: queued.append(args))
+
+    payload = json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "metadata": {"phone_number_id": whatsapp_bot.WHATSAPP_ACCOUNTS["main"]["phone_number_id"]},
+            "messages": [{"from": "2348055550000", "id": "wamid.media", "type": "image",
+                          "image": {"id": "media-1", "mime_type": "image/jpeg", "caption": "receipt"}}]
+        }}]}]
+    }).encode()
+    signature = "sha256=" + hmac.new(whatsapp_bot.APP_SECRET.encode(), payload, hashlib.sha256).hexdigest()
+
+    response = whatsapp_bot.app.test_client().post(
+        "/webhook", data=payload, headers={"X-Hub-Signature-256": signature, "Content-Type": "application/json"})
+    assert response.status_code == 200
+
+    stored = whatsapp_bot.message_store["main"]["2348055550000"][-1]
+    assert stored["text"] == "receipt"
+    assert stored["media"]["id"] == "media-1" and stored["media"]["kind"] == "image"
+    assert queued == [("main", "media-1")]
+
+    client = whatsapp_bot.app.test_client()
+    assert client.get("/api/accounts/main/media/media-1").status_code == 202
+    whatsapp_bot.record_media_download({"account_id": "main", "media_id": "media-1", "mime_type": "image/jpeg"}, "ab" * 32, 10)
+    assert client.get("/api/accounts/main/media/media-1").headers["Location"].endswith("/media/" + "ab" * 32)
+
+
+def test_failed_downloads_are_reported_instead_of_pending(monkeypatch):
+    failures = []
+    downloader = MediaDownloader(None, "v18.0", lambda account_id: "token", None,
+                                 on_failure=lambda job, reason, error: failures.append((job["media_id"], reason)),
+                                 queue_size=1)
+    monkeypatch.setattr(downloader, "start", lambda: None)
+    downloader._threads = ["not started"]
+    assert downloader.enqueue("main", "media-2") and not downloader.enqueue("main", "media-3")
+    assert failures == [("media-3", REJECTED)]
+
+    gone = requests.HTTPError("400 Client Error", response=type("Response", (), {"status_code": 400})())
+    assert failure_reason(gone) == NOT_FOUND and failure_reason(MediaTooLarge()) == "too_large"
+    assert failure_reason(requests.ConnectionError()) == "failed"
+
+    client = whatsapp_bot.app.test_client()
+    whatsapp_bot.record_media_failure({"account_id": "main", "media_id": "media-gone"}, NOT_FOUND, "400 Client Error")
+    whatsapp_bot.record_media_failure({"account_id": "main", "media_id": "media-big"}, "too_large", "media exceeds 10 bytes")
+    assert client.get("/api/accounts/main/media/media-gone").status_code == 404
+    response = client.get("/api/accounts/main/media/media-big")
+    assert response.status_code == 502 and response.get_json()["reason"] == "too_large"
@@ -0,0 +1,181 @@
+import json
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import whatsapp_bot
+from message_scheduler import (CLAIM_SCRIPT, DUE_KEY, LEADER_KEY, PROCESSING_KEY, RELEASE_SCRIPT, RENEW_SCRIPT,
+                               MessageScheduler, job_key, resolve_due_time)
+
+
+class ZsetRedis:
+    """Strings and sorted sets, with the scheduler's scripts run in Python."""
+
+    def __init__(self):
+        self.strings = {}
+        self.zsets = {}
+
+    def set(self, key, value, ex=None, nx=False, px=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        return True
+
+    def get(self, key):
+        return self.strings.get(key)
+
+    def mget(self, keys):
+        return [self.strings.get(key) for key in keys]
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        return 1 if self.zsets.get(key, {}).pop(member, None) is not None else 0
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zrange(self, key, start, end, withscores=False):
+        items = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1])
+        items = items[start:None if end == -1 else end + 1]
+        return items if withscores else [member for member, _ in items]
+
+    def _due(self, key, now, limit):
+        return [member for member, score in self.zrange(key, 0, -1, withscores=True) if score <= now][:limit]
+
+    def register_script(self, source):
+        def claim(keys, args):
+            due, processing = keys
+            now, limit, lease_until = float(args[0]), int(args[1]), float(args[2])
+            for member in self._due(processing, now, limit):
+                self.zrem(processing, member)
+                self.zadd(due, {member: now})
+            ids = self._due(due, now, limit)
+            for member in ids:
+                self.zrem(due, member)
+                self.zadd(processing, {member: lease_until})
+            return ids
+
+        def renew(keys, args):
+            return 1 if self.strings.get(keys[0]) == args[0] else 0
+
+        def release(keys, args):
+            return 1 if self.strings.get(keys[0]) == args[0] and self.strings.pop(keys[0]) else 0
+
+        return {CLAIM_SCRIPT: claim, RENEW_SCRIPT: renew, RELEASE_SCRIPT: release}[source]
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.calls = []
+
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+            def execute(self):
+                return [getattr(client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+        return Pipeline()
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+
+def test_due_time_specs():
+    now = datetime(2024, 3, 1, 10, 0, tzinfo=ZoneInfo("Africa/Lagos")).timestamp()
+
+    tomorrow_nine = datetime(2024, 3, 2, 9, 0, tzinfo=ZoneInfo("Africa/Lagos")).timestamp()
+    assert resolve_due_time({"local_time": "09:00", "timezone": "Africa/Lagos"}, now) == tomorrow_nine
+    assert resolve_due_time({"local_time": "11:30", "timezone": "Africa/Lagos"}, now) == now + 5400
+    assert resolve_due_time({"send_at": "2024-03-01T12:00:00+01:00"}, now) == now + 7200
+    assert resolve_due_time({"delay_seconds": 60}, now) == now + 60
+    assert resolve_due_time({"after_last_inbound_seconds": 7200}, now, last_inbound=now - 3600) == now + 3600
+
+    for spec in ({}, {"delay_seconds": 1, "local_time": "09:00"}, {"local_time": "9am"},
+                 {"local_time": "09:00", "timezone": "Mars/Olympus"}, {"delay_seconds": -5},
+                 {"after_last_inbound_seconds": 60}):
+        with pytest.raises(ValueError):
+            resolve_due_time(spec, now)
+
+
+def test_dispatch_cancel_and_reclaim():
+    client = ZsetRedis()
+    sent = []
+    scheduler = MessageScheduler(Manager(client), send=lambda job: sent.append(job["to"]) or {
+        "success": True, "message_id": f"wamid.{job['to']}"
+    }, batch_size=10, lease_seconds=60)
+
+    second = scheduler.schedule("main", "2348000000002", 200, "second")
+    first = scheduler.schedule("main", "2348000000001", 100, "first")
+    later = scheduler.schedule("main", "2348000000003", 10_000, "later")
+    cancelled = scheduler.schedule("main", "2348000000004", 10_000, "never")
+
+    assert scheduler.cancel("main", cancelled["id"]) == "cancelled"
+    assert scheduler.cancel("secondary", later["id"]) == "not_found"
+    assert scheduler.dispatch_due(client, now=1000) == 2
+    assert sent == ["2348000000001", "2348000000002"]
+
+    assert scheduler.get(first["id"])["status"] == "sent"
+    assert scheduler.get(second["id"])["result"]["message_id"] == "wamid.2348000000002"
+    assert scheduler.cancel("main", first["id"]) == "sent"
+    assert scheduler.cancel("main", cancelled["id"]) == "cancelled"
+    jobs, total = scheduler.list("main")
+    assert [job["id"] for job in jobs] == [later["id"]] and total == 1
+
+    # A dispatcher that claimed a job and died: it is claimed again once its lease runs out
+    assert [job["id"] for job in scheduler.claim(client, now=10_000)] == [later["id"]]
+    assert scheduler.claim(client, now=10_030) == []
+    assert [job["id"] for job in scheduler.claim(client, now=10_061)] == [later["id"]]
+    assert client.zcard(DUE_KEY) == 0 and client.zcard(PROCESSING_KEY) == 1
+
+
+def test_stop_hands_the_leader_lease_over():
+    client = ZsetRedis()
+    scheduler = MessageScheduler(Manager(client), send=lambda job: {"success": True}, max_idle=0.01)
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while not scheduler.is_leader and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.strings[LEADER_KEY] == scheduler.worker_id
+
+    assert scheduler.stop(timeout=5)
+    assert not scheduler.is_leader and LEADER_KEY not in client.strings
+    assert MessageScheduler(Manager(client), send=None)._elect(client)  # no wait for the lease to expire
+
+
+def test_schedule_api(monkeypatch):
+    whatsapp_bot.create_app()
+    client = ZsetRedis()
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: client)
+    monkeypatch.setattr(whatsapp_bot, "message_scheduler", MessageScheduler(whatsapp_bot.redis_manager, send=None))
+    http = whatsapp_bot.app.test_client()
+
+    response = http.post("/api/accounts/main/scheduled", json={"to": "09025794407", "message": "hi"})
+    assert response.status_code == 400
+
+    response = http.post("/api/accounts/main/scheduled", json={
+        "to": "09025794407", "message": "Reminder", "local_time": "09:00", "timezone": "Africa/Lagos"
+    })
+    assert response.status_code == 201
+    job = response.get_json()["job"]
+    assert job["to"] == "2349025794407"
+    assert json.loads(client.get(job_key(job["id"])))["message"] == "Reminder"
+
+    assert http.get("/api/accounts/main/scheduled").get_json()["total"] == 1
+    assert http.delete(f"/api/accounts/main/scheduled/{job['id']}").status_code == 200
+    assert http.get(f"/api/accounts/main/scheduled/{job['id']}").get_json()["job"]["status"] == "cancelled"
+    assert http.delete(f"/api/accounts/main/scheduled/{job['id']}").status_code == 200  # idempotent
+    assert http.get("/api/accounts/main/scheduled").get_json()["total"] == 0
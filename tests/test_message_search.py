@@ -0,0 +1,114 @@
+import sqlite3
+
+from message_search import MessageSearchIndex, account_token
+
+import whatsapp_bot
+
+
+def message(account_id, phone, text, message_id):
+    return {"id": message_id, "text": text, "type": "incoming", "timestamp": "2024-09-18T12:00:00",
+            "phone_number": phone, "account_id": account_id}
+
+
+def test_search_is_ranked_scoped_and_paginated(tmp_path):
+    index = MessageSearchIndex(str(tmp_path / "search.db"))
+    index.add(message("main", "2348000000001", "Where is my order ORD-1234?", "m1"))
+    index.add(message("main", "2348000000002", "order ORD-1234 order again, order status please", "m2"))
+    index.add(message("main", "2348000000002", "Thanks for the delivery", "m3"))
+    index.add(message("secondary", "2348000000001", "order ORD-1234", "s1"))
+    index.flush()
+
+    hits, has_more, older = index.search("main", "order")
+    assert [hit["id"] for hit in hits] == ["m2", "m1"]  # more occurrences rank higher
+    assert not has_more and older is None
+
+    # Punctuated terms match as phrases, the last term as a prefix
+    assert {hit["id"] for hit in index.search("main", "ORD-1234")[0]} == {"m1", "m2"}
+    assert [hit["id"] for hit in index.search("main", "deliv")[0]] == ["m3"]
+
+    # Other accounts and contacts are filtered out inside the index
+    assert [hit["id"] for hit in index.search("secondary", "order")[0]] == ["s1"]
+    assert [hit["id"] for hit in index.search("main", "order", phone_number="2348000000001")[0]] == ["m1"]
+
+    page_one, has_more, _ = index.search("main", "order", per_page=1)
+    page_two, _, _ = index.search("main", "order", page=2, per_page=1)
+    assert has_more and [page_one[0]["id"], page_two[0]["id"]] == ["m2", "m1"]
+
+    assert index.search("main", '"  ')[0] == []
+
+
+def test_matches_beyond_the_rank_window_are_flagged_and_reachable(tmp_path):
+    index = MessageSearchIndex(str(tmp_path / "search.db"), rank_window=2)
+    for i in range(5):
+        index.add(message("main", "2348000000001", f"invoice {i}", f"m{i}"))
+    index.flush()
+
+    hits, _, older = index.search("main", "invoice")
+    assert {hit["id"] for hit in hits} == {"m3", "m4"} and older is not None
+    hits, _, older = index.search("main", "invoice", before=older)
+    assert {hit["id"] for hit in hits} == {"m1", "m2"}
+    hits, _, older = index.search("main", "invoice", before=older)
+    assert [hit["id"] for hit in hits] == ["m0"] and older is None
+
+
+def test_backfill_indexes_only_what_is_missing(tmp_path):
+    index = MessageSearchIndex(str(tmp_path / "search.db"))
+    index.add(message("main", "2348000000001", "already indexed", "m1"))
+    index.flush()
+    stored = [message("main", "2348000000001", "already indexed", "m1"),
+              message("main", "2348000000001", "from before the index", "m2"),
+              message("shop", "2348000000001", "other account", "m1")]
+    assert index.backfill(iter(stored)) == 2
+    assert index.backfill(iter(stored)) == 0
+    assert [hit["id"] for hit in index.search("main", "indexed")[0]] == ["m1"]
+    assert [hit["id"] for hit in index.search("main", "before")[0]] == ["m2"]
+
+
+def test_replays_replace_their_row_and_trimmed_messages_are_dropped(tmp_path):
+    index = MessageSearchIndex(str(tmp_path / "search.db"), history_limit=3)
+    for i in range(5):
+        index.add(dict(message("main", "2348000000001", f"parcel {i}", f"m{i}"), version=i + 1))
+    index.add(dict(message("main", "2348000000001", "parcel 4", "m4"), version=5))  # a webhook retry
+    index.add(dict(message("main", "2348000000002", "parcel elsewhere", "n1"), version=1))
+    index.flush()
+    assert sorted(hit["id"] for hit in index.search("main", "parcel")[0]) == ["m2", "m3", "m4", "n1"]
+
+    # Backfill older than everything kept is trimmed from the history, and from the index
+    index.backfill([dict(message("main", "2348000000001", "parcel from 2019", "old"), version=0)])
+    assert index.search("main", "2019")[0] == []
+
+
+def test_an_index_from_before_message_keys_is_migrated(tmp_path):
+    path = str(tmp_path / "search.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(text, account, phone_number, account_id UNINDEXED, "
+                 "message_id UNINDEXED, timestamp UNINDEXED, type UNINDEXED)")
+    conn.executemany(
+        "INSERT INTO messages_fts VALUES (?, ?, '2348000000001', 'main', ?, '', 'incoming')",
+        [("refund please", account_token("main"), "m1"), ("refund please", account_token("main"), "m1"),
+         ("refund sent", account_token("main"), "m2")]
+    )
+    conn.commit()
+    conn.close()
+
+    index = MessageSearchIndex(path)
+    assert sorted(hit["id"] for hit in index.search("main", "refund")[0]) == ["m1", "m2"]
+    index.add(message("main", "2348000000001", "refund please", "m1"))
+    index.flush()
+    assert len(index.search("main", "please")[0]) == 1
+
+
+def test_search_endpoint_finds_stored_messages():
+    whatsapp_bot.create_app()
+    whatsapp_bot.store_message("2348011112222", "Invoice INV-77 is attached", "incoming", message_id="wamid.search")
+    whatsapp_bot.search_index.flush()
+
+    client = whatsapp_bot.app.test_client()
+    data = client.get("/api/accounts/main/search?q=inv-77").get_json()
+    assert data["status"] == "success"
+    assert data["results"][0]["id"] == "wamid.search"
+    assert data["results"][0]["phone_number"] == "2348011112222"
+    assert data["truncated"] is False
+
+    assert client.get("/api/accounts/main/search").status_code == 400
+    assert client.get("/api/accounts/nope/search?q=x").status_code == 400
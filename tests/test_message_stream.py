@@ -0,0 +1,191 @@
+import json
+
+import redis
+
+import message_stream
+import whatsapp_bot
+
+MESSAGE = {"id": "wamid.1", "text": "hi", "type": "incoming", "phone_number": "2349025794407", "account_id": "main"}
+
+
+def queued_args(command):
+    """Queue a RedisManager-style command on an unconnected pipeline and return the raw args."""
+    pipe = redis.Redis().pipeline(transaction=False)
+    name, *args = command
+    getattr(pipe, name)(*args)
+    return [arg.decode() if isinstance(arg, bytes) else str(arg) for arg in pipe.command_stack[0][0]]
+
+
+def test_append_command_trims_by_length():
+    args = queued_args(message_stream.append_command("main", MESSAGE, maxlen=500))
+    assert args[:5] == ["XADD", message_stream.stream_key("main"), "MAXLEN", "~", "500"]
+    assert json.loads(args[args.index("message") + 1]) == MESSAGE
+
+
+def test_append_command_trims_by_age_and_survives_the_wal():
+    command = message_stream.append_command("main", MESSAGE, retention_hours=24)
+    # Commands are JSON round-tripped through the write-behind WAL
+    args = queued_args(json.loads(json.dumps(command)))
+    assert args[:4] == ["XADD", message_stream.stream_key("main"), "MINID", "~"]
+    assert "MAXLEN" not in args
+
+
+class StreamRedis:
+    """One process's view of Redis streams and consumer groups, with a settable clock (ms)."""
+
+    def __init__(self):
+        self.now = 1_000_000
+        self.streams = {}  # key -> [(id, fields)]
+        self.groups = {}  # key -> {group: {"last": id, "pending": {id: [consumer, delivered at, deliveries]}}}
+
+    @staticmethod
+    def _order(entry_id):
+        return tuple(int(part) for part in entry_id.split("-"))
+
+    def _group(self, key, group, command):
+        if group not in self.groups.get(key, {}):
+            raise redis.exceptions.ResponseError(f"NOGROUP No such key '{key}' or consumer group '{group}' in {command}")
+        return self.groups[key][group]
+
+    def xadd(self, key, fields, id="*", maxlen=None, approximate=True, nomkstream=False, minid=None):
+        entries = self.streams.setdefault(key, [])
+        entry_id = f"{len(entries) + 1}-0"
+        entries.append((entry_id, dict(fields)))
+        return entry_id
+
+    def xgroup_create(self, key, group, id="$", mkstream=False):
+        if key not in self.streams and not mkstream:
+            raise redis.exceptions.ResponseError("ERR The XGROUP subcommand requires the key to exist")
+        entries = self.streams.setdefault(key, [])
+        if group in self.groups.setdefault(key, {}):
+            raise redis.exceptions.ResponseError("BUSYGROUP Consumer Group name already exists")
+        last = entries[-1][0] if id == "$" and entries else "0-0"
+        self.groups[key][group] = {"last": last, "pending": {}}
+        return True
+
+    def xgroup_destroy(self, key, group):
+        if key not in self.streams:
+            raise redis.exceptions.ResponseError("ERR The XGROUP subcommand requires the key to exist")
+        return int(self.groups[key].pop(group, None) is not None)
+
+    def xreadgroup(self, group, consumer, streams, count=None):
+        [(key, start)] = streams.items()
+        state = self._group(key, group, "XREADGROUP with GROUP option")
+        if start == ">":
+            entries = [entry for entry in self.streams[key] if self._order(entry[0]) > self._order(state["last"])]
+            entries = entries[:count]
+            for entry_id, _ in entries:
+                state["pending"][entry_id] = [consumer, self.now, 1]
+                state["last"] = entry_id
+        else:
+            entries = [entry for entry in self.streams[key]
+                       if state["pending"].get(entry[0], [None])[0] == consumer][:count]
+        return [[key, entries]] if entries else []
+
+    def xack(self, key, group, *ids):
+        state = self.groups.get(key, {}).get(group, {"pending": {}})
+        return sum(state["pending"].pop(entry_id, None) is not None for entry_id in ids)
+
+    def xpending(self, key, group):
+        pending = self._group(key, group, "XPENDING")["pending"]
+        ids = sorted(pending, key=self._order)
+        consumers = sorted({consumer for consumer, _, _ in pending.values()})
+        return {
+            "pending": len(ids),
+            "min": ids[0] if ids else None,
+            "max": ids[-1] if ids else None,
+            "consumers": [{"name": name, "pending": sum(p[0] == name for p in pending.values())} for name in consumers],
+        }
+
+    def xpending_range(self, key, group, min, max, count):
+        pending = self._group(key, group, "XPENDING")["pending"]
+        return [
+            {"message_id": entry_id, "consumer": consumer, "time_since_delivered": self.now - delivered,
+             "times_delivered": deliveries}
+            for entry_id, (consumer, delivered, deliveries) in sorted(pending.items(), key=lambda item: self._order(item[0]))
+        ][:count]
+
+    def xautoclaim(self, key, group, consumer, min_idle_time, start_id="0-0", count=None):
+        pending = self._group(key, group, "XAUTOCLAIM")["pending"]
+        claimed = []
+        for entry_id, fields in self.streams[key]:
+            entry = pending.get(entry_id)
+            if entry and self.now - entry[1] >= min_idle_time and len(claimed) < (count or 100):
+                pending[entry_id] = [consumer, self.now, entry[2] + 1]
+                claimed.append((entry_id, fields))
+        return ["0-0", claimed, []]
+
+    def xinfo_stream(self, key):
+        if key not in self.streams:
+            raise redis.exceptions.ResponseError("ERR no such key")
+        entries = self.streams[key]
+        return {"length": len(entries), "groups": len(self.groups.get(key, {})),
+                "first-entry": entries[0] if entries else None, "last-generated-id": entries[-1][0] if entries else "0-0"}
+
+    def xinfo_groups(self, key):
+        if key not in self.streams:
+            raise redis.exceptions.ResponseError("ERR no such key")
+        return [
+            {"name": name, "consumers": len({p[0] for p in state["pending"].values()}), "pending": len(state["pending"]),
+             "lag": sum(self._order(entry_id) > self._order(state["last"]) for entry_id, _ in self.streams[key]),
+             "last-delivered-id": state["last"]}
+            for name, state in self.groups.get(key, {}).items()
+        ]
+
+
+def stored(fake, i):
+    name, *args = message_stream.append_command("main", dict(MESSAGE, id=f"wamid.{i}"), maxlen=500)
+    return getattr(fake, name)(*args)
+
+
+def test_consumers_read_ack_and_claim_through_the_api(monkeypatch):
+    client = whatsapp_bot.create_app().test_client()
+    fake = StreamRedis()
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: fake)
+    base = "/api/accounts/main/stream/groups"
+
+    assert client.post(base, json={"group": "crm", "start": "0"}).status_code == 201
+    assert client.post(base, json={"group": "crm"}).status_code == 409
+    ids = [stored(fake, i) for i in range(3)]
+
+    def read(consumer, **params):
+        query = "&".join(f"{key}={value}" for key, value in dict(consumer=consumer, **params).items())
+        return [entry["message"]["id"] for entry in client.get(f"{base}/crm/messages?{query}").get_json()["entries"]]
+
+    assert read("a", count=2) == ["wamid.0", "wamid.1"]
+    assert read("a") == ["wamid.2"]
+    assert read("a") == []  # nothing new
+    assert client.post(f"{base}/crm/ack", json={"ids": ids[:1]}).get_json()["acknowledged"] == 1
+
+    pending = client.get(f"{base}/crm/pending").get_json()
+    assert pending["pending"] == 2 and [entry["id"] for entry in pending["entries"]] == ids[1:]
+    assert read("a", pending="true") == ["wamid.1", "wamid.2"]
+
+    # Consumer "a" crashed: once its entries have sat idle long enough, "b" takes them over
+    claim = {"consumer": "b", "min_idle_ms": 60000}
+    assert client.post(f"{base}/crm/claim", json=claim).get_json()["count"] == 0
+    fake.now += 60000
+    claimed = client.post(f"{base}/crm/claim", json=claim).get_json()["entries"]
+    assert [entry["message"]["id"] for entry in claimed] == ["wamid.1", "wamid.2"]
+    assert read("a", pending="true") == [] and read("b", pending="true") == ["wamid.1", "wamid.2"]
+    assert client.post(f"{base}/crm/ack", json={"ids": ids[1:]}).get_json()["acknowledged"] == 2
+
+    [group] = client.get("/api/accounts/main/stream").get_json()["groups"]
+    assert (group["name"], group["pending"], group["lag"]) == ("crm", 0, 0)
+    assert client.post(f"{base}/crm/claim", json={"consumer": "b", "min_idle_ms": "soon"}).status_code == 400
+
+
+def test_missing_groups_and_streams_are_404s(monkeypatch):
+    client = whatsapp_bot.create_app().test_client()
+    fake = StreamRedis()
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "get_client", lambda: fake)
+    base = "/api/accounts/main/stream/groups"
+
+    assert client.delete(f"{base}/crm").status_code == 404  # no stream yet
+    assert client.get("/api/accounts/main/stream").get_json()["groups"] == []
+    assert client.post(base, json={"group": "crm"}).status_code == 201
+    assert client.get(f"{base}/other/messages?consumer=a").status_code == 404
+    assert client.get(f"{base}/other/pending").status_code == 404
+    assert client.post(f"{base}/other/claim", json={"consumer": "a"}).status_code == 404
+    assert client.delete(f"{base}/crm").status_code == 200
+    assert client.delete(f"{base}/crm").status_code == 404
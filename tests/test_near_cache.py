@@ -0,0 +1,127 @@
+import json
+import queue
+import time
+
+import whatsapp_bot
+from near_cache import CHANNEL, NearCache, invalidation_channel
+from storage import history_key
+
+
+class PubSubRedis:
+    def __init__(self):
+        self.messages = queue.Queue()
+
+    def pubsub(self):
+        messages = self.messages
+        channels = self.channels = []
+
+        class PubSub:
+            def subscribe(self, *names):
+                channels.extend(names)
+
+            def get_message(self, ignore_subscribe_messages=False, timeout=0):
+                try:
+                    return messages.get(timeout=timeout)
+                except queue.Empty:
+                    return None
+
+            def close(self):
+                pass
+        return PubSub()
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+    def publish_command(self, channel, message):
+        return ("publish", channel, message)
+
+    def subscribe(self, pubsub, *channels):
+        pubsub.subscribe(*channels)
+
+    def get_message(self, pubsub, timeout):
+        return pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_hits_invalidation_and_eviction():
+    cache = NearCache(Manager(None), lambda: ["main"], max_entries=2)
+    a, b, c = (history_key("main", phone) for phone in ("1", "2", "3"))
+    loads = []
+    load = lambda key: lambda: loads.append(key) or [key]
+
+    assert cache.get(a, load(a)) == [a] and cache.get(a, load(a)) == [a]
+    assert loads == [a, a]  # not subscribed to invalidations: nothing is cached
+
+    cache.connected = True
+    cache._subscribed = {None, "main"}
+    cache.get(a, load(a))
+    cache.get(a, load(a))
+    cache.get(b, load(b))
+    cache.get(c, load(c))  # evicts a, the least recently used
+    cache.get(a, load(a))
+    assert loads == [a, a, a, b, c, a]
+    cache.get(history_key("shop", "1"), load("shop"))
+    cache.get(history_key("shop", "1"), load("shop"))  # not subscribed to shop's channel
+    assert loads[-2:] == ["shop", "shop"]
+
+    cache.invalidate(a)
+    cache.get(a, lambda: cache.invalidate(a) or ["stale"])  # an invalidation raced the load
+    cache.get(a, load(a))
+    assert loads[-1] == a and cache.stats()["entries"] == 2
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 10 and stats["hit_ratio"] == round(1 / 11, 4)
+
+
+def test_published_invalidations_reach_every_worker():
+    client = PubSubRedis()
+    accounts = ["main"]
+    cache = NearCache(Manager(client), lambda: accounts)
+    reloaded = []
+    cache.on_invalidate("account:", reloaded.append)
+    cache.start()
+    wait_for(lambda: cache.connected)
+    assert client.channels == [CHANNEL, invalidation_channel("main")]
+
+    key = history_key("main", "111")
+    cache.get(key, lambda: ["old"])
+    assert cache.get(key, lambda: ["new"]) == ["old"]
+    command = cache.invalidation_command(key)
+    assert command[:2] == ("publish", "{main}:cache:invalidate")
+    client.messages.put({"type": "message", "data": command[2]})
+    wait_for(lambda: cache.get(key, lambda: ["new"]) == ["new"])
+
+    # Account records go over the global channel, which also reaches workers that don't know the account
+    command = cache.invalidation_command("account:shop")
+    assert command[1] == CHANNEL
+    client.messages.put({"type": "message", "data": command[2]})
+    wait_for(lambda: reloaded == ["account:shop"])
+
+    accounts.append("shop")
+    wait_for(lambda: invalidation_channel("shop") in client.channels)
+
+
+def test_store_message_publishes_an_invalidation(monkeypatch):
+    whatsapp_bot.create_app()
+    monkeypatch.setattr(whatsapp_bot, "write_behind", None)
+    published = []
+    monkeypatch.setattr(whatsapp_bot.redis_manager, "write",
+                        lambda commands, transient=(): published.extend(transient) or True)
+    whatsapp_bot.store_message("08055550009", "hello", "incoming", account_id="main")
+    invalidations = [json.loads(command[2]) for command in published if command[1] == invalidation_channel("main")]
+    assert invalidations == [[history_key("main", "2348055550009")]]
+    assert ("publish", "{main}:message_updates") in [command[:2] for command in published]
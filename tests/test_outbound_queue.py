@@ -0,0 +1,80 @@
+import threading
+
+import whatsapp_bot
+from outbound_queue import BULK, INTERACTIVE, OutboundScheduler, QueueFull
+
+
+def blocked_scheduler(**kwargs):
+    """A scheduler whose only sender thread is held until the returned event is set."""
+    scheduler = OutboundScheduler(concurrency=1, **kwargs)
+    gate, started = threading.Event(), threading.Event()
+    scheduler.submit(INTERACTIVE, "x", lambda: started.set() or gate.wait())
+    started.wait(5)
+    return scheduler, gate
+
+
+def test_interactive_lane_first_then_accounts_by_weight():
+    weights = {"campaign": 2, "support": 1}
+    scheduler, gate = blocked_scheduler(weight=weights.get)
+    order = []
+    futures = [scheduler.submit(BULK, "campaign", order.append, f"campaign-{i}") for i in range(6)]
+    futures += [scheduler.submit(BULK, "support", order.append, f"support-{i}") for i in range(3)]
+    futures.append(scheduler.submit(INTERACTIVE, "shop", order.append, "reply"))
+    gate.set()
+    for future in futures:
+        future.result(5)
+
+    assert order == ["reply", "campaign-0", "campaign-1", "support-0", "campaign-2", "campaign-3",
+                     "support-1", "campaign-4", "campaign-5", "support-2"]
+    stats = scheduler.stats()["lanes"]
+    assert stats[BULK]["dispatched"] == 9 and stats[BULK]["queued"] == 0 and stats[BULK]["accounts_queued"] == 0
+    assert stats[BULK]["wait_ms"]["max"] >= stats[BULK]["wait_ms"]["p50"] > 0
+
+
+def test_bulk_cannot_take_the_reserved_sender():
+    scheduler = OutboundScheduler(concurrency=2, reserved_interactive=1)
+    gate, started = threading.Event(), threading.Event()
+    first = scheduler.submit(BULK, "campaign", lambda: started.set() or gate.wait())
+    second = scheduler.submit(BULK, "campaign", lambda: "second")
+    started.wait(5)
+    assert scheduler.run(INTERACTIVE, "support", lambda: "reply") == "reply"
+    assert not second.done()  # still waiting for the bulk sender
+    gate.set()
+    assert first.result(5) and second.result(5) == "second"
+
+
+def test_full_queue_is_rejected():
+    scheduler, gate = blocked_scheduler(max_queue=1)
+    scheduler.submit(BULK, "campaign", lambda: None)
+    try:
+        scheduler.submit(BULK, "campaign", lambda: None)
+    except QueueFull:
+        pass
+    else:
+        raise AssertionError("expected QueueFull")
+    gate.set()
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_api_sends_go_through_the_interactive_lane(monkeypatch):
+    whatsapp_bot.create_app()
+    scheduler = OutboundScheduler(concurrency=2)
+    monkeypatch.setattr(whatsapp_bot, "outbound_scheduler", scheduler)
+    senders = []
+    monkeypatch.setattr(whatsapp_bot, "send_whatsapp_message", lambda to, *args, **kwargs: senders.append(
+        threading.current_thread().name) or {"success": True, "response": {}, "message_id": "wamid.q", "phone_number": f"+{to}"})
+    client = whatsapp_bot.app.test_client()
+
+    response = client.post("/api/accounts/main/send", json={"to": "2348055550003", "message": "hi", "priority": "urgent"})
+    assert response.status_code == 400
+    response = client.post("/api/accounts/main/send", json={"to": "2348055550003", "message": "hi"})
+    assert response.status_code == 200
+    response = client.post("/api/accounts/main/send", json={"to": "2348055550003", "message": "hi", "priority": "bulk"})
+    assert response.status_code == 200
+
+    assert all(name.startswith("outbound-send-") for name in senders) and len(senders) == 2
+    lanes = scheduler.stats()["lanes"]
+    assert lanes[INTERACTIVE]["dispatched"] == 1 and lanes[BULK]["dispatched"] == 1
+
+    response = client.put("/api/accounts/main/update", json={"send_weight": -1})
+    assert response.status_code == 400
@@ -0,0 +1,44 @@
+import whatsapp_bot
+from phone_numbers import PhoneNormalizer
+
+
+def test_local_and_international_formats():
+    normalizer = PhoneNormalizer("NG")
+    for raw in ("09025794407", "+2349025794407", "2349025794407", "9025794407",
+                "+234 (0)902 579 4407", "00234 902 579 4407", "２３４９０２５７９４４０７"):
+        assert normalizer.normalize(raw) == "2349025794407"
+
+    # International numbers keep their own country code whatever the default region
+    assert normalizer.normalize("+44 (0)7911 123456") == "447911123456"
+    assert normalizer.normalize("447911123456") == "447911123456"
+    assert normalizer.normalize("+1 415-555-0100") == "14155550100"
+
+    # Local numbers follow the region
+    assert normalizer.normalize("07911 123456", "gb") == "447911123456"
+    assert normalizer.normalize("(415) 555-0100", "US") == "14155550100"
+    assert normalizer.normalize("07911 123456", "XX") == normalizer.normalize("07911 123456", "NG")
+    assert normalizer.is_valid("447911123456") and not normalizer.is_valid("4479")
+
+
+def test_batch_normalizes_each_distinct_input_once():
+    normalizer = PhoneNormalizer("NG")
+    result = normalizer.normalize_many(["0902 579 4407", "09025794407", "0902 579 4407", "", None])
+    assert result == {"0902 579 4407": "2349025794407", "09025794407": "2349025794407"}
+    assert normalizer.cache_info().misses == 2
+
+
+def test_account_default_region(monkeypatch):
+    whatsapp_bot.create_app()
+    client = whatsapp_bot.app.test_client()
+
+    response = client.put("/api/accounts/secondary/update", json={"default_region": "zz"})
+    assert response.status_code == 400
+
+    monkeypatch.setitem(whatsapp_bot.WHATSAPP_ACCOUNTS, "secondary",
+                        dict(whatsapp_bot.WHATSAPP_ACCOUNTS["secondary"]))
+    response = client.put("/api/accounts/secondary/update", json={"default_region": "gb"})
+    assert response.get_json()["account"]["default_region"] == "GB"
+
+    assert whatsapp_bot.normalize_phone_number("07911 123456", "secondary") == "447911123456"
+    assert whatsapp_bot.normalize_phone_number("07911123456", "main") == "2347911123456"
+    assert whatsapp_bot.normalize_phone_number("09025794407") == "2349025794407"
@@ -0,0 +1,57 @@
+import json
+import threading
+
+import whatsapp_bot
+from profiler import SamplingProfiler, collapsed
+
+
+def busy_history_endpoint(profiler, stop):
+    profiler.request_started("get_contacts")
+    while not stop.is_set():
+        json.dumps([{"id": i, "text": "x" * 50} for i in range(200)])
+    profiler.request_finished()
+
+
+def test_samples_are_attributed_to_routes_functions_and_libraries(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path))
+    stop = threading.Event()
+    profile_id = profiler.start(0.5, interval=0.005, focus=["busy_history_endpoint"])
+    worker = threading.Thread(target=busy_history_endpoint, args=(profiler, stop))
+    worker.start()
+    result = profiler.wait(profile_id, 5)
+    stop.set()
+    worker.join()
+
+    assert result["status"] == "done" and result["samples"] > 0
+    route = result["routes"]["get_contacts"]
+    assert route["samples"] > 0 and set(route["categories"]) <= {"json", "app"}
+    assert "json" in result["functions"]["busy_history_endpoint"]["categories"]
+    folded = collapsed(result["stacks"])
+    assert any(line.startswith("get_contacts;") and "busy_history_endpoint" in line for line in folded.splitlines())
+    assert profiler.start(0.1) is not None  # the previous profile released the slot
+    profiler.wait(profiler.active, 5)
+
+
+def test_admin_profile_endpoints(monkeypatch):
+    whatsapp_bot.create_app()
+    client = whatsapp_bot.app.test_client()
+    assert client.post("/admin/profile?seconds=0.1").status_code == 403
+
+    monkeypatch.setattr(whatsapp_bot, "ADMIN_TOKEN", "s3cret")
+    assert client.post("/admin/profile?seconds=0.1", headers={"Authorization": "Bearer nope"}).status_code == 401
+    auth = {"Authorization": "Bearer s3cret"}
+
+    response = client.post("/admin/profile?seconds=0.2&interval_ms=5", headers=auth)
+    assert response.status_code == 202
+    profile_id = response.get_json()["profile_id"]
+    assert client.post("/admin/profile?seconds=0.2", headers=auth).status_code == 409
+
+    whatsapp_bot.profiler.wait(profile_id, 5)
+    result = client.get(f"/admin/profile/{profile_id}", headers=auth).get_json()
+    assert result["status"] == "done" and "stacks" not in result
+    folded = client.get(f"/admin/profile/{profile_id}?format=collapsed", headers=auth)
+    assert folded.mimetype == "text/plain"
+    assert client.get("/admin/profile/../../etc", headers=auth).status_code == 404
+
+    response = client.get("/admin/profile?seconds=0.1&wait=true&format=collapsed", headers=auth)
+    assert response.status_code == 200 and response.mimetype == "text/plain"
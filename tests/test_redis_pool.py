@@ -0,0 +1,82 @@
+from fake_redis import FakeRedis
+from redis_pool import RedisManager
+
+
+def make_manager(**kwargs):
+    manager = RedisManager("localhost", 6379, failure_threshold=2, **kwargs)
+    manager.client = FakeRedis()
+    manager._health_thread = object()  # tests drive check_health() themselves
+    return manager
+
+
+def test_circuit_opens_after_threshold_and_buffers_writes():
+    manager = make_manager()
+
+    assert manager.write([("lpush", "k", "1")]) is False
+    assert manager.healthy is None
+    assert manager.write([("lpush", "k", "2")]) is False
+    assert manager.healthy is False
+    assert manager.get_client() is None
+
+    # While open, writes are buffered without touching Redis
+    assert manager.write([("lpush", "k", "3")], transient=[("publish", "c", "x")]) is False
+    assert manager.stats()["pending_writes"] == 3
+
+
+def test_recovery_replays_buffered_writes_in_order():
+    manager = make_manager()
+    recovered = []
+    manager.on_recovery(lambda: recovered.append(True))
+    assert manager.check_health() is False
+
+    manager.write([("lpush", "k", "1"), ("ltrim", "k", 0, 99)], transient=[("publish", "c", "x")])
+    manager.write([("set", "accounts", "{}")])
+
+    manager.client.up = True
+    assert manager.check_health() is True
+    assert manager.client.executed == [("lpush", "k", "1"), ("ltrim", "k", 0, 99), ("set", "accounts", "{}")]
+    assert manager.stats()["replayed_writes"] == 2
+    assert recovered == [True]
+
+    # Live writes include their transient commands
+    assert manager.write([("lpush", "k", "2")], transient=[("publish", "c", "y")]) is True
+    assert manager.client.executed[-2:] == [("lpush", "k", "2"), ("publish", "c", "y")]
+
+
+def test_replay_buffer_is_bounded():
+    manager = make_manager(replay_buffer_size=2)
+    manager.check_health()
+    for i in range(3):
+        manager.write([("lpush", "k", str(i))])
+    assert manager.stats()["pending_writes"] == 2
+    assert manager.dropped_writes == 1
+
+
+def test_cluster_mode_uses_sharded_pubsub():
+    class FakeCluster(FakeRedis):
+        disconnected = False
+
+        def disconnect_connection_pools(self):
+            self.disconnected = True
+
+    class PubSub:
+        def __init__(self):
+            self.calls = []
+
+        def ssubscribe(self, *channels):
+            self.calls.append(("ssubscribe", channels))
+
+        def get_sharded_message(self, ignore_subscribe_messages=False, timeout=0.0):
+            return {"type": "smessage", "channel": "{main}:c", "data": "x"}
+
+    manager = make_manager(cluster=True)
+    manager.client = FakeCluster()
+    assert manager.publish_command("{main}:c", "x") == ("spublish", "{main}:c", "x")
+    pubsub = PubSub()
+    manager.subscribe(pubsub, "{main}:c", "{shop}:c")
+    assert pubsub.calls == [("ssubscribe", ("{main}:c", "{shop}:c"))]
+    assert manager.get_message(pubsub, timeout=1.0)["type"] == "smessage"
+
+    assert manager.check_health() is False
+    assert manager.client.disconnected and manager.stats()["mode"] == "cluster"
+    assert make_manager().publish_command("{main}:c", "x")[0] == "publish"
@@ -0,0 +1,134 @@
+import json
+import time
+from datetime import datetime
+
+import whatsapp_bot
+from service_window import NO_INBOUND, ServiceWindowIndex, window_key
+from storage import history_key
+
+
+class HashRedis:
+    """Hashes and lists, plus a count of round trips."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.lists = {}
+        self.round_trips = 0
+
+    def hmget(self, key, fields):
+        self.round_trips += 1
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        self.round_trips += 1
+        self.hashes.setdefault(key, {}).update(mapping or {field: value})
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.calls = []
+
+            def lrange(self, key, start, end):
+                self.calls.append(lambda: client.lists.get(key, []))
+
+            def hsetnx(self, key, field, value):
+                self.calls.append(lambda: client.hashes.setdefault(key, {}).setdefault(field, value))
+
+            def execute(self):
+                client.round_trips += 1
+                return [call() for call in self.calls]
+
+        return Pipeline()
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+
+def test_window_from_local_writes_redis_and_history():
+    client = HashRedis()
+    index = ServiceWindowIndex(Manager(client))
+    now = time.time()
+
+    command = index.record_inbound("main", "2348000000001", now - 60)
+    client.hset(*command[1:])
+    client.round_trips = 0
+    assert index.is_open("main", "2348000000001", now) is True
+    assert client.round_trips == 0  # answered from the local cache
+
+    # Seen by another worker: only in Redis
+    client.hashes[window_key("main")]["2348000000002"] = str(now - 25 * 3600)
+    # Never in the hash, but has stored history from before the index existed
+    client.lists[history_key("main", "2348000000003")] = [
+        json.dumps({"type": "outgoing", "timestamp": datetime.fromtimestamp(now - 10).isoformat()}),
+        json.dumps({"type": "incoming", "timestamp": datetime.fromtimestamp(now - 3600).isoformat()}),
+    ]
+
+    statuses = index.bulk_status("main", ["2348000000001", "2348000000002", "2348000000003", "2348000000004"], now)
+    assert [statuses[p]["open"] for p in sorted(statuses)] == [True, False, True, False]
+    assert "2348000000003" in client.hashes[window_key("main")]  # backfilled
+
+    # Closed windows are re-checked only after the negative TTL
+    client.round_trips = 0
+    index.bulk_status("main", ["2348000000002", "2348000000004"], now + 1)
+    assert client.round_trips == 0
+
+    # ... and a contact without inbound messages has its history searched only once
+    assert client.hashes[window_key("main")]["2348000000004"] == NO_INBOUND
+    statuses = ServiceWindowIndex(Manager(client)).bulk_status("main", ["2348000000004"], now + 60)
+    assert statuses["2348000000004"]["open"] is False and client.round_trips == 1  # the HMGET alone
+
+
+def test_unknown_window_when_redis_is_down():
+    index = ServiceWindowIndex(Manager(None))
+    assert index.is_open("main", "2348000000001") is None
+    index.record_inbound("main", "2348000000001")
+    assert index.is_open("main", "2348000000001") is True
+
+
+def test_text_send_outside_window_is_rejected_or_switched_to_template(monkeypatch):
+    whatsapp_bot.create_app()
+    monkeypatch.setattr(whatsapp_bot, "service_window", ServiceWindowIndex(Manager(HashRedis())))
+    monkeypatch.setattr(whatsapp_bot.template_catalog, "validate", lambda *args, **kwargs: [])
+    payloads = []
+
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {"messages": [{"id": "wamid.sent"}]}
+
+    def post(url, headers=None, json=None):
+        payloads.append(json)
+        return Response()
+    monkeypatch.setattr(whatsapp_bot.requests, "post", post)
+    client = whatsapp_bot.app.test_client()
+
+    response = client.post("/api/accounts/main/send", json={"to": "2348000000009", "message": "hi"})
+    assert response.status_code == 400
+    assert response.get_json()["window_closed"] is True
+    assert payloads == []
+
+    response = client.post("/api/accounts/main/send", json={
+        "to": "2348000000009", "message": "hi", "fallback_template": "hello_world"
+    })
+    assert response.get_json()["sent_as"] == "template"
+    assert payloads[-1]["type"] == "template"
+
+    whatsapp_bot.store_message("2348000000009", "hello", "incoming", account_id="main")
+    response = client.post("/api/accounts/main/send", json={"to": "2348000000009", "message": "hi"})
+    assert response.get_json()["sent_as"] == "text"
+    assert payloads[-1]["text"]["body"] == "hi"
+
+    response = client.post("/api/accounts/main/window", json={"recipients": ["2348000000009", "2348000000008"]})
+    assert response.get_json()["open"] == ["2348000000009"]
+    assert response.get_json()["closed"] == ["2348000000008"]
@@ -0,0 +1,90 @@
+import time
+
+from socket_fanout import RESYNC, SocketFanout
+
+
+class FakeSocketIO:
+    """Records emits; clients in acking call the ack callback right away."""
+
+    def __init__(self, acking=()):
+        self.acking = set(acking)
+        self.received = {}
+        self.disconnected = []
+        self.server = self
+
+    def disconnect(self, sid):
+        self.disconnected.append(sid)
+
+    def emit(self, event, data, to=None, callback=None):
+        self.received.setdefault(to, []).append((event, data))
+        if to in self.acking:
+            callback()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_slow_client_gets_a_resync_instead_of_a_backlog():
+    socketio = FakeSocketIO(acking={"fast"})
+    fanout = SocketFanout(socketio, max_queue=10, window=2)
+    assert fanout.connect("fast", "main") and fanout.connect("slow", "main") and fanout.connect("other", "shop")
+    fanout.start()
+
+    for i in range(5):
+        fanout.publish("new_message", {"n": i}, "main")
+    wait_for(lambda: len(socketio.received.get("fast", [])) == 5)
+    assert socketio.received["slow"] == [("new_message", {"n": 0}), ("new_message", {"n": 1})]  # window full
+    assert fanout.stats()["queue_depth"]["max"] == 3
+
+    # Publishing never waits for the slow client, whose backlog collapses into one resync
+    for i in range(5, 200):
+        fanout.publish("new_message", {"n": i}, "main")
+    wait_for(lambda: socketio.received["fast"][-1] in [("new_message", {"n": 199}), (RESYNC, {"account_id": "main"})])
+    stats = fanout.stats()
+    assert stats["queue_depth"] == {"total": 1, "max": 1, "limit": 10}
+    assert stats["in_flight"] == 2 and stats["resyncs"] >= 1 and stats["published"] == 200
+    assert "other" not in socketio.received
+
+    fanout.ack("slow", next(iter(fanout._clients["slow"].in_flight)))
+    wait_for(lambda: socketio.received["slow"][-1] == (RESYNC, {"account_id": "main"}))
+
+
+def test_missing_acks_time_out():
+    socketio = FakeSocketIO()
+    fanout = SocketFanout(socketio, window=1, ack_timeout=0.05)
+    fanout.connect("sid", "main")
+    fanout.start()
+    for i in range(3):
+        fanout.publish("new_message", {"n": i}, "main")
+    wait_for(lambda: len(socketio.received.get("sid", [])) == 3)
+    assert fanout.stats()["ack_timeouts"] >= 2
+
+
+def test_connection_limit_per_account():
+    fanout = SocketFanout(FakeSocketIO(), max_clients_per_account=2)
+    assert fanout.connect("a", "main") and fanout.connect("b", "main")
+    assert not fanout.connect("c", "main")
+    assert fanout.connect("c", "shop")
+    assert not fanout.subscribe("c", "main")
+    fanout.disconnect("a")
+    assert fanout.subscribe("c", "main")
+    stats = fanout.stats()
+    assert stats["clients_per_account"] == {"main": 2} and stats["rejected_connections"] == 2
+
+
+def test_close_sends_what_is_queued_then_disconnects_everyone():
+    socketio = FakeSocketIO(acking={"a", "b"})
+    fanout = SocketFanout(socketio)
+    fanout.connect("a", "main")
+    fanout.connect("b", "shop")
+    fanout.start()
+    fanout.publish("new_message", {"n": 1}, "main")
+
+    assert fanout.close(timeout=5)
+    assert socketio.received["a"] == [("new_message", {"n": 1})]
+    assert sorted(socketio.disconnected) == ["a", "b"] and fanout.stats()["clients"] == 0
+    assert not fanout.connect("c", "main")
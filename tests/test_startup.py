@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+import time
+
+import whatsapp_bot
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_and_create_app_do_not_wait_on_redis():
+    """A blackholed Redis host must not slow down a worker boot."""
+    env = dict(os.environ, REDIS_HOST="10.255.255.1", REDIS_CONNECT_TIMEOUT="5")
+    snippet = "import whatsapp_bot; whatsapp_bot.create_app(); print(whatsapp_bot.STARTUP_TIMINGS['create_app_ms'])"
+
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True, timeout=30)
+    elapsed = time.perf_counter() - started
+
+    assert float(result.stdout.strip().splitlines()[-1]) < 1000
+    assert elapsed < 5
+
+
+def test_create_app_loads_env_accounts_and_is_idempotent():
+    app = whatsapp_bot.create_app()
+    assert whatsapp_bot.create_app() is app
+    assert "main" in whatsapp_bot.WHATSAPP_ACCOUNTS
+    assert "total_ms" in whatsapp_bot.STARTUP_TIMINGS
+
+
+def test_status_reports_redis_state_while_redis_is_down():
+    client = whatsapp_bot.create_app().test_client()
+    assert whatsapp_bot.redis_manager.check_health() is False
+
+    data = client.get("/api/status").get_json()
+    assert data["status"] == "online"
+    assert data["redis"]["state"] == "unavailable"
+    assert whatsapp_bot.get_redis_client() is None
@@ -0,0 +1,169 @@
+import json
+
+import whatsapp_bot
+from storage import RedisStorage, SQLiteStorage, contacts_key, history_key
+
+
+def message(i, phone="2348055550007"):
+    return {"id": f"m{i}", "text": f"message {i}", "phone_number": phone}
+
+
+def test_sqlite_history_ranges_span_committed_and_pending(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLiteStorage, "start", lambda self: None)  # no committer: only flush() commits
+    storage = SQLiteStorage(str(tmp_path / "storage.db"), batch_size=1000, max_delay=60)
+    for i in range(5):
+        storage.append_message("main", "2348055550007", message(i))
+    storage.flush()
+    for i in range(5, 8):
+        storage.append_message("main", "2348055550007", message(i))  # not committed yet
+
+    ids = lambda messages: [m["id"] for m in messages]
+    assert ids(storage.history("main", "2348055550007")) == [f"m{i}" for i in range(8)]
+    assert ids(storage.history("main", "2348055550007", 0, 1)) == ["m6", "m7"]
+    assert ids(storage.history("main", "2348055550007", 2, 4)) == ["m3", "m4", "m5"]
+    assert ids(storage.history("main", "2348055550007", 5, -1)) == ["m0", "m1", "m2"]
+    assert storage.history("other", "2348055550007") == []
+    assert storage.stats()["pending"] == 3
+
+
+def test_sqlite_commits_when_the_oldest_append_is_due(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLiteStorage, "start", lambda self: None)
+    now = [1000.0]
+    monkeypatch.setattr("storage.time.time", lambda: now[0])
+    storage = SQLiteStorage(str(tmp_path / "storage.db"), batch_size=3, max_delay=5)
+    assert storage._due_in() is None
+
+    storage.append_message("main", "111", message(1, "111"))
+    now[0] += 3
+    storage.append_message("main", "111", message(2, "111"))
+    assert storage._due_in() == 2  # counted from the oldest append, not the latest wake-up
+    now[0] += 2
+    assert storage._due_in() == 0
+    now[0] -= 60  # the clock stepped back
+    assert storage._due_in() == 5
+    storage.append_message("main", "111", message(3, "111"))
+    assert storage._due_in() == 0  # a full batch
+
+
+def test_sqlite_contacts_and_accounts_survive_a_restart(tmp_path):
+    path = str(tmp_path / "storage.db")
+    storage = SQLiteStorage(path)
+    storage.append_message("main", "111", message(1, "111"))
+    storage.append_message("main", "222", message(2, "222"))
+    storage.append_message("main", "111", message(3, "111"))
+    storage.upsert_account("shop", {"name": "Shop", "status": "active"})
+    storage.upsert_account("shop", {"name": "Shop v2", "status": "active"})
+    storage.upsert_account("gone", {"name": "Gone"})
+    storage.delete_account("gone")
+    assert [c["phone_number"] for c in storage.contacts("main")] == ["111", "222"]  # before the commit
+    storage.flush()
+
+    reopened = SQLiteStorage(path)
+    contacts = reopened.contacts("main")
+    assert [(c["phone_number"], c["message_count"], c["last_message"]["id"]) for c in contacts] == [
+        ("111", 2, "m3"), ("222", 1, "m2")
+    ]
+    assert [c["phone_number"] for c in reopened.contacts("main", 1, 1)] == ["222"]
+    assert reopened.accounts() == {"shop": {"name": "Shop v2", "status": "active"}}
+
+
+def test_sqlite_keeps_the_newest_messages_of_each_conversation(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "storage.db"), history_limit=3)
+    for i in range(5):
+        storage.append_message("main", "111", message(i, "111"))
+    storage.append_message("main", "222", message(5, "222"))
+    storage.flush()
+    storage.append_message("main", "111", message(6, "111"))
+    assert storage.contacts("main")[0]["message_count"] == 3  # pending counts are capped too
+    storage.flush()
+
+    assert [m["id"] for m in storage.history("main", "111")] == ["m3", "m4", "m6"]
+    assert [(c["phone_number"], c["message_count"]) for c in storage.contacts("main")] == [("111", 3), ("222", 1)]
+    assert storage._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 4
+
+
+def test_contact_listing_reads_the_storage_backend(tmp_path, monkeypatch):
+    client = whatsapp_bot.create_app().test_client()
+    storage = SQLiteStorage(str(tmp_path / "storage.db"))
+    storage.append_message("main", "2348055550009", dict(message(1, "2348055550009"), type="incoming",
+                                                           timestamp="2024-06-01T10:00:00"))
+    monkeypatch.setattr(whatsapp_bot, "storage", storage)
+    monkeypatch.setattr(whatsapp_bot, "STORAGE_BACKEND", "sqlite")
+
+    contacts = client.get("/api/accounts/main/contacts").get_json()["contacts"]
+    assert [(c["phone"], c["last_message"], c["message_count"]) for c in contacts] == [("2348055550009", "message 1", 1)]
+    assert client.get("/api/accounts/main/export").status_code == 501
+    assert client.post("/api/accounts/main/import", data="", content_type="application/x-ndjson").status_code == 501
+
+
+class ListRedis:
+    def __init__(self):
+        self.lists = {}
+        self.zsets = {}
+
+    def lrange(self, key, start, stop):
+        items = self.lists.get(key, [])
+        return items[start:] if stop < 0 else items[start:stop + 1]
+
+    def lindex(self, key, index):
+        items = self.lists.get(key, [])
+        return items[index] if items else None
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def zrevrange(self, key, start, stop, withscores=False):
+        entries = sorted(self.zsets.get(key, {}).items(), key=lambda item: -item[1])
+        return entries[start:] if stop < 0 else entries[start:stop + 1]
+
+    def pipeline(self, transaction=True):
+        client, replies = self, []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args: replies.append(getattr(client, name)(*args))
+
+            def execute(self):
+                return replies
+        return Pipeline()
+
+
+class Manager:
+    def __init__(self, client):
+        self.client = client
+        self.written = []
+
+    def get_client(self):
+        return self.client
+
+    def record_error(self, error):
+        pass
+
+    def write(self, commands, transient=()):
+        self.written.extend(commands)
+        return True
+
+
+def test_redis_storage_matches_the_key_layout():
+    client = ListRedis()
+    storage = RedisStorage(Manager(client), history_limit=2)
+    lpush, ltrim, zadd = storage.append_commands("main", "111", message(1, "111"))
+    assert lpush[:2] == ("lpush", history_key("main", "111")) and ltrim == ("ltrim", history_key("main", "111"), 0, 1)
+    assert zadd[:2] == ("zadd", contacts_key("main"))
+
+    client.lists[history_key("main", "111")] = [json.dumps(message(2, "111")), json.dumps(message(1, "111"))]
+    client.zsets[contacts_key("main")] = {"111": 20.0, "222": 10.0}  # 222's history has expired
+    assert [m["id"] for m in storage.history("main", "111")] == ["m1", "m2"]
+    assert storage.histories("main", ["111", "222"], 0, 0) == {"111": [message(2, "111")], "222": []}
+    assert storage.contacts("main") == [
+        {"phone_number": "111", "last_message": message(2, "111"), "message_count": 2, "updated": 20.0}
+    ]
+
+
+def test_stored_messages_come_from_the_configured_backend(monkeypatch, tmp_path):
+    whatsapp_bot.create_app()
+    monkeypatch.setattr(whatsapp_bot, "storage", SQLiteStorage(str(tmp_path / "storage.db")))
+    whatsapp_bot.store_message("08055550008", "hello", "incoming", account_id="main")
+    [stored] = whatsapp_bot.get_stored_messages("2348055550008", "main")
+    assert stored["text"] == "hello"
+    assert whatsapp_bot.storage.contacts("main")[0]["phone_number"] == "2348055550008"
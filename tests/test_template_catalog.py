@@ -0,0 +1,106 @@
+import threading
+import time
+
+import whatsapp_bot
+from template_catalog import TemplateCatalog
+
+ORDER_UPDATE = {
+    "name": "order_update", "language": "en_US", "status": "APPROVED",
+    "components": [
+        {"type": "HEADER", "format": "IMAGE"},
+        {"type": "BODY", "text": "Hi {{1}}, order {{2}} ships on {{3}}. Thanks {{1}}!"},
+        {"type": "BUTTONS", "buttons": [
+            {"type": "URL", "url": "https://example.com/track/{{1}}"},
+            {"type": "QUICK_REPLY", "text": "Stop"},
+        ]},
+    ],
+}
+PENDING = {"name": "promo", "language": "en_US", "status": "PENDING", "components": []}
+
+
+def text(value):
+    return {"type": "text", "text": value}
+
+
+def valid_components():
+    return [
+        {"type": "header", "parameters": [{"type": "image", "image": {"link": "https://example.com/a.jpg"}}]},
+        {"type": "body", "parameters": [text("Ada"), text("ORD-1"), text("Monday")]},
+        {"type": "button", "sub_type": "url", "index": "0", "parameters": [text("ORD-1")]},
+    ]
+
+
+def make_catalog(templates, calls=None):
+    def fetch(account_id):
+        if calls is not None:
+            calls.append(account_id)
+        return templates
+    return TemplateCatalog(fetch, ttl=3600)
+
+
+def test_valid_send_passes_and_catalog_is_fetched_once():
+    calls = []
+    catalog = make_catalog([ORDER_UPDATE, PENDING], calls)
+    assert catalog.validate("main", "order_update", "en_US", valid_components()) == []
+    assert catalog.validate("main", "order_update", "en_US", valid_components()) == []
+    assert calls == ["main"]
+
+
+def test_malformed_sends_are_rejected_locally():
+    catalog = make_catalog([ORDER_UPDATE, PENDING])
+
+    assert "does not exist" in catalog.validate("main", "nope", "en_US")[0]
+    assert "available: en_US" in catalog.validate("main", "order_update", "fr")[0]
+    assert "PENDING" in catalog.validate("main", "promo", "en_US")[0]
+
+    components = valid_components()
+    components[1]["parameters"] = components[1]["parameters"][:2]
+    assert catalog.validate("main", "order_update", "en_US", components) == ["Body expects 3 parameter(s), got 2"]
+
+    components = valid_components()
+    components[0]["parameters"] = [text("not an image")]
+    assert catalog.validate("main", "order_update", "en_US", components) == ["Header expects a image parameter"]
+
+    assert "Button 0 expects 1" in " ".join(catalog.validate("main", "order_update", "en_US", valid_components()[:2]))
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls, release = [], threading.Event()
+
+    def fetch(account_id):
+        calls.append(account_id)
+        release.wait(5)
+        return [ORDER_UPDATE]
+
+    catalog = TemplateCatalog(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(catalog.get("main"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == ["main"]
+    assert len(results) == 8 and all(("order_update", "en_US") in result for result in results)
+
+
+def test_unreachable_catalog_does_not_block_sends():
+    def fetch(account_id):
+        raise ConnectionError("offline")
+    assert TemplateCatalog(fetch).validate("main", "anything", "en_US") == []
+
+
+def test_send_rejects_invalid_template_without_calling_graph(monkeypatch):
+    whatsapp_bot.create_app()
+    monkeypatch.setattr(whatsapp_bot, "template_catalog", make_catalog([ORDER_UPDATE]))
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("Graph API must not be called")
+    monkeypatch.setattr(whatsapp_bot.requests, "post", no_network)
+
+    response = whatsapp_bot.app.test_client().post("/send-template", json={
+        "to": "2348000000000", "template": "order_update", "language": "en_US", "components": []
+    })
+    assert response.status_code == 400
+    assert "Body expects 3 parameter(s), got 0" in response.get_json()["validation_errors"]
@@ -0,0 +1,102 @@
+import hashlib
+import hmac
+import json
+
+import whatsapp_bot
+from tracing import FileExporter, OtlpExporter, Tracer
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+def test_spans_nest_under_the_callers_trace(tmp_path):
+    exporter = FileExporter(str(tmp_path / "traces.ndjson"))
+    tracer = Tracer(exporters=[exporter])
+
+    @tracer.traced()
+    def store():
+        with tracer.span("redis.write", batch=2):
+            pass
+
+    with tracer.span("outside"):
+        pass  # no trace yet: nothing recorded
+    root = tracer.start_trace("POST /webhook", traceparent=PARENT)
+    store()
+    try:
+        with tracer.span("socketio.emit"):
+            raise ConnectionError("gone")
+    except ConnectionError:
+        pass
+    tracer.end_trace(root)
+    assert tracer.current() is None
+
+    trace = tracer.find("0af7651916cd43dd8448eb211c80319c")
+    spans = {span.name: span for span in trace.spans}
+    assert set(spans) == {"POST /webhook", "store", "redis.write", "socketio.emit"}
+    assert spans["POST /webhook"].parent_id == "b7ad6b7169203331"
+    assert spans["redis.write"].parent_id == spans["store"].span_id
+    assert spans["socketio.emit"].parent_id == root.span_id
+    assert spans["socketio.emit"].error == "ConnectionError: gone"
+
+    [line] = (tmp_path / "traces.ndjson").read_text().splitlines()
+    assert json.loads(line)["error"] is True
+
+    otlp = OtlpExporter("http://collector:4318/v1/traces", "whatsapp-bot").payload([trace])
+    otlp_spans = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {span["traceId"] for span in otlp_spans} == {"0af7651916cd43dd8448eb211c80319c"}
+    assert [span["status"]["code"] for span in otlp_spans if span["name"] == "socketio.emit"] == [2]
+
+
+def test_unsampled_traces_cost_nothing():
+    tracer = Tracer(sample_rate=0)
+    assert tracer.start_trace("GET /api/contacts") is None
+    assert tracer.start_trace("GET /", traceparent=PARENT[:-2] + "00") is None  # caller said not sampled
+    with tracer.span("store_message") as span:
+        span.set("ignored", True)
+    assert tracer.finished == 0 and not tracer.recent
+
+
+def test_webhook_trace_and_slowest_traces_endpoint(monkeypatch):
+    whatsapp_bot.create_app()
+    monkeypatch.setattr(whatsapp_bot, "ADMIN_TOKEN", "s3cret")
+    client = whatsapp_bot.app.test_client()
+
+    payload = json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "metadata": {"phone_number_id": whatsapp_bot.WHATSAPP_ACCOUNTS["main"]["phone_number_id"]},
+            "messages": [{"from": "2348055550002", "id": "wamid.t", "type": "text", "text": {"body": "Hi"}}]
+        }}]}]
+    }).encode()
+    signature = "sha256=" + hmac.new(whatsapp_bot.APP_SECRET.encode(), payload, hashlib.sha256).hexdigest()
+    response = client.post("/webhook", data=payload, headers={
+        "X-Hub-Signature-256": signature, "Content-Type": "application/json", "traceparent": PARENT
+    })
+    assert response.status_code == 200
+    assert response.headers["traceparent"].startswith("00-0af7651916cd43dd8448eb211c80319c-")
+
+    assert client.get("/admin/traces").status_code == 401
+    auth = {"Authorization": "Bearer s3cret"}
+    listing = client.get("/admin/traces?name=POST%20/webhook&limit=5", headers=auth).get_json()
+    webhook = next(t for t in listing["traces"] if t["trace_id"] == "0af7651916cd43dd8448eb211c80319c")
+    assert webhook["status_code"] == 200
+    assert {"verify_webhook_signature", "route_account", "store_message", "redis.write", "socketio.emit"} <= set(webhook["stages"])
+    durations = [t["duration_ms"] for t in listing["traces"]]
+    assert durations == sorted(durations, reverse=True)
+
+    detail = client.get("/admin/traces/0af7651916cd43dd8448eb211c80319c", headers=auth).get_json()
+    assert detail["spans"][0]["name"] == "POST /webhook"
+    assert client.get("/admin/traces/ffffffffffffffffffffffffffffffff", headers=auth).status_code == 404
+    assert client.get("/admin/traces?limit=lots", headers=auth).status_code == 400
+
+
+def test_spans_per_trace_are_capped():
+    tracer = Tracer(max_spans=3)
+    root = tracer.start_trace("POST /webhook")
+    for i in range(5):
+        with tracer.span("store_message", index=i):
+            with tracer.span("redis.write"):
+                pass
+    tracer.end_trace(root)
+    trace = tracer.recent[-1]
+    assert [span.name for span in trace.spans] == ["POST /webhook", "store_message", "redis.write"]
+    assert root.attributes["spans.dropped"] == 8
@@ -0,0 +1,138 @@
+import os
+import runpy
+import signal
+import threading
+import time
+
+import whatsapp_bot
+from outbound_queue import BULK, OutboundScheduler
+from storage import SQLiteStorage
+from worker_lifecycle import DRAINING, READY, STARTING, STOPPED, WorkerLifecycle, warm_up
+
+
+class CountingStorage(SQLiteStorage):
+    def __init__(self, path):
+        super().__init__(path)
+        self.batches = []
+
+    def histories(self, account_id, phone_numbers, start=0, stop=-1):
+        self.batches.append(list(phone_numbers))
+        return super().histories(account_id, phone_numbers, start, stop)
+
+
+def message(i, phone):
+    return {"id": f"m{i}", "text": f"message {i}", "phone_number": phone}
+
+
+def test_warm_up_loads_the_most_recent_conversations_in_batches(tmp_path):
+    storage = CountingStorage(str(tmp_path / "storage.db"))
+    for i, phone in enumerate(["111", "222", "333", "444", "555"]):
+        storage.append_message("main", phone, message(2 * i, phone))
+        storage.append_message("main", phone, message(2 * i + 1, phone))
+    storage.flush()
+
+    loaded = {}
+    counts = warm_up(storage, ["main", "empty"], lambda a, p, messages: loaded.setdefault((a, p), messages),
+                     max_contacts=3, batch_size=2, history_limit=1)
+    assert counts == {"accounts": 2, "contacts": 3, "messages": 3}
+    assert storage.batches == [["555", "444"], ["333"]]
+    assert loaded == {("main", "555"): [message(9, "555")], ("main", "444"): [message(7, "444")],
+                      ("main", "333"): [message(5, "333")]}
+
+
+class UnreachableStorage(SQLiteStorage):
+    def histories(self, account_id, phone_numbers, start=0, stop=-1):
+        return None
+
+
+def test_warm_up_fails_and_runs_again_when_storage_cant_be_read(tmp_path):
+    storage = UnreachableStorage(str(tmp_path / "storage.db"))
+    storage.append_message("main", "111", message(1, "111"))
+    storage.flush()
+    lifecycle = WorkerLifecycle()
+
+    counts = lifecycle.run_warm_up(lambda: warm_up(storage, ["main"], lambda *args: None))
+    assert "could not be read" in counts["error"]
+    assert lifecycle.state == STARTING and not lifecycle.ready()  # ready only after warmup_timeout
+    assert lifecycle.run_warm_up(lambda: {"contacts": 1})["contacts"] == 1  # the retry after recovery
+    assert lifecycle.state == READY and lifecycle.ready()
+
+
+def test_sigterm_drains_before_gunicorn_stops_the_worker(monkeypatch):
+    hooks = runpy.run_path(os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py"))
+    order = []
+    monkeypatch.setattr(whatsapp_bot, "drain_worker", lambda: order.append("drain"))
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: order.append("stop"))
+    try:
+        hooks["post_worker_init"](None)
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        deadline = time.monotonic() + 5
+        while len(order) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    assert order == ["drain", "stop"]
+
+
+def test_ready_after_warm_up_or_after_the_timeout():
+    lifecycle = WorkerLifecycle(warmup_timeout=60)
+    assert lifecycle.state == STARTING and not lifecycle.ready()
+    assert lifecycle.run_warm_up(lambda: {"contacts": 2})["contacts"] == 2
+    assert lifecycle.state == READY and lifecycle.ready()
+    assert lifecycle.run_warm_up(lambda: 1 / 0)["contacts"] == 2  # runs once
+
+    unreachable = WorkerLifecycle(warmup_timeout=0.05)
+    time.sleep(0.06)
+    assert unreachable.ready() and unreachable.state == STARTING  # still warms up once storage is back
+
+
+def test_drain_waits_for_running_requests_then_runs_the_steps_in_order():
+    lifecycle = WorkerLifecycle(drain_timeout=5)
+    outbound = OutboundScheduler(concurrency=1)
+    gate, sent = threading.Event(), []
+    assert lifecycle.begin_request()
+    outbound.submit(BULK, "main", lambda: gate.wait(5) and sent.append("bulk"))
+    order = []
+    lifecycle.on_drain("outbound", lambda timeout: order.append(("outbound", outbound.drain(timeout))))
+    lifecycle.on_drain("broken", lambda timeout: 1 / 0)
+    lifecycle.on_drain("flush", lambda timeout: order.append("flush"))
+
+    draining = threading.Thread(target=lifecycle.drain)
+    draining.start()
+    deadline = time.monotonic() + 5
+    while lifecycle.state != DRAINING and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not lifecycle.begin_request() and not lifecycle.ready()  # new writes are refused meanwhile
+    assert order == []  # still waiting for the running request
+    lifecycle.end_request()
+    gate.set()
+    draining.join(5)
+
+    assert order == [("outbound", True), "flush"] and sent == ["bulk"]
+    report = lifecycle.drain()  # a second call returns the first report
+    assert [name for name in report] == ["requests", "outbound", "broken", "flush"]
+    assert report["requests"]["ok"] and not report["broken"]["ok"]
+    assert lifecycle.stats()["state"] == STOPPED and lifecycle.stats()["refused"] == 1
+
+
+def test_draining_worker_refuses_webhooks_and_keeps_serving_reads(monkeypatch):
+    client = whatsapp_bot.create_app().test_client()
+    lifecycle = WorkerLifecycle()
+    monkeypatch.setattr(whatsapp_bot, "worker_lifecycle", lifecycle)
+    assert client.get("/ready").status_code == 503
+    lifecycle.run_warm_up(lambda: {"contacts": 0})
+    assert client.get("/ready").get_json() == {"status": "ready", "ready": True}
+
+    lifecycle.drain()
+    response = client.post("/webhook", json={"entry": []})
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert client.get("/ready").status_code == 503
+    assert client.get("/api/status").get_json()["lifecycle"]["state"] == STOPPED
+
+
+def test_warmed_conversations_go_behind_messages_received_since_startup(monkeypatch):
+    store = whatsapp_bot.defaultdict(lambda: whatsapp_bot.defaultdict(list))
+    monkeypatch.setattr(whatsapp_bot, "message_store", store)
+    store["main"]["111"].append(message(3, "111"))
+    whatsapp_bot.load_conversation("main", "111", [message(1, "111"), message(2, "111"), message(3, "111")])
+    assert [m["id"] for m in store["main"]["111"]] == ["m1", "m2", "m3"]
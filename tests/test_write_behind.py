@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+from fake_redis import FakeRedis
+from redis_pool import RedisManager
+from write_behind import WriteAheadLog, WriteBehindBuffer
+
+
+def make_buffer(tmp_path, **kwargs):
+    manager = RedisManager("localhost", 6379)
+    manager.client = FakeRedis()
+    manager._health_thread = object()
+    return WriteBehindBuffer(manager, wal_dir=str(tmp_path), retry_interval=0.01, **kwargs), manager
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_writes_are_batched_and_survive_a_redis_outage(tmp_path):
+    buffer, manager = make_buffer(tmp_path, max_batch=3, max_delay=0.01)
+    fake = manager.client
+    buffer.start()
+
+    for i in range(5):
+        buffer.enqueue([("lpush", "k", str(i))], transient=[("publish", "c", str(i))])
+    time.sleep(0.05)
+    assert fake.executed == []  # Redis down: nothing lost, nothing written
+    assert buffer.stats()["depth"] == 5
+
+    fake.up = True
+    manager.check_health()  # closes the circuit the failed flushes opened
+    assert wait_for(lambda: buffer.stats()["depth"] == 0)
+    assert [cmd for cmd in fake.executed if cmd[0] == "lpush"] == [("lpush", "k", str(i)) for i in range(5)]
+    assert buffer.stop()
+
+    # Drained buffer leaves an empty WAL behind
+    assert (tmp_path / buffer.wal.path.split("/")[-1]).read_text() == ""
+
+
+def test_unflushed_writes_from_a_crashed_worker_are_replayed(tmp_path):
+    # A previous boot's worker with our PID (container restart): nothing holds its lock
+    wal = tmp_path / f"writes-{os.getpid()}-0123456789ab.wal"
+    wal.write_text("\n".join([
+        json.dumps({"seq": 1, "commands": [["lpush", "k", "flushed"]]}),
+        json.dumps({"flushed": 1}),
+        json.dumps({"seq": 2, "commands": [["lpush", "k", "pending"]]}),
+        '{"seq": 3, "comm',  # torn write at crash time
+    ]) + "\n")
+
+    buffer, manager = make_buffer(tmp_path, max_delay=0.01)
+    fake = manager.client
+    fake.up = True
+    buffer.start()
+
+    assert wait_for(lambda: fake.executed == [("lpush", "k", "pending")])
+    assert not wal.exists() and buffer.wal.path != str(wal)
+    buffer.stop()
+
+
+def test_logs_of_running_workers_are_left_alone(tmp_path):
+    live = WriteAheadLog(str(tmp_path))
+    live.open()
+    live.append(1, [["lpush", "k", "in flight"]])
+
+    assert WriteAheadLog(str(tmp_path)).recover_orphans() == []
+    assert os.path.exists(live.path)
+
+    live.close()  # the worker died: its lock is gone with it
+    assert WriteAheadLog(str(tmp_path)).recover_orphans() == [[["lpush", "k", "in flight"]]]
+    assert not os.path.exists(live.path)
+
+
+def test_full_buffer_falls_back_to_a_direct_write(tmp_path):
+    buffer, manager = make_buffer(tmp_path, capacity=1, max_delay=10)
+    fake = manager.client
+    fake.up = True
+    buffer.start()
+
+    buffer.enqueue([("lpush", "k", "queued")])
+    buffer.enqueue([("lpush", "k", "direct")])
+    assert fake.executed == [("lpush", "k", "direct")]
+    assert buffer.stats()["overflow_writes"] == 1
+    assert buffer.stop()
+
+
+def test_the_log_is_rotated_under_steady_load(tmp_path):
+    buffer, manager = make_buffer(tmp_path, wal_max_bytes=200)
+    manager.client.up = True
+    buffer.wal.open()  # driven by hand instead of the flush thread
+    for i in range(6):
+        buffer._append_locked([["lpush", "k", str(i)]], [])
+    first = buffer.wal.path
+
+    # The buffer never drains, but once the log is mostly flushed it moves to a file holding only the tail
+    assert buffer._flush_batch([buffer._entries.popleft() for _ in range(4)])
+    assert not os.path.exists(first) and os.path.exists(buffer.wal.path)
+    buffer._append_locked([["lpush", "k", "6"]], [])
+    assert buffer._flush_batch([buffer._entries.popleft()])
+    assert buffer.wal.lines == 4  # below the size limit: a checkpoint
+
+    buffer.wal.close()
+    recovered = WriteAheadLog(str(tmp_path)).recover_orphans()
+    assert recovered == [[["lpush", "k", "5"]], [["lpush", "k", "6"]]]
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,359 @@
+"""
+Lightweight request tracing.
+
+A trace is started for each request (continuing the caller's W3C
+``traceparent`` when there is one, so the trace id propagates from the
+request) and for background entry points such as scheduled sends. Code marks
+its stages with ``with tracer.span("name"):`` or ``@tracer.traced()``; spans
+nest through a context variable, and outside a sampled trace they cost one
+context variable lookup. A trace keeps at most max_spans spans (a webhook
+batch of hundreds of messages would otherwise build a huge trace); further
+spans are not recorded and the root span's ``spans.dropped`` attribute counts
+them. Trace stages, not per-record helpers.
+
+Finished traces go to an in-memory ring buffer (the slowest recent ones are
+served by /admin/traces) and to the configured exporters: a JSON-lines file
+and/or an OTLP/HTTP JSON endpoint (e.g. an OpenTelemetry Collector on
+``http://localhost:4318/v1/traces``), which is batched by a background thread.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import requests
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER = 1, 2
+STATUS_OK, STATUS_ERROR = 1, 2
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(hex_digits):
+    return f"{random.getrandbits(hex_digits * 4):0{hex_digits}x}"
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, trace, name, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = _new_id(16)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, trace_id, name, max_spans=256):
+        self.trace_id = trace_id
+        self.name = name
+        self.spans = []
+        self.root = None
+        self.max_spans = max_spans
+        self.opened = 1  # the root
+        self.dropped = 0
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.root.start_ns / 1e9,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "error": any(span.error for span in self.spans),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+class _NoSpan:
+    """Stand-in yielded outside sampled traces."""
+
+    def set(self, key, value):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _SpanContext:
+    __slots__ = ("tracer", "name", "attributes", "span")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is None:
+            return _NO_SPAN
+        trace = parent.trace
+        if trace.opened >= trace.max_spans:
+            trace.dropped += 1
+            return _NO_SPAN
+        trace.opened += 1
+        self.span = Span(parent.trace, self.name, parent.span_id, attributes=self.attributes)
+        self.span._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            if exc is not None:
+                self.span.error = f"{exc_type.__name__}: {exc}"
+            self.tracer._end(self.span)
+        return False
+
+
+class FileExporter:
+    """One JSON line per trace."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, trace):
+        line = json.dumps(trace.to_dict()) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(span):
+    status = {"code": STATUS_ERROR, "message": span.error} if span.error else {"code": STATUS_OK}
+    otlp = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": status,
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+class OtlpExporter:
+    """Batches traces to an OTLP/HTTP JSON endpoint from a background thread; drops them when it can't keep up."""
+
+    def __init__(self, endpoint, service_name, headers=None, batch_size=100, flush_interval=5.0,
+                 queue_size=10000, timeout=5):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.headers = dict(headers or {}, **{"Content-Type": "application/json"})
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.exported = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        if not self._thread:
+            with self._lock:
+                if not self._thread:
+                    self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def payload(self, traces):
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "whatsapp_bot.tracing"},
+                "spans": [otlp_span(span) for trace in traces for span in trace.spans],
+            }],
+        }]}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                response = requests.post(self.endpoint, json=self.payload(batch), headers=self.headers,
+                                         timeout=self.timeout)
+                response.raise_for_status()
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"⚠️ OTLP trace export failed ({len(batch)} traces dropped): {e}")
+
+
+class Tracer:
+    def __init__(self, sample_rate=1.0, ring_size=1000, exporters=(), max_spans=256):
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.exporters = list(exporters)
+        self.recent = deque(maxlen=ring_size)
+        self.started = 0
+        self.finished = 0
+
+    def start_trace(self, name, traceparent=None, kind=KIND_SERVER, attributes=None):
+        """
+        Open a root span, continuing traceparent's trace if given (its sampled
+        flag is honoured). Returns the span, or None if the trace isn't sampled;
+        pass it to end_trace().
+        """
+        trace_id = parent_id = None
+        sampled = None
+        match = TRACEPARENT.match((traceparent or "").strip().lower())
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            sampled = bool(int(flags, 16) & 1)
+        if sampled is None:
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        if not sampled:
+            return None
+        trace = Trace(trace_id or _new_id(32), name, self.max_spans)
+        span = Span(trace, name, parent_id, kind=kind, attributes=attributes)
+        trace.root = span
+        span._token = _current.set(span)
+        self.started += 1
+        return span
+
+    def end_trace(self, span, error=None):
+        if span is None:
+            return
+        if error is not None and span.error is None:
+            span.error = error
+        self._end(span)
+
+    def _end(self, span):
+        span.end_ns = time.time_ns()
+        span.trace.spans.append(span)
+        if span._token is not None:
+            try:
+                _current.reset(span._token)
+            except ValueError:  # ended in another context (e.g. a streamed response)
+                _current.set(None)
+        if span is span.trace.root:
+            self._finish(span.trace)
+
+    def _finish(self, trace):
+        if trace.dropped:
+            trace.root.set("spans.dropped", trace.dropped)
+        trace.spans.sort(key=lambda span: span.start_ns)
+        self.finished += 1
+        self.recent.append(trace)
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception as e:
+                print(f"⚠️ Trace export failed: {e}")
+
+    def span(self, name, **attributes):
+        """Context manager for a child span of the current span (a no-op outside a sampled trace)."""
+        return _SpanContext(self, name, attributes)
+
+    def traced(self, name=None):
+        """Decorator: run the function in a span named after it."""
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def root(self, name, **attributes):
+        """Context manager for a background root trace (scheduled sends, auto-responses, ...)."""
+        tracer = self
+
+        class _Root:
+            def __enter__(self):
+                self.span = tracer.start_trace(name, kind=KIND_INTERNAL, attributes=attributes)
+                return self.span or _NO_SPAN
+
+            def __exit__(self, exc_type, exc, tb):
+                tracer.end_trace(self.span, f"{exc_type.__name__}: {exc}" if exc is not None else None)
+                return False
+
+        return _Root()
+
+    @staticmethod
+    def current():
+        return _current.get()
+
+    @staticmethod
+    def traceparent(span):
+        return f"00-{span.trace.trace_id}-{span.span_id}-01"
+
+    def slowest(self, limit=20, min_ms=0.0, name=None):
+        traces = [t for t in list(self.recent)
+                  if t.root.duration_ms >= min_ms and (name is None or t.name == name)]
+        traces.sort(key=lambda t: t.root.duration_ms, reverse=True)
+        return traces[:limit]
+
+    def find(self, trace_id):
+        for trace in reversed(list(self.recent)):
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def stats(self):
+        stats = {"sample_rate": self.sample_rate, "started": self.started, "finished": self.finished,
+                 "buffered": len(self.recent)}
+        for exporter in self.exporters:
+            if isinstance(exporter, OtlpExporter):
+                stats["otlp"] = {"exported": exporter.exported, "dropped": exporter.dropped}
+        return stats
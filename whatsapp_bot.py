@@ -13,26 +13,56 @@ Setup Instructions:
 4. Run the script: python whatsapp_bot.py
 """
 
+import time
+
+# Recorded before the heavy imports so the startup benchmark sees the full cold start
+_MODULE_LOAD_STARTED = time.perf_counter()
+
 import os
 import json
 import hmac
 import hashlib
+import heapq
 import requests
 import redis
+import signal
 import threading
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from functools import wraps
+from flask import (Flask, request, jsonify, render_template, send_from_directory, send_file, redirect, abort, g,
+                   make_response, has_request_context)
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from dotenv import load_dotenv
 from datetime import datetime
 from collections import defaultdict
+from redis_pool import RedisManager
+from write_behind import WriteBehindBuffer
+from storage import HISTORY_LIMIT, RedisStorage, SQLiteStorage, history_key
+from near_cache import NearCache
+from key_schema import account_channel, account_key
+from socket_fanout import SocketFanout
+from worker_lifecycle import WorkerLifecycle, warm_up
+import message_stream
+from message_search import MessageSearchIndex
+from media_store import MediaStore, MediaDownloader, MEDIA_MESSAGE_TYPES, NOT_FOUND as MEDIA_NOT_FOUND
+from template_catalog import TemplateCatalog, fetch_templates
+from service_window import ServiceWindowIndex
+from account_stats import AccountStats
+from conversation_versions import ConversationVersions
+from api_responses import compress_response, stream_json, stream_ndjson
+from history_transfer import HistoryImporter, iter_history, parse_records, to_csv, to_ndjson
+from phone_numbers import PhoneNormalizer
+from message_scheduler import MessageScheduler, resolve_due_time
+from auto_responder import AutoResponder, RuleError
+from profiler import DEFAULT_FOCUS, SamplingProfiler, collapsed
+from tracing import FileExporter, OtlpExporter, Tracer
+from outbound_queue import BULK, INTERACTIVE, LANES, OutboundScheduler, QueueFull
+import idempotency
+from idempotency import IdempotencyStore
 
 # Load environment variables
 load_dotenv()
 
-# Redis key for storing accounts
-REDIS_ACCOUNTS_KEY = "whatsapp_accounts"
-
 # In-memory store for accounts, loaded on startup
 WHATSAPP_ACCOUNTS = {}
 
@@ -43,6 +73,10 @@ APP_ID = os.getenv("APP_ID", "1130477048497555")
 APP_SECRET = os.getenv("APP_SECRET", "your_app_secret")
 GRAPH_API_VERSION = "v18.0"
 DEFAULT_ACCOUNT_ID = "main"
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
+PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID", "837445062775054")
+WHATSAPP_BUSINESS_ACCOUNT_ID = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID", "2139592896448288")
+WHATSAPP_API_URL = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{PHONE_NUMBER_ID}/messages"
 
 # Redis Configuration
 REDIS_HOST = os.getenv("REDIS_HOST", "redis-15049.c274.us-east-1-3.ec2.redns.redis-cloud.com")
@@ -56,24 +90,257 @@ app.config['SECRET_KEY'] = 'whatsapp_bot_secret_key'
 CORS(app)  # Enable CORS for all routes
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Initialize Redis connection
-try:
-    redis_client = redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        decode_responses=True,
-        username=REDIS_USERNAME,
-        password=REDIS_PASSWORD,
-    )
-    redis_client.ping()
-    print("✅ Redis connection successful!")
-except Exception as e:
-    print(f"❌ Redis connection failed: {e}")
-    redis_client = None
+# Real-time events go through a bounded queue per WebSocket client: a slow
+# client gets a "resync" instead of an ever-growing backlog, and publishing
+# never waits for a client. Each account takes at most
+# SOCKET_MAX_CLIENTS_PER_ACCOUNT connections per worker.
+SOCKET_QUEUE_SIZE = int(os.getenv("SOCKET_QUEUE_SIZE", "100"))
+SOCKET_MAX_CLIENTS_PER_ACCOUNT = int(os.getenv("SOCKET_MAX_CLIENTS_PER_ACCOUNT", "50"))
+SOCKET_SEND_WINDOW = int(os.getenv("SOCKET_SEND_WINDOW", "8"))
+SOCKET_ACK_TIMEOUT_SECONDS = float(os.getenv("SOCKET_ACK_TIMEOUT_SECONDS", "10"))
+
+socket_fanout = SocketFanout(
+    socketio,
+    max_queue=SOCKET_QUEUE_SIZE,
+    max_clients_per_account=SOCKET_MAX_CLIENTS_PER_ACCOUNT,
+    window=SOCKET_SEND_WINDOW,
+    ack_timeout=SOCKET_ACK_TIMEOUT_SECONDS,
+)
+
+# Redis connection settings. Nothing connects at import time: the client is
+# created on first use and a background thread keeps checking its health.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "1"))
+REDIS_HEALTH_CHECK_INTERVAL = float(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "15"))
+REDIS_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("REDIS_CIRCUIT_FAILURE_THRESHOLD", "3"))
+REDIS_REPLAY_BUFFER_SIZE = int(os.getenv("REDIS_REPLAY_BUFFER_SIZE", "10000"))
+# Redis Cluster: REDIS_HOST/REDIS_PORT is any node, the shards are discovered from it.
+# Keys are hash-tagged per account (see key_schema); key_migration.py moves old keys over.
+REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "false").lower() in ("1", "true", "yes")
+
+# Cold-start budget for a worker, from module import to create_app() returning
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+STARTUP_TIMINGS = {}
+_app_initialized = False
+
+redis_manager = RedisManager(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    username=REDIS_USERNAME,
+    password=REDIS_PASSWORD,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    pool_timeout=REDIS_POOL_TIMEOUT,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    failure_threshold=REDIS_CIRCUIT_FAILURE_THRESHOLD,
+    replay_buffer_size=REDIS_REPLAY_BUFFER_SIZE,
+    cluster=REDIS_CLUSTER,
+)
+
+# Optional write-behind mode: store_message() queues its Redis writes in a
+# bounded local buffer (backed by a write-ahead log) and a background thread
+# flushes them in pipelined batches, so webhook latency doesn't track Redis latency
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "50"))
+WRITE_BEHIND_CAPACITY = int(os.getenv("WRITE_BEHIND_CAPACITY", "10000"))
+WRITE_BEHIND_WAL_DIR = os.getenv("WRITE_BEHIND_WAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "wal"))
+WRITE_BEHIND_WAL_FSYNC = os.getenv("WRITE_BEHIND_WAL_FSYNC", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_WAL_MAX_BYTES = int(os.getenv("WRITE_BEHIND_WAL_MAX_BYTES", "1048576"))
+
+write_behind = WriteBehindBuffer(
+    redis_manager,
+    wal_dir=WRITE_BEHIND_WAL_DIR,
+    max_batch=WRITE_BEHIND_MAX_BATCH,
+    max_delay=WRITE_BEHIND_MAX_DELAY_MS / 1000,
+    capacity=WRITE_BEHIND_CAPACITY,
+    wal_fsync=WRITE_BEHIND_WAL_FSYNC,
+    wal_max_bytes=WRITE_BEHIND_WAL_MAX_BYTES,
+) if MESSAGE_WRITE_BEHIND else None
+
+# Where message history, the contact index and accounts live: "redis" (default)
+# or "sqlite", an embedded store in WAL mode shared by the workers on a host,
+# for small deployments with no network hop on reads (versions, service
+# windows, streams and pub/sub stay in Redis)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "redis").lower()
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "storage.db"))
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", "500"))
+STORAGE_MAX_DELAY_MS = float(os.getenv("STORAGE_MAX_DELAY_MS", "10"))
+
+if STORAGE_BACKEND == "sqlite":
+    storage = SQLiteStorage(STORAGE_SQLITE_PATH, batch_size=STORAGE_BATCH_SIZE, max_delay=STORAGE_MAX_DELAY_MS / 1000)
+else:
+    storage = RedisStorage(redis_manager)
+
+# Near cache: hot conversation slices are kept in each worker and dropped when
+# any worker publishes an invalidation for them on the account's channel
+# (store_message does, in the pipeline of its write); account changes reach
+# the other workers' account records the same way
+NEAR_CACHE_ENABLED = os.getenv("NEAR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+NEAR_CACHE_MAX_ENTRIES = int(os.getenv("NEAR_CACHE_MAX_ENTRIES", "10000"))
+NEAR_CACHE_TTL_SECONDS = float(os.getenv("NEAR_CACHE_TTL_SECONDS", "30"))
+
+near_cache = NearCache(
+    redis_manager,
+    lambda: list(WHATSAPP_ACCOUNTS),
+    max_entries=NEAR_CACHE_MAX_ENTRIES,
+    ttl=NEAR_CACHE_TTL_SECONDS
+) if NEAR_CACHE_ENABLED else None
+
+# Per-account Redis Stream of messages for downstream consumer groups, trimmed
+# by age when MESSAGE_STREAM_RETENTION_HOURS is set, otherwise by length
+MESSAGE_STREAM_ENABLED = os.getenv("MESSAGE_STREAM_ENABLED", "true").lower() in ("1", "true", "yes")
+MESSAGE_STREAM_MAXLEN = int(os.getenv("MESSAGE_STREAM_MAXLEN", "100000"))
+MESSAGE_STREAM_RETENTION_HOURS = float(os.getenv("MESSAGE_STREAM_RETENTION_HOURS", "0"))
+
+# Full-text search over conversation history (SQLite FTS5 sidecar index)
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "search.db"))
+
+search_index = MessageSearchIndex(SEARCH_INDEX_PATH, history_limit=HISTORY_LIMIT) if SEARCH_ENABLED else None
+
+# Inbound media: streamed by background downloaders into a content-addressed store
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "media"))
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(100 * 1024 * 1024)))
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv("MEDIA_DOWNLOAD_WORKERS", "2"))
+
+media_store = MediaStore(MEDIA_STORE_DIR, max_bytes=MEDIA_MAX_BYTES)
+
+# (account_id, media_id) -> {"sha256", "mime_type", "size"}; mirrored in Redis
+media_index = {}
+
+# Approved template catalog cache (per account), used to validate template sends
+# locally; with TEMPLATE_WARMUP on, every account's catalog is fetched in the
+# background at startup instead of by the first template send
+TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", "3600"))
+TEMPLATE_WARMUP = os.getenv("TEMPLATE_WARMUP", "true").lower() in ("1", "true", "yes")
+DEFAULT_TEMPLATE = {"name": "hello_world", "language": "en_US", "components": []}
+
+# 24-hour customer service window: text sends to contacts whose window has
+# closed are switched to a fallback template (per request "fallback_template",
+# or SERVICE_WINDOW_FALLBACK_TEMPLATE as "name:language") or rejected locally.
+# SERVICE_WINDOW_POLICY=off sends everything to the Graph API as before.
+SERVICE_WINDOW_POLICY = os.getenv("SERVICE_WINDOW_POLICY", "enforce").lower()
+SERVICE_WINDOW_FALLBACK_TEMPLATE = os.getenv("SERVICE_WINDOW_FALLBACK_TEMPLATE", "")
+SERVICE_WINDOW_MAX_RECIPIENTS = int(os.getenv("SERVICE_WINDOW_MAX_RECIPIENTS", "1000"))
+
+service_window = ServiceWindowIndex(redis_manager)
+
+# Unread, hourly traffic and daily active contact counters per account, updated
+# in the pipeline of store_message(); hour and day buckets expire after this long
+ACCOUNT_STATS_RETENTION_DAYS = float(os.getenv("ACCOUNT_STATS_RETENTION_DAYS", "30"))
+
+account_stats = AccountStats(redis_manager, retention_days=ACCOUNT_STATS_RETENTION_DAYS)
 
 # Message storage system (fallback to in-memory if Redis fails)
 message_store = defaultdict(lambda: defaultdict(list))
 
+# Account and conversation versions, used as ETags and for ?since= deltas
+conversation_versions = ConversationVersions(redis_manager)
+
+# API responses above API_COMPRESSION_MIN_BYTES are gzip/brotli encoded when the client accepts it
+API_COMPRESSION = os.getenv("API_COMPRESSION", "true").lower() in ("1", "true", "yes")
+API_COMPRESSION_MIN_BYTES = int(os.getenv("API_COMPRESSION_MIN_BYTES", "1024"))
+API_COMPRESSION_LEVEL = int(os.getenv("API_COMPRESSION_LEVEL", "5"))
+
+# Phone numbers are normalized to E.164 digits; local numbers are read in the
+# account's "default_region" (ISO 3166 code), or DEFAULT_PHONE_REGION
+DEFAULT_PHONE_REGION = os.getenv("DEFAULT_PHONE_REGION", "NG").upper()
+PHONE_NORMALIZE_CACHE_SIZE = int(os.getenv("PHONE_NORMALIZE_CACHE_SIZE", "65536"))
+
+phone_normalizer = PhoneNormalizer(DEFAULT_PHONE_REGION, cache_size=PHONE_NORMALIZE_CACHE_SIZE)
+
+# Scheduled messages: a Redis timer queue drained by whichever worker holds the
+# scheduler's leader lease
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "100"))
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "4"))
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "60"))
+
+# Inbound auto-responses: per-account keyword/intent/regex rules, matched on
+# every incoming text message; rule changes reach every worker within
+# AUTO_RESPONSE_REFRESH_SECONDS
+AUTO_RESPONSES_ENABLED = os.getenv("AUTO_RESPONSES_ENABLED", "true").lower() in ("1", "true", "yes")
+AUTO_RESPONSE_REFRESH_SECONDS = float(os.getenv("AUTO_RESPONSE_REFRESH_SECONDS", "5"))
+
+# /admin endpoints need "Authorization: Bearer <ADMIN_TOKEN>"; they are disabled without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Sampling profiles of live workers, shared by the workers on a host
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles"))
+
+profiler = SamplingProfiler(PROFILE_DIR)
+
+# Request tracing: a timed span per stage (signature check, account routing,
+# Redis write/publish, Socket.IO emit, Graph send) under the trace id of the
+# caller's traceparent header, at most TRACE_MAX_SPANS per trace; the slowest
+# recent traces are at /admin/traces, and sampled traces can also go to a
+# JSON-lines file and/or an OTLP/HTTP collector (e.g. http://localhost:4318/v1/traces)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "256"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_OTLP_HEADERS = dict(
+    header.split("=", 1) for header in os.getenv("TRACE_OTLP_HEADERS", "").split(",") if "=" in header
+)
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "whatsapp-bot")
+
+trace_exporters = []
+if TRACE_FILE:
+    trace_exporters.append(FileExporter(TRACE_FILE))
+if TRACE_OTLP_ENDPOINT:
+    trace_exporters.append(OtlpExporter(TRACE_OTLP_ENDPOINT, TRACE_SERVICE_NAME, headers=TRACE_OTLP_HEADERS))
+tracer = Tracer(sample_rate=TRACE_SAMPLE_RATE, ring_size=TRACE_BUFFER_SIZE, exporters=trace_exporters,
+                max_spans=TRACE_MAX_SPANS)
+
+# Outbound sends run on OUTBOUND_CONCURRENCY sender threads per worker, shared
+# between accounts in proportion to their "send_weight" (default 1), with
+# interactive sends (chat UI, API replies, auto-responses) ahead of bulk ones
+# (scheduled messages, sends with "priority": "bulk")
+OUTBOUND_QUEUE_ENABLED = os.getenv("OUTBOUND_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", "4"))
+OUTBOUND_RESERVED_INTERACTIVE = int(os.getenv("OUTBOUND_RESERVED_INTERACTIVE", "1"))
+OUTBOUND_MAX_QUEUE = int(os.getenv("OUTBOUND_MAX_QUEUE", "10000"))
+
+outbound_scheduler = OutboundScheduler(
+    concurrency=OUTBOUND_CONCURRENCY,
+    weight=lambda account_id: get_account_send_weight(account_id),
+    reserved_interactive=OUTBOUND_RESERVED_INTERACTIVE,
+    max_queue=OUTBOUND_MAX_QUEUE
+)
+
+# Send requests with an Idempotency-Key header: the response is kept for
+# IDEMPOTENCY_TTL_SECONDS and replayed to retries; a retry arriving while the
+# first request runs gets a 409. The in-progress marker lives
+# IDEMPOTENCY_LOCK_SECONDS and is renewed while the request runs, so it only
+# lapses if the worker dies mid-request
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+idempotency_store = IdempotencyStore(redis_manager, ttl=IDEMPOTENCY_TTL_SECONDS, lock_ttl=IDEMPOTENCY_LOCK_SECONDS)
+
+# Warm-up and graceful drain. A new worker loads the WARMUP_CONTACTS most
+# recently active contacts of each account, and their conversations, from the
+# storage backend (WARMUP_BATCH_SIZE conversations per round trip) before GET
+# /ready reports it ready; with storage unreachable it reports ready after
+# WARMUP_TIMEOUT_SECONDS anyway. On SIGTERM (the handler gunicorn.conf.py
+# installs) or POST /admin/drain it refuses new webhooks and writes and
+# gets DRAIN_TIMEOUT_SECONDS to finish sends, flush writes and close sockets
+WARMUP_CONTACTS = int(os.getenv("WARMUP_CONTACTS", "500"))
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "100"))
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "30"))
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "25"))
+
+worker_lifecycle = WorkerLifecycle(warmup_timeout=WARMUP_TIMEOUT_SECONDS, drain_timeout=DRAIN_TIMEOUT_SECONDS)
+
+def get_redis_client():
+    """Return the shared Redis client, or None while Redis is down (use the local store then)."""
+    return redis_manager.get_client()
+
 # --- Multi-Account Management ---
 
 def load_accounts_from_env():
@@ -95,28 +362,49 @@ def load_accounts_from_env():
         }
     }
 
+def merge_stored_accounts():
+    """Merge accounts from the storage backend over the in-memory accounts."""
+    try:
+        stored_accounts = storage.accounts()
+        if stored_accounts:
+            WHATSAPP_ACCOUNTS.update(stored_accounts)
+            print(f"✅ Loaded additional accounts from {STORAGE_BACKEND}.")
+    except Exception as e:
+        print(f"⚠️ Could not load stored accounts: {e}")
+
 def load_accounts():
-    """Load accounts from environment variables and then from Redis."""
+    """Load accounts from environment variables and then from the storage backend."""
     global WHATSAPP_ACCOUNTS
-    accounts = load_accounts_from_env()
-    if redis_client:
-        try:
-            stored_accounts = redis_client.get(REDIS_ACCOUNTS_KEY)
-            if stored_accounts:
-                accounts.update(json.loads(stored_accounts))
-                print("✅ Loaded additional accounts from Redis.")
-        except Exception as e:
-            print(f"⚠️ Could not load accounts from Redis: {e}")
-    WHATSAPP_ACCOUNTS = accounts
+    WHATSAPP_ACCOUNTS = load_accounts_from_env()
+    merge_stored_accounts()
 
-def save_accounts():
-    """Save the current accounts dictionary to Redis."""
-    if redis_client:
-        try:
-            redis_client.set(REDIS_ACCOUNTS_KEY, json.dumps(WHATSAPP_ACCOUNTS))
-            print("✅ Saved accounts to Redis.")
-        except Exception as e:
-            print(f"⚠️ Could not save accounts to Redis: {e}")
+def save_account(account_id):
+    """Save one account to the storage backend (buffered while Redis is down)."""
+    try:
+        if account_id in WHATSAPP_ACCOUNTS:
+            saved = storage.upsert_account(account_id, WHATSAPP_ACCOUNTS[account_id])
+        else:
+            saved = storage.delete_account(account_id)
+        if saved:
+            print(f"✅ Saved account {account_id}.")
+        else:
+            print(f"⚠️ Redis unavailable, account {account_id} will be saved when it recovers.")
+        if near_cache:
+            redis_manager.write([], transient=[near_cache.invalidation_command(f"account:{account_id}")])
+    except Exception as e:
+        print(f"⚠️ Could not save account {account_id}: {e}")
+
+def reload_account(key):
+    """Near cache handler: pick up an account another worker added, changed or deleted."""
+    account_id = key.split(":", 1)[1]
+    stored_accounts = storage.accounts()
+    if stored_accounts is None:
+        return
+    if account_id in stored_accounts:
+        WHATSAPP_ACCOUNTS[account_id] = stored_accounts[account_id]
+    elif account_id != DEFAULT_ACCOUNT_ID:
+        WHATSAPP_ACCOUNTS.pop(account_id, None)
+    template_catalog.invalidate(account_id)
 
 def get_account_config(account_id):
     return WHATSAPP_ACCOUNTS.get(account_id)
@@ -138,11 +426,32 @@ def get_all_accounts():
             "name": config["name"],
             "phone_number_id": config["phone_number_id"],
             "business_account_id": config["business_account_id"],
-            "status": config["status"]
+            "status": config["status"],
+            "default_region": get_account_region(account_id),
+            "send_weight": get_account_send_weight(account_id)
         }
         for account_id, config in WHATSAPP_ACCOUNTS.items()
     ]
 
+def get_account_region(account_id):
+    account = get_account_config(account_id) or {}
+    return phone_normalizer.region_for(account.get("default_region"))
+
+def get_account_send_weight(account_id):
+    account = get_account_config(account_id) or {}
+    return account.get("send_weight", 1)
+
+def parse_send_weight(value):
+    """A positive send_weight as a number, or None if it isn't one."""
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not 0 < weight <= 1000:
+        return None
+    return int(weight) if weight.is_integer() else weight
+
+@tracer.traced("route_account")
 def get_account_by_phone_number_id(phone_number_id):
     for account_id, config in WHATSAPP_ACCOUNTS.items():
         if config.get('phone_number_id') == phone_number_id:
@@ -156,15 +465,14 @@ def get_account_by_ids(business_account_id, phone_number_id):
             return account_id
     return None
 
-# ... (rest of the helper functions like normalize_phone_number, store_message, etc.)
-
 
 # --- API Endpoints ---
 
 @app.route("/api/accounts", methods=["GET"])
 def get_accounts_api():
     """Get all available WhatsApp accounts."""
-    return jsonify({"status": "success", "accounts": get_all_accounts()})
+    accounts = get_all_accounts()
+    return jsonify({"status": "success", "accounts": accounts, "count": len(accounts)})
 
 @app.route("/api/accounts/add", methods=["POST"])
 def add_account_api():
@@ -172,6 +480,10 @@ def add_account_api():
     data = request.get_json()
     if not data or not all(k in data for k in ['id', 'name', 'token', 'phone_number_id', 'business_account_id']):
         return jsonify({"status": "error", "message": "Missing required account data"}), 400
+    if data.get('default_region') and str(data['default_region']).upper() not in phone_normalizer.regions:
+        return jsonify({"status": "error", "message": f"Unknown default_region: {data['default_region']}"}), 400
+    if 'send_weight' in data and parse_send_weight(data['send_weight']) is None:
+        return jsonify({"status": "error", "message": "send_weight must be a number between 0 and 1000"}), 400
 
     account_id = data['id']
     if account_id in WHATSAPP_ACCOUNTS:
@@ -184,8 +496,12 @@ def add_account_api():
         "business_account_id": data['business_account_id'],
         "status": data.get('status', 'active')
     }
+    if data.get('default_region'):
+        new_account["default_region"] = str(data['default_region']).upper()
+    if 'send_weight' in data:
+        new_account["send_weight"] = parse_send_weight(data['send_weight'])
     WHATSAPP_ACCOUNTS[account_id] = new_account
-    save_accounts()
+    save_account(account_id)
     return jsonify({"status": "success", "message": "Account added successfully", "account": new_account}), 201
 
 @app.route("/api/accounts/<account_id>/update", methods=["PUT"])
@@ -197,13 +513,22 @@ def update_account_api(account_id):
     data = request.get_json()
     if not data:
         return jsonify({"status": "error", "message": "No update data provided"}), 400
+    if data.get('default_region'):
+        if str(data['default_region']).upper() not in phone_normalizer.regions:
+            return jsonify({"status": "error", "message": f"Unknown default_region: {data['default_region']}"}), 400
+        data['default_region'] = str(data['default_region']).upper()
+    if 'send_weight' in data:
+        data['send_weight'] = parse_send_weight(data['send_weight'])
+        if data['send_weight'] is None:
+            return jsonify({"status": "error", "message": "send_weight must be a number between 0 and 1000"}), 400
 
     # Update only the provided fields
-    for key in ['name', 'token', 'phone_number_id', 'business_account_id', 'status']:
+    for key in ['name', 'token', 'phone_number_id', 'business_account_id', 'status', 'default_region', 'send_weight']:
         if key in data:
             WHATSAPP_ACCOUNTS[account_id][key] = data[key]
-    
-    save_accounts()
+    template_catalog.invalidate(account_id)
+
+    save_account(account_id)
     return jsonify({"status": "success", "message": "Account updated successfully", "account": WHATSAPP_ACCOUNTS[account_id]})
 
 @app.route("/api/accounts/<account_id>/delete", methods=["DELETE"])
@@ -217,54 +542,29 @@ def delete_account_api(account_id):
         return jsonify({"status": "error", "message": "Cannot delete the default main account"}), 403
 
     deleted_account = WHATSAPP_ACCOUNTS.pop(account_id)
-    save_accounts()
+    save_account(account_id)
     return jsonify({"status": "success", "message": f"Account '{deleted_account['name']}' deleted successfully"})
 
 
-# ... (rest of the file from send_whatsapp_message onwards, with modifications to use account_id)
-
-# In initialize_bot():
-# ...
-# load_accounts()
-# ...
-
-if __name__ == "__main__":
-    load_accounts()
-    port = int(os.getenv("PORT", 8000))
-    print(f"🚀 Starting server with WebSocket support on port {port}")
-    socketio.run(app, host="0.0.0.0", port=port, debug=False, allow_unsafe_werkzeug=True)
-
-
-def normalize_phone_number(phone_number):
+def normalize_phone_number(phone_number, account_id=None):
     """
-    Normalize phone number to consistent format for Nigerian numbers
+    Normalize a phone number to E.164 digits (without the + prefix).
+    Local numbers are read in the account's default region.
 
-    Examples:
+    Examples (default region NG):
     - 09025794407 → 2349025794407
     - +2349025794407 → 2349025794407
     - 2349025794407 → 2349025794407
+    - +44 (0)7911 123456 → 447911123456
     """
-    if not phone_number:
-        return phone_number
-
-    # Remove all non-digit characters
-    digits_only = ''.join(filter(str.isdigit, phone_number))
-
-    # Handle Nigerian numbers
-    if digits_only.startswith('234'):
-        # Already in international format without +
-        return digits_only
-    elif digits_only.startswith('0') and len(digits_only) == 11:
-        # Local Nigerian format (0XXXXXXXXXX) → international (234XXXXXXXXXX)
-        return '234' + digits_only[1:]
-    elif len(digits_only) == 10:
-        # Missing leading 0, assume Nigerian local format
-        return '234' + digits_only
-    else:
-        # Return as-is for other formats
-        return digits_only
+    return phone_normalizer.normalize(phone_number, get_account_region(account_id or DEFAULT_ACCOUNT_ID))
+
+def normalize_phone_numbers(phone_numbers, account_id=None):
+    """{input: normalized} for a recipient list, normalizing each distinct input once."""
+    return phone_normalizer.normalize_many(phone_numbers, get_account_region(account_id or DEFAULT_ACCOUNT_ID))
 
-def store_message(phone_number, message_text, sender_type, message_id=None, timestamp=None, account_id=None):
+@tracer.traced()
+def store_message(phone_number, message_text, sender_type, message_id=None, timestamp=None, account_id=None, media=None):
     """
     Store a message in both Redis and in-memory store, then emit WebSocket event
 
@@ -275,6 +575,7 @@ def store_message(phone_number, message_text, sender_type, message_id=None, time
         message_id: WhatsApp message ID (optional)
         timestamp: Message timestamp (optional, defaults to now)
         account_id: Account ID for multi-account support (optional, defaults to main)
+        media: Compact media reference {"id", "kind", "mime_type", "filename"} (optional)
     """
     if timestamp is None:
         timestamp = datetime.now().isoformat()
@@ -283,7 +584,9 @@ def store_message(phone_number, message_text, sender_type, message_id=None, time
         account_id = DEFAULT_ACCOUNT_ID
 
     # Normalize phone number using comprehensive normalization
-    normalized_phone = normalize_phone_number(phone_number)
+    normalized_phone = normalize_phone_number(phone_number, account_id)
+
+    version, version_command = conversation_versions.bump(account_id, normalized_phone)
 
     message_data = {
         'id': message_id or f"{sender_type}_{len(message_store[account_id][normalized_phone])}_{timestamp}",
@@ -291,76 +594,154 @@ def store_message(phone_number, message_text, sender_type, message_id=None, time
         'type': sender_type,
         'timestamp': timestamp,
         'phone_number': normalized_phone,
-        'account_id': account_id
+        'account_id': account_id,
+        'version': version
     }
+    if media:
+        message_data['media'] = media
 
     # Store in in-memory store (fallback)
     message_store[account_id][normalized_phone].append(message_data)
 
-    # Store in Redis if available
-    if redis_client:
+    # Index for full-text search (batched in the background)
+    if search_index:
         try:
-            # Store message in Redis list with account-specific key
-            redis_key = f"messages:{account_id}:{normalized_phone}"
-            redis_client.lpush(redis_key, json.dumps(message_data))
-
-            # Keep only last 100 messages per contact
-            redis_client.ltrim(redis_key, 0, 99)
-
-            # Publish real-time update with account information
-            redis_client.publish('message_updates', json.dumps({
-                'type': 'new_message',
-                'account_id': account_id,
-                'phone_number': normalized_phone,
-                'message': message_data
-            }))
-
+            search_index.add(message_data)
+        except Exception as e:
+            print(f"⚠️ Search indexing failed: {e}")
+
+    # Store in Redis (and the storage backend); while Redis is down the write is buffered and replayed on recovery
+    redis_commands = storage.append_commands(account_id, normalized_phone, message_data) + [version_command]
+    if sender_type == 'incoming':
+        # Opens (or extends) the 24-hour customer service window
+        redis_commands.append(service_window.record_inbound(account_id, normalized_phone))
+    # Unread, traffic and active contact counters for /api/accounts/<id>/stats
+    redis_commands.extend(account_stats.record_commands(account_id, normalized_phone, sender_type,
+                                                        message_id=message_data['id']))
+    if MESSAGE_STREAM_ENABLED:
+        # Durable log for consumer groups (analytics, CRM sync, ...)
+        redis_commands.append(message_stream.append_command(
+            account_id, message_data,
+            maxlen=MESSAGE_STREAM_MAXLEN,
+            retention_hours=MESSAGE_STREAM_RETENTION_HOURS
+        ))
+    # Publish real-time update with account information
+    redis_transient = [redis_manager.publish_command(account_channel(account_id, 'message_updates'), json.dumps({
+        'type': 'new_message',
+        'account_id': account_id,
+        'phone_number': normalized_phone,
+        'message': message_data
+    }))]
+    if near_cache:
+        # Other workers drop their cached copy once the write has landed; this one right away
+        redis_transient.append(near_cache.invalidation_command(history_key(account_id, normalized_phone)))
+        near_cache.invalidate(history_key(account_id, normalized_phone))
+    with tracer.span("redis.write", write_behind=bool(write_behind)):
+        try:
+            if write_behind:
+                write_behind.enqueue(redis_commands, redis_transient)
+            else:
+                redis_manager.write(redis_commands, transient=redis_transient)
         except Exception as e:
             print(f"⚠️ Redis storage failed: {e}")
 
     print(f"📝 Stored {sender_type} message for {normalized_phone} (Account: {account_id}): '{message_text[:50]}...'")
 
-    # Emit WebSocket event for real-time updates with account information
-    try:
-        socketio.emit('new_message', {
+    # Queue a WebSocket event for the account's clients (sent by the fan-out thread)
+    with tracer.span("socketio.emit"):
+        socket_fanout.publish('new_message', {
             'account_id': account_id,
             'phone_number': normalized_phone,
             'message': message_data
-        })
-    except Exception as e:
-        print(f"⚠️ WebSocket emit failed: {e}")
+        }, account_id)
 
     return message_data
 
-def get_messages_from_redis(phone_number, account_id=None):
+def get_stored_messages(phone_number, account_id=None):
     """
-    Get messages for a phone number from Redis for a specific account
+    The newest HISTORY_LIMIT messages of a conversation from the storage backend, oldest first
     """
-    if not redis_client:
-        return []
-
     if account_id is None:
         account_id = DEFAULT_ACCOUNT_ID
 
-    try:
-        normalized_phone = normalize_phone_number(phone_number)
-        redis_key = f"messages:{account_id}:{normalized_phone}"
+    normalized_phone = normalize_phone_number(phone_number, account_id)
+    if near_cache is None:
+        return storage.history(account_id, normalized_phone, 0, HISTORY_LIMIT - 1)
+    return near_cache.get(
+        history_key(account_id, normalized_phone),
+        lambda: storage.history(account_id, normalized_phone, 0, HISTORY_LIMIT - 1)
+    )
 
-        # Get messages from Redis (they're stored in reverse order)
-        message_strings = redis_client.lrange(redis_key, 0, -1)
-        messages = []
+def load_conversation(account_id, phone_number, messages):
+    """Put a stored conversation in the in-memory store, ahead of anything received since startup."""
+    conversation = message_store[account_id][phone_number]
+    seen = {message.get('id') for message in conversation}
+    conversation[:0] = [message for message in messages if message.get('id') not in seen]
+
+def warm_up_worker():
+    """Preload recent conversations of the active accounts, then report ready (see worker_lifecycle)."""
+    def warm():
+        account_ids = [account_id for account_id in list(WHATSAPP_ACCOUNTS) if validate_account_id(account_id)]
+        return warm_up(storage, account_ids, load_conversation,
+                       max_contacts=WARMUP_CONTACTS, batch_size=WARMUP_BATCH_SIZE, history_limit=HISTORY_LIMIT)
+
+    counts = worker_lifecycle.run_warm_up(warm)
+    if "error" not in counts and not counts.get("running"):
+        print(f"🔥 Warmed up {counts['contacts']} conversation(s), {counts['messages']} message(s) "
+              f"of {counts['accounts']} account(s) in {counts['ms']}ms")
+
+def drain_worker():
+    """Take this worker out of service and finish its work; returns the drain report."""
+    return worker_lifecycle.drain()
+
+def record_media_download(job, sha256, size):
+    """Downloader callback: map the WhatsApp media ID to its stored content."""
+    account_id, media_id = job["account_id"], job["media_id"]
+    info = {"sha256": sha256, "mime_type": job.get("mime_type"), "size": size}
+    media_index[(account_id, media_id)] = info
+    try:
+        redis_manager.write([("hset", account_key(account_id, "media"), media_id, json.dumps(info))])
+    except Exception as e:
+        print(f"⚠️ Redis media index update failed: {e}")
 
-        for msg_str in reversed(message_strings):  # Reverse to get chronological order
-            try:
-                message_data = json.loads(msg_str)
-                messages.append(message_data)
-            except json.JSONDecodeError:
-                continue
+    print(f"📎 Stored media {media_id} as {sha256} ({size} bytes, Account: {account_id})")
+    socket_fanout.publish('media_ready', {'account_id': account_id, 'media_id': media_id, 'sha256': sha256}, account_id)
 
-        return messages
+def record_media_failure(job, reason, error):
+    """Downloader callback: remember that a media ID won't be downloaded, and why."""
+    account_id, media_id = job["account_id"], job["media_id"]
+    info = {"error": reason, "message": error}
+    media_index[(account_id, media_id)] = info
+    try:
+        redis_manager.write([("hset", account_key(account_id, "media"), media_id, json.dumps(info))])
     except Exception as e:
-        print(f"⚠️ Redis get messages failed: {e}")
-        return []
+        print(f"⚠️ Redis media index update failed: {e}")
+
+def get_media_info(account_id, media_id):
+    """
+    Look up where a downloaded media ID is stored ({"error", "message"} if its
+    download failed); None while it is still downloading.
+    """
+    info = media_index.get((account_id, media_id))
+    if info is None:
+        client = get_redis_client()
+        if client:
+            try:
+                stored = client.hget(account_key(account_id, "media"), media_id)
+                if stored:
+                    info = media_index[(account_id, media_id)] = json.loads(stored)
+            except Exception as e:
+                redis_manager.record_error(e)
+    return info
+
+media_downloader = MediaDownloader(
+    media_store,
+    GRAPH_API_VERSION,
+    get_token=lambda account_id: get_account_config(account_id)["token"],
+    on_complete=record_media_download,
+    on_failure=record_media_failure,
+    workers=MEDIA_DOWNLOAD_WORKERS
+)
 
 def get_phone_number_id():
     """
@@ -390,6 +771,7 @@ def get_phone_number_id():
             print(f"Response: {e.response.text}")
         return None
 
+@tracer.traced()
 def verify_webhook_signature(payload, signature):
     """
     Verify webhook signature for security
@@ -405,7 +787,49 @@ def verify_webhook_signature(payload, signature):
     
     return hmac.compare_digest(f"sha256={expected_signature}", signature)
 
-def send_whatsapp_message(to_phone_number, message_text, message_type="text", account_id=None):
+def load_account_templates(account_id):
+    account = get_account_config(account_id)
+    return fetch_templates(GRAPH_API_VERSION, account["business_account_id"], account["token"])
+
+template_catalog = TemplateCatalog(load_account_templates, ttl=TEMPLATE_CACHE_TTL)
+
+def get_template_from_request(data):
+    """
+    Read template name, language and components from a send request body,
+    falling back to the default hello_world template.
+    """
+    template = data.get("template")
+    if isinstance(template, dict):
+        return {
+            "name": template.get("name", DEFAULT_TEMPLATE["name"]),
+            "language": template.get("language", DEFAULT_TEMPLATE["language"]),
+            "components": template.get("components", [])
+        }
+    return {
+        "name": template or data.get("template_name") or DEFAULT_TEMPLATE["name"],
+        "language": data.get("language", DEFAULT_TEMPLATE["language"]),
+        "components": data.get("components", [])
+    }
+
+def get_fallback_template(data):
+    """Template to use when a text send falls outside the 24-hour window, or None."""
+    fallback = data.get("fallback_template")
+    if fallback:
+        return get_template_from_request({"template": fallback, "language": data.get("language", DEFAULT_TEMPLATE["language"])})
+    if SERVICE_WINDOW_FALLBACK_TEMPLATE:
+        name, _, language = SERVICE_WINDOW_FALLBACK_TEMPLATE.partition(":")
+        return {"name": name, "language": language or DEFAULT_TEMPLATE["language"], "components": []}
+    return None
+
+def outgoing_message_text(message, result):
+    """Text to store for a successful send (records the template when the window forced one)."""
+    if result.get("sent_as") == "template":
+        return f"[Template: {result['template']}]"
+    return message
+
+@tracer.traced()
+def send_whatsapp_message(to_phone_number, message_text, message_type="text", account_id=None, template=None,
+                          fallback_template=None):
     """
     Send a message via WhatsApp Business API
 
@@ -414,6 +838,12 @@ def send_whatsapp_message(to_phone_number, message_text, message_type="text", ac
         message_text (str): Message content to send
         message_type (str): Type of message ("text" or "template")
         account_id (str): Account ID to send from (optional, defaults to main)
+        template (dict): {"name", "language", "components"} for template sends
+            (optional, defaults to hello_world). Validated against the cached
+            template catalog before anything is sent.
+        fallback_template (dict): Template sent instead of a text message when
+            the recipient's 24-hour window has closed (optional; without one
+            such sends are rejected locally)
 
     Returns:
         dict: API response with detailed status
@@ -436,22 +866,55 @@ def send_whatsapp_message(to_phone_number, message_text, message_type="text", ac
     }
 
     # Format phone number for WhatsApp API (needs + prefix and international format)
-    normalized_phone = normalize_phone_number(to_phone_number)
+    normalized_phone = normalize_phone_number(to_phone_number, account_id)
     formatted_phone = f"+{normalized_phone}"
 
+    sent_as = message_type
+    if message_type == "text" and SERVICE_WINDOW_POLICY != "off":
+        # Free-form messages are only delivered within 24h of the contact's last
+        # message; an unknown window (Redis down) is left for the Graph API to decide
+        if service_window.is_open(account_id, normalized_phone) is False:
+            if not fallback_template:
+                print(f"❌ Text send to {formatted_phone} rejected locally: 24-hour window closed")
+                return {
+                    "success": False,
+                    "error": "Recipient's 24-hour customer service window is closed; send a template message instead",
+                    "window_closed": True,
+                    "phone_number": formatted_phone
+                }
+            print(f"🔁 24-hour window closed for {formatted_phone}; sending template '{fallback_template['name']}'")
+            message_type, template = "template", fallback_template
+
     if message_type == "template":
+        template = template or DEFAULT_TEMPLATE
+
+        # Reject malformed template sends locally instead of paying for a Graph error
+        validation_errors = template_catalog.validate(
+            account_id, template["name"], template["language"], template.get("components")
+        )
+        if validation_errors:
+            print(f"❌ Template send rejected locally: {validation_errors}")
+            return {
+                "success": False,
+                "error": "; ".join(validation_errors),
+                "validation_errors": validation_errors,
+                "phone_number": formatted_phone
+            }
+
         # Send template message (for first contact)
         payload = {
             "messaging_product": "whatsapp",
             "to": formatted_phone,
             "type": "template",
             "template": {
-                "name": "hello_world",  # Default template
+                "name": template["name"],
                 "language": {
-                    "code": "en_US"
+                    "code": template["language"]
                 }
             }
         }
+        if template.get("components"):
+            payload["template"]["components"] = template["components"]
     else:
         # Send regular text message
         payload = {
@@ -471,7 +934,9 @@ def send_whatsapp_message(to_phone_number, message_text, message_type="text", ac
         print(f"API URL: {api_url}")
         print(f"Payload: {json.dumps(payload, indent=2)}")
 
-        response = requests.post(api_url, headers=headers, json=payload)
+        with tracer.span("graph_api.send", account_id=account_id, message_type=message_type) as span:
+            response = requests.post(api_url, headers=headers, json=payload)
+            span.set("http.status_code", response.status_code)
         response_data = response.json()
 
         print(f"API Response Status: {response.status_code}")
@@ -479,12 +944,16 @@ def send_whatsapp_message(to_phone_number, message_text, message_type="text", ac
 
         if response.status_code == 200:
             print(f"✅ Message sent successfully to {formatted_phone}")
-            return {
+            result = {
                 "success": True,
                 "response": response_data,
                 "message_id": response_data.get("messages", [{}])[0].get("id"),
                 "phone_number": formatted_phone
             }
+            if sent_as != message_type:
+                result["sent_as"] = message_type
+                result["template"] = template["name"]
+            return result
         else:
             error_msg = response_data.get("error", {}).get("message", "Unknown error")
             print(f"❌ Failed to send message: {error_msg}")
@@ -517,7 +986,131 @@ def send_whatsapp_message(to_phone_number, message_text, message_type="text", ac
             "phone_number": formatted_phone
         }
 
-# Auto-reply function removed - no longer generating automatic responses
+def queue_whatsapp_message(to_phone_number, message_text, message_type="text", account_id=None, template=None,
+                           fallback_template=None, priority=INTERACTIVE):
+    """
+    send_whatsapp_message() through the outbound scheduler: waits for a sender
+    thread in the account's fair share of the priority lane ("interactive" or
+    "bulk") and returns the send's result.
+    """
+    if account_id is None:
+        account_id = DEFAULT_ACCOUNT_ID
+    claim = g.get("idempotency") if has_request_context() else None
+    if claim is not None:
+        claim["attempted"] = True
+    if not OUTBOUND_QUEUE_ENABLED:
+        result = send_whatsapp_message(to_phone_number, message_text, message_type, account_id,
+                                       template=template, fallback_template=fallback_template)
+    else:
+        with tracer.span("outbound.queue", lane=priority) as span:
+            try:
+                future = outbound_scheduler.submit(priority, account_id, send_whatsapp_message, to_phone_number,
+                                                   message_text, message_type, account_id, template=template,
+                                                   fallback_template=fallback_template)
+            except QueueFull as e:
+                print(f"❌ Send to {to_phone_number} rejected: {e}")
+                return {"success": False, "error": str(e), "queue_full": True, "phone_number": to_phone_number}
+            result = future.result()
+            span.set("queue_wait_ms", round(future.queue_wait * 1000, 3))
+    if claim is not None:
+        # Keep the outcome before anything else can fail, so a retry can't send twice
+        body = {"status": "success" if result["success"] else "error", "message_id": result.get("message_id"),
+                "phone_number": result.get("phone_number"), "message": result.get("error")}
+        idempotency_store.complete(claim["scope"], claim["key"], claim["token"], claim["fingerprint"],
+                                   200 if result["success"] else 400, body)
+    return result
+
+def get_send_priority(data):
+    """The request's "priority" lane (default interactive), or None if it isn't one."""
+    priority = (data.get("priority") or INTERACTIVE).lower()
+    return priority if priority in LANES else None
+
+def idempotent(view):
+    """Run a request with an Idempotency-Key header once; replay its response to retries."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return view(*args, **kwargs)
+        if not idempotency.valid_key(key):
+            return jsonify({"error": f"Idempotency-Key must be 1-{idempotency.MAX_KEY_LENGTH} printable characters"}), 400
+
+        scope = request.path
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        with tracer.span("idempotency.begin"):
+            state, record = idempotency_store.begin(scope, key, fingerprint)
+        if state is None:
+            return jsonify({"error": "Redis unavailable; requests with an Idempotency-Key can't be accepted"}), 503
+        if state == idempotency.MISMATCH:
+            return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+        if state == idempotency.IN_PROGRESS:
+            return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409, {"Retry-After": "1"}
+        if state == idempotency.REPLAY:
+            return jsonify(record["body"]), record["status"], {"Idempotent-Replayed": "true"}
+
+        token = record  # PROCEED comes with the claim's token
+        # queue_whatsapp_message() marks the send as attempted and stores its outcome
+        g.idempotency = claim = {"scope": scope, "key": key, "token": token, "fingerprint": fingerprint,
+                                 "attempted": False}
+        response = None
+        try:
+            with idempotency_store.hold(scope, key, token):
+                response = make_response(view(*args, **kwargs))
+        finally:
+            if response is not None and response.status_code < 500:
+                idempotency_store.complete(scope, key, token, fingerprint, response.status_code,
+                                           response.get_json(silent=True))
+            elif not claim["attempted"]:
+                idempotency_store.release(scope, key, token)  # nothing was sent; let the retry run
+            # Otherwise a retry gets the send's stored outcome (or, if the send itself
+            # blew up, a 409 until the marker expires) rather than a second send
+        return response
+    return wrapper
+
+def send_scheduled_message(job):
+    """Send a due scheduled message and store it like any other outgoing message."""
+    with tracer.root("send_scheduled_message", account_id=job["account_id"], job_id=job["id"]):
+        result = queue_whatsapp_message(job["to"], job["message"], job["type"], job["account_id"],
+                                        template=job.get("template"), fallback_template=job.get("fallback_template"),
+                                        priority=BULK)
+        if result["success"]:
+            store_message(
+                phone_number=job["to"],
+                message_text=outgoing_message_text(job["message"], result),
+                sender_type='outgoing',
+                message_id=result.get('message_id'),
+                timestamp=datetime.now().isoformat(),
+                account_id=job["account_id"]
+            )
+        return result
+
+message_scheduler = MessageScheduler(
+    redis_manager,
+    send=send_scheduled_message,
+    batch_size=SCHEDULER_BATCH_SIZE,
+    lease_seconds=SCHEDULER_LEASE_SECONDS,
+    concurrency=SCHEDULER_CONCURRENCY
+)
+
+def send_auto_response(account_id, phone_number, rule):
+    """Send the reply of a matched auto-response rule and store it."""
+    message_type = "template" if rule.get("template") else "text"
+    template = get_template_from_request(rule) if message_type == "template" else None
+    message = rule.get("response", "")
+    with tracer.root("send_auto_response", account_id=account_id, rule_id=rule.get("id", "")):
+        result = queue_whatsapp_message(phone_number, message, message_type, account_id, template=template)
+        if result["success"]:
+            store_message(
+                phone_number=phone_number,
+                message_text=message if message_type == "text" else f"[Template: {template['name']}]",
+                sender_type='outgoing',
+                message_id=result.get('message_id'),
+                timestamp=datetime.now().isoformat(),
+                account_id=account_id
+            )
+        return result
+
+auto_responder = AutoResponder(redis_manager, send=send_auto_response, refresh_interval=AUTO_RESPONSE_REFRESH_SECONDS)
 
 @app.route("/webhook", methods=["GET"])
 def verify_webhook():
@@ -600,8 +1193,8 @@ def handle_webhook():
                                 print(f"💬 Message content: '{message_text}'")
 
                                 # Store incoming message with account ID
-                                store_message(
-                                    phone_number=sender_phone,
+                                stored = store_message(
+                                    phone_number=f"+{sender_phone}",  # "from" is always international
                                     message_text=message_text,
                                     sender_type='incoming',
                                     message_id=message_id,
@@ -610,7 +1203,39 @@ def handle_webhook():
                                 )
 
                                 print(f"✅ Message received and stored successfully from {sender_phone}")
-                                # Auto-reply functionality removed - messages are received and stored only
+                                if AUTO_RESPONSES_ENABLED:
+                                    # Reply is sent in the background
+                                    rule = auto_responder.handle_incoming(account_id, stored["phone_number"], message_text)
+                                    if rule:
+                                        print(f"🤖 Auto-response rule '{rule['id']}' matched for {sender_phone}")
+                            elif message_type in MEDIA_MESSAGE_TYPES:
+                                media_object = message.get(message_type, {})
+                                media_id = media_object.get("id")
+                                caption = media_object.get("caption", "")
+                                print(f"📎 Media content: {message_type} {media_id} ({media_object.get('mime_type')})")
+
+                                # Store only a compact reference; the file is downloaded in the background
+                                store_message(
+                                    phone_number=f"+{sender_phone}",  # "from" is always international
+                                    message_text=caption or f"[{message_type}]",
+                                    sender_type='incoming',
+                                    message_id=message_id,
+                                    timestamp=datetime.now().isoformat(),
+                                    account_id=account_id,
+                                    media={
+                                        "id": media_id,
+                                        "kind": message_type,
+                                        "mime_type": media_object.get("mime_type"),
+                                        "filename": media_object.get("filename"),
+                                        "url": f"/api/accounts/{account_id}/media/{media_id}"
+                                    }
+                                )
+                                if media_id:
+                                    media_downloader.enqueue(
+                                        account_id, media_id,
+                                        mime_type=media_object.get("mime_type"),
+                                        filename=media_object.get("filename")
+                                    )
                             else:
                                 print(f"⚠️ Unsupported message type: {message_type}")
         else:
@@ -625,10 +1250,14 @@ def handle_webhook():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/send", methods=["POST"])
+@idempotent
 def send_message_endpoint():
     """
     Manual endpoint to send messages (supports multi-account)
     Usage: POST /send with JSON body: {"to": "phone_number", "message": "text", "type": "text|template", "business_id": "your_business_id", "phone_id": "your_phone_id"}
+    Text sends outside the 24-hour window use "fallback_template" (name or {"name", "language", "components"}) if given
+    Campaign traffic should add "priority": "bulk" so that interactive replies go first
+    Retries carrying the same Idempotency-Key header get the first response back instead of a second send
     """
     try:
         data = request.get_json()
@@ -647,18 +1276,24 @@ def send_message_endpoint():
         if message_type == "text" and not message:
             return jsonify({"error": "Missing 'message' parameter for text messages"}), 400
 
+        priority = get_send_priority(data)
+        if priority is None:
+            return jsonify({"error": f"'priority' must be one of: {', '.join(LANES)}"}), 400
+
         account_id = get_account_by_ids(business_id, phone_id)
 
         if not account_id:
             return jsonify({"error": f"No account found for business_id {business_id} and phone_id {phone_id}"}), 404
 
-        result = send_whatsapp_message(to_phone, message, message_type, account_id)
+        template = get_template_from_request(data) if message_type == "template" else None
+        result = queue_whatsapp_message(to_phone, message, message_type, account_id, template=template,
+                                        fallback_template=get_fallback_template(data), priority=priority)
 
         if result["success"]:
             # Store outgoing message with account ID
             store_message(
                 phone_number=to_phone,
-                message_text=message,
+                message_text=outgoing_message_text(message, result),
                 sender_type='outgoing',
                 message_id=result.get('message_id'),
                 timestamp=datetime.now().isoformat(),
@@ -671,6 +1306,7 @@ def send_message_endpoint():
                 "message_id": result.get("message_id"),
                 "phone_number": result["phone_number"],
                 "account_id": account_id,
+                "sent_as": result.get("sent_as", message_type),
                 "delivery_info": "Message accepted by WhatsApp API. Delivery depends on recipient's opt-in status and 24-hour messaging window."
             }), 200
         else:
@@ -679,6 +1315,7 @@ def send_message_endpoint():
                 "message": result["error"],
                 "phone_number": result["phone_number"],
                 "account_id": account_id,
+                "window_closed": result.get("window_closed", False),
                 "details": result.get("response", {})
             }), 400
 
@@ -689,16 +1326,26 @@ def send_message_endpoint():
 def send_template_message_endpoint():
     """
     Send template message (for first contact)
-    Usage: POST /send-template with JSON body: {"to": "phone_number"}
+    Usage: POST /send-template with JSON body: {"to": "phone_number", "template": "name", "language": "en_US",
+           "components": [...], "account_id": "main", "priority": "interactive|bulk"} (template defaults to hello_world)
     """
     try:
         data = request.get_json()
         to_phone = data.get("to")
+        account_id = data.get("account_id", DEFAULT_ACCOUNT_ID)
 
         if not to_phone:
             return jsonify({"error": "Missing 'to' parameter"}), 400
 
-        result = send_whatsapp_message(to_phone, "", "template")
+        if not validate_account_id(account_id):
+            return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+        priority = get_send_priority(data)
+        if priority is None:
+            return jsonify({"error": f"'priority' must be one of: {', '.join(LANES)}"}), 400
+
+        result = queue_whatsapp_message(to_phone, "", "template", account_id, template=get_template_from_request(data),
+                                        priority=priority)
 
         if result["success"]:
             return jsonify({
@@ -713,7 +1360,8 @@ def send_template_message_endpoint():
                 "status": "error",
                 "message": result["error"],
                 "phone_number": result["phone_number"],
-                "details": result.get("response", {})
+                "details": result.get("response", {}),
+                "validation_errors": result.get("validation_errors", [])
             }), 400
 
     except Exception as e:
@@ -928,7 +1576,7 @@ def test_incoming_message():
 
                             # Store incoming message
                             store_message(
-                                phone_number=sender_phone,
+                                phone_number=f"+{sender_phone}",  # "from" is always international
                                 message_text=message_text,
                                 sender_type='incoming',
                                 message_id=message_id,
@@ -989,83 +1637,58 @@ def enhanced_chat_interface():
     """
     Enhanced web chat interface with contacts and message history
     """
-    return render_template("enhanced_chat.html")
+    return render_template("enhanced_chat.html", phone_rules={
+        "regions": phone_normalizer.client_rules(),
+        "default_region": phone_normalizer.default_region,
+        "account_regions": {account_id: get_account_region(account_id) for account_id in WHATSAPP_ACCOUNTS}
+    })
 
 @app.route("/api/status")
 def api_status():
     """
     API endpoint to check bot status
     """
-    return jsonify({
+    response = jsonify({
         "status": "online",
         "phone_number_id": PHONE_NUMBER_ID,
         "business_account_id": WHATSAPP_BUSINESS_ACCOUNT_ID,
-        "webhook_url": WEBHOOK_URL
+        "webhook_url": WEBHOOK_URL,
+        "redis": redis_manager.stats(),
+        "write_behind": write_behind.stats() if write_behind else None,
+        "media": media_downloader.stats(),
+        "scheduler": message_scheduler.stats() if SCHEDULER_ENABLED else None,
+        "auto_responses": auto_responder.stats() if AUTO_RESPONSES_ENABLED else None,
+        "outbound": outbound_scheduler.stats() if OUTBOUND_QUEUE_ENABLED else None,
+        "idempotency": idempotency_store.stats(),
+        "storage": storage.stats(),
+        "near_cache": near_cache.stats() if near_cache else None,
+        "websocket": socket_fanout.stats(),
+        "lifecycle": worker_lifecycle.stats(),
+        "startup": STARTUP_TIMINGS
     })
+    # Pollers get a bodiless 304 while nothing has changed
+    response.add_etag()
+    return response.make_conditional(request)
 
-# Multi-Account Management APIs
-@app.route("/api/accounts", methods=["GET"])
-def get_accounts_api():
+@app.route("/ready")
+def readiness():
     """
-    Get all available WhatsApp accounts
+    Readiness probe: 200 once this worker has warmed up, 503 while it starts or drains
+    Usage: GET /ready
     """
-    try:
-        accounts = get_all_accounts()
-        return jsonify({
-            "status": "success",
-            "accounts": accounts,
-            "count": len(accounts)
-        }), 200
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
-
-@app.route("/api/accounts/add", methods=["POST"])
-def add_account_api():
-    """
-    Add a new WhatsApp account
-    """
-    try:
-        data = request.get_json()
-        account_id = data.get("id")
-        account_name = data.get("name")
-        account_token = data.get("token")
-        account_phone_number_id = data.get("phone_number_id")
-        account_business_account_id = data.get("business_account_id")
-
-        if not all([account_id, account_name, account_token, account_phone_number_id, account_business_account_id]):
-            return jsonify({"status": "error", "message": "Missing required account data"}), 400
-
-        if account_id in WHATSAPP_ACCOUNTS:
-            return jsonify({"status": "error", "message": f"Account with ID '{account_id}' already exists"}), 400
-
-        WHATSAPP_ACCOUNTS[account_id] = {
-            "name": account_name,
-            "token": account_token,
-            "phone_number_id": account_phone_number_id,
-            "business_account_id": account_business_account_id,
-            "status": "active"
-        }
-
-        return jsonify({
-            "status": "success",
-            "message": f"Account '{account_name}' added successfully",
-            "account": {
-                "id": account_id,
-                "name": account_name,
-                "phone_number_id": account_phone_number_id,
-                "business_account_id": account_business_account_id,
-                "status": "active"
-            }
-        }), 201
-
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+    stats = worker_lifecycle.stats()
+    return jsonify({"status": stats["state"], "ready": stats["ready"]}), 200 if stats["ready"] else 503
 
 @app.route("/api/accounts/<account_id>/send", methods=["POST"])
+@idempotent
 def send_message_from_account_api(account_id):
     """
     Send message from specific account
     Usage: POST /api/accounts/{account_id}/send with JSON body: {"to": "phone_number", "message": "text", "type": "text|template"}
+    Template sends may add "template", "language" and "components" (see /send-template)
+    Text sends outside the 24-hour window use "fallback_template" if given, otherwise they are rejected
+    Campaign traffic should add "priority": "bulk" so that interactive replies go first
+    Retries carrying the same Idempotency-Key header get the first response back instead of a second send
     """
     try:
         # Validate account ID
@@ -1083,14 +1706,20 @@ def send_message_from_account_api(account_id):
         if message_type == "text" and not message:
             return jsonify({"error": "Missing 'message' parameter for text messages"}), 400
 
+        priority = get_send_priority(data)
+        if priority is None:
+            return jsonify({"error": f"'priority' must be one of: {', '.join(LANES)}"}), 400
+
         # Send message using specific account
-        result = send_whatsapp_message(to_phone, message, message_type, account_id)
+        template = get_template_from_request(data) if message_type == "template" else None
+        result = queue_whatsapp_message(to_phone, message, message_type, account_id, template=template,
+                                        fallback_template=get_fallback_template(data), priority=priority)
 
         if result["success"]:
             # Store outgoing message with account ID
             store_message(
                 phone_number=to_phone,
-                message_text=message,
+                message_text=outgoing_message_text(message, result),
                 sender_type='outgoing',
                 message_id=result.get('message_id'),
                 timestamp=datetime.now().isoformat(),
@@ -1103,6 +1732,7 @@ def send_message_from_account_api(account_id):
                 "message_id": result.get("message_id"),
                 "phone_number": result["phone_number"],
                 "account_id": account_id,
+                "sent_as": result.get("sent_as", message_type),
                 "delivery_info": "Message accepted by WhatsApp API. Delivery depends on recipient's opt-in status and 24-hour messaging window."
             }), 200
         else:
@@ -1111,88 +1741,953 @@ def send_message_from_account_api(account_id):
                 "message": result["error"],
                 "phone_number": result["phone_number"],
                 "account_id": account_id,
+                "window_closed": result.get("window_closed", False),
                 "details": result.get("response", {})
             }), 400
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/api/accounts/<account_id>/window", methods=["POST"])
+def get_service_window_api(account_id):
+    """
+    Which recipients are inside their 24-hour customer service window
+    Usage: POST /api/accounts/{account_id}/window with JSON body: {"recipients": ["phone_number", ...]}
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    recipients = (request.get_json(silent=True) or {}).get("recipients")
+    if not isinstance(recipients, list) or not recipients:
+        return jsonify({"error": "'recipients' must be a non-empty list of phone numbers"}), 400
+    if len(recipients) > SERVICE_WINDOW_MAX_RECIPIENTS:
+        return jsonify({"error": f"At most {SERVICE_WINDOW_MAX_RECIPIENTS} recipients per request"}), 400
+
+    normalized = normalize_phone_numbers(recipients, account_id)
+    statuses = service_window.bulk_status(account_id, list(set(normalized.values())))
+    results = {phone: statuses[normalized_phone] for phone, normalized_phone in normalized.items()}
+    return jsonify({
+        "account_id": account_id,
+        "open": [phone for phone, status in results.items() if status["open"]],
+        "closed": [phone for phone, status in results.items() if status["open"] is False],
+        "unknown": [phone for phone, status in results.items() if status["open"] is None],
+        "recipients": results
+    })
+
+@app.route("/api/accounts/<account_id>/scheduled", methods=["POST"])
+def schedule_message_api(account_id):
+    """
+    Schedule a message for later
+    Usage: POST /api/accounts/{account_id}/scheduled with JSON body: {"to": "phone_number", "message": "text",
+           "type": "text|template", plus one of "send_at" (ISO 8601), "local_time" ("HH:MM", with "timezone"),
+           "delay_seconds" or "after_last_inbound_seconds"}
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    data = request.get_json(silent=True) or {}
+    to_phone = data.get("to")
+    message = data.get("message", "")
+    message_type = data.get("type", "text")
+    if not to_phone:
+        return jsonify({"error": "Missing 'to' field"}), 400
+    if message_type == "text" and not message:
+        return jsonify({"error": "Missing 'message' field"}), 400
+
+    normalized_phone = normalize_phone_number(to_phone, account_id)
+    last_inbound = None
+    if data.get("after_last_inbound_seconds") not in (None, ""):
+        last_inbound = service_window.last_inbound(account_id, normalized_phone)
+    try:
+        due = resolve_due_time(data, last_inbound=last_inbound)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    job = message_scheduler.schedule(
+        account_id,
+        normalized_phone,
+        due,
+        message,
+        message_type,
+        template=get_template_from_request(data) if message_type == "template" else None,
+        fallback_template=get_fallback_template(data)
+    )
+    if job is None:
+        return jsonify({"status": "error", "message": "Redis is unavailable, nothing was scheduled"}), 503
+    return jsonify({"status": "success", "job": job, "due_at": datetime.fromtimestamp(due).isoformat()}), 201
+
+@app.route("/api/accounts/<account_id>/scheduled", methods=["GET"])
+def list_scheduled_messages_api(account_id):
+    """
+    Pending scheduled messages of an account, earliest first
+    Usage: GET /api/accounts/{account_id}/scheduled?offset=0&limit=100
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    jobs, total = message_scheduler.list(account_id, offset, limit)
+    if jobs is None:
+        return jsonify({"status": "error", "message": "Redis is unavailable"}), 503
+    return jsonify({"account_id": account_id, "jobs": jobs, "count": len(jobs), "total": total})
+
+@app.route("/api/accounts/<account_id>/scheduled/<job_id>", methods=["GET", "DELETE"])
+def scheduled_message_api(account_id, job_id):
+    """
+    Look up (GET) or cancel (DELETE) a scheduled message
+    Usage: GET|DELETE /api/accounts/{account_id}/scheduled/{job_id}
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    if request.method == "GET":
+        if redis_manager.get_client() is None:
+            return jsonify({"status": "error", "message": "Redis is unavailable"}), 503
+        job = message_scheduler.get(job_id)
+        if not job or job["account_id"] != account_id:
+            return jsonify({"error": "Scheduled message not found"}), 404
+        return jsonify({"job": job})
+
+    outcome = message_scheduler.cancel(account_id, job_id)
+    if outcome is None:
+        return jsonify({"status": "error", "message": "Redis is unavailable"}), 503
+    if outcome == "not_found":
+        return jsonify({"error": "Scheduled message not found"}), 404
+    if outcome != "cancelled":
+        return jsonify({"error": f"Scheduled message can no longer be cancelled ({outcome})"}), 409
+    return jsonify({"status": "success", "job_id": job_id, "cancelled": True})
+
+@app.route("/api/accounts/<account_id>/rules", methods=["GET"])
+def get_auto_response_rules_api(account_id):
+    """
+    Auto-response rules of an account
+    Usage: GET /api/accounts/{account_id}/rules
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    ruleset = auto_responder.ruleset(account_id)
+    if ruleset is None:
+        return jsonify({"account_id": account_id, "rules": [], "count": 0})
+    return jsonify({"account_id": account_id, "rules": ruleset.rules, "count": len(ruleset.rules), **ruleset.describe()})
+
+@app.route("/api/accounts/<account_id>/rules", methods=["PUT"])
+def replace_auto_response_rules_api(account_id):
+    """
+    Replace an account's auto-response rules; every worker picks them up without a restart
+    Usage: PUT /api/accounts/{account_id}/rules with JSON body: {"rules": [{"id": "...", "type": "keyword|intent|regex",
+           "keywords": [...] or "pattern": "...", "response": "text" or "template": "name", "priority": 100}]}
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    rules = (request.get_json(silent=True) or {}).get("rules")
+    if not isinstance(rules, list):
+        return jsonify({"error": "'rules' must be a list"}), 400
+    try:
+        ruleset, commands = auto_responder.replace(account_id, rules)
+    except RuleError as e:
+        return jsonify({"error": "Invalid rules", "errors": e.errors}), 400
+
+    # Buffered and replayed while Redis is down; this worker uses the new rules right away
+    redis_manager.write(commands)
+    return jsonify({"status": "success", "account_id": account_id, **ruleset.describe()})
+
+@app.route("/api/accounts/<account_id>/rules/reload", methods=["POST"])
+def reload_auto_response_rules_api(account_id):
+    """
+    Re-read an account's auto-response rules from Redis in this worker now
+    Usage: POST /api/accounts/{account_id}/rules/reload
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    ruleset = auto_responder.ruleset(account_id, force=True)
+    if ruleset is None:
+        return jsonify({"status": "error", "message": "Redis is unavailable"}), 503
+    return jsonify({"status": "success", "account_id": account_id, **ruleset.describe()})
+
+@app.route("/api/accounts/<account_id>/rules/test", methods=["POST"])
+def test_auto_response_rules_api(account_id):
+    """
+    Which rule (if any) would answer a message, without sending anything
+    Usage: POST /api/accounts/{account_id}/rules/test with JSON body: {"text": "message text"}
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    text = (request.get_json(silent=True) or {}).get("text", "")
+    ruleset = auto_responder.ruleset(account_id)
+    rule = ruleset.match(text) if ruleset else None
+    return jsonify({"account_id": account_id, "matched": rule is not None, "rule": rule})
+
+def require_admin(view):
+    """Only let requests carrying the admin token through."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin endpoints are disabled; set ADMIN_TOKEN"}), 403
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def profile_request_started():
+    profiler.request_started(request.endpoint)
+
+@app.teardown_request
+def profile_request_finished(exc):
+    profiler.request_finished()
+
+@app.before_request
+def refuse_writes_while_draining():
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        return None
+    if not worker_lifecycle.begin_request():
+        # Meta retries webhooks and clients retry sends, so they land on a worker that is staying
+        return jsonify({"status": "error", "message": "This worker is shutting down, retry"}), 503, {"Retry-After": "1"}
+    g.lifecycle_request = True
+
+@app.teardown_request
+def finish_draining_request(exc):
+    if g.pop("lifecycle_request", False):
+        worker_lifecycle.end_request()
+
+@app.before_request
+def start_request_trace():
+    if request.endpoint == "static":
+        return
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.trace_span = tracer.start_trace(
+        f"{request.method} {route}",
+        traceparent=request.headers.get("traceparent"),
+        attributes={"http.method": request.method, "http.route": route}
+    )
+
+@app.after_request
+def add_traceparent_header(response):
+    span = g.get("trace_span")
+    if span is not None:
+        span.set("http.status_code", response.status_code)
+        response.headers["traceparent"] = tracer.traceparent(span)
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    span = g.pop("trace_span", None)
+    tracer.end_trace(span, f"{type(exc).__name__}: {exc}" if exc is not None else None)
+
+def profile_response(result, fmt):
+    if fmt == "collapsed":
+        return collapsed(result.get("stacks", {})), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return jsonify({key: value for key, value in result.items() if key != "stacks"})
+
+@app.route("/admin/drain", methods=["POST"])
+@require_admin
+def drain_worker_api():
+    """
+    Take this worker out of service ahead of a shutdown: refuse new webhooks and writes, finish sends, flush writes, close sockets
+    Usage: POST /admin/drain → 202; progress and the drain report are under "lifecycle" in /api/status
+    """
+    threading.Thread(target=drain_worker, name="worker-drain", daemon=True).start()
+    return jsonify({"status": "draining", "pid": os.getpid(), "timeout_seconds": DRAIN_TIMEOUT_SECONDS}), 202
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+@require_admin
+def start_profile_api():
+    """
+    Sample this worker's stacks for a while (low overhead, safe under load)
+    Usage: POST /admin/profile?seconds=30&interval_ms=10 → 202 with a profile id to fetch from /admin/profile/{id};
+           add wait=true to get the result in the response (ties up this worker's request slot meanwhile)
+    """
+    try:
+        seconds = float(request.args.get("seconds", 30))
+        interval = float(request.args.get("interval_ms", 10)) / 1000
+    except ValueError:
+        return jsonify({"error": "'seconds' and 'interval_ms' must be numbers"}), 400
+    focus = [name for name in request.args.get("focus", "").split(",") if name]
+    profile_id = profiler.start(
+        seconds,
+        interval,
+        focus=focus or DEFAULT_FOCUS,
+        include_idle=request.args.get("idle", "false").lower() == "true"
+    )
+    if profile_id is None:
+        return jsonify({"error": f"A profile is already running in this worker ({profiler.active})"}), 409
+
+    if request.args.get("wait", "false").lower() == "true":
+        return profile_response(profiler.wait(profile_id, seconds + 5), request.args.get("format", "json"))
+    return jsonify({
+        "status": "running",
+        "profile_id": profile_id,
+        "pid": os.getpid(),
+        "result_url": f"/admin/profile/{profile_id}"
+    }), 202
+
+@app.route("/admin/profile/<profile_id>", methods=["GET"])
+@require_admin
+def get_profile_api(profile_id):
+    """
+    A profile's result: per-route and per-function breakdowns, or collapsed stacks for a flamegraph
+    Usage: GET /admin/profile/{profile_id}?format=json|collapsed
+    """
+    result = profiler.result(profile_id)
+    if result is None:
+        return jsonify({"error": "Profile not found"}), 404
+    if result["status"] == "running":
+        return jsonify(result), 202
+    return profile_response(result, request.args.get("format", "json"))
+
+def trace_summary(trace):
+    """A trace with its time per stage (spans of the same name added up) instead of the raw spans."""
+    stages = {}
+    for span in trace.spans:
+        if span is not trace.root:
+            stages[span.name] = round(stages.get(span.name, 0) + span.duration_ms, 3)
+    summary = trace.to_dict()
+    del summary["spans"]
+    summary["status_code"] = trace.root.attributes.get("http.status_code")
+    summary["stages"] = stages
+    return summary
+
+@app.route("/admin/traces", methods=["GET"])
+@require_admin
+def list_traces_api():
+    """
+    The slowest recent traces of this worker, with the time spent in each stage
+    Usage: GET /admin/traces?limit=20&min_ms=0&name=POST%20/webhook
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 1000)
+        min_ms = float(request.args.get("min_ms", 0))
+    except ValueError:
+        return jsonify({"error": "'limit' and 'min_ms' must be numbers"}), 400
+    traces = tracer.slowest(limit, min_ms, request.args.get("name") or None)
+    return jsonify({
+        "pid": os.getpid(),
+        "tracing": tracer.stats(),
+        "traces": [trace_summary(trace) for trace in traces]
+    })
+
+@app.route("/admin/traces/<trace_id>", methods=["GET"])
+@require_admin
+def get_trace_api(trace_id):
+    """
+    One buffered trace with all of its spans
+    Usage: GET /admin/traces/{trace_id}
+    """
+    trace = tracer.find(trace_id.lower())
+    if trace is None:
+        return jsonify({"error": "Trace not found in this worker's buffer"}), 404
+    return jsonify(trace.to_dict())
+
+def get_since_version():
+    """The ?since=<version> query parameter as an int, or None (ValueError if malformed)."""
+    since = request.args.get("since")
+    return int(since) if since not in (None, "") else None
+
+@app.after_request
+def compress_api_response(response):
+    if API_COMPRESSION:
+        response = compress_response(response, request, min_size=API_COMPRESSION_MIN_BYTES, level=API_COMPRESSION_LEVEL)
+    return response
+
+def listing_response(envelope, key, items):
+    """
+    A listing as {**envelope, key: [...], "count": n}. With ?stream=ndjson
+    (one item per line) or ?stream=json (the same document, written item by
+    item) the items are streamed from the iterator instead of collected.
+    """
+    mode = request.args.get("stream")
+    if mode == "ndjson":
+        return app.response_class(stream_ndjson(items), mimetype="application/x-ndjson")
+    if mode == "json":
+        return app.response_class(stream_json(envelope, key, items), mimetype="application/json")
+    items = list(items)
+    return jsonify({**envelope, key: items, "count": len(items)})
+
+def iter_contacts(account_id, changed=None):
+    """
+    (phone_number, last_message, message_count) of an account's conversations,
+    most recent first: from the storage backend, or from this worker's
+    in-memory store while storage is unavailable
+    """
+    stored = storage.contacts(account_id)
+    if stored is not None:
+        for contact in stored:
+            if contact["last_message"] and (changed is None or contact["phone_number"] in changed):
+                yield contact["phone_number"], contact["last_message"], contact["message_count"]
+        return
+
+    account_messages = list(message_store.get(account_id, {}).items())
+    order = sorted(
+        ((messages[-1]["timestamp"], phone_number, messages)
+         for phone_number, messages in account_messages
+         if messages and (changed is None or phone_number in changed)),  # Only include contacts with messages
+        key=lambda entry: entry[0],
+        reverse=True
+    )
+    for _, phone_number, messages in order:
+        yield phone_number, messages[-1], len(messages)
+
+def not_modified(etag):
+    """A 304 response if the client already holds this ETag, else None."""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # always revalidate; a 304 costs nothing
+    return response
+
+def conversation_response(account_id, phone_number):
+    """
+    Message history of one conversation, tagged with its version. Answers 304
+    when the client's ETag is current and, with ?since=<version>, returns only
+    messages newer than that version. ?limit=<n> returns the newest n messages
+    (older than ?before=<version> when given) for paging back through history.
+    """
+    try:
+        since = get_since_version()
+        before = request.args.get("before", type=int)
+        limit = request.args.get("limit", type=int)
+    except ValueError:
+        return jsonify({"error": "'since' must be an integer version"}), 400
+    if limit is not None and not 1 <= limit <= 500:
+        return jsonify({"error": "'limit' must be between 1 and 500"}), 400
+
+    normalized_phone = normalize_phone_number(phone_number, account_id)
+    version = conversation_versions.conversation_version(account_id, normalized_phone)
+    etag = f"{account_id}:{normalized_phone}:{version}"
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # Try to get messages from the storage backend first
+    messages = get_stored_messages(normalized_phone, account_id)
+
+    # Fallback to in-memory store if the backend is unavailable or empty
+    if not messages:
+        messages = message_store.get(account_id, {}).get(normalized_phone, [])
+
+    if since is not None:
+        messages = [message for message in messages if message.get("version", 0) > since]
+    if before is not None:
+        messages = [message for message in messages if message.get("version", 0) < before]
+    has_more = False
+    if limit is not None:
+        has_more = len(messages) > limit
+        messages = messages[-limit:]
+
+    return with_etag(listing_response({
+        "status": "success",
+        "account_id": account_id,
+        "phone_number": normalized_phone,
+        "has_more": has_more,
+        "version": version
+    }, "messages", messages), etag), 200
+
 @app.route("/api/accounts/<account_id>/messages/<phone_number>", methods=["GET"])
 def get_account_messages(account_id, phone_number):
     """
     Get message history for a specific phone number from a specific account
+    Supports ETags (304 when unchanged) and ?since=<version> for newer messages only
     """
     try:
         # Validate account ID
         if not validate_account_id(account_id):
             return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
 
-        # Normalize phone number
-        normalized_phone = normalize_phone_number(phone_number)
+        return conversation_response(account_id, phone_number)
 
-        # Try to get messages from Redis first
-        messages = get_messages_from_redis(normalized_phone, account_id)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        # Fallback to in-memory store if Redis is unavailable or empty
-        if not messages:
-            messages = message_store.get(account_id, {}).get(normalized_phone, [])
+@app.route("/api/accounts/<account_id>/contacts", methods=["GET"])
+def get_account_contacts(account_id):
+    """
+    Get all contacts with message history for a specific account
+    Supports ETags (304 when unchanged) and ?since=<version> for contacts changed after a version
+    """
+    try:
+        # Validate account ID
+        if not validate_account_id(account_id):
+            return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+        try:
+            since = get_since_version()
+        except ValueError:
+            return jsonify({"error": "'since' must be an integer version"}), 400
+
+        version = conversation_versions.account_version(account_id)
+        etag = f"{account_id}:{version}"
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        changed = conversation_versions.changed_since(account_id, since) if since is not None else None
+
+        # Contacts of this account, most recent first
+        contacts = (
+            {
+                "phone": phone_number,
+                "name": f"Contact {phone_number[-4:]}",  # Simple name based on last 4 digits
+                "last_message": last_message.get("text", ""),
+                "last_message_time": last_message.get("timestamp", ""),
+                "message_count": message_count,
+                "last_message_type": last_message.get("type", "")
+            }
+            for phone_number, last_message, message_count in iter_contacts(account_id, changed)
+        )
+
+        return with_etag(listing_response({
+            "status": "success",
+            "account_id": account_id,
+            "version": version
+        }, "contacts", contacts), etag), 200
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/contacts/<phone_number>/read", methods=["POST"])
+def mark_contact_read_api(account_id, phone_number):
+    """
+    Reset the unread count of a conversation
+    Usage: POST /api/accounts/{account_id}/contacts/{phone_number}/read
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    normalized_phone = normalize_phone_number(phone_number, account_id)
+    written = account_stats.mark_read(account_id, normalized_phone)
+    socket_fanout.publish('messages_read', {'account_id': account_id, 'phone_number': normalized_phone}, account_id)
+    return jsonify({
+        "status": "success" if written else "queued",
+        "account_id": account_id,
+        "phone_number": normalized_phone,
+        "unread": 0
+    })
 
+@app.route("/api/accounts/<account_id>/stats", methods=["GET"])
+def get_account_stats_api(account_id):
+    """
+    Unread counts, hourly in/out message counts and unique active contacts,
+    read from counters rather than message history
+    Usage: GET /api/accounts/{account_id}/stats?hours=24&days=7&phone=<phone_number>
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    hours = request.args.get("hours", 24, type=int)
+    days = request.args.get("days", 7, type=int)
+    if not 1 <= hours <= 168:
+        return jsonify({"error": "'hours' must be between 1 and 168"}), 400
+    if not 1 <= days <= ACCOUNT_STATS_RETENTION_DAYS:
+        return jsonify({"error": f"'days' must be between 1 and {ACCOUNT_STATS_RETENTION_DAYS:g}"}), 400
+    phone_number = request.args.get("phone")
+    if phone_number:
+        phone_number = normalize_phone_number(phone_number, account_id)
+
+    stats = account_stats.read(account_id, hours=hours, days=days, phone_number=phone_number)
+    if stats is None:
+        return jsonify({"status": "error", "message": "Redis is unavailable"}), 503
+    return jsonify({"status": "success", "account_id": account_id, **stats})
+
+@app.route("/api/accounts/<account_id>/export", methods=["GET"])
+def export_account_history(account_id):
+    """
+    Stream the whole message history of an account (503 while Redis is down, 501 with STORAGE_BACKEND=sqlite)
+    Usage: GET /api/accounts/{account_id}/export?format=ndjson|csv
+    An NDJSON export cut short by a Redis error ends with an {"error", "truncated": true} line; a CSV one is aborted
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "'format' must be 'ndjson' or 'csv'"}), 400
+    if STORAGE_BACKEND != "redis":
+        return jsonify({"error": f"History export reads Redis and isn't available with STORAGE_BACKEND={STORAGE_BACKEND}"}), 501
+
+    client = get_redis_client()
+    if client is None:
+        # This worker's in-memory history would pass for a complete export
+        return jsonify({"status": "error", "message": "Redis is unavailable"}), 503
+
+    def messages():
+        try:
+            yield from iter_history(client, account_id)
+        except Exception as e:
+            redis_manager.record_error(e)
+            print(f"❌ History export for account {account_id} stopped: {e}")
+            if fmt == "csv":
+                raise  # aborts the chunked response, so the download fails instead of looking complete
+            yield {"error": f"Export stopped: {e}", "truncated": True}  # last line of a cut-short NDJSON export
+
+    if fmt == "csv":
+        response = app.response_class(to_csv(messages()), mimetype="text/csv")
+    else:
+        response = app.response_class(to_ndjson(messages()), mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = f'attachment; filename="{account_id}-history.{fmt}"'
+    return response
+
+def invalidate_histories(keys):
+    """Drop cached copies of history keys here; returns the command that drops them in the other workers."""
+    near_cache.invalidate(*keys)
+    return near_cache.invalidation_command(*keys)
+
+def read_conversation_heads(account_id, phone_numbers):
+    """{phone_number: newest stored message or None}, or None if storage is unavailable."""
+    histories = storage.histories(account_id, phone_numbers, 0, 0)
+    if histories is None:
+        return None
+    return {phone_number: messages[-1] if messages else None for phone_number, messages in histories.items()}
+
+@app.route("/api/accounts/<account_id>/import", methods=["POST"])
+def import_account_history(account_id):
+    """
+    Import message history from a streamed NDJSON or CSV upload (the export formats; 501 with STORAGE_BACKEND=sqlite)
+    Usage: POST /api/accounts/{account_id}/import with a Content-Type of application/x-ndjson or text/csv
+    Records need phone_number, type ('incoming' or 'outgoing') and timestamp; text, id and media are optional
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "'format' must be 'ndjson' or 'csv'"}), 400
+    if STORAGE_BACKEND != "redis":
+        return jsonify({"error": f"History import writes to Redis and isn't available with STORAGE_BACKEND={STORAGE_BACKEND}"}), 501
+
+    importer = HistoryImporter(
+        account_id,
+        write_batch=redis_manager.write_batch,
+        read_heads=read_conversation_heads,
+        normalize=lambda phone: normalize_phone_number(phone, account_id),
+        next_version=conversation_versions.bump,
+        on_message=search_index.add if search_index else None,
+        invalidate=invalidate_histories if near_cache else None
+    )
+    for line_number, record, error in parse_records(request.stream, fmt):
+        if error:
+            importer.reject(line_number, error)
+        elif not importer.add(line_number, record):
+            break
+    else:
+        if importer.flush():
+            print(f"📥 Imported {importer.imported} message(s) into account {account_id} ({importer.rejected} rejected)")
+            return jsonify({"status": "success", "account_id": account_id, **importer.stats()}), 200
+
+    # Batches written so far stay imported; the rest can be re-sent once Redis is back
+    return jsonify({
+        "status": "error",
+        "message": "Redis is unavailable; import stopped",
+        "account_id": account_id,
+        **importer.stats()
+    }), 503
+
+@app.route("/api/accounts/<account_id>/templates", methods=["GET"])
+def get_account_templates(account_id):
+    """
+    Approved message template catalog for an account (cached; ?refresh=true forces a Graph fetch)
+    """
+    try:
+        if not validate_account_id(account_id):
+            return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+        catalog = template_catalog.get(account_id, refresh=request.args.get("refresh", "false").lower() == "true")
+        if catalog is None:
+            return jsonify({"status": "error", "message": "Template catalog unavailable"}), 503
+
+        templates = [
+            {
+                "name": template["name"],
+                "language": template["language"],
+                "status": template.get("status"),
+                "category": template.get("category"),
+                "components": template.get("components", [])
+            }
+            for template in catalog.values()
+        ]
         return jsonify({
             "status": "success",
             "account_id": account_id,
-            "phone_number": normalized_phone,
-            "messages": messages,
-            "count": len(messages)
+            "templates": templates,
+            "count": len(templates)
         }), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route("/api/accounts/<account_id>/contacts", methods=["GET"])
-def get_account_contacts(account_id):
+@app.route("/api/accounts/<account_id>/search", methods=["GET"])
+def search_account_messages(account_id):
     """
-    Get all contacts with message history for a specific account
+    Full-text search across all conversations of an account
+    Usage: GET /api/accounts/{account_id}/search?q=order 1234&page=1&per_page=20&phone=2349025794407
+    Only the most recent matches are ranked; with older ones "truncated" is true and ?before=<older> searches those
     """
     try:
         # Validate account ID
         if not validate_account_id(account_id):
             return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
 
-        contacts = []
-
-        # Get contacts from in-memory store for this account
-        account_messages = message_store.get(account_id, {})
-        for phone_number, messages in account_messages.items():
-            if messages:  # Only include contacts with messages
-                last_message = messages[-1]  # Get most recent message
-                contacts.append({
-                    "phone": phone_number,
-                    "name": f"Contact {phone_number[-4:]}",  # Simple name based on last 4 digits
-                    "last_message": last_message.get("text", ""),
-                    "last_message_time": last_message.get("timestamp", ""),
-                    "message_count": len(messages),
-                    "last_message_type": last_message.get("type", "")
-                })
-
-        # Sort contacts by last message time (most recent first)
-        contacts.sort(key=lambda x: x["last_message_time"], reverse=True)
+        if not search_index:
+            return jsonify({"status": "error", "message": "Search is disabled"}), 503
+
+        query = request.args.get("q", "").strip()
+        if not query:
+            return jsonify({"error": "Missing 'q' parameter"}), 400
+
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+        phone = request.args.get("phone")
+        phone = normalize_phone_number(phone, account_id) if phone else None
+        before = request.args.get("before", type=int)
+
+        started = time.perf_counter()
+        hits, has_more, older = search_index.search(account_id, query, page=page, per_page=per_page,
+                                                    phone_number=phone, before=before)
 
         return jsonify({
             "status": "success",
             "account_id": account_id,
-            "contacts": contacts,
-            "count": len(contacts)
+            "query": query,
+            "results": hits,
+            "count": len(hits),
+            "page": page,
+            "per_page": per_page,
+            "has_more": has_more,
+            "truncated": older is not None,
+            "older": older,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
         }), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/media/<sha256>", methods=["GET"])
+def serve_media(sha256):
+    """
+    Serve stored media by content hash, with HTTP Range and conditional request support.
+    Full-file responses go out through the server's sendfile file wrapper.
+    """
+    if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+        abort(404)
+    path = media_store.path_for(sha256)
+    if not os.path.exists(path):
+        abort(404)
+
+    metadata = media_store.metadata(sha256)
+    response = send_file(
+        path,
+        mimetype=metadata.get("mime_type") or "application/octet-stream",
+        download_name=metadata.get("filename") or sha256,
+        conditional=True,
+        etag=sha256,
+        max_age=31536000  # content-addressed, so it never changes
+    )
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route("/api/accounts/<account_id>/media/<media_id>", methods=["GET"])
+def get_account_media(account_id, media_id):
+    """
+    Resolve a WhatsApp media ID from a message to its stored file
+    Answers 202 while it downloads, 404 if WhatsApp no longer has it and 502 if the download failed
+    """
+    if not validate_account_id(account_id):
+        return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
+
+    info = get_media_info(account_id, media_id)
+    if not info:
+        return jsonify({"status": "pending", "message": "Media is still downloading"}), 202
+    if "error" in info:
+        status = 404 if info["error"] == MEDIA_NOT_FOUND else 502
+        return jsonify({"status": "error", "reason": info["error"], "message": f"Media download failed: {info['message']}"}), status
+    return redirect(f"/media/{info['sha256']}", code=302)
+
+# Message stream consumer group APIs
+def _stream_request(account_id):
+    """Validate the account and return a Redis client, or an error response tuple."""
+    if not validate_account_id(account_id):
+        return None, (jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400)
+    client = get_redis_client()
+    if not client:
+        return None, (jsonify({"status": "error", "message": "Redis unavailable"}), 503)
+    return client, None
+
+@app.route("/api/accounts/<account_id>/stream", methods=["GET"])
+def get_message_stream_api(account_id):
+    """
+    Stream length and consumer group backlog for an account
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    try:
+        return jsonify({
+            "status": "success",
+            "account_id": account_id,
+            "stream": message_stream.stream_info(client, account_id),
+            "groups": message_stream.list_groups(client, account_id)
+        }), 200
+    except Exception as e:
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/stream/groups", methods=["POST"])
+def create_stream_group_api(account_id):
+    """
+    Create a consumer group
+    Usage: POST /api/accounts/{account_id}/stream/groups with JSON body: {"group": "analytics", "start": "$|0"}
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    data = request.get_json() or {}
+    group = data.get("group")
+    if not group:
+        return jsonify({"error": "Missing 'group' parameter"}), 400
+    try:
+        created = message_stream.create_group(client, account_id, group, data.get("start", "$"))
+        if not created:
+            return jsonify({"status": "error", "message": f"Consumer group '{group}' already exists"}), 409
+        return jsonify({"status": "success", "account_id": account_id, "group": group}), 201
+    except Exception as e:
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/stream/groups/<group>", methods=["DELETE"])
+def delete_stream_group_api(account_id, group):
+    """
+    Delete a consumer group and its pending entries
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    try:
+        if not message_stream.delete_group(client, account_id, group):
+            return jsonify({"status": "error", "message": "Consumer group not found"}), 404
+        return jsonify({"status": "success", "message": f"Consumer group '{group}' deleted"}), 200
+    except Exception as e:
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/stream/groups/<group>/messages", methods=["GET"])
+def read_stream_group_api(account_id, group):
+    """
+    Read the next messages for a consumer
+    Usage: GET /api/accounts/{account_id}/stream/groups/{group}/messages?consumer=worker-1&count=100&pending=false
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    consumer = request.args.get("consumer")
+    if not consumer:
+        return jsonify({"error": "Missing 'consumer' parameter"}), 400
+    count = min(request.args.get("count", 100, type=int), 1000)
+    pending = request.args.get("pending", "false").lower() == "true"
+    try:
+        entries = message_stream.read_group(client, account_id, group, consumer, count=count, pending=pending)
+        return jsonify({
+            "status": "success",
+            "account_id": account_id,
+            "group": group,
+            "consumer": consumer,
+            "entries": entries,
+            "count": len(entries)
+        }), 200
+    except Exception as e:
+        if message_stream.group_missing(e):
+            return jsonify({"status": "error", "message": "Consumer group not found"}), 404
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/stream/groups/<group>/claim", methods=["POST"])
+def claim_stream_group_api(account_id, group):
+    """
+    Take over entries other consumers left unacknowledged (e.g. after a crash)
+    Usage: POST /api/accounts/{account_id}/stream/groups/{group}/claim with JSON body: {"consumer": "worker-2", "min_idle_ms": 60000, "count": 100}
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    data = request.get_json() or {}
+    consumer = data.get("consumer")
+    if not consumer:
+        return jsonify({"error": "Missing 'consumer' parameter"}), 400
+    try:
+        min_idle_ms = int(data.get("min_idle_ms", 60000))
+        count = min(int(data.get("count", 100)), 1000)
+    except (TypeError, ValueError):
+        return jsonify({"error": "'min_idle_ms' and 'count' must be integers"}), 400
+    try:
+        entries = message_stream.claim(client, account_id, group, consumer, min_idle_ms, count=count)
+        return jsonify({
+            "status": "success",
+            "account_id": account_id,
+            "group": group,
+            "consumer": consumer,
+            "entries": entries,
+            "count": len(entries)
+        }), 200
+    except Exception as e:
+        if message_stream.group_missing(e):
+            return jsonify({"status": "error", "message": "Consumer group not found"}), 404
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/stream/groups/<group>/ack", methods=["POST"])
+def ack_stream_group_api(account_id, group):
+    """
+    Acknowledge processed entries
+    Usage: POST /api/accounts/{account_id}/stream/groups/{group}/ack with JSON body: {"ids": ["1726662000000-0"]}
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    ids = (request.get_json() or {}).get("ids") or []
+    try:
+        acked = message_stream.ack(client, account_id, group, ids)
+        return jsonify({"status": "success", "acknowledged": acked}), 200
+    except Exception as e:
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/accounts/<account_id>/stream/groups/<group>/pending", methods=["GET"])
+def pending_stream_group_api(account_id, group):
+    """
+    Inspect a consumer group's backlog of delivered but unacknowledged entries
+    """
+    client, error = _stream_request(account_id)
+    if error:
+        return error
+    count = min(request.args.get("count", 100, type=int), 1000)
+    try:
+        return jsonify({
+            "status": "success",
+            "account_id": account_id,
+            "group": group,
+            **message_stream.pending_summary(client, account_id, group, count=count)
+        }), 200
+    except Exception as e:
+        if message_stream.group_missing(e):
+            return jsonify({"status": "error", "message": "Consumer group not found"}), 404
+        redis_manager.record_error(e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # API endpoints for Enhanced Chat Interface (Legacy - maintained for backward compatibility)
 @app.route("/api/messages/<phone_number>", methods=["GET"])
 def get_messages(phone_number):
     """
     Get message history for a specific phone number (supports account_id parameter for multi-account)
-    Usage: GET /api/messages/{phone_number}?account_id=main
+    Usage: GET /api/messages/{phone_number}?account_id=main[&since=<version>][&limit=<n>&before=<version>]
     """
     try:
         # Get account_id from query parameters (defaults to main for backward compatibility)
@@ -1202,23 +2697,7 @@ def get_messages(phone_number):
         if account_id != DEFAULT_ACCOUNT_ID and not validate_account_id(account_id):
             return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
 
-        # Normalize phone number using comprehensive normalization
-        normalized_phone = normalize_phone_number(phone_number)
-
-        # Try to get messages from Redis first
-        messages = get_messages_from_redis(normalized_phone, account_id)
-
-        # Fallback to in-memory store if Redis is unavailable or empty
-        if not messages:
-            messages = message_store.get(account_id, {}).get(normalized_phone, [])
-
-        return jsonify({
-            "status": "success",
-            "account_id": account_id,
-            "phone_number": normalized_phone,
-            "messages": messages,
-            "count": len(messages)
-        }), 200
+        return conversation_response(account_id, phone_number)
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1227,7 +2706,7 @@ def get_messages(phone_number):
 def get_contacts():
     """
     Get all contacts that have message history (supports account_id parameter for multi-account)
-    Usage: GET /api/contacts?account_id=main
+    Usage: GET /api/contacts?account_id=main[&since=<version>]
     """
     try:
         # Get account_id from query parameters (defaults to main for backward compatibility)
@@ -1237,30 +2716,37 @@ def get_contacts():
         if account_id != DEFAULT_ACCOUNT_ID and not validate_account_id(account_id):
             return jsonify({"error": f"Invalid or inactive account ID: {account_id}"}), 400
 
-        contacts = []
-        account_messages = message_store.get(account_id, {})
+        try:
+            since = get_since_version()
+        except ValueError:
+            return jsonify({"error": "'since' must be an integer version"}), 400
 
-        for phone_number, messages in account_messages.items():
-            if messages:  # Only include contacts with messages
-                last_message = messages[-1]  # Get most recent message
-                contacts.append({
-                    "phone_number": phone_number,
-                    "display_name": f"+{phone_number}",  # Could be enhanced with actual names
-                    "last_message": last_message["text"][:50] + "..." if len(last_message["text"]) > 50 else last_message["text"],
-                    "last_message_time": last_message["timestamp"],
-                    "last_message_type": last_message["type"],
-                    "message_count": len(messages)
-                })
+        version = conversation_versions.account_version(account_id)
+        etag = f"{account_id}:{version}"
+        cached = not_modified(etag)
+        if cached:
+            return cached
 
-        # Sort by most recent message
-        contacts.sort(key=lambda x: x["last_message_time"], reverse=True)
+        changed = conversation_versions.changed_since(account_id, since) if since is not None else None
 
-        return jsonify({
+        def contact_summary(phone_number, last_message, message_count):
+            return {
+                "phone_number": phone_number,
+                "display_name": f"+{phone_number}",  # Could be enhanced with actual names
+                "last_message": last_message["text"][:50] + "..." if len(last_message["text"]) > 50 else last_message["text"],
+                "last_message_time": last_message["timestamp"],
+                "last_message_type": last_message["type"],
+                "message_count": message_count
+            }
+
+        # Sorted by most recent message
+        contacts = (contact_summary(*contact) for contact in iter_contacts(account_id, changed))
+
+        return with_etag(listing_response({
             "status": "success",
             "account_id": account_id,
-            "contacts": contacts,
-            "count": len(contacts)
-        }), 200
+            "version": version
+        }, "contacts", contacts), etag), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1268,48 +2754,56 @@ def get_contacts():
 @app.route("/api/messages", methods=["GET"])
 def get_all_messages():
     """
-    Get all messages across all contacts (for debugging)
+    Get all messages across all contacts of an account, newest first (for debugging)
+    Usage: GET /api/messages?account_id=main[&stream=ndjson|json]
     """
     try:
-        all_messages = []
-        for phone_number, messages in message_store.items():
-            for message in messages:
+        account_id = request.args.get('account_id', DEFAULT_ACCOUNT_ID)
+        account_messages = list(message_store.get(account_id, {}).items())
+
+        def newest_first(phone_number, messages):
+            for message in reversed(messages):
                 message_copy = message.copy()
                 message_copy["contact_phone"] = phone_number
-                all_messages.append(message_copy)
+                yield message_copy
 
-        # Sort by timestamp
-        all_messages.sort(key=lambda x: x["timestamp"], reverse=True)
+        # Each conversation is already in order, so merging them avoids sorting everything
+        all_messages = heapq.merge(
+            *(newest_first(phone_number, messages) for phone_number, messages in account_messages),
+            key=lambda x: x["timestamp"],
+            reverse=True
+        )
 
-        return jsonify({
-            "status": "success",
-            "messages": all_messages,
-            "count": len(all_messages)
-        }), 200
+        return listing_response({"status": "success", "account_id": account_id}, "messages", all_messages), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-def initialize_bot():
-    """Initialize bot configuration"""
+def detect_phone_number_id():
+    """Resolve the Phone Number ID from the Graph API and update the legacy globals."""
     global PHONE_NUMBER_ID, WHATSAPP_API_URL
 
+    detected_id = get_phone_number_id()
+    if detected_id:
+        PHONE_NUMBER_ID = detected_id
+        WHATSAPP_API_URL = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{PHONE_NUMBER_ID}/messages"
+        print(f"✅ Phone Number ID set to: {PHONE_NUMBER_ID}")
+    else:
+        print("❌ Could not auto-detect Phone Number ID. Please set it manually in .env file.")
+        print("You can find it in your WhatsApp Business API dashboard.")
+
+def initialize_bot():
+    """Initialize bot configuration"""
     print("Starting WhatsApp Business API Bot...")
     print(f"Webhook URL: {WEBHOOK_URL}")
     print(f"Business Account ID: {WHATSAPP_BUSINESS_ACCOUNT_ID}")
     print(f"App ID: {APP_ID}")
 
-    # Auto-detect Phone Number ID if not set
+    # Auto-detect Phone Number ID if not set (in the background, so the Graph
+    # API round trip never delays worker startup)
     if PHONE_NUMBER_ID == "YOUR_PHONE_NUMBER_ID":
-        print("\n🔍 Phone Number ID not set, attempting to auto-detect...")
-        detected_id = get_phone_number_id()
-        if detected_id:
-            PHONE_NUMBER_ID = detected_id
-            WHATSAPP_API_URL = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{PHONE_NUMBER_ID}/messages"
-            print(f"✅ Phone Number ID set to: {PHONE_NUMBER_ID}")
-        else:
-            print("❌ Could not auto-detect Phone Number ID. Please set it manually in .env file.")
-            print("You can find it in your WhatsApp Business API dashboard.")
+        print("\n🔍 Phone Number ID not set, auto-detecting in the background...")
+        threading.Thread(target=detect_phone_number_id, name="phone-number-id", daemon=True).start()
     else:
         print(f"Phone Number ID: {PHONE_NUMBER_ID}")
 
@@ -1321,27 +2815,112 @@ def initialize_bot():
     print("  - POST /send     : Send messages manually")
     print("\n" + "="*50)
 
+def create_app():
+    """
+    Application factory: prepare the app for serving and return it.
+
+    Used by gunicorn (``whatsapp_bot:create_app()``) and by ``__main__``. Startup
+    does no network I/O: accounts come from the environment, Redis-stored
+    accounts are merged by the health check thread once Redis answers, and the
+    Phone Number ID lookup runs in the background, as does the warm-up that
+    /ready waits for (see worker_lifecycle). Calling it again is a no-op.
+    """
+    global _app_initialized
+    if _app_initialized:
+        return app
+
+    started = time.perf_counter()
+    WHATSAPP_ACCOUNTS.update(load_accounts_from_env())
+    initialize_bot()
+    if STORAGE_BACKEND == "sqlite":
+        merge_stored_accounts()  # a local read
+        threading.Thread(target=warm_up_worker, name="warm-up", daemon=True).start()
+    else:
+        redis_manager.on_recovery(merge_stored_accounts)
+        # Once Redis answers, after the accounts are merged; off the health check thread
+        redis_manager.on_recovery(lambda: threading.Thread(target=warm_up_worker, name="warm-up", daemon=True).start())
+    redis_manager.start_health_check()
+    if write_behind:
+        write_behind.start()
+    if search_index:
+        search_index.start()
+    media_downloader.start()
+    socket_fanout.start()
+    if near_cache:
+        near_cache.on_invalidate("account:", reload_account)
+        near_cache.start()
+    if OUTBOUND_QUEUE_ENABLED:
+        outbound_scheduler.start()
+    if SCHEDULER_ENABLED:
+        message_scheduler.start()
+    if TEMPLATE_WARMUP:
+        template_catalog.warm([account_id for account_id in WHATSAPP_ACCOUNTS if validate_account_id(account_id)])
+
+    # Drain steps, in order, after running requests have finished
+    if OUTBOUND_QUEUE_ENABLED:
+        worker_lifecycle.on_drain("outbound", outbound_scheduler.drain)
+    if SCHEDULER_ENABLED:
+        worker_lifecycle.on_drain("scheduler", message_scheduler.stop)
+    worker_lifecycle.on_drain("websocket", socket_fanout.close)
+    if write_behind:
+        worker_lifecycle.on_drain("write_behind", write_behind.stop)
+    worker_lifecycle.on_drain("storage", lambda timeout: storage.flush())
+    worker_lifecycle.on_drain("redis", lambda timeout: redis_manager.close())
+    _app_initialized = True
+
+    finished = time.perf_counter()
+    STARTUP_TIMINGS["create_app_ms"] = round((finished - started) * 1000, 2)
+    STARTUP_TIMINGS["total_ms"] = round((finished - _MODULE_LOAD_STARTED) * 1000, 2)
+    STARTUP_TIMINGS["budget_ms"] = STARTUP_BUDGET_MS
+    if STARTUP_TIMINGS["total_ms"] > STARTUP_BUDGET_MS:
+        print(f"⚠️ Cold start took {STARTUP_TIMINGS['total_ms']}ms (budget {STARTUP_BUDGET_MS:g}ms)")
+    else:
+        print(f"⏱️ Cold start took {STARTUP_TIMINGS['total_ms']}ms (budget {STARTUP_BUDGET_MS:g}ms)")
+    return app
+
 # WebSocket event handlers
 @socketio.on('connect')
-def handle_connect():
-    print('🔌 Client connected to WebSocket')
+def handle_connect(auth=None):
+    account_id = (auth or {}).get('account_id') or request.args.get('account_id') or DEFAULT_ACCOUNT_ID
+    if not socket_fanout.connect(request.sid, account_id):
+        if socket_fanout.closed:
+            print(f'🚫 Refused WebSocket client: this worker is shutting down (Account: {account_id})')
+        else:
+            print(f'🚫 Refused WebSocket client: account {account_id} is at {SOCKET_MAX_CLIENTS_PER_ACCOUNT} connections')
+        return False
+    print(f'🔌 Client connected to WebSocket (Account: {account_id})')
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    socket_fanout.disconnect(request.sid)
     print('🔌 Client disconnected from WebSocket')
 
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Switch the account whose events this client receives; acks True, or False at the connection limit"""
+    account_id = (data or {}).get('account_id') or DEFAULT_ACCOUNT_ID
+    return socket_fanout.subscribe(request.sid, account_id)
+
 @socketio.on('join_room')
 def handle_join_room(data):
     """Join a room for a specific phone number to receive real-time updates"""
     phone_number = data.get('phone_number')
     if phone_number:
-        normalized_phone = normalize_phone_number(phone_number)
+        normalized_phone = normalize_phone_number(phone_number, data.get('account_id'))
         socketio.join_room(f"chat_{normalized_phone}")
         print(f'📱 Client joined room for {normalized_phone}')
 
+STARTUP_TIMINGS["import_ms"] = round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 2)
+
+def handle_sigterm(signum, frame):
+    drain_worker()
+    raise SystemExit(0)
+
 if __name__ == "__main__":
     # Initialize bot configuration
-    initialize_bot()
+    create_app()
+    # Drain before exiting (under gunicorn, gunicorn.conf.py does this)
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
     # Run Flask app with SocketIO
     port = int(os.getenv("PORT", 8000))  # Render uses PORT environment variable
@@ -0,0 +1,168 @@
+"""
+Worker warm-up, readiness and graceful drain.
+
+A new worker starts cold: contact listings are served from its in-memory
+store, which is empty after a deploy. warm_up() reads the most recently
+active contacts of each account and their conversations from the storage
+backend, a batch of conversations per round trip, and the worker only
+reports ready (GET /ready) once that has run. If storage can't be reached,
+it reports ready anyway after warmup_timeout, so an outage can't keep every
+new worker out of rotation; the warm-up then runs as soon as storage is back.
+A read that fails part-way fails the warm-up too (rather than counting the
+contacts it couldn't read as empty), so it is run again on recovery.
+
+With Redis storage the most recently active contacts come from the
+``{acct}:contacts`` index, which only has conversations written since it was
+introduced; key_migration.py adds the older ones as it moves them.
+
+drain() takes a worker out of service for a deploy or shutdown:
+
+1. New webhooks, sends and other writes are refused with 503 and /ready
+   answers 503 (Meta retries webhooks, and load balancers stop routing here).
+2. Requests already running are given time to finish.
+3. The shutdown steps registered with on_drain() run in order: finishing
+   queued sends, flushing buffered writes, closing sockets. Each gets what is
+   left of the drain timeout, and one failing doesn't stop the rest.
+
+drain() runs once; calling it again waits for the first run and returns its
+report.
+"""
+
+import threading
+import time
+
+from storage import HISTORY_LIMIT
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+
+def warm_up(storage, account_ids, load, max_contacts=500, batch_size=100, history_limit=HISTORY_LIMIT):
+    """
+    Pass the conversations of each account's max_contacts most recently active
+    contacts to load(account_id, phone_number, messages), newest contacts
+    first, reading batch_size conversations per round trip. Returns counts;
+    raises RuntimeError if the storage backend can't be read.
+    """
+    counts = {"accounts": 0, "contacts": 0, "messages": 0}
+    for account_id in account_ids:
+        contacts = storage.contacts(account_id, 0, max_contacts - 1)
+        if contacts is None:
+            raise RuntimeError(f"contacts of account {account_id} could not be read")
+        phone_numbers = [contact["phone_number"] for contact in contacts]
+        for offset in range(0, len(phone_numbers), batch_size):
+            batch = phone_numbers[offset:offset + batch_size]
+            histories = storage.histories(account_id, batch, 0, history_limit - 1)
+            if histories is None:
+                raise RuntimeError(f"conversations of account {account_id} could not be read")
+            for phone_number, messages in histories.items():
+                if messages:
+                    load(account_id, phone_number, messages)
+                    counts["contacts"] += 1
+                    counts["messages"] += len(messages)
+        counts["accounts"] += 1
+    return counts
+
+
+class WorkerLifecycle:
+    def __init__(self, warmup_timeout=30.0, drain_timeout=25.0):
+        self.warmup_timeout = warmup_timeout
+        self.drain_timeout = drain_timeout
+        self.state = STARTING
+        self.refused = 0
+        self.warm_up = None  # {"accounts", "contacts", "messages", "ms"} once it has run
+        self.drain_report = None  # {step: {"ok", "ms"}} once drained
+        self._started = time.monotonic()
+        self._in_flight = 0
+        self._steps = []  # (name, step(timeout) -> False if it couldn't finish)
+        self._cond = threading.Condition()
+        self._drain_lock = threading.Lock()
+
+    def ready(self):
+        """Whether load balancers should route to this worker."""
+        if self.state == STARTING:
+            return time.monotonic() - self._started >= self.warmup_timeout
+        return self.state == READY
+
+    def run_warm_up(self, warm):
+        """
+        Run warm() (returning counts) once, then report ready; later calls do
+        nothing unless it failed. A failed warm-up leaves the worker starting,
+        so it reports ready only after warmup_timeout (or a later successful run).
+        """
+        with self._cond:
+            if self.warm_up is not None and "error" not in self.warm_up:
+                return self.warm_up
+            self.warm_up = {"running": True}
+        started = time.perf_counter()
+        try:
+            counts = dict(warm())
+        except Exception as e:
+            print(f"⚠️ Warm-up failed: {e}")
+            counts = {"error": str(e)}
+        counts["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        with self._cond:
+            self.warm_up = counts
+            if self.state == STARTING and "error" not in counts:
+                self.state = READY
+        return counts
+
+    def begin_request(self):
+        """Count a request that changes state; False if the worker is draining and it must be refused."""
+        with self._cond:
+            if self.state in (DRAINING, STOPPED):
+                self.refused += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def end_request(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def on_drain(self, name, step):
+        """Run step(timeout) when draining, after running requests; it returns False if it couldn't finish."""
+        self._steps.append((name, step))
+
+    def drain(self, timeout=None):
+        with self._drain_lock:
+            if self.drain_report is not None:
+                return self.drain_report
+            deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+            started = time.perf_counter()
+            with self._cond:
+                self.state = DRAINING
+                while self._in_flight and deadline > time.monotonic():
+                    self._cond.wait(deadline - time.monotonic())
+                report = {"requests": {"ok": not self._in_flight, "ms": round((time.perf_counter() - started) * 1000, 2)}}
+            for name, step in self._steps:
+                started = time.perf_counter()
+                try:
+                    ok = step(max(deadline - time.monotonic(), 0)) is not False
+                except Exception as e:
+                    print(f"⚠️ Drain step {name} failed: {e}")
+                    ok = False
+                report[name] = {"ok": ok, "ms": round((time.perf_counter() - started) * 1000, 2)}
+            with self._cond:
+                self.state = STOPPED
+            self.drain_report = report
+            failed = [name for name, result in report.items() if not result["ok"]]
+            if failed:
+                print(f"⚠️ Worker drained, unfinished: {', '.join(failed)}")
+            else:
+                print("🛑 Worker drained")
+            return report
+
+    def stats(self):
+        with self._cond:
+            return {
+                "state": self.state,
+                "ready": self.ready(),
+                "in_flight": self._in_flight,
+                "refused": self.refused,
+                "warm_up": self.warm_up,
+                "drain": self.drain_report,
+            }
@@ -0,0 +1,317 @@
+"""
+Write-behind buffer for message persistence.
+
+store_message() hands its Redis commands to a bounded in-process buffer and
+returns immediately; a background thread flushes the buffer to Redis in
+pipelined batches once it holds max_batch entries or its oldest entry is
+max_delay seconds old. Every entry is appended to a small write-ahead log
+first, so a batch that was never flushed is replayed by the next worker that
+starts after a crash.
+"""
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class WriteAheadLog:
+    """
+    Append-only JSON-lines log of buffered writes, one file per worker boot
+    (``writes-{pid}-{random}.wal``, so a restarted container whose workers get
+    the same PIDs never appends to a dead worker's log).
+
+    The owning worker holds an exclusive flock on its log for as long as it
+    runs; the kernel drops the lock when the process dies, however it dies.
+    A log whose lock can be taken therefore belongs to no running worker, and
+    is claimed and replayed by the next worker that starts.
+
+    Entries are {"seq": n, "commands": [...]}; after a partial flush a
+    {"flushed": n} checkpoint is appended, and the file is truncated whenever
+    the buffer drains completely. Under steady load the buffer never drains,
+    so rotate() moves the unflushed tail to a fresh file instead.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = directory
+        self.fsync = fsync
+        self.path = self._new_path()
+        self.lines = 0  # records in the current file
+        self._file = None
+
+    def _new_path(self):
+        return os.path.join(self.directory, f"writes-{os.getpid()}-{uuid.uuid4().hex[:12]}.wal")
+
+    @staticmethod
+    def _create(path):
+        """
+        Open a new log locked; it only takes its name once the lock is held,
+        so recover_orphans() in a starting worker can't claim it in between.
+        """
+        f = open(path + ".new", "a", encoding="utf-8")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return f
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = self._create(self.path)
+        os.rename(self.path + ".new", self.path)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.lines += 1
+
+    def size(self):
+        return self._file.tell()
+
+    def append(self, seq, commands):
+        self._write({"seq": seq, "commands": commands})
+
+    def checkpoint(self, seq):
+        self._write({"flushed": seq})
+
+    def truncate(self):
+        self._file.truncate(0)
+        self._file.seek(0)
+        self.lines = 0
+
+    def rotate(self, entries):
+        """
+        Continue in a new file holding only entries ([(seq, commands)], the
+        unflushed tail) and delete the current one. The new file is complete
+        before the old one goes, so a crash in between replays the tail twice
+        rather than losing it; if it can't be written, the current file stays.
+        """
+        path = self._new_path()
+        f = self._create(path)
+        try:
+            f.write("".join(json.dumps({"seq": seq, "commands": commands}) + "\n" for seq, commands in entries))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            os.rename(path + ".new", path)
+        except BaseException:
+            f.close()
+            os.remove(path + ".new")
+            raise
+        old_path, old_file = self.path, self._file
+        self.path, self._file, self.lines = path, f, len(entries)
+        os.remove(old_path)
+        old_file.close()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def recover_orphans(self):
+        """
+        Claim the logs no running worker holds the lock of and return their
+        unflushed command lists in write order. Call it before open().
+        """
+        recovered = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "writes-*.wal"))):
+            if path == self.path:
+                continue
+            try:
+                f = open(path, encoding="utf-8")
+            except OSError:
+                continue  # claimed by another starting worker meanwhile
+            with f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # its worker is alive
+                try:
+                    if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                        continue  # another worker recovered and removed it before we got the lock
+                except FileNotFoundError:
+                    continue
+                recovered.extend(self._read_unflushed(f))
+                os.remove(path)  # while still locked, so no one else reads it again
+        for path in glob.glob(os.path.join(self.directory, "writes-*.wal.new")):
+            # Left by a worker that died while creating a log (what it held is still in the
+            # old one); a minute old, so it isn't one whose creator is about to lock it
+            try:
+                if os.stat(path).st_mtime > time.time() - 60:
+                    continue
+                f = open(path, encoding="utf-8")
+            except OSError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+                except (BlockingIOError, FileNotFoundError):
+                    continue
+        return recovered
+
+    @staticmethod
+    def _read_unflushed(f):
+        entries = []
+        flushed = 0
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn final line from the crash
+            if "flushed" in record:
+                flushed = max(flushed, record["flushed"])
+            else:
+                entries.append(record)
+        return [entry["commands"] for entry in entries if entry["seq"] > flushed]
+
+
+class WriteBehindBuffer:
+    """Bounded buffer of Redis writes flushed in the background through a RedisManager."""
+
+    def __init__(self, redis_manager, wal_dir, max_batch=200, max_delay=0.05,
+                 capacity=10000, wal_fsync=False, wal_max_bytes=1 << 20, retry_interval=1.0):
+        self.redis_manager = redis_manager
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.capacity = capacity
+        self.wal_max_bytes = wal_max_bytes
+        self.retry_interval = retry_interval
+        self.wal = WriteAheadLog(wal_dir, fsync=wal_fsync)
+
+        self.flushed_writes = 0
+        self.overflow_writes = 0
+        self.last_flush_ms = None
+        self._entries = deque()  # (seq, enqueued_at, commands, transient)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        """Open the WAL, re-queue writes left behind by crashed workers and start flushing."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            recovered = self.wal.recover_orphans()
+            self.wal.open()
+            for commands in recovered:
+                self._append_locked(commands, [])
+            if recovered:
+                print(f"🔁 Recovered {len(recovered)} unflushed write(s) from the write-ahead log")
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        return {
+            "depth": len(self._entries),
+            "capacity": self.capacity,
+            "flushed_writes": self.flushed_writes,
+            "overflow_writes": self.overflow_writes,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    def enqueue(self, commands, transient=()):
+        """
+        Queue write commands (see RedisManager.write) for a background flush.
+
+        If the buffer is full the write goes straight through the RedisManager
+        instead, so memory stays bounded during a long Redis outage.
+        """
+        commands = [list(command) for command in commands]
+        transient = [list(command) for command in transient]
+        with self._cond:
+            if self._thread is not None and len(self._entries) < self.capacity:
+                self._append_locked(commands, transient)
+                if len(self._entries) >= self.max_batch:
+                    self._cond.notify()
+                return
+            self.overflow_writes += 1
+        self.redis_manager.write(commands, transient)
+
+    def _append_locked(self, commands, transient):
+        self._seq += 1
+        self.wal.append(self._seq, commands)
+        self._entries.append((self._seq, time.monotonic(), commands, transient))
+
+    def _next_batch(self):
+        """Wait until a batch is due, then take it off the buffer."""
+        with self._cond:
+            while not self._stopping:
+                if self._entries:
+                    age = time.monotonic() - self._entries[0][1]
+                    if len(self._entries) >= self.max_batch or age >= self.max_delay:
+                        break
+                    self._cond.wait(self.max_delay - age)
+                else:
+                    self._cond.wait()
+            count = min(self.max_batch, len(self._entries))
+            return [self._entries.popleft() for _ in range(count)]
+
+    def _flush_batch(self, batch):
+        started = time.perf_counter()
+        written = self.redis_manager.write_batch(
+            [entry[2] + entry[3] for entry in batch]
+        )
+        with self._cond:
+            if not written:
+                # Put the batch back in front; it is still in the WAL
+                self._entries.extendleft(reversed(batch))
+                return False
+            self.flushed_writes += len(batch)
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            if not self._entries:
+                self.wal.truncate()
+            elif self.wal.size() >= self.wal_max_bytes and self.wal.lines > 2 * len(self._entries):
+                # Mostly flushed entries and checkpoints: rewrite what is left into a new file
+                try:
+                    self.wal.rotate([(seq, commands) for seq, _, commands, _ in self._entries])
+                except OSError as e:
+                    print(f"⚠️ Write-ahead log rotation failed: {e}")
+                    self.wal.checkpoint(batch[-1][0])
+            else:
+                self.wal.checkpoint(batch[-1][0])
+            return True
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return  # stopping and drained
+            try:
+                flushed = self._flush_batch(batch)
+            except Exception as e:
+                print(f"⚠️ Write-behind flush failed: {e}")
+                with self._cond:
+                    self._entries.extendleft(reversed(batch))
+                flushed = False
+            if not flushed:
+                time.sleep(self.retry_interval)
+
+    def flush(self, timeout=5.0):
+        """Ask for an immediate flush and wait (up to timeout seconds) for the buffer to drain."""
+        deadline = time.monotonic() + timeout
+        while self._entries and time.monotonic() < deadline:
+            with self._cond:
+                # Make the head of the buffer due right away
+                if self._entries:
+                    seq, _, commands, transient = self._entries[0]
+                    self._entries[0] = (seq, 0, commands, transient)
+                self._cond.notify()
+            time.sleep(0.01)
+        return not self._entries
+
+    def stop(self, timeout=5.0):
+        """Flush what is buffered, then stop the background thread and close the WAL."""
+        drained = self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if drained:
+            self.wal.close()
+        return drained